@@ -43,10 +43,23 @@ export CLASSIFICATION_DIR="${PROJECT_DIR}/shared/classification"
 
 export LABELME_USER="tsukeyoka"
 
+# Options of scripts/index_db.py for every new db version, e.g. "--add_is_page".
+export INDEX_DB_OPTIONS=""
+
 log_db_version() {
     local campaign_id=$1
     local version=$2
     local text=$3
     echo "v${version} $(date): ${text}
 " >> "${DATABASES_DIR}/campaign${campaign_id}/versions.log"
+
+    # Index databases of the new version, so that queries on them are fast.
+    # Requires path_generator.sh, which every pipeline script sources.
+    local code_dir=$(dirname $(readlink -f ${BASH_SOURCE[0]}))
+    python3 ${code_dir}/scripts/index_db.py --logging_level 30 ${INDEX_DB_OPTIONS} \
+      --db_files \
+        $(get_1800x1200_db_path ${campaign_id} ${version}) \
+        $(get_6Kx4K_db_path ${campaign_id} ${version}) \
+        $(get_1800x1200_uptonow_db_path ${campaign_id} ${version}) \
+        $(get_6Kx4K_uptonow_db_path ${campaign_id} ${version})
 }
@@ -12,6 +12,11 @@ get_1800x1200_all_db_path() {
     echo "${DATABASES_DIR}/all-1800x1200.db"
 }
 
+# Sizes, validity and hashes of all images. See scripts/image_metadata_index.py.
+get_image_metadata_db_path() {
+    echo "${DATABASES_DIR}/all-1800x1200.metadata.db"
+}
+
 get_1800x1200_db_path () {
     local campaign_id=$1
     local version=$2
@@ -73,6 +78,16 @@ get_uptonow_cropped_db_path () {
     echo "${DATABASES_DIR}/campaign${campaign_id}/crops/campaign3to${campaign_id}-6Kx4K.v${version}.cropped.db"
 }
 
+# Crops of all campaigns, keyed by image, bbox and size. See scripts/crop_utils.py.
+get_crops_cache_dir () {
+    echo "${DATABASES_DIR}/crops_cache"
+}
+
+# Sizes of images of every resolution. See scripts/resolution_pyramid.py.
+get_resolution_manifest_path () {
+    echo "${DATABASES_DIR}/resolutions.db"
+}
+
 get_classification_run_dir() {
     local campaign_id=$1
     local set_id=$2
@@ -172,16 +172,11 @@ python -m shuffler \
     --overwrite
 
 # Can't be combined with the previous step, otherwise images will be different in db.
-python -m shuffler \
-  -i ${out_db_path} \
+python3 ${dir_of_this_file}/../scripts/write_preview.py \
+  --db_file ${out_db_path} \
   --rootdir ${labelme_rootdir} \
-  randomNImages -n ${num_images_for_video} \| \
-  writeMedia \
-    --media "video" \
-    --image_path "${out_db_path}.avi" \
-    --with_objects \
-    --with_imageid \
-    --overwrite
+  --out_path "${out_db_path}.avi" \
+  --number ${num_images_for_video}
 
 log_db_version ${campaign_id} ${out_version} \
     "Exported to labelme under folder '${folder}'."
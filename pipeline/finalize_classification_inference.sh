@@ -187,26 +187,17 @@ echo "Classified database will be:   ${out_db_path}"
 ls ${ref_db_path}
 ls ${in_db_path}
 
-# Populate predicted names from ref_db_path.
-python -m shuffler \
-  -i ${in_db_path} \
-  -o ${out_db_path} \
-  syncObjectsDataWithDb --ref_db_file ${ref_db_path} --cols "name" "score"
-
-# Can't be combined with the previous step, otherwise images will be different in db.
-python -m shuffler \
-  -i ${out_db_path} \
+# Populate predicted names, copy classification scores to properties,
+# and write a video in one pass.
+python3 ${dir_of_this_file}/../scripts/finalize_inference.py \
+  --in_db_file ${in_db_path} \
+  --out_db_file ${out_db_path} \
   --rootdir ${ROOT_DIR} \
-  randomNImages -n ${num_images_for_video} \| \
-  writeMedia \
-    --media "video" \
-    --image_path "${out_db_path}.avi" \
-    --with_objects \
-    --with_imageid \
-    --overwrite
-
-# Copy classification scores to properties.
-sqlite3 ${out_db_path} "INSERT INTO properties(objectid,key,value) SELECT objectid,'classification_score',score FROM objects WHERE name != 'page' AND score > 0"
+  --sync_ref_db_file ${ref_db_path} \
+  --sync_cols "name" "score" \
+  --score_to_property "classification_score" \
+  --score_to_property_where "name != 'page' AND score > 0" \
+  --num_images_for_video ${num_images_for_video}
 
 # NOTE: A new version does not appear. ${out_version} already exists and means
 #       the stamps are classifed. It is introduced by start_classification_inference.sh
@@ -20,6 +20,7 @@ Usage:
      --set_id SET_ID
      --run_id RUN_ID
      --num_images_for_video INT
+     --detected_on_version VERSION
 
 Example:
   $PROGNAME
@@ -46,6 +47,11 @@ Options:
       (Required) Run id of the model.
   --num_images_for_video
       (optional) How many random images to write to the video.
+  --detected_on_version
+      (optional) The version that pages were detected on, if it is not
+                 in_version. Used after start_detection_inference.sh, which
+                 detects pages together with stamps, before stamps are finalized.
+                 Then detected pages are added to the in_version database.
 EO
 }
 
@@ -58,6 +64,7 @@ ARGUMENT_LIST=(
     "set_id"
     "run_id"
     "num_images_for_video"
+    "detected_on_version"
 )
 
 opts=$(getopt \
@@ -112,6 +119,10 @@ while [[ $# -gt 0 ]]; do
             num_images_for_video=$2
             shift 2
             ;;
+        --detected_on_version)
+            detected_on_version=$2
+            shift 2
+            ;;
         --) # No more arguments
             shift
             break
@@ -153,6 +164,7 @@ echo "model_campaign_id:      ${model_campaign_id}"
 echo "set_id:                 ${set_id}"
 echo "run_id:                 ${run_id}"
 echo "num_images_for_video:   ${num_images_for_video}"
+echo "detected_on_version:    ${detected_on_version}"
 
 # The end of the parsing code.
 ################################################################################
@@ -167,33 +179,50 @@ conda activate ${CONDA_SHUFFLER_ENV}
 echo "Conda environment is activated: '${CONDA_SHUFFLER_ENV}'"
 
 
-in_db_path=$(get_detected_db_path ${campaign_id} ${in_version} ${model_campaign_id} ${set_id} ${run_id})
+if [ -z "$detected_on_version" ]; then
+  in_db_path=$(get_detected_db_path ${campaign_id} ${in_version} ${model_campaign_id} ${set_id} ${run_id})
+  add_objects_args=()
+else
+  # Pages were detected on an earlier version, add them to in_version.
+  in_db_path=$(get_1800x1200_db_path ${campaign_id} ${in_version})
+  detected_db_path=$(get_detected_db_path ${campaign_id} ${detected_on_version} ${model_campaign_id} ${set_id} ${run_id})
+  # Objects of the version that pages were detected on are not added again.
+  detected_base_db_path=$(get_1800x1200_db_path ${campaign_id} ${detected_on_version})
+  ls ${detected_db_path} ${detected_base_db_path}
+  add_objects_args=(--add_objects_db_file ${detected_db_path} \
+    --add_objects_base_db_file ${detected_base_db_path} \
+    --add_objects_where "name LIKE '%page%'")
+fi
 out_db_path=$(get_1800x1200_db_path ${campaign_id} ${out_version})
 
 ls ${in_db_path}
 
-echo "Number of page detections BEFORE filtering:"
-sqlite3 ${in_db_path} "SELECT COUNT(1) FROM objects WHERE name LIKE '%page%'"
-
-python -m shuffler -i ${in_db_path} -o ${out_db_path} \
-  polygonsToBboxes \| \
-  filterObjectsSQL --sql "SELECT objectid FROM objects WHERE name LIKE '%page%' AND score < ${threshold}" --delete \| \
-  sql --sql "INSERT INTO properties(objectid,key,value) SELECT objectid,'page_detection_score',score FROM objects" \| \
-  sql --sql "UPDATE objects SET score = 0" \| \
-  classifyPages
-
-echo "Number of detections AFTER filtering:"
-sqlite3 ${out_db_path} "SELECT COUNT(1) FROM objects WHERE name LIKE '%page%'"
+# Skip if detections, parameters and this script did not change.
+memo_args="--manifest ${out_db_path}.manifest.json \
+  --inputs ${in_db_path} ${detected_db_path} ${detected_base_db_path} \
+  --params threshold=${threshold} num_images_for_video=${num_images_for_video} \
+  --scripts $0 ${dir_of_this_file}/../scripts/finalize_inference.py \
+  --outputs ${out_db_path}"
+if python3 ${dir_of_this_file}/../scripts/memoize.py check ${memo_args}; then
+  echo "${out_db_path} is up to date, skipping."
+  exit 0
+fi
 
-python -m shuffler -i ${out_db_path} --rootdir ${ROOT_DIR} \
-  randomNImages -n ${num_images_for_video} \| \
-  writeMedia \
-    --media "video" \
-    --image_path "${out_db_path}.avi" \
-    --with_objects \
-    --with_imageid \
-    --overwrite
+# Filter, keep scores in properties and write a video in one pass.
+# Converting polygons and classifying pages are done by Shuffler on the result.
+python3 ${dir_of_this_file}/../scripts/finalize_inference.py \
+  --in_db_file ${in_db_path} \
+  --out_db_file ${out_db_path} \
+  --rootdir ${ROOT_DIR} \
+  "${add_objects_args[@]}" \
+  --delete_where "name LIKE '%page%' AND score < ${threshold}" \
+  --score_to_property "page_detection_score" \
+  --reset_scores \
+  --shuffler_ops "polygonsToBboxes | classifyPages" \
+  --num_images_for_video ${num_images_for_video}
 
 log_db_version ${campaign_id} ${out_version} \
   "Filtered bad page detections and classified pages."
+# After log_db_version, which indexes the output dbs.
+python3 ${dir_of_this_file}/../scripts/memoize.py record ${memo_args}
 echo "Done."
@@ -13,6 +13,7 @@ Usage:
   $PROGNAME
      --campaign_id CAMPAIGN_ID
      --run_id RUN_ID
+     --clean_up CLEAN_UP
 
 Example:
   $PROGNAME
@@ -23,6 +24,9 @@ Options:
       (required) The campaign id.
   --run_id
       (optional) The try id. Use if the 0th try failed. Default is 0.
+  --clean_up
+      (optional) Enter 1 to delete all but the last snapshot of every hyper
+      after promoting the best model. Default: 0.
 EO
 }
 
@@ -41,6 +45,7 @@ opts=$(getopt \
 
 # Defaults.
 run_id=0
+clean_up=0
 
 eval set --$opts
 
@@ -58,6 +63,10 @@ while [[ $# -gt 0 ]]; do
             run_id=$2
             shift 2
             ;;
+        --clean_up)
+            clean_up=$2
+            shift 2
+            ;;
         --) # No more arguments
             shift
             break
@@ -77,6 +86,7 @@ fi
 
 echo "campaign_id:            ${campaign_id}"
 echo "run_id:                 ${run_id}"
+echo "clean_up:               ${clean_up}"
 
 # The end of the parsing code.
 ################################################################################
@@ -105,6 +115,7 @@ python3 ${dir_of_this_file}/../scripts/detection_training_polygon_yolov5_jobs/po
   --set_id ${set_id} \
   --run_id ${run_id} \
   --ignore_splits "full" \
-  --copy_best_model_from_split "full"
+  --copy_best_model_from_split "full" \
+  --clean_up ${clean_up}
 
 echo "Done."
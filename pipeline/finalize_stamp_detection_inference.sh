@@ -170,26 +170,29 @@ out_db_path=$(get_1800x1200_db_path ${campaign_id} ${out_version})
 
 ls ${in_db_path}
 
-echo "Number of detections BEFORE filtering:"
-sqlite3 ${in_db_path} "SELECT name,COUNT(1) FROM objects GROUP BY name"
-
-python -m shuffler -i ${in_db_path} -o ${out_db_path} \
-  filterObjectsSQL --sql "SELECT objectid FROM objects WHERE name = 'stamp' AND score < ${threshold}" --delete \| \
-  sql --sql "INSERT INTO properties(objectid,key,value) SELECT objectid,'stamp_detection_score',score FROM objects" \| \
-  sql --sql "UPDATE objects SET score = 0"
-
-echo "Number of detections AFTER filtering:"
-sqlite3 ${out_db_path} "SELECT name,COUNT(1) FROM objects GROUP BY name"
-
-python -m shuffler -i "${out_db_path}" --rootdir ${ROOT_DIR} \
-  randomNImages -n ${num_images_for_video} \| \
-  writeMedia \
-    --media "video" \
-    --image_path "${out_db_path}.avi" \
-    --with_objects \
-    --with_imageid \
-    --overwrite
+# Skip if detections, parameters and this script did not change.
+memo_args="--manifest ${out_db_path}.manifest.json \
+  --inputs ${in_db_path} \
+  --params threshold=${threshold} num_images_for_video=${num_images_for_video} \
+  --scripts $0 ${dir_of_this_file}/../scripts/finalize_inference.py \
+  --outputs ${out_db_path}"
+if python3 ${dir_of_this_file}/../scripts/memoize.py check ${memo_args}; then
+  echo "${out_db_path} is up to date, skipping."
+  exit 0
+fi
+
+# Filter, keep scores in properties and write a video in one pass.
+python3 ${dir_of_this_file}/../scripts/finalize_inference.py \
+  --in_db_file ${in_db_path} \
+  --out_db_file ${out_db_path} \
+  --rootdir ${ROOT_DIR} \
+  --delete_where "name = 'stamp' AND score < ${threshold}" \
+  --score_to_property "stamp_detection_score" \
+  --reset_scores \
+  --num_images_for_video ${num_images_for_video}
 
 log_db_version ${campaign_id} ${out_version} \
   "Detected stamps, filtered bad stamp detections, save detection scores in properties."
+# After log_db_version, which indexes the output dbs.
+python3 ${dir_of_this_file}/../scripts/memoize.py record ${memo_args}
 echo "Done."
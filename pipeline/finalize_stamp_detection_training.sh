@@ -25,7 +25,8 @@ Options:
   --run_id
       (optional) The try id. Use if the 0th try failed. Default is 0.
   --clean_up
-      (optional) If not 0, will skip cleaning up space by deleteing non-best model snapshots.
+      (optional) Enter 1 to delete all but the last snapshot of every hyper
+      after promoting the best model. Default: 0.
 EO
 }
 
@@ -155,38 +155,35 @@ if [ ${up_to_now} -eq 0 ]; then
 
   # 6Kx4K all campaigns.
   echo "Creating database: ${out_6Kx4K_uptonow_db_path}"
-  python -m shuffler \
-    -i ${out_6Kx4K_db_path} \
-    -o ${out_6Kx4K_uptonow_db_path} \
-    addDb --db_file $(get_6Kx4K_uptonow_db_path ${previous_campaign_id} "latest")
+  python3 ${dir_of_this_file}/../scripts/merge_uptonow.py merge \
+    --base_db_file $(get_6Kx4K_uptonow_db_path ${previous_campaign_id} "latest") \
+    --new_db_file ${out_6Kx4K_db_path} \
+    --out_db_file ${out_6Kx4K_uptonow_db_path}
 
   # Make 1800x1200 this campaign.
   out_1800x1200_db_path=$(get_1800x1200_db_path ${campaign_id} ${out_version})
   echo "Creating database: ${out_1800x1200_db_path}"
-  python -m shuffler \
-    -i ${out_6Kx4K_db_path} \
-    -o ${out_1800x1200_db_path} \
+  python3 ${dir_of_this_file}/../scripts/resolution_pyramid.py \
     --rootdir "${ROOT_DIR}" \
-    moveMedia --image_path "1800x1200" --level 2 \| \
-    resizeAnnotations
+    --manifest_db_file $(get_resolution_manifest_path) \
+    rescale \
+      --in_db_file ${out_6Kx4K_db_path} \
+      --out_db_file ${out_1800x1200_db_path} \
+      --image_path "1800x1200"
 
   # Make 1800x1200 all campaigns.
   out_1800x1200_uptonow_db_path=$(get_1800x1200_uptonow_db_path ${campaign_id} ${out_version})
   echo "Creating database: ${out_1800x1200_uptonow_db_path}"
-  python -m shuffler \
-    -i ${out_1800x1200_db_path} \
-    -o ${out_1800x1200_uptonow_db_path} \
-    addDb --db_file $(get_1800x1200_uptonow_db_path ${previous_campaign_id} "latest")
+  python3 ${dir_of_this_file}/../scripts/merge_uptonow.py merge \
+    --base_db_file $(get_1800x1200_uptonow_db_path ${previous_campaign_id} "latest") \
+    --new_db_file ${out_1800x1200_db_path} \
+    --out_db_file ${out_1800x1200_uptonow_db_path}
 
   # Make a video of this campaign.
-  python -m shuffler -i ${out_1800x1200_db_path} --rootdir ${ROOT_DIR} \
-    randomNImages -n ${num_images_for_video} \| \
-    writeMedia \
-      --media "video" \
-      --image_path "${out_1800x1200_db_path}.avi" \
-      --with_objects \
-      --with_imageid \
-      --overwrite
+  python3 ${dir_of_this_file}/../scripts/write_preview.py \
+    --db_file ${out_1800x1200_db_path} --rootdir ${ROOT_DIR} \
+    --out_path "${out_1800x1200_db_path}.avi" \
+    --number ${num_images_for_video}
   echo "Made a video at ${out_1800x1200_db_path}.avi"
 
   log_db_version ${campaign_id} ${out_version} "A cleaning round have completed on the latest campaign."
@@ -208,12 +205,13 @@ else
   # Make 1800x1200 all campaigns.
   out_1800x1200_uptonow_db_path=$(get_1800x1200_uptonow_db_path ${campaign_id} ${out_version})
   echo "Creating database: ${out_1800x1200_uptonow_db_path}"
-  python -m shuffler \
-    -i ${out_6Kx4K_uptonow_db_path} \
-    -o ${out_1800x1200_uptonow_db_path} \
+  python3 ${dir_of_this_file}/../scripts/resolution_pyramid.py \
     --rootdir "${ROOT_DIR}" \
-    moveMedia --image_path "1800x1200" --level 2 \| \
-    resizeAnnotations
+    --manifest_db_file $(get_resolution_manifest_path) \
+    rescale \
+      --in_db_file ${out_6Kx4K_uptonow_db_path} \
+      --out_db_file ${out_1800x1200_uptonow_db_path} \
+      --image_path "1800x1200"
 
   # TODO: replace INT to FLOAT in bboxes in Shuffler.
   # Uncomment below if you know rectangle positions didn't change.
@@ -221,14 +219,10 @@ else
   #   syncObjectsDataWithDb --ref_db_file ${in_6Kx4K_uptonow_db_path} --cols x1 y1 width height
 
   # Make a video of all campaigns.
-  python -m shuffler -i ${out_1800x1200_uptonow_db_path} --rootdir ${ROOT_DIR} \
-    randomNImages -n ${num_images_for_video} \| \
-    writeMedia \
-      --media "video" \
-      --image_path "${out_1800x1200_uptonow_db_path}.avi" \
-      --with_objects \
-      --with_imageid \
-      --overwrite
+  python3 ${dir_of_this_file}/../scripts/write_preview.py \
+    --db_file ${out_1800x1200_uptonow_db_path} --rootdir ${ROOT_DIR} \
+    --out_path "${out_1800x1200_uptonow_db_path}.avi" \
+    --number ${num_images_for_video}
   echo "Made a video at ${out_1800x1200_uptonow_db_path}.avi"
 
   log_db_version ${campaign_id} ${out_version} "A cleaning round have completed on all campaigns."
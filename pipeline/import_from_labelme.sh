@@ -139,13 +139,26 @@ out_db_6Kx4K_path=$(get_6Kx4K_db_path ${campaign_id} ${out_version})
 out_db_1800x1200_uptonow_path=$(get_1800x1200_uptonow_db_path ${campaign_id} ${out_version})
 out_db_6Kx4K_uptonow_path=$(get_6Kx4K_uptonow_db_path ${campaign_id} ${out_version})
 
+labelme_rootdir="${LABELME_DIR}/campaign${campaign_id}/initial"
+labelme_labeled_rootdir="${LABELME_DIR}/campaign${campaign_id}/initial-labeled"
+
+# Skip if annotations, input dbs, parameters and this script did not change.
+memo_args="--manifest ${out_db_1800x1200_path}.manifest.json \
+  --inputs ${labelme_labeled_rootdir}/Annotations ${in_db_1800x1200_path} ${prev_db_1800x1200_path} \
+    ${in_db_1800x1200_uptoprevious_path} ${in_db_6Kx4K_uptoprevious_path} \
+  --params num_images_for_video=${num_images_for_video} \
+  --scripts $0 ${dir_of_this_file}/../scripts/merge_uptonow.py \
+    ${dir_of_this_file}/../scripts/resolution_pyramid.py \
+  --outputs ${out_db_1800x1200_path} ${out_db_6Kx4K_path} ${out_db_1800x1200_uptonow_path} ${out_db_6Kx4K_uptonow_path}"
+if python3 ${dir_of_this_file}/../scripts/memoize.py check ${memo_args}; then
+  echo "Output databases are up to date, skipping."
+  exit 0
+fi
+
 # If this script was already run before, the output db exists, and Shuffler will raise an exception.
 echo "Deleting files if they exist."
 rm -f ${out_db_1800x1200_path} ${out_db_6Kx4K_path} ${out_db_1800x1200_uptonow_path} ${out_db_6Kx4K_uptonow_path}
 
-labelme_rootdir="${LABELME_DIR}/campaign${campaign_id}/initial"
-labelme_labeled_rootdir="${LABELME_DIR}/campaign${campaign_id}/initial-labeled"
-
 python -m shuffler \
   --logging 30 \
   --rootdir ${labelme_rootdir} \
@@ -178,37 +191,45 @@ sqlite3 ${out_db_1800x1200_path} "
   INSERT INTO properties(objectid,key,value) SELECT objectid,'campaign',${campaign_id} FROM objects
 "
 
-# Get the same db but with big images.
-python -m shuffler \
-  -i ${out_db_1800x1200_path} -o ${out_db_6Kx4K_path} --rootdir ${ROOT_DIR} --logging 30 \
-  moveMedia --image_path "original_dataset" --level 2 \| \
-  resizeAnnotations
+# Get the same db but with big images. Sizes come from the manifest of resolutions.
+python3 ${dir_of_this_file}/../scripts/resolution_pyramid.py \
+  --rootdir ${ROOT_DIR} \
+  --manifest_db_file $(get_resolution_manifest_path) \
+  --logging_level 30 \
+  rescale \
+    --in_db_file ${out_db_1800x1200_path} \
+    --out_db_file ${out_db_6Kx4K_path} \
+    --image_path "original_dataset"
 
 # Merge 1800x1200 with the previous campaign.
+# Only rows of this campaign are appended to a copy of the previous db.
 echo "Merging 1800x1200 with the previous campaign..."
-python -m shuffler \
-  -i ${out_db_1800x1200_path} \
-  -o ${out_db_1800x1200_uptonow_path} \
-  addDb --db_file ${in_db_1800x1200_uptoprevious_path}
+python3 ${dir_of_this_file}/../scripts/merge_uptonow.py merge \
+  --base_db_file ${in_db_1800x1200_uptoprevious_path} \
+  --new_db_file ${out_db_1800x1200_path} \
+  --out_db_file ${out_db_1800x1200_uptonow_path}
 
 # Merge 6Kx4K with the previous campaign.
 echo "Merging 6Kx4K with the previous campaign..."
-python -m shuffler \
-  -i ${out_db_6Kx4K_path} \
-  -o ${out_db_6Kx4K_uptonow_path} \
-  addDb --db_file ${in_db_6Kx4K_uptoprevious_path}
+python3 ${dir_of_this_file}/../scripts/merge_uptonow.py merge \
+  --base_db_file ${in_db_6Kx4K_uptoprevious_path} \
+  --new_db_file ${out_db_6Kx4K_path} \
+  --out_db_file ${out_db_6Kx4K_uptonow_path}
 
 # Can't be combined with the previous step, otherwise images will be different in db.
-python -m shuffler \
-  -i ${out_db_1800x1200_path} \
+python3 ${dir_of_this_file}/../scripts/write_preview.py \
+  --db_file ${out_db_1800x1200_path} \
   --rootdir ${ROOT_DIR} \
-  randomNImages -n ${num_images_for_video} \| \
-  writeMedia \
-    --media "video" \
-    --image_path "${out_db_1800x1200_path}.avi" \
-    --with_objects \
-    --with_imageid \
-    --overwrite
+  --out_path "${out_db_1800x1200_path}.avi" \
+  --number ${num_images_for_video}
 
 log_db_version ${campaign_id} ${out_version} "Imported from labelme."
+# Images of this campaign are not selected for new campaigns.
+python3 ${dir_of_this_file}/../scripts/select_new_campaign.py \
+  --index_db_file $(get_image_metadata_db_path) \
+  record \
+    --db_file ${out_db_1800x1200_path} \
+    --campaign_id ${campaign_id}
+# After log_db_version, which indexes the output dbs.
+python3 ${dir_of_this_file}/../scripts/memoize.py record ${memo_args}
 echo "Done."
@@ -0,0 +1,347 @@
+'''
+Run steps of a campaign as a DAG, instead of running each "pipeline/*.sh"
+by hand and calling "check_if_all_jobs_completed.sh" in between.
+
+Built-in plans:
+- "inference":  stamp detection -> page detection -> cropping ->
+                classification, each followed by its finalize step.
+                Page detection runs on the database with finalized stamps,
+                so these stages are sequential. With --combined_detection,
+                one job detects stamps and pages on the input version, and
+                detected pages are added when pages are finalized.
+- "training":   stamp detection, page detection and cropping + classification
+                are trained in parallel. Each is finalized when its jobs
+                complete.
+A plan can also be a JSON file, see scripts/dag_utils.py for the format.
+
+Example:
+  source constants.sh
+  python3 pipeline/run_campaign.py run \
+    --plan inference --campaign_id 8 --in_version 1 \
+    --stamp_run_id 0 --page_run_id 0 --classification_run_id 0
+'''
+
+import os, sys, os.path as op
+import time
+import shlex
+import logging
+import argparse
+
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), '..', 'scripts'))
+import dag_utils
+import slurm_utils
+
+PIPELINE_DIR = op.dirname(op.abspath(__file__))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Run steps of a campaign as a DAG.')
+    parser.add_argument(
+        "--logging_level",
+        type=int,
+        choices=[10, 20, 30, 40],
+        default=20,
+        help="Set logging level. 10: debug, 20: info, 30: warning, 40: error.")
+    subparsers = parser.add_subparsers(dest='subcommand')
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser('run', help='Run a plan.')
+    run_parser.add_argument(
+        '--plan',
+        required=True,
+        help='"inference", "training", or a path to a JSON file.')
+    run_parser.add_argument('--campaign_id', type=int, required=True)
+    run_parser.add_argument(
+        '--in_version',
+        type=int,
+        help='The version of the input database. Required by built-in plans.')
+    run_parser.add_argument(
+        '--model_campaign_id',
+        type=int,
+        help='Campaign of the models for inference. Default: campaign_id-1.')
+    run_parser.add_argument('--stamp_run_id',
+                            default='0',
+                            help='Run id of stamp detection.')
+    run_parser.add_argument('--page_run_id',
+                            default='0',
+                            help='Run id of page detection.')
+    run_parser.add_argument(
+        '--combined_detection',
+        action='store_true',
+        help='Detect stamps and pages in one job that reads images once.')
+    run_parser.add_argument('--classification_run_id',
+                            default='0',
+                            help='Run id of classification.')
+    run_parser.add_argument(
+        '--hold_full',
+        action='store_true',
+        help='In training, train the "full" split only for the best '
+        'hyperparameters, after the other splits.')
+    run_parser.add_argument('--executor',
+                            choices=['local', 'slurm'],
+                            default='slurm')
+    run_parser.add_argument(
+        '--work_dir',
+        help='Scripts and logs of stage jobs go here. '
+        'Default: ${DATABASES_DIR}/campaign${campaign_id}/batch_jobs/dag_<date>'
+    )
+    run_parser.add_argument(
+        '--job_options',
+        default='-p RM-shared -t 48:00:00',
+        help='sbatch options of stage jobs, which only run shuffler or wait.')
+    run_parser.add_argument('--interval',
+                            type=float,
+                            default=60,
+                            help='Seconds between polls of job states.')
+    run_parser.add_argument(
+        '--fake_states_path',
+        help='Use a JSON file {job_id: state} instead of SLURM. For testing.')
+    run_parser.add_argument('--dry_run',
+                            action='store_true',
+                            help='Print the plan and exit.')
+
+    wait_parser = subparsers.add_parser(
+        'run_and_wait',
+        help='Run a command and wait for the jobs it submits. '
+        'Used inside stage jobs.')
+    wait_parser.add_argument('--interval', type=float, default=60)
+    wait_parser.add_argument('command', nargs=argparse.REMAINDER)
+    return parser
+
+
+def _script(name, **kwargs):
+    ''' Command to run "pipeline/<name>.sh --key value ...". '''
+    command = [op.join(PIPELINE_DIR, '%s.sh' % name)]
+    for key, value in kwargs.items():
+        if value is not None:
+            command += ['--%s' % key, str(value)]
+    return command
+
+
+def make_detection_stages(args):
+    ''' Stages of stamp and page detection, from version v to v + 2. '''
+    c = args.campaign_id
+    v = args.in_version
+    m = args.model_campaign_id
+    Stage = dag_utils.Stage
+    if args.combined_detection:
+        return [
+            Stage('start_detection_inference',
+                  _script('start_detection_inference',
+                          campaign_id=c,
+                          in_version=v,
+                          model_campaign_id=m,
+                          stamp_run_id=args.stamp_run_id,
+                          page_run_id=args.page_run_id),
+                  submits_jobs=True),
+            Stage('finalize_stamp_detection_inference',
+                  _script('finalize_stamp_detection_inference',
+                          campaign_id=c,
+                          in_version=v,
+                          out_version=v + 1,
+                          model_campaign_id=m,
+                          run_id=args.stamp_run_id),
+                  deps=['start_detection_inference']),
+            Stage('finalize_page_detection_inference',
+                  _script('finalize_page_detection_inference',
+                          campaign_id=c,
+                          in_version=v + 1,
+                          out_version=v + 2,
+                          model_campaign_id=m,
+                          run_id=args.page_run_id,
+                          detected_on_version=v),
+                  deps=['finalize_stamp_detection_inference']),
+        ]
+    return [
+        Stage('start_stamp_detection_inference',
+              _script('start_stamp_detection_inference',
+                      campaign_id=c,
+                      in_version=v,
+                      model_campaign_id=m,
+                      run_id=args.stamp_run_id),
+              submits_jobs=True),
+        Stage('finalize_stamp_detection_inference',
+              _script('finalize_stamp_detection_inference',
+                      campaign_id=c,
+                      in_version=v,
+                      out_version=v + 1,
+                      model_campaign_id=m,
+                      run_id=args.stamp_run_id),
+              deps=['start_stamp_detection_inference']),
+        Stage('start_page_detection_inference',
+              _script('start_page_detection_inference',
+                      campaign_id=c,
+                      in_version=v + 1,
+                      model_campaign_id=m,
+                      run_id=args.page_run_id),
+              deps=['finalize_stamp_detection_inference'],
+              submits_jobs=True),
+        Stage('finalize_page_detection_inference',
+              _script('finalize_page_detection_inference',
+                      campaign_id=c,
+                      in_version=v + 1,
+                      out_version=v + 2,
+                      model_campaign_id=m,
+                      run_id=args.page_run_id),
+              deps=['start_page_detection_inference']),
+    ]
+
+
+def make_inference_plan(args):
+    c = args.campaign_id
+    v = args.in_version
+    m = args.model_campaign_id
+    Stage = dag_utils.Stage
+    return dag_utils.Dag(make_detection_stages(args) + [
+        Stage('start_cropping_for_classification_inference',
+              _script('start_cropping_for_classification_inference',
+                      campaign_id=c,
+                      in_version=v + 2),
+              deps=['finalize_page_detection_inference'],
+              submits_jobs=True),
+        Stage('start_classification_inference',
+              _script('start_classification_inference',
+                      campaign_id=c,
+                      in_version=v + 2,
+                      model_campaign_id=m,
+                      run_id=args.classification_run_id),
+              deps=['start_cropping_for_classification_inference'],
+              submits_jobs=True),
+        Stage('finalize_classification_inference',
+              _script('finalize_classification_inference',
+                      campaign_id=c,
+                      ref_version=v + 2,
+                      in_version=v + 2,
+                      out_version=v + 3,
+                      model_campaign_id=m,
+                      run_id=args.classification_run_id),
+              deps=['start_classification_inference']),
+        Stage('statistics_of_version',
+              _script('statistics_of_version', campaign_id=c,
+                      in_version=v + 3),
+              deps=['finalize_classification_inference']),
+    ])
+
+
+def make_training_plan(args):
+    c = args.campaign_id
+    v = args.in_version
+    Stage = dag_utils.Stage
+    return dag_utils.Dag([
+        Stage('start_stamp_detection_training',
+              _script('start_stamp_detection_training',
+                      campaign_id=c,
+                      in_version=v,
+                      run_id=args.stamp_run_id,
+                      hold_full=int(args.hold_full)),
+              submits_jobs=True),
+        Stage('finalize_stamp_detection_training',
+              _script('finalize_stamp_detection_training',
+                      campaign_id=c,
+                      run_id=args.stamp_run_id),
+              deps=['start_stamp_detection_training']),
+        Stage('start_page_detection_training',
+              _script('start_page_detection_training',
+                      campaign_id=c,
+                      in_version=v,
+                      run_id=args.page_run_id,
+                      hold_full=int(args.hold_full)),
+              submits_jobs=True),
+        Stage('finalize_page_detection_training',
+              _script('finalize_page_detection_training',
+                      campaign_id=c,
+                      run_id=args.page_run_id),
+              deps=['start_page_detection_training']),
+        Stage('start_cropping_for_classification_training',
+              _script('start_cropping_for_classification_training',
+                      campaign_id=c,
+                      in_version=v),
+              submits_jobs=True),
+        Stage('start_classification_training',
+              _script('start_classification_training',
+                      campaign_id=c,
+                      in_version=v,
+                      run_id=args.classification_run_id,
+                      hold_full=int(args.hold_full)),
+              deps=['start_cropping_for_classification_training'],
+              submits_jobs=True),
+        Stage('finalize_classification_training',
+              _script('finalize_classification_training',
+                      campaign_id=c,
+                      run_id=args.classification_run_id),
+              deps=['start_classification_training']),
+    ])
+
+
+def make_plan(args):
+    if args.plan in ['inference', 'training']:
+        if args.in_version is None:
+            raise ValueError('Plan "%s" needs --in_version.' % args.plan)
+        if args.plan == 'inference':
+            return make_inference_plan(args)
+        return make_training_plan(args)
+    if not op.exists(args.plan):
+        raise FileNotFoundError('Plan file does not exist at: %s' % args.plan)
+    return dag_utils.Dag.from_json(args.plan)
+
+
+def run(args):
+    dag = make_plan(args)
+    logging.info('The plan:\n%s', dag.describe())
+    if args.dry_run:
+        return
+
+    scheduler = slurm_utils.get_scheduler(args.fake_states_path)
+    if args.executor == 'local':
+        executor = dag_utils.LocalExecutor(scheduler, interval=args.interval)
+        statuses = executor.run(dag)
+        logging.info('Statuses of stages: %s', statuses)
+        if any(status != dag_utils.DONE for status in statuses.values()):
+            sys.exit(1)
+        return
+
+    work_dir = args.work_dir
+    if work_dir is None:
+        work_dir = op.join(os.environ['DATABASES_DIR'],
+                           'campaign%d' % args.campaign_id, 'batch_jobs',
+                           'dag_%s' % time.strftime('%Y-%m-%d_%H-%M-%S'))
+    wait_command = [
+        sys.executable,
+        op.abspath(__file__), 'run_and_wait', '--interval',
+        str(args.interval)
+    ]
+    executor = dag_utils.SlurmExecutor(scheduler, work_dir,
+                                       shlex.split(args.job_options),
+                                       wait_command)
+    stage_jobs = executor.run(dag)
+    for name, job_ids in stage_jobs.items():
+        if job_ids is None:
+            status = 'failed'
+        elif len(job_ids) == 0:
+            status = 'done'
+        else:
+            status = ', '.join(job_ids)
+        logging.info('%-45s %s', name, status)
+    if any(job_ids is None for job_ids in stage_jobs.values()):
+        sys.exit(1)
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        level=args.logging_level)
+
+    if args.subcommand == 'run':
+        run(args)
+    else:
+        command = args.command
+        if len(command) > 0 and command[0] == '--':
+            command = command[1:]
+        dag_utils.run_and_wait(command, slurm_utils.get_scheduler(),
+                               args.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,7 @@ Usage:
      --campaign_id CAMPAIGN_ID
      --out_version OUT_VERSION
      --num_images_in_campaign DB_NAME
+     [--stratify_by none|folder|decade]
 
 Example:
   $PROGNAME
@@ -28,6 +29,9 @@ Options:
       (required) The number of random image in the campaign.
   --out_version
       (optional) The version suffix of the new database. Default is 1.
+  --stratify_by
+      (optional) Take the same number of images from every folder ("folder")
+      or decade ("decade"). Default is "none".
 EO
 }
 
@@ -35,6 +39,7 @@ ARGUMENT_LIST=(
     "campaign_id"
     "out_version"
     "num_images_in_campaign"
+    "stratify_by"
 )
 
 opts=$(getopt \
@@ -46,6 +51,7 @@ opts=$(getopt \
 
 # Defaults.
 out_version=1
+stratify_by="none"
 
 eval set --$opts
 
@@ -67,6 +73,10 @@ while [[ $# -gt 0 ]]; do
             num_images_in_campaign=$2
             shift 2
             ;;
+        --stratify_by)
+            stratify_by=$2
+            shift 2
+            ;;
         --) # No more arguments
             shift
             break
@@ -94,6 +104,7 @@ echo "campaign_id:            ${campaign_id}"
 echo "out_version:            ${out_version}"
 echo "prev_campaign_id:       ${prev_campaign_id}"
 echo "num_images_in_campaign: ${num_images_in_campaign}"
+echo "stratify_by:            ${stratify_by}"
 
 # The end of the parsing code.
 ################################################################################
@@ -112,17 +123,31 @@ db_path=$(get_1800x1200_db_path ${campaign_id} ${out_version})
 echo "Creating directory '${DATABASES_DIR}/campaign${campaign_id}'"
 mkdir -p "${DATABASES_DIR}/campaign${campaign_id}"
 
-# Select random images.
-python -m shuffler \
-  -i $(get_1800x1200_all_db_path) \
-  -o ${db_path} \
+# Labeled images are recorded after every import. Recording the latest
+# up-to-now db again is cheap, and covers dbs imported before that.
+python3 ${dir_of_this_file}/../scripts/select_new_campaign.py \
+  --index_db_file $(get_image_metadata_db_path) \
+  record \
+    --db_file $(get_1800x1200_uptonow_db_path ${prev_campaign_id} 'latest')
+
+# Select random unlabeled images.
+python3 ${dir_of_this_file}/../scripts/select_new_campaign.py \
+  --index_db_file $(get_image_metadata_db_path) \
+  select \
+    --all_db_file $(get_1800x1200_all_db_path) \
+    --out_db_file ${db_path} \
+    --number ${num_images_in_campaign} \
+    --stratify_by ${stratify_by}
+
+# Images that are not in the index yet are checked here.
+python3 ${dir_of_this_file}/../scripts/image_metadata_index.py \
+  --rootdir ${ROOT_DIR} \
+  --index_db_file $(get_image_metadata_db_path) \
+  filter_bad --db_file ${db_path}
+python3 ${dir_of_this_file}/../scripts/image_metadata_index.py \
   --rootdir ${ROOT_DIR} \
-  filterImagesViaAnotherDb \
-    --ref_db_file $(get_1800x1200_uptonow_db_path ${prev_campaign_id} 'latest') \
-    --delete \
-    --dirtree_level 1 \| \
-  randomNImages -n ${num_images_in_campaign} \| \
-  filterBadImages
+  --index_db_file $(get_image_metadata_db_path) \
+  fill_sizes --db_file ${db_path}
 
 sqlite3 ${db_path} "
   UPDATE images SET name='${campaign_id}';
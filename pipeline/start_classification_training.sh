@@ -16,6 +16,7 @@ Usage:
      --k_fold K_FOLD
      --set_id SET_ID
      --run_id RUN_ID
+     --hold_full HOLD_FULL
      --dry_run_split DRY_RUN_SPLIT
      --dry_run_submit DRY_RUN_SUBMIT
 
@@ -36,6 +37,10 @@ Options:
                  Default: "expand0.5.size260". Look up options in dir "crops".
   --run_id
       (optional) The try id. Use if the 0th try failed. Default is 0.
+  --hold_full
+      (optional) Enter 1 to train the "full" split only for the best
+      hyperparameters, which are selected after the other splits finish.
+      Default: "0"
   --dry_run_split
       (optional) Enter 1 to NOT create splits. Use it when testing submission scrips. Default: "0"
   --dry_run_submit
@@ -49,6 +54,7 @@ ARGUMENT_LIST=(
     "k_fold"
     "set_id"
     "run_id"
+    "hold_full"
     "dry_run_submit"
     "dry_run_split"
 )
@@ -64,6 +70,7 @@ opts=$(getopt \
 set_id="expand0.5.size260"
 k_fold=5
 run_id=0
+hold_full=0
 dry_run_submit=0
 dry_run_split=0
 
@@ -95,6 +102,10 @@ while [[ $# -gt 0 ]]; do
             run_id=$2
             shift 2
             ;;
+        --hold_full)
+            hold_full=$2
+            shift 2
+            ;;
         --dry_run_split)
             dry_run_split=$2
             shift 2
@@ -129,6 +140,7 @@ echo "in_version:             ${in_version}"
 echo "k_fold:                 ${k_fold}"
 echo "set_id:                 ${set_id}"
 echo "run_id:                 ${run_id}"
+echo "hold_full:              ${hold_full}"
 echo "dry_run_split:          ${dry_run_split}"
 echo "dry_run_submit:         ${dry_run_submit}"
 
@@ -150,6 +162,17 @@ filename=$(basename -- ${in_db_path})
 stem="${filename%.*}"
 splits_dir="${DATABASES_DIR}/campaign${campaign_id}/crops/splits/${stem}"
 
+# Skip splitting if the input db, parameters and this script did not change.
+memo_args="--manifest ${splits_dir}/manifest.json \
+  --inputs ${in_db_path} \
+  --params k_fold=${k_fold} seed=0 \
+  --scripts $0 \
+  --outputs ${splits_dir}"
+if [ ${dry_run_split} -eq "0" ] && python3 ${dir_of_this_file}/../scripts/memoize.py check ${memo_args}; then
+    echo "Splits are up to date, skipping."
+    dry_run_split=1
+fi
+
 # Generate splits.
 if [ ${dry_run_split} -eq  "0" ]; then
     echo "Generating splits..."
@@ -164,6 +187,8 @@ if [ ${dry_run_split} -eq  "0" ]; then
     mkdir -p "${splits_dir}/full"
     cp ${in_db_path} "${splits_dir}/full/train.db"
     cp ${in_db_path} "${splits_dir}/full/validation.db"
+
+    python3 ${dir_of_this_file}/../scripts/memoize.py record ${memo_args}
 fi
 
 # Make experiments file. 
@@ -188,4 +213,5 @@ ${dir_of_this_file}/../scripts/classification_training_pel/submit.sh \
   --campaign_id ${campaign_id} \
   --set_id ${set_id} \
   --run_id ${run_id} \
+  --hold_full ${hold_full} \
   --dry_run ${dry_run_submit}
@@ -16,6 +16,7 @@ Usage:
      --expand_fraction EXPAND_FRACTION (0.5, 0.2, 0, etc)
      --size SIZE
      --in_front_pages {0,1}
+     --num_shards NUM_SHARDS
      --dry_run_submit DRY_RUN_SUBMIT
 
 Example:
@@ -35,6 +36,8 @@ Options:
       (optional) Resized to squares of 'size x size' after crop. Default: 260.
   --in_front_pages
       (optional) Enter 1 to keep only stamps inside front pages.
+  --num_shards
+      (optional) Crop on this many nodes. Default: 1.
   --dry_run_submit
       (optional) Enter 1 to NOT submit jobs. Default: "0"
 EO
@@ -46,6 +49,7 @@ ARGUMENT_LIST=(
     "expand_fraction"
     "size"
     "in_front_pages"
+    "num_shards"
     "dry_run_submit"
 )
 
@@ -60,6 +64,7 @@ opts=$(getopt \
 expand_fraction=0.5
 size=260
 in_front_pages=0
+num_shards=1
 dry_run_submit=0
 
 eval set --$opts
@@ -90,6 +95,10 @@ while [[ $# -gt 0 ]]; do
             in_front_pages=$2
             shift 2
             ;;
+        --num_shards)
+            num_shards=$2
+            shift 2
+            ;;
         --dry_run_submit)
             dry_run_submit=$2
             shift 2
@@ -124,6 +133,7 @@ echo "in_version:             ${in_version}"
 echo "expand_fraction:        ${expand_fraction}"
 echo "size:                   ${size}"
 echo "in_front_pages:         ${in_front_pages}"
+echo "num_shards:             ${num_shards}"
 echo "dry_run_submit:         ${dry_run_submit}"
 
 # The end of the parsing code.
@@ -146,27 +156,41 @@ else
 fi
 out_db_file=$(get_6Kx4K_uptonow_db_path ${campaign_id} ${out_version})
 
-if [ ${in_front_pages} -eq 0 ]; then
-  python -m shuffler \
-      -i ${in_db_file} \
-      -o ${out_db_file} \
-      recordPositionOnPage \| \
-      expandObjects --expand_fraction ${expand_fraction}
+# Skip expanding if the input db, parameters and this script did not change.
+memo_args="--manifest ${out_db_file}.manifest.json \
+  --inputs ${in_db_file} \
+  --params expand_fraction=${expand_fraction} in_front_pages=${in_front_pages} \
+  --scripts $0 \
+  --outputs ${out_db_file}"
+if python3 ${dir_of_this_file}/../scripts/memoize.py check ${memo_args}; then
+  echo "${out_db_file} is up to date, skipping."
 else
-  python -m shuffler \
-      -i ${in_db_file} \
-      -o ${out_db_file} \
-      filterObjectsInsideCertainObjects \
-        --keep --where_shadowing_objects "name IN ('page_l', 'page_r', 'page', 'pagel', 'pager')" \| \
-      recordPositionOnPage \| \
-      expandObjects --expand_fraction ${expand_fraction}
+  if [ ${in_front_pages} -eq 0 ]; then
+    python -m shuffler \
+        -i ${in_db_file} \
+        -o ${out_db_file} \
+        recordPositionOnPage \| \
+        expandObjects --expand_fraction ${expand_fraction}
+  else
+    python -m shuffler \
+        -i ${in_db_file} \
+        -o ${out_db_file} \
+        filterObjectsInsideCertainObjects \
+          --keep --where_shadowing_objects "name IN ('page_l', 'page_r', 'page', 'pagel', 'pager')" \| \
+        recordPositionOnPage \| \
+        expandObjects --expand_fraction ${expand_fraction}
+  fi
+
+  python3 ${dir_of_this_file}/../scripts/memoize.py record ${memo_args}
 fi
 
+# Stamps cropped for previous campaigns are reused from the cache of crops.
 ${dir_of_this_file}/../scripts/crop_stamps_job/submit.sh \
   --campaign_id ${campaign_id} \
   --in_version ${out_version} \
   --up_to_now "1" \
   --size ${size} \
+  --num_shards ${num_shards} \
   --dry_run ${dry_run_submit}
 
 echo "Done."
@@ -0,0 +1,187 @@
+#!/bin/bash
+
+set -e
+
+# Parse command line arguments.
+PROGNAME=${0##*/}
+usage()
+{
+  cat << EO
+Start ML-detection of stamps and pages in the newly created campaign in one job.
+Replaces start_stamp_detection_inference.sh and start_page_detection_inference.sh.
+Both models run on the input version, so pages are detected before stamps are
+finalized. Pass "--detected_on_version IN_VERSION" to
+finalize_page_detection_inference.sh to add the detected pages to the version
+with finalized stamps.
+
+Usage:
+  $PROGNAME
+     --campaign_id CAMPAIGN_ID
+     --in_version IN_VERSION
+     --model_campaign_id MODEL_CAMPAIGN_ID
+     --stamp_set_id STAMP_SET_ID
+     --stamp_run_id STAMP_RUN_ID
+     --page_set_id PAGE_SET_ID
+     --page_run_id PAGE_RUN_ID
+     --dry_run_submit DRY_RUN_SUBMIT
+
+Example:
+  $PROGNAME
+     --campaign_id 8
+     --in_version 1
+     --stamp_run_id 0
+     --page_run_id 0
+
+Options:
+  --campaign_id
+      (required) The campaign id.
+  --in_version
+      (required) The version of the input database.
+  --model_campaign_id
+      (optional) Pick which campaign to load the models from. Default: campaign_id-1.
+  --stamp_set_id
+      (optional) Set id of the stamp model. Default: "set-stamp-1800x1200".
+  --stamp_run_id
+      (Required) Run id of the stamp model.
+  --page_set_id
+      (optional) Set id of the page model. Default: "set-page-1800x1200".
+  --page_run_id
+      (Required) Run id of the page model.
+  --dry_run_submit
+      (optional) Enter 1 to NOT submit jobs. Default: "0"
+EO
+}
+
+ARGUMENT_LIST=(
+    "campaign_id"
+    "in_version"
+    "model_campaign_id"
+    "stamp_set_id"
+    "stamp_run_id"
+    "page_set_id"
+    "page_run_id"
+    "dry_run_submit"
+)
+
+opts=$(getopt \
+    --longoptions "help,""$(printf "%s:," "${ARGUMENT_LIST[@]}")" \
+    --name "$(basename "$0")" \
+    --options "h" \
+    -- "$@"
+)
+
+# Defaults.
+stamp_set_id="set-stamp-1800x1200"
+page_set_id="set-page-1800x1200"
+dry_run_submit=0
+
+eval set --$opts
+
+while [[ $# -gt 0 ]]; do
+    case "$1" in
+        -h|--help)
+            usage
+            exit 0
+            ;;
+        --campaign_id)
+            campaign_id=$2
+            shift 2
+            ;;
+        --in_version)
+            in_version=$2
+            shift 2
+            ;;
+        --model_campaign_id)
+            model_campaign_id=$2
+            shift 2
+            ;;
+        --stamp_set_id)
+            stamp_set_id=$2
+            shift 2
+            ;;
+        --stamp_run_id)
+            stamp_run_id=$2
+            shift 2
+            ;;
+        --page_set_id)
+            page_set_id=$2
+            shift 2
+            ;;
+        --page_run_id)
+            page_run_id=$2
+            shift 2
+            ;;
+        --dry_run_submit)
+            dry_run_submit=$2
+            shift 2
+            ;;
+        --) # No more arguments
+            shift
+            break
+            ;;
+        *)
+            echo "Arg '$1' is not supported."
+            exit 1
+            ;;
+    esac
+done
+
+# Check required arguments.
+if [ -z "$campaign_id" ]; then
+  echo "Argument 'campaign_id' is required."
+  exit 1
+fi
+if [ -z "$in_version" ]; then
+  echo "Argument 'in_version' is required."
+  exit 1
+fi
+if [ -z "$model_campaign_id" ]; then
+  model_campaign_id=$((campaign_id-1))
+  echo "Automatically setting model_campaign_id to ${model_campaign_id}."
+fi
+if [ -z "$stamp_run_id" ]; then
+  echo "Argument 'stamp_run_id' is required."
+  exit 1
+fi
+if [ -z "$page_run_id" ]; then
+  echo "Argument 'page_run_id' is required."
+  exit 1
+fi
+
+echo "campaign_id:            ${campaign_id}"
+echo "in_version:             ${in_version}"
+echo "model_campaign_id:      ${model_campaign_id}"
+echo "stamp_set_id:           ${stamp_set_id}"
+echo "stamp_run_id:           ${stamp_run_id}"
+echo "page_set_id:            ${page_set_id}"
+echo "page_run_id:            ${page_run_id}"
+echo "dry_run_submit:         ${dry_run_submit}"
+
+
+# The end of the parsing code.
+################################################################################
+
+# Import all constants.
+dir_of_this_file=$(dirname $(readlink -f $0))
+source ${dir_of_this_file}/../constants.sh
+source ${dir_of_this_file}/../path_generator.sh
+
+# The same paths as of separate stamp and page jobs, so that
+# finalize_*_detection_inference.sh find them.
+stamp_out_db_path=$(get_detected_db_path ${campaign_id} ${in_version} ${model_campaign_id} ${stamp_set_id} ${stamp_run_id})
+page_out_db_path=$(get_detected_db_path ${campaign_id} ${in_version} ${model_campaign_id} ${page_set_id} ${page_run_id})
+echo "Will write the output databases to ${stamp_out_db_path} and ${page_out_db_path}"
+mkdir -p $(dirname ${stamp_out_db_path})
+
+${dir_of_this_file}/../scripts/detection_inference_combined_jobs/submit.sh \
+  --in_db_file "$(get_1800x1200_db_path ${campaign_id} ${in_version})" \
+  --stamp_out_db_file "${stamp_out_db_path}" \
+  --page_out_db_file "${page_out_db_path}" \
+  --model_campaign_id ${model_campaign_id} \
+  --stamp_set_id ${stamp_set_id} \
+  --stamp_run_id ${stamp_run_id} \
+  --page_set_id ${page_set_id} \
+  --page_run_id ${page_run_id} \
+  --dry_run ${dry_run_submit}
+
+echo "Stamp and page inference started."
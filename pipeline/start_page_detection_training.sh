@@ -15,6 +15,7 @@ Usage:
      --in_version IN_VERSION
      --k_fold K_FOLD
      --run_id RUN_ID
+     --hold_full HOLD_FULL
      --dry_run_export DRY_RUN_EXPORT
      --dry_run_submit DRY_RUN_SUBMIT
 
@@ -32,6 +33,10 @@ Options:
       (optional) Will perform k-fold validation. Default is 5.
   --run_id
       (optional) The try id. Use if the 0th try failed. Default is 0.
+  --hold_full
+      (optional) Enter 1 to train the "full" split only for the best
+      hyperparameters, which are selected after the other splits finish.
+      Default: "0"
   --dry_run_export
       (optional) Enter 1 when the data was already exported to COCO. Default: "0"
   --dry_run_submit
@@ -44,6 +49,7 @@ ARGUMENT_LIST=(
     "in_version"
     "k_fold"
     "run_id"
+    "hold_full"
     "dry_run_export"
     "dry_run_submit"
 )
@@ -58,6 +64,7 @@ opts=$(getopt \
 # Defaults.
 k_fold=5
 run_id=0
+hold_full=0
 dry_run_export=0
 dry_run_submit=0
 
@@ -85,6 +92,10 @@ while [[ $# -gt 0 ]]; do
             run_id=$2
             shift 2
             ;;
+        --hold_full)
+            hold_full=$2
+            shift 2
+            ;;
         --dry_run_export)
             dry_run_export=$2
             shift 2
@@ -118,6 +129,7 @@ echo "campaign_id:            ${campaign_id}"
 echo "in_version:             ${in_version}"
 echo "k_fold:                 ${k_fold}"
 echo "run_id:                 ${run_id}"
+echo "hold_full:              ${hold_full}"
 echo "dry_run_export:         ${dry_run_export}"
 echo "dry_run_submit:         ${dry_run_submit}"
 
@@ -137,17 +149,19 @@ echo "Conda environment is activated: '${CONDA_SHUFFLER_ENV}'"
 splits_dir="$(get_page_detection_splits_uptonow_dir $campaign_id $in_version)"
 yolo_dir="${splits_dir}"
 
-yml_text='''
-  path: .  # dataset root dir
-  train: images/train2017  # train images (relative to "path")
-  val: images/val2017  # val images (relative to "path")
-  test:
-  nc: 1
-  names:
-    0: page
-'''
-
 db_path="$(get_1800x1200_uptonow_db_path ${campaign_id} ${in_version}).page.db"
+
+# Skip the export if the input db, parameters and this script did not change.
+memo_args="--manifest ${splits_dir}/manifest.json \
+  --inputs $(get_1800x1200_uptonow_db_path ${campaign_id} ${in_version}) \
+  --params k_fold=${k_fold} seed=0 \
+  --scripts $0 ${dir_of_this_file}/../scripts/export_yolo_splits.py \
+  --outputs ${db_path} ${splits_dir} ${yolo_dir}"
+if [ $dry_run_export -eq 0 ] && python3 ${dir_of_this_file}/../scripts/memoize.py check ${memo_args}; then
+  echo "Splits are up to date, skipping the export."
+  dry_run_export=1
+fi
+
 if [ $dry_run_export -eq 0 ]; then
 
   # Remove pages, remove a bad image, rename all stamps to "stamp".
@@ -161,51 +175,21 @@ if [ $dry_run_export -eq 0 ]; then
   sqlite3 ${db_path} \
     "UPDATE objects SET name='page'; SELECT name,COUNT(name) FROM objects GROUP BY name"
 
-  # Generate splits.
-  echo "Generating splits..."
-  rm -rf ${splits_dir}
-  ${SHUFFLER_DIR}/shuffler/tools/make_cross_validation_splits.sh \
-    --input_db ${db_path} \
-    --output_dir ${splits_dir} \
-    --number ${k_fold} \
-    --seed 0
-
-  # Without splits.
-  mkdir -p "${splits_dir}/full"
-  cp ${db_path} "${splits_dir}/full/train.db"
-  cp ${db_path} "${splits_dir}/full/validation.db"
-
-  # Export to YOLO.
-  echo "Export to YOLO..."
-  seq_from_zero_to_n_minus_one=$(seq 0 $((${k_fold} - 1)))
-  for i in ${seq_from_zero_to_n_minus_one}; do
-    echo "Recreating: ${yolo_dir}/split${i}"
-    rm -rf "${yolo_dir}/split${i}/images"
-    rm -rf "${yolo_dir}/split${i}/labels"
-    python -m shuffler -i "${splits_dir}/split${i}/train.db" --rootdir ${ROOT_DIR} \
-      exportYolo --yolo_dir "${yolo_dir}/split${i}" --subset "train2017" \
-        --classes "page" --symlink_images --dirtree_level_for_name 2 \
-        --as_polygons
-    python -m shuffler -i "${splits_dir}/split${i}/validation.db" --rootdir ${ROOT_DIR} \
-      exportYolo --yolo_dir "${yolo_dir}/split${i}" --subset "val2017" \
-        --classes "page" --symlink_images --dirtree_level_for_name 2 \
-        --as_polygons
-    echo "${yml_text}" >"${yolo_dir}/split${i}/dataset.yml"
-  done
-
-  # Export to YOLO without splits.
-  echo "Export to YOLO without splits..."
-  rm -rf "${yolo_dir}/full/images"
-  rm -rf "${yolo_dir}/full/labels"
-  python -m shuffler -i ${db_path} --rootdir ${ROOT_DIR} \
-    exportYolo --yolo_dir "${yolo_dir}/full" --subset "train2017" \
-      --classes "page" --symlink_images --dirtree_level_for_name 2 \
-      --as_polygons
-  python -m shuffler -i ${db_path} --rootdir ${ROOT_DIR} \
-    exportYolo --yolo_dir "${yolo_dir}/full" --subset "val2017" \
-      --classes "page" --symlink_images --dirtree_level_for_name 2 \
-      --as_polygons
-  echo "${yml_text}" >"${yolo_dir}/full/dataset.yml"
+  # Generate splits and export them to YOLO in one run.
+  echo "Generating splits and exporting to YOLO..."
+  rm -rf ${splits_dir} ${yolo_dir}
+  python3 ${dir_of_this_file}/../scripts/export_yolo_splits.py \
+    --db_file ${db_path} \
+    --rootdir ${ROOT_DIR} \
+    --yolo_dir ${yolo_dir} \
+    --splits_dir ${splits_dir} \
+    --k_fold ${k_fold} \
+    --seed 0 \
+    --classes "page" \
+    --dirtree_level_for_name 2 \
+    --as_polygons
+
+  python3 ${dir_of_this_file}/../scripts/memoize.py record ${memo_args}
 fi
 
 set_id="set-page-1800x1200"
@@ -233,6 +217,7 @@ ${dir_of_this_file}/../scripts/detection_training_polygon_yolov5_jobs/submit.sh
   --campaign ${campaign_id} \
   --set_id ${set_id} \
   --run_id ${run_id} \
+  --hold_full ${hold_full} \
   --dry_run ${dry_run_submit}
 
 echo "Started."
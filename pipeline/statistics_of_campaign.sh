@@ -120,25 +120,14 @@ uptonow_db_path=$(get_1800x1200_uptonow_db_path ${campaign_id} ${in_version})
 echo "Visualizing data from ${uptonow_db_path}"
 
 ls ${uptonow_db_path}  # Will exit with an error if does not exist.
-echo 'Labeled total images:'
-sqlite3 ${uptonow_db_path} "SELECT COUNT(1) FROM images"
-echo 'out of total of images in archive:'
-sqlite3 $(get_1800x1200_all_db_path) "SELECT COUNT(1) FROM images"
-
-echo 'Printing number of images per campaign.'
-sqlite3 ${uptonow_db_path} \
-  "SELECT value, COUNT(DISTINCT(imagefile)) 
-   FROM objects o JOIN properties p ON o.objectid = p.objectid
-   WHERE key='campaign' GROUP BY value ORDER BY value"
-
-echo 'Labeled total stamps:'
-sqlite3 ${uptonow_db_path} "SELECT COUNT(1) FROM objects WHERE name NOT LIKE '%page%'"
-
-echo 'Printing number of stamps per campaign.'
-sqlite3 ${uptonow_db_path} \
-  "SELECT value,COUNT(1) 
-   FROM objects o JOIN properties p ON o.objectid = p.objectid
-   WHERE key='campaign' AND name NOT LIKE '%page%' GROUP BY value ORDER BY value"
+
+# Counts are stored in ${DATABASES_DIR}/statistics.db the first time.
+python3 ${dir_of_this_file}/../scripts/db_statistics.py \
+  --logging_level 30 \
+  --db_file ${uptonow_db_path} \
+  --version ${in_version} \
+  --all_db_file $(get_1800x1200_all_db_path) \
+  --report campaign
 
 ## Make some historgrams of name distributions.
 
@@ -116,15 +116,18 @@ in_db_path=$(${get_db_name_func} ${campaign_id} ${in_version})
 
 echo "Working with database: ${in_db_path}"
 
-echo "Stamp names and their count:"
-sqlite3 ${in_db_path} \
-  "SELECT name,COUNT(1) FROM objects WHERE name NOT LIKE '%page%' GROUP BY name"
-
-echo "Number of stamps:"
-sqlite3 ${in_db_path} "SELECT COUNT(1) FROM objects WHERE name NOT LIKE '%page%'"
-
-echo "Number of pages:"
-sqlite3 ${in_db_path} "SELECT COUNT(1) FROM objects WHERE name LIKE '%page%'"
+# Counts are stored in ${DATABASES_DIR}/statistics.db the first time.
+# Only the current campaign is recounted if the previous version was counted.
+base_args=""
+if [[ ${in_version} =~ ^[0-9]+$ ]] && [ ${in_version} -gt 1 ]; then
+  base_args="--base_db_file $(${get_db_name_func} ${campaign_id} $((in_version - 1))) --recount_campaigns ${campaign_id}"
+fi
+python3 ${dir_of_this_file}/../scripts/db_statistics.py \
+  --logging_level 30 \
+  --db_file ${in_db_path} \
+  --version ${in_version} \
+  ${base_args} \
+  --report version
 
 
 echo "Done."
@@ -0,0 +1,137 @@
+'''
+Times statistics queries on a campaign db before and after index_db.py.
+
+Queries are the ones of pipeline/statistics_of_*.sh. With "is_page" they
+use the generated column instead of "name LIKE '%page%'".
+
+A db is synthetic: "num_images" images with "objects_per_image" objects
+each, one of which is a page, in "num_campaigns" campaigns.
+
+Example:
+  python3 scripts/benchmarks/index_db_benchmark.py --num_images 200000
+'''
+
+import sys, os.path as op
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), '..'))
+import db_utils
+import index_db
+
+# Use "{stamp}" for the condition on stamps.
+QUERIES = [
+    'SELECT name,COUNT(1) FROM objects WHERE {stamp} GROUP BY name',
+    'SELECT COUNT(1) FROM objects WHERE {stamp}',
+    'SELECT COUNT(1) FROM objects WHERE {page}',
+    "SELECT value, COUNT(DISTINCT(imagefile)) FROM objects o "
+    "JOIN properties p ON o.objectid = p.objectid "
+    "WHERE key='campaign' GROUP BY value ORDER BY value",
+    "SELECT value,COUNT(1) FROM objects o "
+    "JOIN properties p ON o.objectid = p.objectid "
+    "WHERE key='campaign' AND {stamp} GROUP BY value ORDER BY value",
+]
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Benchmark statistics queries with and without indexes.')
+    parser.add_argument('--num_images', type=int, default=200000)
+    parser.add_argument('--objects_per_image', type=int, default=5)
+    parser.add_argument('--num_names', type=int, default=1000)
+    parser.add_argument('--num_campaigns', type=int, default=6)
+    return parser
+
+
+def make_db(path, num_images, objects_per_image, num_names, num_campaigns):
+    rng = np.random.RandomState(0)
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+      CREATE TABLE images (imagefile TEXT PRIMARY KEY, width INTEGER,
+        height INTEGER, maskfile TEXT, timestamp TIMESTAMP, name TEXT,
+        score REAL);
+      CREATE TABLE objects (objectid INTEGER PRIMARY KEY, imagefile TEXT,
+        x1 INTEGER, y1 INTEGER, width INTEGER, height INTEGER, name TEXT,
+        score REAL);
+      CREATE TABLE properties (id INTEGER PRIMARY KEY, objectid INTEGER,
+        key TEXT, value TEXT);
+    ''')
+    imagefiles = ['campaign/%08d.JPG' % i for i in range(num_images)]
+    conn.executemany('INSERT INTO images(imagefile) VALUES (?)',
+                     ((imagefile, ) for imagefile in imagefiles))
+    num_objects = num_images * objects_per_image
+    names = rng.randint(0, num_names, size=num_objects)
+    objects = []
+    properties = []
+    for objectid in range(num_objects):
+        image = objectid // objects_per_image
+        if objectid % objects_per_image == 0:
+            name = 'page_l' if image % 2 else 'page_r'
+        else:
+            name = 'name%04d' % names[objectid]
+        objects.append((objectid, imagefiles[image], name))
+        properties.append(
+            (objectid, 'campaign', str(3 + image * num_campaigns // num_images)))
+        properties.append((objectid, 'number', str(names[objectid])))
+    conn.executemany(
+        'INSERT INTO objects(objectid,imagefile,name) VALUES (?,?,?)', objects)
+    conn.executemany(
+        'INSERT INTO properties(objectid,key,value) VALUES (?,?,?)',
+        properties)
+    conn.commit()
+    conn.close()
+
+
+def time_queries(db_path):
+    conn = db_utils.connect(db_path, read_only=True)
+    cursor = conn.cursor()
+    conditions = {
+        'stamp': db_utils.page_condition(cursor, is_page=False),
+        'page': db_utils.page_condition(cursor, is_page=True),
+    }
+    results = []
+    total = 0
+    for query in QUERIES:
+        start = time.time()
+        results.append(cursor.execute(query.format(**conditions)).fetchall())
+        total += time.time() - start
+    conn.close()
+    return results, total
+
+
+def main():
+    args = get_parser().parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        db_path = op.join(work_dir, 'campaign3toN.db')
+        make_db(db_path, args.num_images, args.objects_per_image,
+                args.num_names, args.num_campaigns)
+        print('Made %d images, %d objects.' %
+              (args.num_images, args.num_images * args.objects_per_image))
+
+        before, elapsed = time_queries(db_path)
+        print('%-12s %8.3f sec' % ('no indexes', elapsed))
+
+        start = time.time()
+        index_db.index_db(db_path)
+        print('%-12s %8.3f sec' % ('indexing', time.time() - start))
+        after, elapsed = time_queries(db_path)
+        print('%-12s %8.3f sec' % ('indexes', elapsed))
+
+        index_db.index_db(db_path, add_is_page=True)
+        with_is_page, elapsed = time_queries(db_path)
+        print('%-12s %8.3f sec' % ('is_page', elapsed))
+
+        if not before == after == with_is_page:
+            print('Results differ.')
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+'''
+Times one pass over crops: a JPEG file per crop vs packed shards.
+
+Crops are synthetic noise of "size" x "size". Pass --work_dir on the file
+system of interest (e.g. Lustre), because a local disk hides the cost of
+opening files. Page cache is not dropped, so run it on crops that were not
+read recently, or compare the second runs.
+
+Example:
+  python3 scripts/benchmarks/packed_crops_benchmark.py \
+    --num_crops 20000 --work_dir ${DATABASES_DIR}/tmp
+'''
+
+import os, sys, os.path as op
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import cv2
+
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), '..'))
+import packed_crops
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Benchmark reading crops from files and from shards.')
+    parser.add_argument('--num_crops', type=int, default=20000)
+    parser.add_argument('--size', type=int, default=260)
+    parser.add_argument('--shard_size', type=int, default=10000)
+    parser.add_argument('--work_dir', help='Default: a temporary dir.')
+    return parser
+
+
+def make_crops(crops_dir, num_crops, size):
+    rng = np.random.RandomState(0)
+    base = rng.randint(0, 255, size=(size, size, 3)).astype(np.uint8)
+    items = []
+    for objectid in range(num_crops):
+        path = op.join(crops_dir, '%09d.jpg' % objectid)
+        cv2.imwrite(path, np.roll(base, objectid, axis=0))
+        items.append((objectid, path))
+    return items
+
+
+def main():
+    args = get_parser().parse_args()
+
+    work_dir = tempfile.mkdtemp(dir=args.work_dir)
+    try:
+        crops_dir = op.join(work_dir, 'crops')
+        os.makedirs(crops_dir)
+        items = make_crops(crops_dir, args.num_crops, args.size)
+        print('Made %d crops.' % args.num_crops)
+
+        start = time.time()
+        total = 0
+        for _, path in items:
+            total += int(cv2.imread(path)[0, 0, 0])
+        print('%-16s %8.3f sec' % ('files', time.time() - start))
+
+        packed_dir = op.join(work_dir, 'packed')
+        start = time.time()
+        packed_crops.pack(items, packed_dir, args.size, args.shard_size)
+        print('%-16s %8.3f sec' % ('packing', time.time() - start))
+        # All crops are unchanged, so they are copied from the shards.
+        start = time.time()
+        packed_crops.pack(items, packed_dir, args.size, args.shard_size)
+        print('%-16s %8.3f sec' % ('repacking', time.time() - start))
+
+        crops = packed_crops.PackedCrops(packed_dir)
+        start = time.time()
+        for _, batch in crops.iterate():
+            total += int(batch[:, 0, 0, 0].sum())
+        print('%-16s %8.3f sec' % ('packed', time.time() - start))
+
+        shuffled = np.random.RandomState(0).permutation(crops.objectids())
+        start = time.time()
+        for objectid in shuffled:
+            total += int(crops.get(objectid)[0, 0, 0])
+        print('%-16s %8.3f sec' % ('packed, shuffled', time.time() - start))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
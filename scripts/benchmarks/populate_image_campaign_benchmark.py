@@ -0,0 +1,131 @@
+'''
+Compares ways of setting images.name to the campaign id in a big db.
+
+- "rows":       one "UPDATE images SET name=? WHERE imagefile=?" per image
+                of every campaign db, as populate_image_campaign.py used to do.
+- "set":        populate_image_campaign.populate, one UPDATE per campaign
+                over attached campaign dbs.
+"--no_index" drops the primary key on images.imagefile, which makes every
+UPDATE of "rows" a full table scan, so use it with fewer images.
+
+A db is synthetic: "num_images" images split evenly between
+"num_campaigns" campaigns, each with its own campaign db.
+
+Example:
+  python3 scripts/benchmarks/populate_image_campaign_benchmark.py \
+    --num_images 1000000 --num_campaigns 6
+'''
+
+import sys, os.path as op
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), '..'))
+import db_utils
+import populate_image_campaign
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Benchmark populating the campaign of images.')
+    parser.add_argument('--num_images', type=int, default=1000000)
+    parser.add_argument('--num_campaigns', type=int, default=6)
+    parser.add_argument('--no_index',
+                        action='store_true',
+                        help='Images table without an index on imagefile.')
+    parser.add_argument('--methods',
+                        nargs='+',
+                        default=['rows', 'set'],
+                        choices=['rows', 'set'])
+    return parser
+
+
+def make_db(path, imagefiles, with_index=True):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE images (imagefile TEXT%s, width INTEGER, '
+                 'height INTEGER, maskfile TEXT, timestamp TIMESTAMP, '
+                 'name TEXT, score REAL)' %
+                 (' PRIMARY KEY' if with_index else ''))
+    conn.executemany('INSERT INTO images(imagefile,width,height) VALUES (?,?,?)',
+                     ((imagefile, 1800, 1200) for imagefile in imagefiles))
+    conn.commit()
+    conn.close()
+
+
+def make_dbs(work_dir, num_images, num_campaigns, with_index):
+    imagefiles = [
+        'original_dataset/campaign%d/%07d.JPG' % (i % num_campaigns, i)
+        for i in range(num_images)
+    ]
+    db_path = op.join(work_dir, 'all.db')
+    make_db(db_path, imagefiles, with_index)
+    campaign_db_paths = []
+    for campaign in range(num_campaigns):
+        campaign_db_path = op.join(work_dir, 'campaign%d.db' % campaign)
+        make_db(campaign_db_path, imagefiles[campaign::num_campaigns])
+        campaign_db_paths.append(campaign_db_path)
+    return db_path, campaign_db_paths
+
+
+def populate_with_rows(db_path, campaign_db_paths):
+    for campaign_id, campaign_db_path in enumerate(campaign_db_paths):
+        conn = sqlite3.connect('file:%s?mode=ro' % campaign_db_path, uri=True)
+        ref_imagefiles = conn.execute('SELECT imagefile FROM images').fetchall()
+        conn.close()
+        conn = sqlite3.connect(db_path)
+        c = conn.cursor()
+        for imagefile, in ref_imagefiles:
+            c.execute('UPDATE images SET name=? WHERE imagefile=?',
+                      (campaign_id, imagefile))
+        conn.commit()
+        conn.close()
+
+
+def populate_with_set(db_path, campaign_db_paths):
+    conn = db_utils.connect(db_path)
+    populate_image_campaign.populate(conn, campaign_db_paths,
+                                     list(range(len(campaign_db_paths))))
+    conn.close()
+
+
+def count_named(db_path):
+    conn = sqlite3.connect(db_path)
+    counts = conn.execute(
+        'SELECT name,COUNT(1) FROM images GROUP BY name ORDER BY name'
+    ).fetchall()
+    conn.close()
+    return counts
+
+
+def main():
+    args = get_parser().parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        start = time.time()
+        db_path, campaign_db_paths = make_dbs(work_dir, args.num_images,
+                                              args.num_campaigns,
+                                              not args.no_index)
+        print('Made %d images in %d campaigns in %.1f sec.' %
+              (args.num_images, args.num_campaigns, time.time() - start))
+
+        funcs = {'rows': populate_with_rows, 'set': populate_with_set}
+        results = {}
+        for method in args.methods:
+            method_db_path = op.join(work_dir, '%s.db' % method)
+            shutil.copyfile(db_path, method_db_path)
+            start = time.time()
+            funcs[method](method_db_path, campaign_db_paths)
+            print('%-8s %8.2f sec' % (method, time.time() - start))
+            results[method] = count_named(method_db_path)
+        if len(set(map(str, results.values()))) > 1:
+            print('Methods disagree: %s' % results)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
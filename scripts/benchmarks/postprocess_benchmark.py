@@ -0,0 +1,122 @@
+'''
+Compares ways of aggregating epochs of a sweep into one table.
+
+- "concat":     pd.concat per hyper, as detection postprocess.py used to do.
+- "dicts":      A list of per-epoch dicts, as classification postprocess.py
+                used to do.
+- "table":      postprocess_utils.ResultTable.
+
+A sweep is synthetic: "num_hypers" runs with "num_epochs" epochs each.
+Prints time and peak memory allocated by Python for every method.
+
+Example:
+  python3 scripts/benchmarks/postprocess_benchmark.py \
+    --num_hypers 2000 --num_epochs 300
+'''
+
+import sys, os.path as op
+import time
+import argparse
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), '..'))
+import postprocess_utils
+
+METRIC = 'metrics/mAP_0.5'
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Benchmark aggregation of epochs of a sweep.')
+    parser.add_argument('--num_hypers', type=int, default=1000)
+    parser.add_argument('--num_epochs', type=int, default=200)
+    parser.add_argument('--num_splits', type=int, default=5)
+    parser.add_argument(
+        '--methods',
+        nargs='+',
+        default=['concat', 'dicts', 'table'],
+        choices=['concat', 'dicts', 'table'],
+        help='"concat" is quadratic. Skip it for very large sweeps.')
+    return parser
+
+
+def make_sweep(num_hypers, num_epochs, num_splits):
+    ''' Returns a list of (constants, columns) as parsed by a schema. '''
+    rng = np.random.RandomState(0)
+    sweep = []
+    for i in range(num_hypers):
+        constants = {
+            'hyper_n': '%03d' % (i + 1),
+            'split': 'split%d' % (i % num_splits),
+            'batch_size': 2**(i // num_splits % 3),
+            'lr': 10.**-(i // num_splits // 3 % 4 + 2),
+        }
+        columns = {
+            'epoch': list(range(num_epochs)),
+            METRIC: rng.rand(num_epochs).tolist(),
+        }
+        sweep.append((constants, columns))
+    return sweep
+
+
+def aggregate_with_concat(sweep):
+    df = None
+    for constants, columns in sweep:
+        df_hyper = pd.DataFrame(columns)
+        for key, value in constants.items():
+            df_hyper[key] = value
+        df = df_hyper if df is None else pd.concat([df, df_hyper])
+    return df
+
+
+def aggregate_with_dicts(sweep):
+    list_of_dicts = []
+    for constants, columns in sweep:
+        for epoch, value in zip(columns['epoch'], columns[METRIC]):
+            row = {'epoch': epoch, METRIC: value}
+            row.update(constants)
+            list_of_dicts.append(row)
+    return pd.DataFrame(list_of_dicts)
+
+
+def aggregate_with_table(sweep):
+    table = postprocess_utils.ResultTable(['epoch', METRIC])
+    for constants, columns in sweep:
+        table.append_run(columns, constants)
+    return table.to_dataframe()
+
+
+def measure(func, sweep):
+    tracemalloc.start()
+    start = time.time()
+    df = func(sweep)
+    elapsed = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return df, elapsed, peak
+
+
+def main():
+    args = get_parser().parse_args()
+
+    sweep = make_sweep(args.num_hypers, args.num_epochs, args.num_splits)
+    print(
+        'Sweep: %d hypers x %d epochs = %d rows.' %
+        (args.num_hypers, args.num_epochs, args.num_hypers * args.num_epochs))
+
+    funcs = {
+        'concat': aggregate_with_concat,
+        'dicts': aggregate_with_dicts,
+        'table': aggregate_with_table,
+    }
+    for method in args.methods:
+        df, elapsed, peak = measure(funcs[method], sweep)
+        print('%-8s %8.3f sec, peak %8.1f MB, frame %8.1f MB' %
+              (method, elapsed, peak / 2.**20,
+               df.memory_usage(deep=True).sum() / 2.**20))
+
+
+if __name__ == '__main__':
+    main()
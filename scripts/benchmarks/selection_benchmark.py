@@ -0,0 +1,91 @@
+'''
+Compares ways of selecting the best hyperparameters and epoch of a sweep.
+
+- "pandas":     groupby mean across splits, idxmax per config, global idxmax,
+                as postprocess.py used to do.
+- "cube":       selection_utils.build_cube and selection_utils.select.
+
+A sweep is synthetic: "num_configs" configs trained on "num_splits" splits
+with up to "num_epochs" epochs each. Some runs stop early.
+
+Example:
+  python3 scripts/benchmarks/selection_benchmark.py \
+    --num_configs 500 --num_splits 5 --num_epochs 300
+'''
+
+import sys, os.path as op
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), '..'))
+import postprocess_utils
+import selection_utils
+
+METRIC = 'metrics/mAP_0.5'
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Benchmark selection of the best hyperparameters.')
+    parser.add_argument('--num_configs', type=int, default=500)
+    parser.add_argument('--num_splits', type=int, default=5)
+    parser.add_argument('--num_epochs', type=int, default=300)
+    return parser
+
+
+def make_df(num_configs, num_splits, num_epochs):
+    rng = np.random.RandomState(0)
+    table = postprocess_utils.ResultTable(['epoch', METRIC])
+    for config in range(num_configs):
+        for split in range(num_splits):
+            # Every 10th run stops early.
+            stop = num_epochs if rng.rand() > 0.1 else rng.randint(
+                1, num_epochs)
+            columns = {
+                'epoch': list(range(stop)),
+                METRIC: rng.rand(stop).tolist(),
+            }
+            constants = {
+                'hyper_n': '%05d' % (config * num_splits + split),
+                'split': 'split%d' % split,
+                'batch_size': 2**(config % 5),
+                'lr': 1e-4 * (config // 5 + 1),
+            }
+            table.append_run(columns, constants)
+    return table.to_dataframe()
+
+
+def select_with_pandas(df):
+    df = df.groupby(['batch_size', 'lr', 'epoch'], observed=True).agg({
+        METRIC: ['mean']
+    }).reset_index()
+    df.columns = df.columns.get_level_values(0)
+    df = df.loc[df.groupby(['batch_size', 'lr'],
+                           observed=True)[METRIC].idxmax()]
+    return df.loc[df[METRIC].idxmax()]
+
+
+def select_with_cube(df):
+    cube = selection_utils.build_cube(df, ['batch_size', 'lr'], [METRIC])
+    _, best = selection_utils.select(cube, min_splits=1)
+    return best
+
+
+def main():
+    args = get_parser().parse_args()
+
+    df = make_df(args.num_configs, args.num_splits, args.num_epochs)
+    print('Sweep: %d rows.' % len(df))
+
+    for method, func in [('pandas', select_with_pandas),
+                         ('cube', select_with_cube)]:
+        start = time.time()
+        best = func(df)
+        print('%-8s %8.3f sec, best: batch_size %s, lr %s, epoch %s' %
+              (method, time.time() - start, best['batch_size'], best['lr'],
+               best['epoch']))
+
+
+if __name__ == '__main__':
+    main()
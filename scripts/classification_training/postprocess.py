@@ -6,19 +6,24 @@ The output of this script goes to google sheets.
 '''
 
 import os, sys
-import re
 import logging
 import argparse
-import shutil
-import pandas as pd
+
+sys.path.insert(0,
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 import postprocess_utils
+import selection_utils
+import model_registry
+import submit_utils
 
+# The output from stage1 and stage2 are written to the same output file.
+# Only stage2 is evaluated.
+SCHEMA = postprocess_utils.LogSchema(
+    r'Eval-Accuracy top1 : ([\\.0-9]+)%',
+    start_line='Loading stamps Stage 1 Classifier Weights')
 
-def get_pattern():
-    pattern_str = r'Eval-Accuracy top1 : ([\\.0-9]+)%'
-    logging.info("Will look for pattern: '%s'", pattern_str)
-    pattern = re.compile(pattern_str)
-    return pattern
+# Snapshots of a hyper, deleted with --clean_up.
+SNAPSHOT_PATTERNS = ['stage1/*.pth', 'stage2/*.pth']
 
 
 def get_parser():
@@ -47,6 +52,55 @@ def get_parser():
         help=
         'Copy the best model from this split to folder ${run_id}/besthyper. '
         'If specified, it should normally be "full".')
+    parser.add_argument(
+        "--clean_up",
+        type=int,
+        default=0,
+        help='Enter 1 to delete snapshots of all hypers except the last '
+        '"keep_snapshots" of every hyper, after promoting the best model. '
+        'If copy_best_model_from_split is None, has no effect.')
+    parser.add_argument("--keep_snapshots",
+                        type=int,
+                        default=1,
+                        help='See --clean_up.')
+    parser.add_argument(
+        "--submit_held_full",
+        action='store_true',
+        help='Instead of copying the best model, submit the held hyper of '
+        'split "copy_best_model_from_split" with the best hyperparameters. '
+        'See "--hold_full" of submit.py.')
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        help='The number of processes to parse .out files. Default: all CPUs.')
+    parser.add_argument(
+        "--no_cache",
+        action='store_true',
+        help='Do not use and do not update the cache of parsed .out files '
+        'in "${run_dir}/postprocess_cache.db".')
+    parser.add_argument(
+        "--metrics",
+        nargs='+',
+        default=['value'],
+        help='Metrics to select the best hyperparameters and epoch by, '
+        'in the format "name=weight" or "name". The score is the weighted sum. '
+        'Default: %(default)s.')
+    parser.add_argument(
+        "--smooth_window",
+        type=int,
+        default=1,
+        help='Average the score over this many epochs before selecting.')
+    parser.add_argument(
+        "--std_penalty",
+        type=float,
+        default=0.,
+        help='Subtract std_penalty * (std of the score across splits).')
+    parser.add_argument(
+        "--min_splits",
+        type=int,
+        default=1,
+        help='An epoch counts only if at least this many splits reached it. '
+        'Default: %(default)s, any split.')
     parser.add_argument(
         "--logging_level",
         type=int,
@@ -56,65 +110,13 @@ def get_parser():
     return parser
 
 
-def process_one_run(run_dir, hyper_n, config_prefix):
-    ''' Parse and process one .out file. '''
-    cout_path = postprocess_utils.find_output_file(run_dir, hyper_n)
-    logging.info('Reading cout file "%s"', cout_path)
-    with open(cout_path) as f:
-        lines = f.read().splitlines()
-
-    epoch = 0
-    list_of_dicts = []
-
-    pattern = get_pattern()
-
-    # The output from stage1 and stage2 are written to the same output file.
-    has_started_stage_2 = False
-
-    for line in lines:
-        if line.startswith('Loading stamps Stage 1 Classifier Weights'):
-            has_started_stage_2 = True
-            continue
-        elif not has_started_stage_2:
-            continue
-
-        match = pattern.match(line)
-        if match is None:
-            continue
-        logging.debug('Found line: %s', line)
-        value = float(match.group(1))
-        list_of_dicts.append({
-            'epoch': epoch,
-            'value': value,
-            'hyper_n': hyper_n,
-            'config_prefix': config_prefix,
-        })
-        # Every match is one epoch.
-        epoch += 1
-
-    logging.debug('Found %d epochs in cout_path: %s', epoch, cout_path)
-    return list_of_dicts
-
-
 def build_df(args, run_dir):
     ''' Parse all .out files and build a pd.DataFrame. '''
 
-    if not os.path.exists(args.experiments_path):
-        raise FileNotFoundError('Experiment file not found at: %s' %
-                                args.experiments_path)
-
-    with open(args.experiments_path) as f:
-        lines = f.read().splitlines()
-
-    list_of_dicts_to_eval = []
+    runs_to_eval = []
     hyper_to_hyper_n_map_for_copy = {}
 
-    for line in lines:
-        logging.debug(line)
-        if len(line) == 0 or line.startswith('#'):
-            continue
-        words = line.split(';')
-
+    for words in postprocess_utils.read_experiments(args.experiments_path):
         hyper_n = words[0]
         split = words[1]
         config_prefix = words[2]
@@ -130,10 +132,22 @@ def build_df(args, run_dir):
             logging.info('Skipping this split since it is in the ignore list.')
 
         else:
-            list_of_dicts_to_eval += process_one_run(run_dir, hyper_n,
-                                                     config_prefix)
-
-    return pd.DataFrame(list_of_dicts_to_eval), hyper_to_hyper_n_map_for_copy
+            runs_to_eval.append({
+                'path':
+                postprocess_utils.find_output_file(run_dir, hyper_n),
+                'hyper_n':
+                hyper_n,
+                'split':
+                split,
+                'config_prefix':
+                config_prefix,
+            })
+
+    cache_path = (None if args.no_cache else os.path.join(
+        run_dir, 'postprocess_cache.db'))
+    df = postprocess_utils.parse_runs(runs_to_eval, SCHEMA, args.num_workers,
+                                      cache_path)
+    return df, hyper_to_hyper_n_map_for_copy
 
 
 def main():
@@ -151,23 +165,26 @@ def main():
     if len(df) == 0:
         raise ValueError('Dataframe is empty.')
 
-    df_by_hyper = df.groupby(['hyper_n']).agg({'epoch': ['max']})
+    df_by_hyper = df.groupby(['hyper_n'],
+                             observed=True).agg({'epoch': ['max']})
     logging.info(df_by_hyper)
-
-    # Get the averages across splits.
-    df = df.groupby(['config_prefix', 'epoch']).agg({
-        'value': ['mean']
-    }).reset_index()
-    df.columns = df.columns.get_level_values(0)
-    logging.info(df)
-
-    # Get the best epoch.
-    df = df.loc[df.groupby(['config_prefix'])['value'].idxmax()]
+    fold_hyper_ns = list(df_by_hyper.index)
+
+    metric_names, weights = selection_utils.parse_metrics(args.metrics)
+    for name in metric_names:
+        if name not in SCHEMA.columns():
+            raise ValueError('Unknown metric "%s". Available: %s' %
+                             (name, SCHEMA.columns()))
+    cube = selection_utils.build_cube(df, ['config_prefix'], metric_names)
+
+    # Get the best epoch of every hyperparameter and the best hyperparameter.
+    df_by_config, df = selection_utils.select(cube, weights,
+                                              args.smooth_window,
+                                              args.std_penalty,
+                                              args.min_splits)
     logging.info('The best epoch from every hyperparameter')
-    logging.info(df)
+    logging.info(df_by_config)
 
-    # Get the best hyperparameters.
-    df = df.loc[df['value'].idxmax()]
     logging.info('The best hyperparameter and epoch')
     logging.info(df)
 
@@ -184,6 +201,9 @@ def main():
             sys.exit(1)
 
         hyper_n = int(hyper_to_hyper_n_map_for_copy[(df['config_prefix'])])
+        if args.submit_held_full:
+            submit_utils.submit_held_full(run_dir, hyper_n, fold_hyper_ns)
+            return
 
         epoch_in_filename = df['epoch'] + 1
         hyper_dir = os.path.join(run_dir, 'hyper%03d' % hyper_n)
@@ -196,49 +216,32 @@ def main():
                 snapshot_path)
             sys.exit(1)
 
-        best_hyper_dir = os.path.join(run_dir, 'hyperbest')
-        if os.path.exists(best_hyper_dir):
-            logging.warning('Best hyper dir already exists. Deleting it.')
-            shutil.rmtree(best_hyper_dir)
-
-        # Copy best snapshot.
-        best_snapshot_dir = os.path.join(best_hyper_dir, 'stage2')
-        out_best_snapshot_path = os.path.join(best_snapshot_dir,
-                                              'final_model_checkpoint.pth')
-        if not os.path.exists(best_snapshot_dir):
-            os.makedirs(best_snapshot_dir)
-        shutil.copyfile(snapshot_path, out_best_snapshot_path)
-
-        logging.info('Copied the best model from:\n\t%s\nto\n\t%s',
-                     snapshot_path, out_best_snapshot_path)
-
-        # Copy every extra file in hyper_dir to "hyperbest" dir.
-        files_names = [
-            f for f in os.listdir(hyper_dir)
+        # Link every extra file in hyper_dir and the best snapshot into a new
+        # version of "hyperbest" dir, and swap the symlink "hyperbest" to it.
+        out_best_snapshot_relpath = os.path.join('stage2',
+                                                 'final_model_checkpoint.pth')
+        files = [
+            (os.path.join(hyper_dir, f), f) for f in os.listdir(hyper_dir)
             if os.path.isfile(os.path.join(hyper_dir, f))
         ]
-        for file_name in files_names:
-            old_file_path = os.path.join(hyper_dir, file_name)
-            new_file_path = os.path.join(best_hyper_dir, file_name)
-            logging.info('Copying from:\n\t%s\nto\n\t%s', old_file_path,
-                         new_file_path)
-            shutil.copyfile(old_file_path, new_file_path)
-
-        # logging.warning('Clean up is set to %s. Will ignore it.',
-        #                 'TRUE' if args.clean_up else 'FALSE')
-        # if args.clean_up:
-        #     count = 0
-        #     for hyper_dir in glob.glob(
-        #             os.path.join(args.classification_dir,
-        #                          'campaign%d' % args.campaign,
-        #                          'set%s' % args.set, 'run%s' % args.run,
-        #                          'results', 'hyper???')):
-        #         for snaphot_path in glob.glob(
-        #                 os.path.join(hyper_dir, 'snapshots/*.h5')):
-        #             logging.debug('Deleting %s', snaphot_path)
-        #             os.remove(snaphot_path)
-        #             count += 1
-        #     logging.info('Removed %d snapshots.', count)
+        files.append((snapshot_path, out_best_snapshot_relpath))
+        info = {
+            'hyper_n': hyper_n,
+            'config_prefix': str(df['config_prefix']),
+            'epoch': int(df['epoch']),
+        }
+        model_registry.promote_dir(files,
+                                   os.path.join(run_dir, 'hyperbest'),
+                                   run_dir=run_dir,
+                                   info=info)
+        logging.info('Promoted the best model from:\n\t%s', snapshot_path)
+
+        if args.clean_up:
+            # The best snapshot is read by this script when it reruns.
+            model_registry.collect_garbage(run_dir,
+                                           SNAPSHOT_PATTERNS,
+                                           args.keep_snapshots,
+                                           protected=[snapshot_path])
 
 
 if __name__ == '__main__':
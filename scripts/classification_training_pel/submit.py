@@ -0,0 +1,136 @@
+'''
+Submits a sweep of PEL classification trainings as one job array.
+Called by submit.sh, which activates the Shuffler environment.
+
+Every line of the experiments file is
+  "hyper_n;split;num_epochs".
+'''
+
+import os, sys, os.path as op
+import logging
+import argparse
+import subprocess
+
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), '..'))
+import postprocess_utils
+import submit_utils
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Submit a sweep of classification trainings.')
+    submit_utils.add_arguments(parser)
+    parser.add_argument('--gpu_type', default='v100-32')
+    parser.add_argument('--campaign_id',
+                        type=int,
+                        help='Needed for postprocess.py with --hold_full 1.')
+    parser.add_argument('--set_id',
+                        help='Needed for postprocess.py with --hold_full 1.')
+    parser.add_argument('--run_id',
+                        help='Needed for postprocess.py with --hold_full 1.')
+    return parser
+
+
+def encode_names(train_db_file, val_db_file, encoding_file):
+    '''
+    Make an encoding from stamp names to numbers.
+    Creates property key,value = "name_id","<id>" for all except LIKE '%??%'.
+    '''
+    subprocess.run([
+        sys.executable, '-m', 'shuffler', '-i', train_db_file, '-o',
+        train_db_file, 'filterObjectsSQL', '--delete', '--sql',
+        "SELECT objectid FROM objects WHERE name LIKE '%??%' "
+        "OR name LIKE '%page%';", '|', 'encodeNames',
+        '--out_encoding_json_file', encoding_file
+    ],
+                   check=True)
+    # Use the existing encoding file to assign name_ids to validation file.
+    subprocess.run([
+        sys.executable, '-m', 'shuffler', '-i', val_db_file, '-o', val_db_file,
+        'filterObjectsSQL', '--delete', '--sql',
+        "SELECT objectid FROM objects WHERE name LIKE '%page%';", '|',
+        'encodeNames', '--in_encoding_json_file', encoding_file
+    ],
+                   check=True)
+
+
+def make_tasks(args):
+    template = submit_utils.read_template(
+        op.join(op.dirname(op.abspath(__file__)), 'template.sbatch'))
+
+    tasks = []
+    for words in postprocess_utils.read_experiments(args.experiments_path):
+        hyper_n, split, num_epochs = words[:3]
+        logging.info('Hyper %s, split: %s, num_epochs: %s', hyper_n, split,
+                     num_epochs)
+
+        split_dir = op.join(args.splits_dir, split)
+        train_db_file = op.join(split_dir, 'train.db')
+        val_db_file = op.join(split_dir, 'validation.db')
+        for path in [train_db_file, val_db_file]:
+            if not op.exists(path):
+                raise FileNotFoundError('File does not exist at "%s"' % path)
+
+        hyper_dir = op.join(args.run_dir, 'hyper%s' % hyper_n)
+        if not op.exists(hyper_dir):
+            os.makedirs(hyper_dir)
+
+        encoding_file = op.join(hyper_dir, 'encoding.json')
+        encode_names(train_db_file, val_db_file, encoding_file)
+
+        script = submit_utils.render(
+            template, {
+                'PEL_DIR': submit_utils.get_constant('PEL_DIR'),
+                'TRAIN_DB_FILE': train_db_file,
+                'VAL_DB_FILE': val_db_file,
+                'ROOT_DIR': submit_utils.get_constant('ROOT_DIR'),
+                'OUTPUT_DIR': hyper_dir,
+                'ENCODING_FILE': encoding_file,
+                'NUM_EPOCHS': num_epochs,
+                'GPU_TYPE': args.gpu_type,
+                'CONDA_INIT_SCRIPT':
+                submit_utils.get_constant('CONDA_INIT_SCRIPT'),
+                'CONDA_PEL_ENV': submit_utils.get_constant('CONDA_PEL_ENV'),
+            })
+        tasks.append(submit_utils.Task(hyper_dir, script, split))
+    return tasks
+
+
+def make_select_command(args):
+    ''' The command that submits the "full" hyper of the best config. '''
+    for name in ['campaign_id', 'set_id', 'run_id']:
+        if getattr(args, name) is None:
+            raise ValueError('Need --%s with --hold_full 1.' % name)
+    return ' '.join([
+        'python3',
+        op.join(op.dirname(op.abspath(__file__)), 'postprocess.py'),
+        '--experiments_path', args.experiments_path,
+        '--classification_dir',
+        submit_utils.get_constant('CLASSIFICATION_DIR'),
+        '--campaign_id', str(args.campaign_id),
+        '--set_id', args.set_id,
+        '--run_id', args.run_id,
+        '--copy_best_model_from_split', 'full',
+        '--submit_held_full',
+    ])
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        level=args.logging_level)
+
+    tasks = make_tasks(args)
+    if args.hold_full != 0:
+        submit_utils.submit_holding_full(tasks, args.run_dir,
+                                         'train_classification',
+                                         make_select_command(args),
+                                         args.max_parallel, args.dry_run != 0)
+    else:
+        submit_utils.submit_array(tasks, args.run_dir, 'train_classification',
+                                  args.max_parallel, args.dry_run != 0)
+
+
+if __name__ == '__main__':
+    main()
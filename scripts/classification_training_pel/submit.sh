@@ -18,6 +18,8 @@ Usage:
     --run_id RUN_ID
     --experiments_path EXPERIMENTS_PATH
     --gpu_type GPU_TYPE
+    --max_parallel MAX_PARALLEL
+    --hold_full HOLD_FULL
     --dry_run DRY_RUN
 
 Example:
@@ -44,6 +46,12 @@ Options:
       Specify for debugging of experimenting. 
   --gpu_type
       (optional) GPU type to use. Default: "v100-32".
+  --max_parallel
+      (optional) Run at most this many hypers at a time. Default: 0 (no limit).
+  --hold_full
+      (optional) Enter 1 to train the "full" split only for the best
+      hyperparameters. A selection job runs postprocess.py after the other
+      splits, and submits the "full" hyper of the best config. Default: 0.
   --dry_run
       (optional) Enter 1 to NOT submit jobs. Default: "0"
   -h|--help
@@ -58,6 +66,8 @@ ARGUMENT_LIST=(
     "run_id"
     "experiments_path"
     "gpu_type"
+    "max_parallel"
+    "hold_full"
     "dry_run"
 )
 
@@ -70,6 +80,8 @@ opts=$(getopt \
 
 # Defaults.
 gpu_type="v100-32"
+max_parallel=0
+hold_full=0
 dry_run=0
 
 eval set --$opts
@@ -104,6 +116,14 @@ while [[ $# -gt 0 ]]; do
             gpu_type=$2
             shift 2
             ;;
+        --max_parallel)
+            max_parallel=$2
+            shift 2
+            ;;
+        --hold_full)
+            hold_full=$2
+            shift 2
+            ;;
         --dry_run)
             dry_run=$2
             shift 2
@@ -173,89 +193,18 @@ echo "campaign_id:      ${campaign_id}"
 echo "set_id:           ${set_id}"
 echo "run_id:           ${run_id}"
 echo "dry_run:          ${dry_run}"
-
-cat ${experiments_path} | while read line || [[ -n $line ]];
-do
-    echo "Line: ${line}"
-    if [[ "${line}" == "" ]]; then
-        echo "Skipping an empty line."
-        continue
-    fi
-    if [[ ${line} == \#* ]]; then
-        echo "This line is a comment. Skip."
-        continue
-    fi
-
-    IFS=';' # Delimiter
-    read -ra ADDR <<< "$line" # line is read into an array as tokens separated by IFS
-
-    HYPER_N="${ADDR[0]}"
-    SPLIT="${ADDR[1]}"
-    NUM_EPOCHS="${ADDR[2]}"
-
-    split_dir=$splits_dir/$SPLIT
-    if [ ! -d "$split_dir" ]; then
-        echo "Directory with a split does not exist at '$split_dir'"
-        exit 1
-    fi
-
-    hyper_dir="${run_dir}/hyper${HYPER_N}"
-    mkdir -p ${hyper_dir}
-
-    train_db_file="${split_dir}/train.db"
-    val_db_file="${split_dir}/validation.db"
-    ls ${train_db_file}
-    ls ${val_db_file}
-
-    # Stem of the batch job (without extension).
-    batch_job_dir="${hyper_dir}/batch_jobs"
-    mkdir -p "${batch_job_dir}"
-    batch_job_path_stem="${batch_job_dir}/train_classification_$(date +%Y-%m-%d_%H-%M)"
-
-    # Make an encoding from stamp names to numbers.
-    # Creates property key,value = "name_id","<id>" for all except LIKE '%??%'.
-    encoding_file="${hyper_dir}/encoding.json"
-    python -m shuffler -i ${train_db_file} -o ${train_db_file} \
-      filterObjectsSQL \
-        --delete \
-        --sql "SELECT objectid FROM objects WHERE name LIKE '%??%' OR name LIKE '%page%';" \| \
-      encodeNames --out_encoding_json_file ${encoding_file}
-    # Use the existing encoding file to assign name_ids to validation file.
-    python -m shuffler -i ${val_db_file} -o ${val_db_file} \
-      filterObjectsSQL \
-        --delete \
-        --sql "SELECT objectid FROM objects WHERE name LIKE '%page%';" \| \
-      encodeNames --in_encoding_json_file ${encoding_file}
-
-    sed \
-        -e "s|PEL_DIR|${PEL_DIR}|g" \
-        -e "s|TRAIN_DB_FILE|${train_db_file}|g" \
-        -e "s|VAL_DB_FILE|${val_db_file}|g" \
-        -e "s|ROOT_DIR|${ROOT_DIR}|g" \
-        -e "s|OUTPUT_DIR|${hyper_dir}|g" \
-        -e "s|ENCODING_FILE|${encoding_file}|g" \
-        -e "s|NUM_EPOCHS|${NUM_EPOCHS}|g" \
-        -e "s|GPU_TYPE|${gpu_type}|g" \
-        -e "s|CONDA_INIT_SCRIPT|${CONDA_INIT_SCRIPT}|g" \
-        -e "s|CONDA_PEL_ENV|${CONDA_PEL_ENV}|g" \
-        ${template_path} > "${batch_job_path_stem}.sbatch"
-    status=$?
-    if [ ${status} -ne 0 ]; then
-        echo "Failed to use the template from '${template_path}'"
-        exit ${status}
-    fi
-
-    echo "Wrote a job file to '${batch_job_path_stem}.sbatch'."
-    if [ ${dry_run} == "0" ]; then
-        JID=$(sbatch -A ${ACCOUNT} \
-            --output="${batch_job_path_stem}.out" \
-            --error="${batch_job_path_stem}.err" \
-            "${batch_job_path_stem}.sbatch")
-        echo $JID
-        JOB_ID=${JID##* }
-        touch "${batch_job_dir}/job_ids.txt"
-        echo `date`" "${JOB_ID} >> "${batch_job_dir}/job_ids.txt"
-    fi
-
-    IFS=' ' # reset to default value after usage
-done
+echo "max_parallel:     ${max_parallel}"
+echo "hold_full:        ${hold_full}"
+
+# Render all jobs and submit them as one job array.
+python3 ${dir_of_this_file}/submit.py \
+  --experiments_path ${experiments_path} \
+  --splits_dir ${splits_dir} \
+  --run_dir ${run_dir} \
+  --gpu_type ${gpu_type} \
+  --run_id ${run_id} \
+  --max_parallel ${max_parallel} \
+  --hold_full ${hold_full} \
+  --campaign_id ${campaign_id} \
+  --set_id ${set_id} \
+  --dry_run ${dry_run}
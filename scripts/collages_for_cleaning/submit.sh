@@ -128,6 +128,8 @@ sed \
     -e "s|ROOT_DIR|${ROOT_DIR}|g" \
     -e "s|LABELME_USER|${LABELME_USER}|g" \
     -e "s|LABELME_DIR|${LABELME_DIR}|g" \
+    -e "s|SCRIPTS_DIR|$(readlink -f ${dir_of_this_file}/..)|g" \
+    -e "s|CACHE_DIR|$(get_crops_cache_dir)|g" \
     ${template_path} > "${batch_job_path_stem}.sbatch"
 status=$?
 if [ ${status} -ne 0 ]; then
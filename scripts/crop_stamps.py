@@ -0,0 +1,193 @@
+'''
+Crop objects of a db into a new db, where every crop is an image.
+This replaces "shuffler cropObjects | propertyToObjectsField": objects of
+the output db keep their objectid and properties, and have the property
+"original_objectid".
+
+Crops come from the cache (see crop_utils.py). Only crops that are not in
+the cache are cut, in parallel. Files of the output db are hardlinks into
+the cache.
+
+With --packed_dir, crops are also packed into shards that are read with
+one sequential read each, see packed_crops.py.
+
+To crop on several nodes, run a SLURM array with --shard_id and
+--num_shards. Then shards only fill the cache, and a final run without
+these arguments writes the db.
+
+Example:
+  python3 scripts/crop_stamps.py \
+    --rootdir ${ROOT_DIR} \
+    --in_db_file campaign3to8-6Kx4K.v5.expand0.5.db \
+    --out_db_file crops/campaign3to8-6Kx4K.v5.expand0.5.size260.cropped.db \
+    --cache_dir ${DATABASES_DIR}/crops_cache \
+    --size 260
+'''
+
+import os, os.path as op
+import time
+import shutil
+import sqlite3
+import logging
+import argparse
+
+import db_utils
+import crop_utils
+import packed_crops
+
+TABLES = ['images', 'objects', 'properties', 'polygons', 'matches']
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Crop objects of a db, reusing cached crops.')
+    parser.add_argument('--in_db_file', required=True)
+    parser.add_argument('--out_db_file',
+                        help='Not written if --num_shards is more than 1.')
+    parser.add_argument('--rootdir', required=True)
+    parser.add_argument('--cache_dir', required=True)
+    parser.add_argument(
+        '--image_path',
+        help='Directory for crops of the output db. '
+        'Default: the path of the output db without extension.')
+    parser.add_argument(
+        '--where_object',
+        default="objects.name NOT LIKE '%page%' AND objects.name != '??'",
+        help='SQL condition on objects to crop.')
+    parser.add_argument('--size',
+                        type=int,
+                        help='If given, resize crops to squares of this size. '
+                        'Otherwise, keep the original size.')
+    parser.add_argument(
+        '--packed_dir',
+        help='If given, also pack crops there. Requires --size.')
+    parser.add_argument('--num_workers',
+                        type=int,
+                        help='The number of processes. Default: all cpus.')
+    parser.add_argument('--shard_id', type=int, default=0)
+    parser.add_argument('--num_shards', type=int, default=1)
+    parser.add_argument(
+        "--logging_level",
+        type=int,
+        choices=[10, 20, 30, 40],
+        default=20,
+        help="Set logging level. 10: debug, 20: info, 30: warning, 40: error.")
+    return parser
+
+
+def get_objects(in_db_file, where_object):
+    ''' Returns a list of (objectid, imagefile, (x1,y1,width,height)). '''
+    conn = db_utils.connect(in_db_file, read_only=True)
+    try:
+        rows = conn.execute(
+            'SELECT objectid,imagefile,x1,y1,width,height FROM objects '
+            'WHERE %s ORDER BY imagefile' % where_object).fetchall()
+    finally:
+        conn.close()
+    return [(row[0], row[1], tuple(row[2:])) for row in rows]
+
+
+def write_cropped_db(in_db_file, out_db_file, crops, rootdir):
+    '''
+    Args:
+      crops:  A list of (objectid, path of the crop, width, height).
+    '''
+    tmp_db_file = out_db_file + '.tmp'
+    if op.exists(tmp_db_file):
+        os.remove(tmp_db_file)
+    conn = sqlite3.connect(tmp_db_file)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('ATTACH DATABASE ? AS src', (in_db_file, ))
+        for table in TABLES:
+            sql = cursor.execute(
+                "SELECT sql FROM src.sqlite_master "
+                "WHERE type='table' AND name=?", (table, )).fetchone()
+            if sql is not None:
+                cursor.execute(sql[0])
+        cursor.execute(
+            'CREATE TEMP TABLE crops (objectid INTEGER PRIMARY KEY, '
+            'imagefile TEXT, width INTEGER, height INTEGER)')
+        cursor.executemany(
+            'INSERT INTO crops VALUES (?,?,?,?)',
+            [(objectid, op.relpath(path, rootdir), width, height)
+             for objectid, path, width, height in crops])
+        cursor.execute('INSERT INTO images(imagefile,width,height) '
+                       'SELECT imagefile,width,height FROM crops')
+        cursor.execute(
+            'INSERT INTO objects(objectid,imagefile,x1,y1,width,height,name,'
+            'score) SELECT o.objectid,c.imagefile,0,0,c.width,c.height,'
+            'o.name,o.score FROM src.objects o '
+            'JOIN crops c ON o.objectid = c.objectid')
+        cursor.execute('INSERT INTO properties(objectid,key,value) '
+                       'SELECT objectid,key,value FROM src.properties '
+                       'WHERE objectid IN (SELECT objectid FROM crops)')
+        cursor.execute("INSERT INTO properties(objectid,key,value) "
+                       "SELECT objectid,'original_objectid',objectid "
+                       "FROM crops")
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_db_file, out_db_file)
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        level=args.logging_level)
+
+    if args.num_shards == 1 and args.out_db_file is None:
+        raise ValueError('Specify --out_db_file.')
+    if args.packed_dir is not None and args.size is None:
+        raise ValueError('Crops can be packed only with --size.')
+
+    start = time.time()
+    objects = get_objects(args.in_db_file, args.where_object)
+    logging.info('Found %d objects to crop.', len(objects))
+    keys = crop_utils.fill_cache([(imagefile, bbox)
+                                  for _, imagefile, bbox in objects],
+                                 args.rootdir, args.cache_dir, args.size,
+                                 args.num_workers, args.shard_id,
+                                 args.num_shards)
+    logging.info('Filled the cache in %.1f sec.', time.time() - start)
+    if args.num_shards > 1:
+        logging.info('Not writing the db from a shard.')
+        return
+
+    image_path = args.image_path
+    if image_path is None:
+        image_path = op.splitext(args.out_db_file)[0]
+    # The dir only has links, and is made anew to drop deleted objects.
+    if op.exists(image_path):
+        shutil.rmtree(image_path)
+    os.makedirs(image_path)
+    crops = []
+    packed_items = []
+    for (objectid, _, bbox), key in zip(objects, keys):
+        cache_path = crop_utils.get_cache_path(args.cache_dir, key)
+        if not op.exists(cache_path):
+            logging.warning('Object %d was not cropped.', objectid)
+            continue
+        path = op.join(image_path, '%09d.jpg' % objectid)
+        crop_utils.link_or_copy(cache_path, path)
+        width, height = crop_utils.get_crop_shape(bbox, args.size)
+        crops.append((objectid, path, width, height))
+        packed_items.append((objectid, cache_path))
+
+    os.makedirs(op.dirname(op.abspath(args.out_db_file)), exist_ok=True)
+    write_cropped_db(args.in_db_file, args.out_db_file, crops, args.rootdir)
+    if args.packed_dir is not None and len(packed_items) == 0:
+        logging.warning('No crops to pack into %s.', args.packed_dir)
+    elif args.packed_dir is not None:
+        packed_crops.pack(packed_items,
+                          args.packed_dir,
+                          args.size,
+                          num_workers=args.num_workers)
+    logging.info('Wrote %d crops to %s in %.1f sec.', len(crops),
+                 args.out_db_file,
+                 time.time() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,7 @@ Usage:
      --campaign_id CAMPAIGN_ID
      --version IN_VERSION
      --size SIZE
+     --num_shards NUM_SHARDS
 
 Example:
   $PROGNAME
@@ -31,6 +32,9 @@ Options:
       (required) If "0" only this campaign, otherwise all campaigns.
   --size
       (optional) If specified, resize to this size, otherwise, keep the original size.
+  --num_shards
+      (optional) If more than 1, crop images in a job array of this many tasks,
+                 then write the db in a job that depends on it. Default: 1.
   --dry_run
       (optional) Enter 1 to NOT submit jobs. Default: "0"
   -h|--help
@@ -43,6 +47,7 @@ ARGUMENT_LIST=(
     "in_version"
     "up_to_now"
     "size"
+    "num_shards"
     "dry_run"
 )
 
@@ -55,6 +60,7 @@ opts=$(getopt \
 
 # Defaults.
 size=""
+num_shards=1
 dry_run=0
 
 eval set --$opts
@@ -81,6 +87,10 @@ while [[ $# -gt 0 ]]; do
             size=$2
             shift 2
             ;;
+        --num_shards)
+            num_shards=$2
+            shift 2
+            ;;
         --dry_run)
             dry_run=$2
             shift 2
@@ -114,6 +124,7 @@ echo "campaign_id:            ${campaign_id}"
 echo "in_version:             ${in_version}"
 echo "up_to_now:              ${up_to_now}"
 echo "size:                   ${size}"
+echo "num_shards:             ${num_shards}"
 echo "dry_run:                ${dry_run}"
 
 # The end of the parsing code.
@@ -154,6 +165,8 @@ sed \
     -e "s|OUT_CROPPED_DB_FILE|${cropped_db_file}|g" \
     -e "s|SIZE|${size}|g" \
     -e "s|ROOT_DIR|${ROOT_DIR}|g" \
+    -e "s|SCRIPTS_DIR|$(readlink -f ${dir_of_this_file}/..)|g" \
+    -e "s|CACHE_DIR|$(get_crops_cache_dir)|g" \
     -e "s|CONDA_INIT_SCRIPT|${CONDA_INIT_SCRIPT}|g" \
     -e "s|CONDA_SHUFFLER_ENV|${CONDA_SHUFFLER_ENV}|g" \
     ${template_path} > "${batch_job_path_stem}.sbatch"
@@ -165,7 +178,17 @@ fi
 
 echo "Wrote ready job to '${batch_job_path_stem}.sbatch'"
 if [ ${dry_run} == "0" ]; then
-    sbatch -A ${ACCOUNT} \
+    dependency_clause=""
+    if [ ${num_shards} -gt 1 ]; then
+        array_job_id=$(sbatch --parsable -A ${ACCOUNT} \
+            --array=0-$((num_shards-1)) \
+            --output="${batch_job_path_stem}.shard%a.out" \
+            --error="${batch_job_path_stem}.shard%a.err" \
+            "${batch_job_path_stem}.sbatch")
+        echo "Submitted job array ${array_job_id}"
+        dependency_clause="--dependency=afterok:${array_job_id}"
+    fi
+    sbatch -A ${ACCOUNT} ${dependency_clause} \
         --output="${batch_job_path_stem}.out" \
         --error="${batch_job_path_stem}.err" \
         "${batch_job_path_stem}.sbatch"
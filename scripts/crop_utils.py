@@ -0,0 +1,239 @@
+'''
+Cropping objects from images, with a cache of crops.
+
+Shuffler's cropObjects decodes a 6000x4000 image for every object, and
+recrops all stamps of all previous campaigns every time. Here objects are
+grouped by image, so an image is decoded once for all of its crops, and
+images are cropped in parallel by a process pool.
+
+Every crop is stored in a content-addressed cache: its path is a hash of
+(imagefile, bbox, size). A bbox is already expanded if needed, so the
+expansion is part of the key. Images of the archive never change in place,
+so a crop in the cache is valid as long as its key is. A rerun only crops
+objects that are new or whose bbox changed.
+
+Images can also be split between jobs (e.g. of a SLURM array) by a hash of
+imagefile, see in_shard().
+
+Files of cropped dbs are hardlinks into the cache, so a crop with only one
+link is not used by any cropped db. The cache has no size limit. To delete
+unused crops, e.g. after removing old cropped dbs:
+  python3 scripts/crop_utils.py gc --cache_dir ${DATABASES_DIR}/crops_cache \
+    --min_age_days 7 --dry_run
+'''
+
+import os, os.path as op
+import json
+import time
+import zlib
+import shutil
+import hashlib
+import logging
+import argparse
+import concurrent.futures
+import numpy as np
+import cv2
+
+JPEG_QUALITY = 95
+
+
+def get_crop_key(imagefile, bbox, size=None):
+    ''' A hash of everything that defines a crop. "bbox" is (x1,y1,w,h). '''
+    key = json.dumps([imagefile, [float(x) for x in bbox], size])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def get_cache_path(cache_dir, key):
+    return op.join(cache_dir, key[:2], '%s.jpg' % key)
+
+
+def get_crop_shape(bbox, size=None):
+    ''' Returns (width, height) of a crop without reading it. '''
+    if size is not None:
+        return size, size
+    _, _, width, height = bbox
+    return max(int(round(width)), 1), max(int(round(height)), 1)
+
+
+def in_shard(imagefile, shard_id, num_shards):
+    ''' Stable across processes and runs, unlike hash(). '''
+    return zlib.crc32(imagefile.encode('utf-8')) % num_shards == shard_id
+
+
+def crop(image, bbox, size=None):
+    '''
+    Crop "bbox" out of "image". Parts of bbox outside of the image are
+    filled with black. If "size" is given, the crop is resized to a square.
+    '''
+    x1, y1, width, height = bbox
+    x1, y1 = int(round(x1)), int(round(y1))
+    x2 = x1 + max(int(round(width)), 1)
+    y2 = y1 + max(int(round(height)), 1)
+    image_height, image_width = image.shape[:2]
+    patch = image[max(y1, 0):max(min(y2, image_height), 0),
+                  max(x1, 0):max(min(x2, image_width), 0)]
+    pads = (max(-y1, 0), y2 - y1 - max(-y1, 0) - patch.shape[0], max(-x1, 0),
+            x2 - x1 - max(-x1, 0) - patch.shape[1])
+    if any(pads):
+        if patch.size == 0:
+            patch = np.zeros((y2 - y1, x2 - x1, image.shape[2]), image.dtype)
+        else:
+            patch = cv2.copyMakeBorder(patch, *pads, cv2.BORDER_CONSTANT)
+    if size is not None:
+        patch = cv2.resize(patch, (size, size), interpolation=cv2.INTER_AREA)
+    return patch
+
+
+def _write_atomically(path, image):
+    os.makedirs(op.dirname(path), exist_ok=True)
+    tmp_path = '%s.%d.tmp.jpg' % (path[:-len('.jpg')], os.getpid())
+    if not cv2.imwrite(tmp_path, image,
+                       [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]):
+        raise IOError('Failed to write "%s"' % tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _crop_image(task):
+    '''
+    Decode one image and write all its crops to the cache.
+    Returns the number of written crops.
+    '''
+    imagefile, image_path, crops, cache_dir, size = task
+    image = cv2.imread(image_path)
+    if image is None:
+        logging.error('Failed to read "%s", skipping %d crops.', image_path,
+                      len(crops))
+        return 0
+    for key, bbox in crops:
+        _write_atomically(get_cache_path(cache_dir, key),
+                          crop(image, bbox, size))
+    return len(crops)
+
+
+def fill_cache(objects,
+               rootdir,
+               cache_dir,
+               size=None,
+               num_workers=None,
+               shard_id=0,
+               num_shards=1):
+    '''
+    Crop objects that are not in the cache yet.
+    Args:
+      objects:      A list of (imagefile, bbox).
+      rootdir:      Imagefiles are relative to it.
+      cache_dir:    The cache of crops.
+      size:         If given, crops are resized to squares of this size.
+      num_workers:  The number of processes. Default: the number of cpus.
+      shard_id, num_shards:  Only crop images of this shard.
+    Returns:
+      A list of cache keys of "objects", in the same order.
+    '''
+    keys = []
+    missing = {}
+    for imagefile, bbox in objects:
+        key = get_crop_key(imagefile, bbox, size)
+        keys.append(key)
+        if not op.exists(get_cache_path(cache_dir, key)):
+            missing.setdefault(imagefile, {})[key] = bbox
+    logging.info('%d out of %d crops are in the cache.',
+                 len(keys) - sum(len(x) for x in missing.values()), len(keys))
+
+    tasks = [(imagefile, op.join(rootdir, imagefile), list(crops.items()),
+              cache_dir, size) for imagefile, crops in missing.items()
+             if in_shard(imagefile, shard_id, num_shards)]
+    logging.info('Cropping %d images of shard %d/%d.', len(tasks), shard_id,
+                 num_shards)
+    if len(tasks) == 0:
+        return keys
+
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = min(num_workers, len(tasks))
+
+    if num_workers <= 1:
+        num_written = sum(_crop_image(task) for task in tasks)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(num_workers) as executor:
+            num_written = sum(
+                executor.map(_crop_image,
+                             tasks,
+                             chunksize=max(len(tasks) // num_workers // 8, 1)))
+    logging.info('Wrote %d crops to the cache.', num_written)
+    return keys
+
+
+def link_or_copy(src_path, dst_path):
+    ''' Hardlink a file, or copy it if it is on another file system. '''
+    if op.exists(dst_path):
+        os.remove(dst_path)
+    try:
+        os.link(src_path, dst_path)
+    except OSError:
+        shutil.copyfile(src_path, dst_path)
+
+
+def collect_garbage(cache_dir, min_age_days=7, dry_run=False):
+    '''
+    Delete crops that are not linked from any cropped db. Crops younger
+    than "min_age_days" are kept, since a running job may not have linked
+    them yet.
+    Returns:
+      The number of deleted files and the number of bytes freed.
+    '''
+    max_mtime = time.time() - min_age_days * 24 * 3600
+    num_files, num_bytes = 0, 0
+    for dirpath, _, filenames in os.walk(cache_dir):
+        for filename in filenames:
+            path = op.join(dirpath, filename)
+            stat = os.stat(path)
+            if stat.st_nlink > 1 or stat.st_mtime > max_mtime:
+                continue
+            num_files += 1
+            num_bytes += stat.st_size
+            if dry_run:
+                logging.debug('Would delete %s', path)
+            else:
+                os.remove(path)
+    logging.info('%s %d unused crops, %.1f GB.',
+                 'Would delete' if dry_run else 'Deleted', num_files,
+                 num_bytes / 1e9)
+    return num_files, num_bytes
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Delete unused crops from the cache.')
+    parser.add_argument(
+        "--logging_level",
+        type=int,
+        choices=[10, 20, 30, 40],
+        default=20,
+        help="Set logging level. 10: debug, 20: info, 30: warning, 40: error.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_gc = subparsers.add_parser(
+        'gc', help='Delete crops that no cropped db links to.')
+    parser_gc.add_argument('--cache_dir', required=True)
+    parser_gc.add_argument('--min_age_days',
+                           type=float,
+                           default=7,
+                           help='Keep crops modified more recently.')
+    parser_gc.add_argument('--dry_run',
+                           action='store_true',
+                           help='Only log what would be deleted.')
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        level=args.logging_level)
+
+    if args.command == 'gc':
+        collect_garbage(args.cache_dir, args.min_age_days, args.dry_run)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+'''
+Running pipeline steps as a DAG (directed acyclic graph) of stages.
+
+A stage is a command, usually a "pipeline/*.sh" script, with the names of
+stages it depends on. A stage that submits batch jobs (e.g. "start_*.sh")
+is marked with "submits_jobs", and it is complete only when its jobs are.
+
+Two executors are available:
+- LocalExecutor runs every stage as soon as all its dependencies are complete,
+  independent stages in parallel, and waits for submitted jobs by polling.
+- SlurmExecutor runs stages that can start right away, and submits every
+  other stage as a batch job with "--dependency=afterok:<job ids>" on the
+  jobs of its dependencies. The whole DAG is queued at once, and SLURM starts
+  each stage as soon as its inputs are ready.
+'''
+
+import os, sys, os.path as op
+import re
+import json
+import shlex
+import logging
+import subprocess
+import concurrent.futures
+
+import slurm_utils
+
+# Completed successfully, failed, or not run because a dependency failed.
+DONE = 'DONE'
+FAILED = 'FAILED'
+SKIPPED = 'SKIPPED'
+
+# submit.sh scripts print the output of sbatch, submit_utils logs job arrays.
+JOB_ID_PATTERN = re.compile(r'Submitted (?:batch job|job array|job) (\d+)')
+# A job that submits more jobs, e.g. the selection job of submit_utils, is
+# logged with its output, where the ids of those jobs are looked up.
+JOB_OUTPUT_PATTERN = re.compile(r'Submitted job (\d+) with output (\S+)')
+
+
+def parse_job_ids(text):
+    ''' Find ids of all jobs submitted by a stage in its output. '''
+    return JOB_ID_PATTERN.findall(text)
+
+
+def parse_job_outputs(text):
+    ''' Returns {job_id: path of its output} of jobs that submit jobs. '''
+    return dict(JOB_OUTPUT_PATTERN.findall(text))
+
+
+class Stage(object):
+    '''
+    Args:
+      name:           A unique name.
+      command:        A list of strings, the command to run.
+      deps:           Names of stages that must complete before this one.
+      inputs:         Paths that must exist when the stage starts.
+      submits_jobs:   If True, the stage is complete when jobs it submitted are.
+    '''
+
+    def __init__(self, name, command, deps=(), inputs=(), submits_jobs=False):
+        self.name = name
+        self.command = [str(x) for x in command]
+        self.deps = list(deps)
+        self.inputs = list(inputs)
+        self.submits_jobs = submits_jobs
+
+    def command_str(self):
+        return ' '.join(shlex.quote(x) for x in self.command)
+
+    def check_inputs(self):
+        for path in self.inputs:
+            if not op.exists(path):
+                raise FileNotFoundError('Input of stage "%s" is missing: %s' %
+                                        (self.name, path))
+
+
+class Dag(object):
+
+    def __init__(self, stages=()):
+        self.stages = {}
+        for stage in stages:
+            self.add(stage)
+
+    def add(self, stage):
+        if stage.name in self.stages:
+            raise ValueError('Stage "%s" is added twice.' % stage.name)
+        self.stages[stage.name] = stage
+
+    @staticmethod
+    def from_json(path):
+        '''
+        Read a DAG from a JSON file like:
+          {"stages": [{"name": "a", "command": ["echo", "a"]},
+                      {"name": "b", "command": ["echo", "b"], "deps": ["a"]}]}
+        '''
+        with open(path) as f:
+            plan = json.load(f)
+        return Dag([Stage(**stage) for stage in plan['stages']])
+
+    def topological_order(self):
+        ''' Returns stages so that every stage goes after its dependencies. '''
+        for stage in self.stages.values():
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError('Stage "%s" depends on unknown "%s".' %
+                                     (stage.name, dep))
+        order = []
+        # 0 for not visited, 1 for in progress, 2 for visited.
+        marks = {name: 0 for name in self.stages}
+
+        def visit(name):
+            if marks[name] == 1:
+                raise ValueError('The DAG has a cycle through "%s".' % name)
+            if marks[name] == 2:
+                return
+            marks[name] = 1
+            for dep in self.stages[name].deps:
+                visit(dep)
+            marks[name] = 2
+            order.append(self.stages[name])
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def describe(self):
+        lines = []
+        for stage in self.topological_order():
+            lines.append(
+                '%s%s <- [%s]\n\t%s' %
+                (stage.name, ' (submits jobs)' if stage.submits_jobs else '',
+                 ', '.join(stage.deps), stage.command_str()))
+        return '\n'.join(lines)
+
+
+def run_command(command):
+    '''
+    Run a command, echo and return its output (stdout and stderr together).
+    Raises subprocess.CalledProcessError if the command fails.
+    '''
+    logging.info('Running: %s', ' '.join(shlex.quote(x) for x in command))
+    process = subprocess.run(command,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT,
+                             universal_newlines=True)
+    sys.stdout.write(process.stdout)
+    sys.stdout.flush()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command,
+                                            process.stdout)
+    return process.stdout
+
+
+def run_and_wait(command, scheduler, interval=60):
+    '''
+    Run a command, then wait until all jobs it submitted finish, and the jobs
+    that those jobs submitted, if their outputs are known.
+    Raises RuntimeError if any of the jobs did not complete successfully.
+    '''
+    output = run_command(command)
+    job_ids = parse_job_ids(output)
+    outputs = parse_job_outputs(output)
+    seen = set()
+    while True:
+        job_ids = sorted(set(job_ids) - seen)
+        if len(job_ids) == 0:
+            return
+        seen.update(job_ids)
+        logging.info('Waiting for jobs %s.', ', '.join(job_ids))
+        states = slurm_utils.wait_for_jobs(scheduler, job_ids, interval)
+        failed = [
+            job_id for job_id, state in states.items() if state != 'COMPLETED'
+        ]
+        if len(failed) > 0:
+            raise RuntimeError('Jobs did not complete: %s' %
+                               ', '.join('%s (%s)' % (job_id, states[job_id])
+                                         for job_id in failed))
+        # Jobs submitted by the jobs that just finished.
+        new_job_ids = []
+        for job_id in job_ids:
+            if job_id in outputs and op.exists(outputs[job_id]):
+                with open(outputs[job_id]) as f:
+                    text = f.read()
+                new_job_ids += parse_job_ids(text)
+                outputs.update(parse_job_outputs(text))
+        job_ids = new_job_ids
+
+
+class LocalExecutor(object):
+    '''
+    Runs stages as subprocesses. Independent stages run in parallel.
+    Stages that submit jobs are complete when their jobs are, so "scheduler"
+    is used to poll them.
+    '''
+
+    def __init__(self, scheduler=None, max_workers=None, interval=60):
+        self.scheduler = scheduler
+        self.max_workers = max_workers
+        self.interval = interval
+
+    def _run_stage(self, stage):
+        stage.check_inputs()
+        if stage.submits_jobs and self.scheduler is not None:
+            run_and_wait(stage.command, self.scheduler, self.interval)
+        else:
+            run_command(stage.command)
+
+    def run(self, dag):
+        ''' Returns a dict {stage name: DONE, FAILED or SKIPPED}. '''
+        order = dag.topological_order()
+        statuses = {}
+        running = {}
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_workers or len(order)) as executor:
+            while len(statuses) < len(order):
+                # Start or skip every stage whose dependencies are resolved.
+                for stage in order:
+                    if stage.name in statuses or stage.name in running.values(
+                    ):
+                        continue
+                    dep_statuses = [statuses.get(dep) for dep in stage.deps]
+                    if any(status in [FAILED, SKIPPED]
+                           for status in dep_statuses):
+                        logging.warning('Skipping "%s", a dependency failed.',
+                                        stage.name)
+                        statuses[stage.name] = SKIPPED
+                    elif all(status == DONE for status in dep_statuses):
+                        logging.info('Starting stage "%s".', stage.name)
+                        running[executor.submit(self._run_stage,
+                                                stage)] = stage.name
+                if len(running) == 0:
+                    continue
+
+                finished, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        future.result()
+                        statuses[name] = DONE
+                        logging.info('Stage "%s" is done.', name)
+                    except Exception as e:
+                        statuses[name] = FAILED
+                        logging.error('Stage "%s" failed: %s', name, e)
+        return statuses
+
+
+class SlurmExecutor(object):
+    '''
+    Queues the whole DAG at once.
+
+    Stages without pending dependencies that do not submit jobs run right
+    away on this machine. Other stages become batch jobs that depend on the
+    jobs of their dependencies via "--dependency=afterok". If a stage submits
+    jobs, its batch job runs it with "wait_command", which waits for its jobs
+    and the jobs they submit (e.g. the held "full" hyper, see
+    run_and_wait), so that "afterok" on it means that all of them completed.
+
+    Args:
+      scheduler:      slurm_utils.Scheduler.
+      work_dir:       Scripts and logs of stage jobs are written here.
+      job_options:    Extra sbatch options of stage jobs, e.g. a partition.
+      wait_command:   The prefix of the command that runs a stage and waits
+                      for its jobs.
+    '''
+
+    def __init__(self, scheduler, work_dir, job_options=(), wait_command=()):
+        self.scheduler = scheduler
+        self.work_dir = work_dir
+        self.job_options = list(job_options)
+        self.wait_command = list(wait_command)
+
+    def _write_script(self, stage):
+        if not op.exists(self.work_dir):
+            os.makedirs(self.work_dir)
+        command = stage.command
+        if stage.submits_jobs:
+            command = self.wait_command + ['--'] + command
+        script_path = op.join(self.work_dir, '%s.sbatch' % stage.name)
+        with open(script_path, 'w') as f:
+            f.write('#!/bin/bash\n\nset -e\n\n')
+            for path in stage.inputs:
+                f.write('ls %s\n' % shlex.quote(path))
+            f.write(' '.join(shlex.quote(x) for x in command) + '\n')
+        return script_path
+
+    def run(self, dag):
+        '''
+        Returns a dict {stage name: list of job ids to wait for}.
+        An empty list means that the stage is already complete, and None means
+        that it failed or was skipped because a dependency failed.
+        '''
+        stage_jobs = {}
+        for stage in dag.topological_order():
+            if any(stage_jobs[dep] is None for dep in stage.deps):
+                logging.warning('Skipping "%s", a dependency failed.',
+                                stage.name)
+                stage_jobs[stage.name] = None
+                continue
+            dep_job_ids = []
+            for dep in stage.deps:
+                dep_job_ids += stage_jobs[dep]
+
+            if len(dep_job_ids) == 0 and not stage.submits_jobs:
+                try:
+                    stage.check_inputs()
+                    run_command(stage.command)
+                except (OSError, subprocess.CalledProcessError) as e:
+                    logging.error('Stage "%s" failed: %s', stage.name, e)
+                    stage_jobs[stage.name] = None
+                    continue
+                stage_jobs[stage.name] = []
+                logging.info('Stage "%s" is done.', stage.name)
+                continue
+
+            script_path = self._write_script(stage)
+            options = self.job_options + ['--job-name=%s' % stage.name]
+            if len(dep_job_ids) > 0:
+                options += [
+                    '--dependency=afterok:%s' % ':'.join(dep_job_ids),
+                    '--kill-on-invalid-dep=yes',
+                ]
+            options += [
+                '--output=%s' % op.join(self.work_dir, '%s.out' % stage.name),
+                '--error=%s' % op.join(self.work_dir, '%s.err' % stage.name),
+            ]
+            job_id = self.scheduler.submit(script_path, options)
+            stage_jobs[stage.name] = [job_id]
+            logging.info('Stage "%s" is queued as job %s after jobs: %s',
+                         stage.name, job_id, dep_job_ids)
+        return stage_jobs
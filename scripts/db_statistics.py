@@ -0,0 +1,118 @@
+'''
+Print statistics of a campaign database from the statistics store.
+See stats_utils.py for how statistics are computed and stored.
+
+The first call on a db counts its objects, later calls read the store.
+With --base_db_file (e.g. the previous version), only the campaigns that
+changed since that db are counted.
+
+Example:
+  python3 scripts/db_statistics.py \
+    --db_file ${DATABASES_DIR}/campaign8/campaign3to8-1800x1200.v5.db \
+    --base_db_file ${DATABASES_DIR}/campaign8/campaign3to8-1800x1200.v4.db \
+    --recount_campaigns 8 --report version
+'''
+
+import os, os.path as op
+import logging
+import argparse
+
+import stats_utils
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Print statistics of a database.')
+    parser.add_argument('--db_file', required=True)
+    parser.add_argument('--version', help='Version of the db, for reference.')
+    parser.add_argument(
+        '--base_db_file',
+        help='A db with a stored summary that differs in a few campaigns.')
+    parser.add_argument(
+        '--recount_campaigns',
+        nargs='*',
+        default=[],
+        help='Campaigns to recount even if their number of objects is the '
+        'same as in the base db.')
+    parser.add_argument(
+        '--all_db_file',
+        help='The db of the whole archive. Its number of images is printed.')
+    parser.add_argument(
+        '--store_file',
+        help='The statistics store. Default: ${DATABASES_DIR}/statistics.db')
+    parser.add_argument('--full',
+                        action='store_true',
+                        help='Recompute the summary.')
+    parser.add_argument('--report',
+                        choices=['version', 'campaign', 'none'],
+                        default='version')
+    parser.add_argument(
+        "--logging_level",
+        type=int,
+        choices=[10, 20, 30, 40],
+        default=20,
+        help="Set logging level. 10: debug, 20: info, 30: warning, 40: error.")
+    return parser
+
+
+def _print_counts(counts):
+    for value, count in counts:
+        print('%s|%d' % ('' if value is None else value, count))
+
+
+def print_version_report(store, summary_id):
+    print('Stamp names and their count:')
+    _print_counts(stats_utils.get_counts(store, summary_id, 'name', False))
+    print('Number of stamps:')
+    print('%d' % stats_utils.get_num_objects(store, summary_id, False))
+    print('Number of pages:')
+    print('%d' % stats_utils.get_num_objects(store, summary_id, True))
+
+
+def print_campaign_report(store, summary_id, num_all_images=None):
+    print('Labeled total images:')
+    print(stats_utils.get_num_images(store, summary_id))
+    if num_all_images is not None:
+        print('out of total of images in archive:')
+        print(num_all_images)
+    print('Printing number of images per campaign.')
+    _print_counts(stats_utils.get_image_counts(store, summary_id))
+    print('Labeled total stamps:')
+    print('%d' % stats_utils.get_num_objects(store, summary_id, False))
+    print('Printing number of stamps per campaign.')
+    _print_counts(
+        stats_utils.get_counts(store, summary_id, 'campaign', False))
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        level=args.logging_level)
+
+    store_file = args.store_file
+    if store_file is None:
+        if 'DATABASES_DIR' not in os.environ:
+            raise KeyError('Specify --store_file or source "constants.sh".')
+        store_file = op.join(os.environ['DATABASES_DIR'], 'statistics.db')
+
+    store = stats_utils.open_store(store_file)
+    try:
+        summary_id = stats_utils.summarize(store, args.db_file, args.version,
+                                           args.base_db_file,
+                                           args.recount_campaigns, args.full)
+        # Only the number of images is needed, no need to summarize.
+        num_all_images = None
+        if args.all_db_file is not None:
+            num_all_images = stats_utils.count_db_images(args.all_db_file)
+
+        if args.report == 'version':
+            print_version_report(store, summary_id)
+        elif args.report == 'campaign':
+            print_campaign_report(store, summary_id, num_all_images)
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
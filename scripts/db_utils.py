@@ -0,0 +1,149 @@
+'''
+Indexes and pragmas of campaign databases.
+
+Databases like "campaign3toN-*.db" grow with every campaign, and Shuffler
+does not create indexes besides primary keys. Statistics and filters query
+them by objects.name, objects.imagefile and properties.key, so every such
+query was a full table scan. create_indexes() adds covering indexes for
+these queries, and connect() opens a db with a large cache and mmap.
+
+objects.name LIKE '%page%' can not use an index. add_is_page_column() adds
+a generated column "is_page" with an index, so that "is_page = 1" is an
+index lookup. It is opt-in, because the column shows up in
+"SELECT * FROM objects", which some tools unpack into 8 fields.
+'''
+
+import os.path as op
+import sqlite3
+import logging
+
+# Per-connection pragmas. mmap and the cache hold indexes of a full archive.
+PRAGMAS = [
+    'cache_size = -262144',
+    'mmap_size = 1073741824',
+    'temp_store = MEMORY',
+    'synchronous = NORMAL',
+]
+
+# (index name, table, columns). Indexes cover statistics queries, and
+# properties(objectid) is used when Shuffler deletes or syncs objects.
+INDEXES = [
+    ('objects_name', 'objects', ['name']),
+    ('objects_imagefile', 'objects', ['imagefile']),
+    ('properties_key_value', 'properties', ['key', 'value', 'objectid']),
+    ('properties_objectid', 'properties', ['objectid']),
+    ('images_imagefile', 'images', ['imagefile']),
+]
+
+IS_PAGE_SQL = "name LIKE '%page%'"
+
+
+def connect(db_file, read_only=False, pragmas=PRAGMAS):
+    ''' Open a db and set "pragmas". '''
+    if not op.exists(db_file):
+        raise FileNotFoundError('Database does not exist at "%s"' % db_file)
+    if read_only:
+        conn = sqlite3.connect('file:%s?mode=ro' % db_file, uri=True)
+    else:
+        conn = sqlite3.connect(db_file)
+    for pragma in pragmas:
+        conn.execute('PRAGMA %s' % pragma)
+    return conn
+
+
+def get_tables(cursor, schema='main'):
+    return [
+        name for name, in cursor.execute(
+            "SELECT name FROM %s.sqlite_master WHERE type='table'" % schema)
+    ]
+
+
+def has_column(cursor, table, column, schema='main'):
+    # table_xinfo also lists generated columns.
+    return any(
+        row[1] == column for row in cursor.execute(
+            'PRAGMA %s.table_xinfo(%s)' % (schema, table)).fetchall())
+
+
+def get_columns(cursor, schema, table):
+    ''' Returns stored columns of a table. Generated columns are skipped. '''
+    return [
+        row[1]
+        for row in cursor.execute('PRAGMA %s.table_info(%s)' % (schema, table))
+    ]
+
+
+def find_index(cursor, table, columns, schema='main'):
+    '''
+    Returns the name of an index of "table" that starts with "columns",
+    or None. Indexes of primary keys count too.
+    '''
+    for index in cursor.execute('PRAGMA %s.index_list(%s)' %
+                                (schema, table)).fetchall():
+        index_name = index[1]
+        index_columns = [
+            row[2] for row in cursor.execute('PRAGMA %s.index_info(%s)' %
+                                             (schema, index_name)).fetchall()
+        ]
+        if index_columns[:len(columns)] == list(columns):
+            return index_name
+    return None
+
+
+def create_indexes(conn, indexes=INDEXES):
+    ''' Create indexes that are missing. Returns names of created ones. '''
+    cursor = conn.cursor()
+    tables = get_tables(cursor)
+    created = []
+    for name, table, columns in indexes:
+        if table not in tables:
+            logging.debug('No table "%s", skipping index "%s".', table, name)
+            continue
+        existing = find_index(cursor, table, columns)
+        if existing is not None:
+            logging.debug('Index "%s" already covers %s(%s).', existing,
+                          table, ','.join(columns))
+            continue
+        logging.info('Creating index "%s" on %s(%s).', name, table,
+                     ','.join(columns))
+        cursor.execute('CREATE INDEX IF NOT EXISTS %s ON %s(%s)' %
+                       (name, table, ','.join(columns)))
+        created.append(name)
+    conn.commit()
+    return created
+
+
+def add_is_page_column(conn):
+    ''' Add the generated column objects.is_page and its index. '''
+    cursor = conn.cursor()
+    if not has_column(cursor, 'objects', 'is_page'):
+        logging.info('Adding the generated column objects.is_page.')
+        cursor.execute('ALTER TABLE objects ADD COLUMN is_page INTEGER '
+                       'GENERATED ALWAYS AS (%s) VIRTUAL' % IS_PAGE_SQL)
+    create_indexes(conn, [('objects_is_page', 'objects', ['is_page', 'name'])])
+
+
+def page_condition(cursor, is_page=True):
+    '''
+    SQL condition for pages (or for everything else if "is_page" is False).
+    It is an index lookup if the column is_page exists.
+    '''
+    if has_column(cursor, 'objects', 'is_page'):
+        return 'is_page = %d' % int(is_page)
+    return IS_PAGE_SQL if is_page else 'NOT %s' % IS_PAGE_SQL
+
+
+def analyze(conn):
+    ''' Update statistics used by the query planner. '''
+    conn.execute('ANALYZE')
+    conn.commit()
+
+
+def set_wal(conn):
+    '''
+    Switch the db to WAL, so that readers do not block a writer.
+    This is stored in the db file. WAL needs shared memory between
+    processes, so do not use it for dbs opened from several nodes.
+    '''
+    mode = conn.execute('PRAGMA journal_mode = WAL').fetchone()[0]
+    logging.info('Journal mode: %s', mode)
@@ -0,0 +1,410 @@
+'''
+Detect stamps and pages of a db in one pass over its images.
+
+detection_inference_yolov5_jobs and detection_inference_polygon_yolov5_jobs
+each read and decode all images of a campaign, in two GPU jobs. Here every
+image is decoded once, by a pool of threads that prepares the next batch
+while the GPU runs the current one, and each batch is fed to the stamp model
+(YOLOv5) and to the page model (PolygonYOLOv5). Detections of each model are
+written to its own copy of the input db, same as the separate jobs wrote
+them, so that finalize_*_detection_inference.sh read them as before.
+
+The two forks of YOLOv5 have clashing top-level packages "models" and
+"utils", and their checkpoints are pickled against their own fork and
+environment. So the page model runs in this process, in the PolygonYOLOv5
+environment, and the stamp model runs in detect_worker.py, started with
+the python of the YOLOv5 environment ("--stamp_python"), as the separate
+jobs run them. The worker gets letterboxed batches through its stdin and
+runs the stamp model while this process runs the page model.
+
+Example (see template.sbatch):
+  python3 detect.py \
+    --in_db_file campaign8-1800x1200.v1.db --rootdir ${ROOT_DIR} \
+    --stamp_python ${CONDA_YOLOV5_ENV}/bin/python3 \
+    --stamp_weights .../set-stamp-1800x1200/run0/snapshots_best_full.pt \
+    --stamp_out_db_file .../trained-on-campaign7-set-stamp-1800x1200-run0.db \
+    --page_weights .../set-page-1800x1200/run0/snapshots_best_full.pt \
+    --page_out_db_file .../trained-on-campaign7-set-page-1800x1200-run0.db \
+    --yolov5_dir ${YOLOV5_DIR} \
+    --polygon_yolov5_dir ${POLYGON_YOLOV5_DIR}/polygon-yolov5
+'''
+
+import os, sys, os.path as op
+import json
+import time
+import struct
+import sqlite3
+import logging
+import argparse
+import importlib
+import subprocess
+import concurrent.futures
+
+import cv2
+import numpy as np
+import torch
+
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), '..'))
+import db_utils
+
+# The header of a batch sent to detect_worker.py: its shape (N, C, H, W).
+# A batch of 0 images asks the worker to exit.
+BATCH_HEADER = struct.Struct('<4q')
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Detect stamps and pages in one pass over images.')
+    parser.add_argument('--in_db_file', required=True)
+    parser.add_argument('--rootdir', required=True)
+    parser.add_argument('--yolov5_dir',
+                        required=True,
+                        help='The YOLOv5 repo of the stamp model.')
+    parser.add_argument(
+        '--polygon_yolov5_dir',
+        required=True,
+        help='The dir with "models" and "utils" of PolygonYOLOv5.')
+    parser.add_argument(
+        '--stamp_python',
+        default=sys.executable,
+        help='The python of the YOLOv5 environment, runs the stamp model.')
+    parser.add_argument('--stamp_weights', required=True)
+    parser.add_argument('--stamp_out_db_file', required=True)
+    parser.add_argument('--stamp_imgsz', type=int, default=1824)
+    parser.add_argument('--stamp_conf_thres', type=float, default=0.05)
+    parser.add_argument('--stamp_class_name', default='stamp')
+    parser.add_argument('--page_weights', required=True)
+    parser.add_argument('--page_out_db_file', required=True)
+    parser.add_argument('--page_imgsz', type=int, default=1024)
+    parser.add_argument('--page_conf_thres', type=float, default=0.25)
+    parser.add_argument('--page_class_name', default='page')
+    parser.add_argument('--iou_thres', type=float, default=0.45)
+    parser.add_argument('--batch_size', type=int, default=50)
+    parser.add_argument('--num_workers',
+                        type=int,
+                        default=8,
+                        help='The number of threads that decode images.')
+    parser.add_argument('--device',
+                        default='cuda:0' if torch.cuda.is_available() else
+                        'cpu')
+    parser.add_argument(
+        "--logging_level",
+        type=int,
+        choices=[10, 20, 30, 40],
+        default=20,
+        help="Set logging level. 10: debug, 20: info, 30: warning, 40: error.")
+    return parser
+
+
+def letterbox(image, size, color=(114, 114, 114)):
+    '''
+    Resize "image" to fit into a "size" x "size" square, keeping its aspect
+    ratio, and pad it, as YOLOv5 does.
+    Returns:
+      The square image, the scale, and the padding (left, top).
+    '''
+    height, width = image.shape[:2]
+    ratio = min(size / height, size / width)
+    new_width, new_height = round(width * ratio), round(height * ratio)
+    if (new_width, new_height) != (width, height):
+        image = cv2.resize(image, (new_width, new_height),
+                           interpolation=cv2.INTER_LINEAR)
+    left = (size - new_width) // 2
+    top = (size - new_height) // 2
+    image = cv2.copyMakeBorder(image,
+                               top,
+                               size - new_height - top,
+                               left,
+                               size - new_width - left,
+                               cv2.BORDER_CONSTANT,
+                               value=color)
+    return image, ratio, (left, top)
+
+
+class Detector(object):
+    '''
+    A model of a YOLOv5 fork.
+    Args:
+      polygon:  If True, the model is PolygonYOLOv5, and detections are
+                4-point polygons. Otherwise, they are boxes.
+    '''
+
+    def __init__(self, repo_dir, weights, imgsz, conf_thres, iou_thres,
+                 class_name, device, polygon):
+        # Only one fork is imported per process, see the module docstring.
+        sys.path.insert(0, repo_dir)
+        experimental = importlib.import_module('models.experimental')
+        general = importlib.import_module('utils.general')
+        self.model = experimental.attempt_load(weights, device)
+        self.nms = (general.polygon_non_max_suppression
+                    if polygon else general.non_max_suppression)
+        self.model.eval()
+        stride = int(self.model.stride.max())
+        self.imgsz = (imgsz + stride - 1) // stride * stride
+        if self.imgsz != imgsz:
+            logging.warning('Image size %d is not a multiple of %d, using %d.',
+                            imgsz, stride, self.imgsz)
+        self.conf_thres = conf_thres
+        self.iou_thres = iou_thres
+        self.class_name = class_name
+        self.device = device
+        self.polygon = polygon
+        logging.info('Loaded %s, image size %d.', weights, self.imgsz)
+
+    def prepare(self, image):
+        ''' Letterbox a decoded BGR image. Called by decoding threads. '''
+        return prepare(image, self.imgsz)
+
+    @torch.no_grad()
+    def predict(self, batch):
+        '''
+        Args:
+          batch:  A uint8 array N x 3 x imgsz x imgsz of letterboxed images.
+        Returns:
+          A list with an array of NMS rows for every image, in pixels of the
+          letterboxed image.
+        '''
+        batch = torch.from_numpy(batch).to(self.device).float() / 255.
+        predictions = self.nms(self.model(batch)[0], self.conf_thres,
+                               self.iou_thres)
+        return [prediction.cpu().numpy() for prediction in predictions]
+
+    def detect(self, prepared, shapes):
+        '''
+        Args:
+          prepared:  A list of results of "prepare" for a batch.
+          shapes:    A list of (height, width) of original images.
+        Returns:
+          A list with a list of (points, score) for every image. Points are
+          [(x, y), ...] in pixels of the original image.
+        '''
+        rows = self.predict(np.stack([x[0] for x in prepared]))
+        return to_detections(rows, prepared, shapes, self.polygon)
+
+
+class StampWorker(object):
+    '''
+    Runs a YOLOv5 model in detect_worker.py, started with "python", and
+    has the interface of Detector. A batch is sent with "send" and its
+    detections are read with "receive", so that the caller can run another
+    model meanwhile.
+    '''
+
+    def __init__(self, python, repo_dir, weights, imgsz, conf_thres,
+                 iou_thres, device):
+        command = [
+            python,
+            op.join(op.dirname(op.abspath(__file__)), 'detect_worker.py'),
+            '--repo_dir', repo_dir, '--weights', weights, '--imgsz',
+            str(imgsz), '--conf_thres',
+            str(conf_thres), '--iou_thres',
+            str(iou_thres), '--device', device
+        ]
+        logging.info('Starting the stamp model: %s', ' '.join(command))
+        self.process = subprocess.Popen(command,
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE)
+        # The worker reports the image size once it loaded the model.
+        self.imgsz = self._read()['imgsz']
+        self.polygon = False
+
+    def _read(self):
+        line = self.process.stdout.readline()
+        if len(line) == 0:
+            raise RuntimeError('The stamp model exited with code %s.' %
+                               self.process.wait())
+        return json.loads(line)
+
+    def prepare(self, image):
+        ''' Letterbox a decoded BGR image. Called by decoding threads. '''
+        return prepare(image, self.imgsz)
+
+    def send(self, prepared):
+        ''' Start detecting in a list of results of "prepare". '''
+        batch = np.stack([x[0] for x in prepared])
+        self.process.stdin.write(BATCH_HEADER.pack(*batch.shape))
+        self.process.stdin.write(batch.tobytes())
+        self.process.stdin.flush()
+
+    def receive(self, prepared, shapes):
+        ''' Get detections of the batch, same as Detector.detect. '''
+        rows = [np.array(x).reshape(-1, 6) for x in self._read()]
+        return to_detections(rows, prepared, shapes, self.polygon)
+
+    def close(self):
+        self.process.stdin.write(BATCH_HEADER.pack(0, 0, 0, 0))
+        self.process.stdin.close()
+        returncode = self.process.wait()
+        if returncode != 0:
+            raise RuntimeError('The stamp model exited with code %d.' %
+                               returncode)
+
+
+def prepare(image, imgsz):
+    ''' Letterbox a decoded BGR image to a CHW RGB array. '''
+    padded, ratio, pad = letterbox(image, imgsz)
+    # BGR to RGB, HWC to CHW.
+    return np.ascontiguousarray(padded[:, :, ::-1].transpose(2, 0, 1)), \
+        ratio, pad
+
+
+def to_detections(rows, prepared, shapes, polygon):
+    '''
+    Convert NMS rows of images to a list of (points, score) per image, in
+    pixels of the original images. See Detector.detect.
+    '''
+    results = []
+    for prediction, (_, ratio, (left, top)), (height, width) in zip(
+            rows, prepared, shapes):
+        detections = []
+        for row in prediction:
+            if polygon:
+                coords, score = row[:8], row[8]
+            else:
+                x1, y1, x2, y2, score = row[:5]
+                coords = [x1, y1, x2, y1, x2, y2, x1, y2]
+            points = [(min(max((x - left) / ratio, 0), width),
+                       min(max((y - top) / ratio, 0), height))
+                      for x, y in zip(coords[0::2], coords[1::2])]
+            detections.append((points, float(score)))
+        results.append(detections)
+    return results
+
+
+class DetectionWriter(object):
+    ''' Writes detections of one model to a copy of the input db. '''
+
+    def __init__(self, in_db_file, out_db_file, class_name, with_polygons):
+        self.out_db_file = out_db_file
+        self.tmp_db_file = out_db_file + '.tmp'
+        if op.exists(self.tmp_db_file):
+            os.remove(self.tmp_db_file)
+        src = db_utils.connect(in_db_file, read_only=True)
+        self.conn = sqlite3.connect(self.tmp_db_file)
+        src.backup(self.conn)
+        src.close()
+        self.class_name = class_name
+        self.with_polygons = with_polygons
+        self.count = 0
+
+    def add(self, imagefile, detections):
+        cursor = self.conn.cursor()
+        for points, score in detections:
+            xs = [x for x, _ in points]
+            ys = [y for _, y in points]
+            cursor.execute(
+                'INSERT INTO objects(imagefile,x1,y1,width,height,name,score) '
+                'VALUES (?,?,?,?,?,?,?)',
+                (imagefile, min(xs), min(ys), max(xs) - min(xs),
+                 max(ys) - min(ys), self.class_name, score))
+            if self.with_polygons:
+                objectid = cursor.lastrowid
+                cursor.executemany(
+                    'INSERT INTO polygons(objectid,x,y) VALUES (?,?,?)',
+                    [(objectid, x, y) for x, y in points])
+        self.count += len(detections)
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+        os.replace(self.tmp_db_file, self.out_db_file)
+        logging.info('Wrote %d objects "%s" to %s', self.count,
+                     self.class_name, self.out_db_file)
+
+
+def read_image(rootdir, imagefile, detectors):
+    ''' Decode an image once, and prepare it for every detector. '''
+    image = cv2.imread(op.join(rootdir, imagefile))
+    if image is None:
+        return None
+    return image.shape[:2], [detector.prepare(image) for detector in detectors]
+
+
+def iterate_batches(imagefiles, rootdir, detectors, batch_size, executor):
+    '''
+    Yield (imagefiles, images) of batches, where images are results of
+    "read_image". The next batch is decoded while the current one is used.
+    '''
+    batches = [
+        imagefiles[i:i + batch_size]
+        for i in range(0, len(imagefiles), batch_size)
+    ]
+
+    def submit(batch):
+        return [
+            executor.submit(read_image, rootdir, imagefile, detectors)
+            for imagefile in batch
+        ]
+
+    futures = submit(batches[0]) if len(batches) > 0 else []
+    for i, batch in enumerate(batches):
+        images = [future.result() for future in futures]
+        if i + 1 < len(batches):
+            futures = submit(batches[i + 1])
+        yield batch, images
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        level=args.logging_level)
+
+    src = db_utils.connect(args.in_db_file, read_only=True)
+    imagefiles = [
+        imagefile for imagefile, in src.execute(
+            'SELECT imagefile FROM images ORDER BY imagefile')
+    ]
+    src.close()
+    logging.info('Found %d images in %s', len(imagefiles), args.in_db_file)
+
+    stamp_detector = StampWorker(args.stamp_python, args.yolov5_dir,
+                                 args.stamp_weights, args.stamp_imgsz,
+                                 args.stamp_conf_thres, args.iou_thres,
+                                 args.device)
+    page_detector = Detector(args.polygon_yolov5_dir, args.page_weights,
+                             args.page_imgsz, args.page_conf_thres,
+                             args.iou_thres, args.page_class_name,
+                             args.device, True)
+    detectors = [stamp_detector, page_detector]
+    writers = [
+        DetectionWriter(args.in_db_file, args.stamp_out_db_file,
+                        args.stamp_class_name, False),
+        DetectionWriter(args.in_db_file, args.page_out_db_file,
+                        args.page_class_name, True),
+    ]
+
+    start = time.time()
+    num_done = 0
+    with concurrent.futures.ThreadPoolExecutor(args.num_workers) as executor:
+        for batch, images in iterate_batches(imagefiles, args.rootdir,
+                                             detectors, args.batch_size,
+                                             executor):
+            for imagefile, image in zip(batch, images):
+                if image is None:
+                    logging.error('Failed to read image %s', imagefile)
+            batch = [x for x, image in zip(batch, images) if image is not None]
+            images = [image for image in images if image is not None]
+            if len(images) == 0:
+                continue
+            shapes = [shape for shape, _ in images]
+            stamp_detector.send([prepared[0] for _, prepared in images])
+            page_results = page_detector.detect(
+                [prepared[1] for _, prepared in images], shapes)
+            stamp_results = stamp_detector.receive(
+                [prepared[0] for _, prepared in images], shapes)
+            for writer, results in zip(writers,
+                                       [stamp_results, page_results]):
+                for imagefile, detections in zip(batch, results):
+                    writer.add(imagefile, detections)
+            num_done += len(images)
+            logging.info('Processed %d of %d images, %.2f sec per image.',
+                         num_done, len(imagefiles),
+                         (time.time() - start) / num_done)
+    stamp_detector.close()
+    for writer in writers:
+        writer.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+'''
+Run a YOLOv5 model on batches of images sent by detect.py.
+
+detect.py starts this script with the python of the environment of the
+model, and writes batches to its stdin: a header detect.BATCH_HEADER with
+the shape N x 3 x imgsz x imgsz, followed by uint8 letterboxed images. For
+every batch, the script writes a json line to its stdout, with a list of NMS
+rows for every image. A batch of 0 images ends the script. Once the model is
+loaded, the first line says its image size, e.g. {"imgsz": 1824}.
+
+Messages of the model go to stderr, so that they do not mix with the lines.
+'''
+
+import os, sys
+import json
+import logging
+import argparse
+
+import numpy as np
+
+import detect
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Run a YOLOv5 model on batches from detect.py.')
+    parser.add_argument('--repo_dir', required=True)
+    parser.add_argument('--weights', required=True)
+    parser.add_argument('--imgsz', type=int, required=True)
+    parser.add_argument('--conf_thres', type=float, required=True)
+    parser.add_argument('--iou_thres', type=float, required=True)
+    parser.add_argument('--device', required=True)
+    parser.add_argument(
+        "--logging_level",
+        type=int,
+        choices=[10, 20, 30, 40],
+        default=20,
+        help="Set logging level. 10: debug, 20: info, 30: warning, 40: error.")
+    return parser
+
+
+def read_exactly(stream, size):
+    ''' Read "size" bytes into a writable buffer, for torch.from_numpy. '''
+    data = bytearray(size)
+    num_read = stream.readinto(data)
+    if num_read != size:
+        raise EOFError('Expected %d bytes, got %d.' % (size, num_read))
+    return data
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        level=args.logging_level)
+
+    # Keep stdout for the results, and send everything printed to stderr.
+    out = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    stdin = sys.stdin.buffer
+
+    detector = detect.Detector(args.repo_dir, args.weights, args.imgsz,
+                               args.conf_thres, args.iou_thres, None,
+                               args.device, False)
+    out.write(json.dumps({'imgsz': detector.imgsz}) + '\n')
+    out.flush()
+
+    while True:
+        shape = detect.BATCH_HEADER.unpack(
+            read_exactly(stdin, detect.BATCH_HEADER.size))
+        if shape[0] == 0:
+            break
+        batch = np.frombuffer(read_exactly(stdin, int(np.prod(shape))),
+                              dtype=np.uint8).reshape(shape)
+        rows = detector.predict(batch)
+        out.write(json.dumps([x.tolist() for x in rows]) + '\n')
+        out.flush()
+    logging.info('Done.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+#!/bin/bash
+
+set -e
+
+# Parse command line arguments.
+PROGNAME=${0##*/}
+usage()
+{
+  cat << EO
+This scripts performs the inference with a stamp and a page detection model
+in one job. Every image is read and decoded once for both models.
+
+Usage:
+  $PROGNAME
+     --in_db_file IN_DB_FILE
+     --stamp_out_db_file STAMP_OUT_DB_FILE
+     --page_out_db_file PAGE_OUT_DB_FILE
+     --model_campaign_id CAMPAIGN_ID
+     --stamp_set_id STAMP_SET_ID
+     --stamp_run_id STAMP_RUN_ID
+     --page_set_id PAGE_SET_ID
+     --page_run_id PAGE_RUN_ID
+     --gpu_type GPU_TYPE
+     --dry_run DRY_RUN
+
+Example:
+  $PROGNAME
+     --in_db_file "/ocean/projects/hum180001p/shared/databases/campaign8/campaign8-1800x1200.v1.db"
+     --stamp_out_db_file "/ocean/projects/hum180001p/shared/databases/campaign8/campaign8.v1-detected/trained-on-campaign7-set-stamp-1800x1200-run0.db"
+     --page_out_db_file "/ocean/projects/hum180001p/shared/databases/campaign8/campaign8.v1-detected/trained-on-campaign7-set-page-1800x1200-run0.db"
+     --model_campaign_id 7
+     --stamp_run_id 0
+     --page_run_id 0
+
+Options:
+  --in_db_file
+      (required) Full path to the input database file.
+  --stamp_out_db_file
+      (required) Full path to the output database file with detected stamps.
+  --page_out_db_file
+      (required) Full path to the output database file with detected pages.
+  --model_campaign_id
+      (required) Id of campaign OF THE MODELS. Example: 7.
+  --stamp_set_id
+      (optional) Id of set of the stamp model. Default: "set-stamp-1800x1200".
+  --stamp_run_id
+      (required) Id of run of the stamp model. Example: 0.
+  --page_set_id
+      (optional) Id of set of the page model. Default: "set-page-1800x1200".
+  --page_run_id
+      (required) Id of run of the page model. Example: 0.
+  --gpu_type
+      (optional) GPU type to use. Default: "v100-32".
+  --dry_run
+      (optional) Enter 1 to NOT submit the job. Default: 0.
+  -h|--help
+      Print usage and exit.
+EO
+}
+
+ARGUMENT_LIST=(
+    "in_db_file"
+    "stamp_out_db_file"
+    "page_out_db_file"
+    "model_campaign_id"
+    "stamp_set_id"
+    "stamp_run_id"
+    "page_set_id"
+    "page_run_id"
+    "gpu_type"
+    "dry_run"
+)
+
+opts=$(getopt \
+    --longoptions "help,""$(printf "%s:," "${ARGUMENT_LIST[@]}")" \
+    --name "$(basename "$0")" \
+    --options "h" \
+    -- "$@"
+)
+
+# Defaults.
+stamp_set_id="set-stamp-1800x1200"
+page_set_id="set-page-1800x1200"
+gpu_type="v100-32"
+dry_run=0
+
+eval set --$opts
+
+while [[ $# -gt 0 ]]; do
+    case "$1" in
+        -h|--help)
+            usage
+            exit 0
+            ;;
+        --in_db_file)
+            in_db_file=$2
+            shift 2
+            ;;
+        --stamp_out_db_file)
+            stamp_out_db_file=$2
+            shift 2
+            ;;
+        --page_out_db_file)
+            page_out_db_file=$2
+            shift 2
+            ;;
+        --model_campaign_id)
+            model_campaign_id=$2
+            shift 2
+            ;;
+        --stamp_set_id)
+            stamp_set_id=$2
+            shift 2
+            ;;
+        --stamp_run_id)
+            stamp_run_id=$2
+            shift 2
+            ;;
+        --page_set_id)
+            page_set_id=$2
+            shift 2
+            ;;
+        --page_run_id)
+            page_run_id=$2
+            shift 2
+            ;;
+        --gpu_type)
+            gpu_type=$2
+            shift 2
+            ;;
+        --dry_run)
+            dry_run=$2
+            shift 2
+            ;;
+        --) # No more arguments
+            shift
+            break
+            ;;
+        *)
+            echo "Arg '$1' is not supported."
+            exit 1
+            ;;
+    esac
+done
+
+# Check required arguments.
+if [ -z "$in_db_file" ]; then
+  echo "Argument 'in_db_file' is required."
+  exit 1
+fi
+if [ -z "$stamp_out_db_file" ]; then
+  echo "Argument 'stamp_out_db_file' is required."
+  exit 1
+fi
+if [ -z "$page_out_db_file" ]; then
+  echo "Argument 'page_out_db_file' is required."
+  exit 1
+fi
+if [ -z "$model_campaign_id" ]; then
+  echo "Argument 'model_campaign_id' is required."
+  exit 1
+fi
+if [ -z "$stamp_run_id" ]; then
+  echo "Argument 'stamp_run_id' is required."
+  exit 1
+fi
+if [ -z "$page_run_id" ]; then
+  echo "Argument 'page_run_id' is required."
+  exit 1
+fi
+
+echo "in_db_file:        $in_db_file"
+echo "stamp_out_db_file: $stamp_out_db_file"
+echo "page_out_db_file:  $page_out_db_file"
+echo "model_campaign_id: $model_campaign_id"
+echo "stamp_set_id:      $stamp_set_id"
+echo "stamp_run_id:      $stamp_run_id"
+echo "page_set_id:       $page_set_id"
+echo "page_run_id:       $page_run_id"
+echo "gpu_type:          $gpu_type"
+
+# The end of the parsing code.
+################################################################################
+
+# Import all constants.
+dir_of_this_file=$(dirname $(readlink -f $0))
+source ${dir_of_this_file}/../../constants.sh
+source ${dir_of_this_file}/../../path_generator.sh
+
+template_path="${dir_of_this_file}/template.sbatch"
+if [ ! -f "$template_path" ]; then
+    echo "Job template does not exist at '$template_path'"
+    exit 1
+fi
+
+stamp_model_path="${DETECTION_DIR}/campaign${model_campaign_id}/${stamp_set_id}/run${stamp_run_id}/snapshots_best_full.pt"
+ls ${stamp_model_path}
+page_model_path="${DETECTION_DIR}/campaign${model_campaign_id}/${page_set_id}/run${page_run_id}/snapshots_best_full.pt"
+ls ${page_model_path}
+
+batch_jobs_dir="${DATABASES_DIR}/campaign${model_campaign_id}/batch_jobs"
+mkdir -p ${batch_jobs_dir}
+batch_job_path_stem="${batch_jobs_dir}/detection_inference_combined_${stamp_run_id}_${page_run_id}_$(date +%Y-%m-%d_%H-%M)"
+
+# POLYGON_YOLOV5_DIR goes before YOLOV5_DIR, which is its substring.
+sed \
+    -e "s|IN_DB_FILE|${in_db_file}|g" \
+    -e "s|STAMP_OUT_DB_FILE|${stamp_out_db_file}|g" \
+    -e "s|STAMP_MODEL_PATH|${stamp_model_path}|g" \
+    -e "s|PAGE_OUT_DB_FILE|${page_out_db_file}|g" \
+    -e "s|PAGE_MODEL_PATH|${page_model_path}|g" \
+    -e "s|ROOT_DIR|${ROOT_DIR}|g" \
+    -e "s|POLYGON_YOLOV5_DIR|${POLYGON_YOLOV5_DIR}|g" \
+    -e "s|YOLOV5_DIR|${YOLOV5_DIR}|g" \
+    -e "s|SCRIPTS_DIR|$(readlink -f ${dir_of_this_file}/..)|g" \
+    -e "s|GPU_TYPE|${gpu_type}|g" \
+    -e "s|CONDA_INIT_SCRIPT|${CONDA_INIT_SCRIPT}|g" \
+    -e "s|CONDA_POLYGON_YOLOV5_ENV|${CONDA_POLYGON_YOLOV5_ENV}|g" \
+    -e "s|CONDA_YOLOV5_ENV|${CONDA_YOLOV5_ENV}|g" \
+    ${template_path} > "${batch_job_path_stem}.sbatch"
+status=$?
+if [ ${status} -ne 0 ]; then
+    echo "Failed to use the template from '${template_path}'"
+    exit ${status}
+fi
+
+echo "Wrote a job file to '${batch_job_path_stem}.sbatch'."
+if [ ${dry_run} == "0" ]; then
+    sbatch -A ${ACCOUNT} \
+        --output="${batch_job_path_stem}.out" \
+        --error="${batch_job_path_stem}.err" \
+        "${batch_job_path_stem}.sbatch"
+else
+    echo "Wrote a job file without submitting it."
+fi
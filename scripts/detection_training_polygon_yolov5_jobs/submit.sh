@@ -8,7 +8,8 @@ usage()
 {
   cat << EO
 This scripts submits a set of experiments for keras-retinanet.
-A directory is created for each experiment, and then an sbatch is submitted.
+A directory is created for each experiment, and then all experiments
+are submitted as one job array.
  
 The script can be run in dry-run mode without submitting jobs.
 
@@ -22,6 +23,8 @@ Usage:
      --img_size IMG_SIZE
      --gpu_type GPU_TYPE
      --num_gpus NUM_GPUS
+     --max_parallel MAX_PARALLEL
+     --hold_full HOLD_FULL
      --dry_run DRY_RUN
 
 Example:
@@ -49,6 +52,12 @@ Options:
       (optional) GPU type to use. Default: "v100-32".
   --num_gpus
       (optional) Number of GPUs to use. Default: 1.
+  --max_parallel
+      (optional) Run at most this many hypers at a time. Default: 0 (no limit).
+  --hold_full
+      (optional) Enter 1 to train the "full" split only for the best
+      hyperparameters. A selection job runs postprocess.py after the other
+      splits, and submits the "full" hyper of the best config. Default: 0.
   --dry_run
       (optional) Enter 1 to NOT submit jobs. Default: 0.
   -h|--help
@@ -65,6 +74,8 @@ ARGUMENT_LIST=(
     "img_size"
     "gpu_type"
     "num_gpus"
+    "max_parallel"
+    "hold_full"
     "dry_run"
 )
 
@@ -79,6 +90,8 @@ opts=$(getopt \
 img_size=1824
 gpu_type="v100-32"
 num_gpus=1
+max_parallel=0
+hold_full=0
 dry_run=0
 
 eval set --$opts
@@ -121,6 +134,14 @@ while [[ $# -gt 0 ]]; do
             num_gpus=$2
             shift 2
             ;;
+        --max_parallel)
+            max_parallel=$2
+            shift 2
+            ;;
+        --hold_full)
+            hold_full=$2
+            shift 2
+            ;;
         --dry_run)
             dry_run=$2
             shift 2
@@ -166,6 +187,10 @@ dir_of_this_file=$(dirname $(readlink -f $0))
 source ${dir_of_this_file}/../../constants.sh
 source ${dir_of_this_file}/../../path_generator.sh
 
+source ${CONDA_INIT_SCRIPT}
+conda activate ${CONDA_SHUFFLER_ENV}
+echo "Conda environment is activated: '${CONDA_SHUFFLER_ENV}'"
+
 # Will contain hyperparameter folders.
 run_dir=$(get_detection_run_dir ${campaign_id} ${set_id} ${run_id})
 
@@ -192,91 +217,23 @@ echo "campaign_id:      ${campaign_id}"
 echo "set_id:           ${set_id}"
 echo "run_id:           ${run_id}"
 echo "dry_run:          ${dry_run}"
+echo "max_parallel:     ${max_parallel}"
+echo "hold_full:        ${hold_full}"
 echo "img_size:         ${img_size}"
 echo "gpu_type:         ${gpu_type}"
 echo "num_gpus:         ${num_gpus}"
 
-cat ${experiments_path} | while read line || [[ -n $line ]];
-do
-    echo "Line: ${line}"
-    if [[ "${line}" == "" ]]; then
-        echo "Skipping an empty line."
-        continue
-    fi
-    if [[ ${line} == \#* ]]; then
-        echo "This line is a comment. Skip."
-        continue
-    fi
-
-    IFS=';' # Delimiter
-    read -ra ADDR <<< "$line" # line is read into an array as tokens separated by IFS
-
-    HYPER_N="${ADDR[0]}"
-    SPLIT="${ADDR[1]}"
-    BATCH_SIZE="${ADDR[2]}"
-    LEARNING_RATE="${ADDR[3]}"
-    EPOCHS="${ADDR[4]}"
-    SAVE_SNAPSHOTS="${ADDR[5]}"
-    if [ ${SAVE_SNAPSHOTS} == "0" ]; then
-        NO_SAVE_FLAG="--nosave"
-    else
-        NO_SAVE_FLAG=""
-    fi
-
-    # # In case of multiple GPUs, we need to provide some extra arguments.
-    # if [ ${num_gpus} -gt 1 ]; then
-    #   echo "Going to run in the multi-gpu mode."
-    #   num_gpu_options="--multi-gpu ${num_gpus} --multi-gpu-force"
-    # else
-    #   num_gpu_options=""
-    # fi
-    
-    split_dir=$splits_dir/$SPLIT
-    if [ ! -d "$split_dir" ]; then
-        echo "Directory with a split does not exist at '$split_dir'"
-        exit 1
-    fi
-    
-    hyper_dir="${run_dir}/hyper${HYPER_N}"
-    mkdir -p ${hyper_dir}
-
-    # Stem of the batch job (without extension).
-    batch_job_dir="${hyper_dir}/batch_jobs"
-    mkdir -p "${batch_job_dir}"
-    batch_job_path_stem="${batch_job_dir}/train_detector_$(date +%Y-%m-%d_%H-%M)"
-
-    sed \
-      -e "s|DATA_DIR|${split_dir}|g" \
-      -e "s|BATCH_SIZE|${BATCH_SIZE}|g" \
-      -e "s|LEARNING_RATE|${LEARNING_RATE}|g" \
-      -e "s|EPOCHS|${EPOCHS}|g" \
-      -e "s|IMG_SIZE|${img_size}|g" \
-      -e "s|PROJECT_DIR|${hyper_dir}|g" \
-      -e "s|NO_SAVE_FLAG|${NO_SAVE_FLAG}|g" \
-      -e "s|CONDA_INIT_SCRIPT|${CONDA_INIT_SCRIPT}|g" \
-      -e "s|CONDA_POLYGON_YOLOV5_ENV|${CONDA_POLYGON_YOLOV5_ENV}|g" \
-      -e "s|POLYGON_YOLOV5_DIR|${POLYGON_YOLOV5_DIR}|g" \
-      -e "s|DETECTION_DIR|${DETECTION_DIR}|g" \
-      -e "s|GPU_TYPE|${gpu_type}|g" \
-      -e "s|NUM_GPUS|${num_gpus}|g" \
-      ${template_path} > "${batch_job_path_stem}.sbatch"
-    status=$?
-    if [ ${status} -ne 0 ]; then
-        echo "Failed to use the template from '${template_path}'"
-        exit ${status}
-    fi
-
-    echo "Wrote a job file to '${batch_job_path_stem}.sbatch'."
-    if [ ${dry_run} == "0" ]; then
-        JID=$(sbatch -A ${ACCOUNT} \
-            --output="${batch_job_path_stem}.out" \
-            --error="${batch_job_path_stem}.err" \
-            "${batch_job_path_stem}.sbatch")
-        echo $JID
-        JOB_ID=${JID##* }
-        touch "${batch_job_dir}/job_ids.txt"
-        echo `date`" "${JOB_ID} >> "${batch_job_dir}/job_ids.txt"
-    fi
-
-    IFS=' ' # reset to default value after usage
-done
+# Render all jobs and submit them as one job array.
+python3 ${dir_of_this_file}/submit.py \
+  --experiments_path ${experiments_path} \
+  --splits_dir ${splits_dir} \
+  --run_dir ${run_dir} \
+  --img_size ${img_size} \
+  --gpu_type ${gpu_type} \
+  --num_gpus ${num_gpus} \
+  --max_parallel ${max_parallel} \
+  --hold_full ${hold_full} \
+  --campaign_id ${campaign_id} \
+  --set_id ${set_id} \
+  --run_id ${run_id} \
+  --dry_run ${dry_run}
@@ -4,12 +4,23 @@ The result of the analysis is how different hyperparameters perform.
 The output of this script goes to google sheets.
 '''
 
-import os, sys, os.path as op
-import re
+import sys, os.path as op
 import logging
 import argparse
-import shutil
-import pandas as pd
+
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), '..'))
+import postprocess_utils
+import selection_utils
+import model_registry
+import submit_utils
+
+SCHEMA = postprocess_utils.CsvSchema(
+    ['epoch', 'metrics/precision', 'metrics/recall', 'metrics/mAP_0.5'])
+
+# Snapshots of a hyper, deleted with --clean_up.
+SNAPSHOT_PATTERNS = ['exp/weights/*.pt']
+# Read by this script, so never deleted with --clean_up.
+PROTECTED_SNAPSHOTS = ['exp/weights/last.pt']
 
 
 def get_parser():
@@ -38,10 +49,53 @@ def get_parser():
         help="Will look for this 'area' in .out files. Default: all")
     parser.add_argument(
         "--clean_up",
-        type=bool,
-        default=False,
-        help='If true, will delete all snapshots except the best one. '
+        type=int,
+        default=0,
+        help='Enter 1 to delete snapshots of all hypers except the last '
+        '"keep_snapshots" of every hyper, after promoting the best model. '
         'If copy_best_model_from_split is None, has no effect.')
+    parser.add_argument("--keep_snapshots",
+                        type=int,
+                        default=1,
+                        help='See --clean_up.')
+    parser.add_argument(
+        "--submit_held_full",
+        action='store_true',
+        help='Instead of copying the best model, submit the held hyper of '
+        'split "copy_best_model_from_split" with the best hyperparameters. '
+        'See "--hold_full" of submit.py.')
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        help='The number of processes to parse results. Default: all CPUs.')
+    parser.add_argument(
+        "--no_cache",
+        action='store_true',
+        help='Do not use and do not update the cache of parsed results '
+        'in "${run_dir}/postprocess_cache.db".')
+    parser.add_argument(
+        "--metrics",
+        nargs='+',
+        default=['metrics/mAP_0.5'],
+        help='Metrics to select the best hyperparameters and epoch by, '
+        'in the format "name=weight" or "name". The score is the weighted sum. '
+        'Default: %(default)s.')
+    parser.add_argument(
+        "--smooth_window",
+        type=int,
+        default=1,
+        help='Average the score over this many epochs before selecting.')
+    parser.add_argument(
+        "--std_penalty",
+        type=float,
+        default=0.,
+        help='Subtract std_penalty * (std of the score across splits).')
+    parser.add_argument(
+        "--min_splits",
+        type=int,
+        default=1,
+        help='An epoch counts only if at least this many splits reached it. '
+        'Default: %(default)s, any split.')
     parser.add_argument(
         "--logging_level",
         type=int,
@@ -51,50 +105,24 @@ def get_parser():
     return parser
 
 
-def postprocess_one_run(run_dir, hyper_n, batch_size, lr):
-    ''' Parse and process one .out file. '''
-    results_path = os.path.join(run_dir, 'hyper%s' % hyper_n, 'exp',
-                                'results.csv')
+def get_results_path(run_dir, hyper_n):
+    results_path = op.join(run_dir, 'hyper%s' % hyper_n, 'exp', 'results.csv')
     if not op.exists(results_path):
-        raise FileNotFoundError('File does not exist: %s.', results_path)
-
-    df = pd.read_csv(results_path,
-                     sep=',\ *',
-                     usecols=[
-                         'epoch', 'metrics/precision', 'metrics/recall',
-                         'metrics/mAP_0.5'
-                     ])
-    df['hyper_n'] = hyper_n
-    df['batch_size'] = batch_size
-    df['lr'] = lr
-
-    logging.debug('Found %d epochs in results_path: %s', len(df), results_path)
-    return df
+        raise FileNotFoundError('File does not exist: %s.' % results_path)
+    return results_path
 
 
 def build_df(args):
-    ''' Parse all .out files and build a pd.DataFrame. '''
-
-    if not op.exists(args.experiments_path):
-        raise FileNotFoundError('Experiment file not found at: %s' %
-                                args.experiments_path)
+    ''' Parse all results files and build a pd.DataFrame. '''
 
     run_dir = op.dirname(args.experiments_path)
     if not op.exists(run_dir):
         raise FileNotFoundError('Run dir not found at: %s' % run_dir)
 
-    with open(args.experiments_path) as f:
-        lines = f.read().splitlines()
-
-    df = None  # Lazy init.
+    runs_to_eval = []
     hyper_to_hyper_n_map_for_copy = {}
 
-    for line in lines:
-        logging.debug(line)
-        if len(line) == 0 or line.startswith('#'):
-            continue
-        words = line.split(';')
-
+    for words in postprocess_utils.read_experiments(args.experiments_path):
         hyper_n = words[0]
         split = words[1]
         batch_size = int(words[2])
@@ -114,12 +142,18 @@ def build_df(args):
             logging.info('Skipping this split since it is in the ignore list.')
 
         else:
-            df_hyper = postprocess_one_run(run_dir, hyper_n, batch_size, lr)
-            if df is None:  # Lazy init.
-                df = df_hyper
-            else:
-                df = pd.concat([df, df_hyper])
-
+            runs_to_eval.append({
+                'path': get_results_path(run_dir, hyper_n),
+                'hyper_n': hyper_n,
+                'split': split,
+                'batch_size': batch_size,
+                'lr': lr,
+            })
+
+    cache_path = (None if args.no_cache else op.join(run_dir,
+                                                     'postprocess_cache.db'))
+    df = postprocess_utils.parse_runs(runs_to_eval, SCHEMA, args.num_workers,
+                                      cache_path)
     return df, hyper_to_hyper_n_map_for_copy
 
 
@@ -134,23 +168,26 @@ def main():
     if len(df) == 0:
         raise ValueError('Dataframe is empty.')
 
-    df_by_hyper = df.groupby(['hyper_n']).agg({'epoch': ['max']})
+    df_by_hyper = df.groupby(['hyper_n'],
+                             observed=True).agg({'epoch': ['max']})
     logging.info(df_by_hyper)
-
-    # Get the averages across splits.
-    df = df.groupby(['batch_size', 'lr', 'epoch']).agg({
-        'metrics/mAP_0.5': ['mean']
-    }).reset_index()
-    df.columns = df.columns.get_level_values(0)
-    logging.info(df)
-
-    # Get the best epoch.
-    df = df.loc[df.groupby(['batch_size', 'lr'])['metrics/mAP_0.5'].idxmax()]
+    fold_hyper_ns = list(df_by_hyper.index)
+
+    metric_names, weights = selection_utils.parse_metrics(args.metrics)
+    for name in metric_names:
+        if name not in SCHEMA.columns():
+            raise ValueError('Unknown metric "%s". Available: %s' %
+                             (name, SCHEMA.columns()))
+    cube = selection_utils.build_cube(df, ['batch_size', 'lr'], metric_names)
+
+    # Get the best epoch of every hyperparameter and the best hyperparameter.
+    df_by_config, df = selection_utils.select(cube, weights,
+                                              args.smooth_window,
+                                              args.std_penalty,
+                                              args.min_splits)
     logging.info('The best epoch from every hyperparameter')
-    logging.info(df)
+    logging.info(df_by_config)
 
-    # Get the best hyperparameters.
-    df = df.loc[df['metrics/mAP_0.5'].idxmax()]
     logging.info('The best hyperparameter and epoch')
     logging.info(df)
 
@@ -171,6 +208,10 @@ def main():
 
         hyper_n = int(hyper_to_hyper_n_map_for_copy[(df['batch_size'],
                                                      df['lr'])])
+        if args.submit_held_full:
+            submit_utils.submit_held_full(run_dir, hyper_n, fold_hyper_ns)
+            return
+
         snapshot_path = op.join(args.detection_root_dir,
                                 'campaign%d' % args.campaign_id, args.set_id,
                                 'run%s' % args.run_id, 'hyper%03d' % hyper_n,
@@ -183,62 +224,34 @@ def main():
                 snapshot_path)
             sys.exit(1)
 
-        # Copy.
+        # Link the model into the run dir, and swap symlinks to it.
         best_snapshot_name = 'hyper%03d_epoch_last.pt' % hyper_n
         best_snapshot_path = op.join(run_dir, best_snapshot_name)
-        shutil.copyfile(snapshot_path, best_snapshot_path)
-        if not op.exists(best_snapshot_path):
-            logging.error('Failed to copy best snapshot from:\n\t%s\nto\n\t%s',
-                          snapshot_path, best_snapshot_path)
-            sys.exit(1)
-
-        # Symlink to run_id.
         run_symlink_path = op.join(
             run_dir, 'snapshots_best_%s.pt' % args.copy_best_model_from_split)
-        if op.exists(run_symlink_path):
-            os.remove(run_symlink_path)
-            logging.debug('Symlink already existed, deleted it:\n\t%s',
-                          run_symlink_path)
-        os.symlink(best_snapshot_name, run_symlink_path)
-        if not op.exists(run_symlink_path):
-            logging.error('Failed to write symlink to:\n\t%s',
-                          run_symlink_path)
-            sys.exit(1)
-
-        # Symlink to set_id.
         set_symlink_path = op.join(
             set_dir, 'snapshots_best_%s.pt' % args.copy_best_model_from_split)
-        if op.exists(set_symlink_path):
-            os.remove(set_symlink_path)
-            logging.debug('Symlink already existed, deleted it:\n\t%s',
-                          set_symlink_path)
-        os.symlink(op.join('run%s' % args.run_id, best_snapshot_name),
-                   set_symlink_path)
-
-        logging.info(
-            'Copied the best model from:\n\t%s\nto\n\t%s\nand symlinked as\n\t%s\nand as\n\t%s',
-            snapshot_path, best_snapshot_path, run_symlink_path,
-            set_symlink_path)
-        if not op.exists(set_symlink_path):
-            logging.error('Failed to write symlink to:\n\t%s',
-                          set_symlink_path)
-            sys.exit(1)
-
-        logging.warning('Clean up is set to %s. Will ignore it.',
-                        'TRUE' if args.clean_up else 'FALSE')
-        # if args.clean_up:
-        #     count = 0
-        #     for hyper_dir in glob.glob(
-        #             op.join(args.results_root_dir,
-        #                          'campaign%d' % args.campaign_id,
-        #                          'set%s' % args.set_id, 'run%s' % args.run_id,
-        #                          'results', 'hyper???')):
-        #         for snaphot_path in glob.glob(
-        #                 op.join(hyper_dir, 'snapshots/*.h5')):
-        #             logging.debug('Deleting %s', snaphot_path)
-        #             os.remove(snaphot_path)
-        #             count += 1
-        #     logging.info('Removed %d snapshots.', count)
+        model_registry.promote_file(
+            snapshot_path,
+            best_snapshot_path,
+            symlinks=[(best_snapshot_name, run_symlink_path),
+                      (op.join('run%s' % args.run_id,
+                               best_snapshot_name), set_symlink_path)],
+            run_dir=run_dir,
+            info={
+                'hyper_n': hyper_n,
+                'batch_size': int(df['batch_size']),
+                'lr': float(df['lr']),
+                'epoch': int(df['epoch']),
+            })
+        logging.info('Symlinked the best model as\n\t%s\nand as\n\t%s',
+                     run_symlink_path, set_symlink_path)
+
+        if args.clean_up:
+            model_registry.collect_garbage(run_dir,
+                                           SNAPSHOT_PATTERNS,
+                                           args.keep_snapshots,
+                                           protected=PROTECTED_SNAPSHOTS)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,108 @@
+'''
+Submits a sweep of YOLOv5 trainings as one job array. Called by submit.sh.
+
+Every line of the experiments file is
+  "hyper_n;split;batch_size;learning_rate;epochs;save_snapshots".
+'''
+
+import sys, os.path as op
+import logging
+import argparse
+
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), '..'))
+import postprocess_utils
+import submit_utils
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Submit a sweep of YOLOv5 trainings.')
+    submit_utils.add_arguments(parser)
+    parser.add_argument('--img_size', type=int, default=1824)
+    parser.add_argument('--gpu_type', default='v100-32')
+    parser.add_argument('--num_gpus', type=int, default=1)
+    parser.add_argument('--campaign_id',
+                        type=int,
+                        help='Needed for postprocess.py with --hold_full 1.')
+    parser.add_argument('--set_id',
+                        help='Needed for postprocess.py with --hold_full 1.')
+    parser.add_argument('--run_id',
+                        help='Needed for postprocess.py with --hold_full 1.')
+    return parser
+
+
+def make_tasks(args):
+    template = submit_utils.read_template(
+        op.join(op.dirname(op.abspath(__file__)), 'template.sbatch'))
+
+    tasks = []
+    for words in postprocess_utils.read_experiments(args.experiments_path):
+        hyper_n, split, batch_size, lr, epochs, save_snapshots = words[:6]
+        logging.info(
+            'Hyper %s, split: %s, batch_size: %s, learning_rate: %s, '
+            'epochs: %s', hyper_n, split, batch_size, lr, epochs)
+
+        split_dir = op.join(args.splits_dir, split)
+        if not op.isdir(split_dir):
+            raise FileNotFoundError(
+                'Directory with a split does not exist at "%s"' % split_dir)
+        hyper_dir = op.join(args.run_dir, 'hyper%s' % hyper_n)
+
+        script = submit_utils.render(
+            template, {
+                'DATA_DIR': split_dir,
+                'BATCH_SIZE': batch_size,
+                'LEARNING_RATE': lr,
+                'EPOCHS': epochs,
+                'IMG_SIZE': args.img_size,
+                'PROJECT_DIR': hyper_dir,
+                'NO_SAVE_FLAG': '--nosave' if save_snapshots == '0' else '',
+                'CONDA_INIT_SCRIPT':
+                submit_utils.get_constant('CONDA_INIT_SCRIPT'),
+                'CONDA_YOLOV5_ENV':
+                submit_utils.get_constant('CONDA_YOLOV5_ENV'),
+                'YOLOV5_DIR': submit_utils.get_constant('YOLOV5_DIR'),
+                'DETECTION_DIR': submit_utils.get_constant('DETECTION_DIR'),
+                'GPU_TYPE': args.gpu_type,
+                'NUM_GPUS': args.num_gpus,
+            })
+        tasks.append(submit_utils.Task(hyper_dir, script, split))
+    return tasks
+
+
+def make_select_command(args):
+    ''' The command that submits the "full" hyper of the best config. '''
+    for name in ['campaign_id', 'set_id', 'run_id']:
+        if getattr(args, name) is None:
+            raise ValueError('Need --%s with --hold_full 1.' % name)
+    return ' '.join([
+        'python3',
+        op.join(op.dirname(op.abspath(__file__)), 'postprocess.py'),
+        '--experiments_path', args.experiments_path,
+        '--campaign_id', str(args.campaign_id),
+        '--set_id', args.set_id,
+        '--run_id', args.run_id,
+        '--detection_root_dir', submit_utils.get_constant('DETECTION_DIR'),
+        '--submit_held_full',
+    ])
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        level=args.logging_level)
+
+    tasks = make_tasks(args)
+    if args.hold_full != 0:
+        submit_utils.submit_holding_full(tasks, args.run_dir,
+                                         'train_detector',
+                                         make_select_command(args),
+                                         args.max_parallel, args.dry_run != 0)
+    else:
+        submit_utils.submit_array(tasks, args.run_dir, 'train_detector',
+                                  args.max_parallel, args.dry_run != 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+'''
+Make cross-validation splits of a db and export them to YOLO in one run.
+
+Previously, make_cross_validation_splits.sh wrote a db per split, "full"
+was two copies of the db, and every split was exported with two
+"shuffler exportYolo" runs, each reopening a db and symlinking its images.
+Here the db is read once, and:
+- All folds are computed in memory: images are shuffled with --seed and
+  dealt into --k_fold folds. Split "splitN" validates on fold N and trains
+  on the others. Split "full" trains and validates on all images.
+- Labels of an image do not depend on the split, so the YOLO dir has one
+  tree of image symlinks ("images") and labels ("labels") for all splits,
+  written by a process pool. Every split dir has lists of its images
+  ("train2017.txt", "val2017.txt") and "dataset.yml" that points to them.
+- With --splits_dir, dbs of splits are written too. "full/train.db" and
+  "full/validation.db" are hardlinks of the input db.
+
+Example:
+  python3 scripts/export_yolo_splits.py \
+    --db_file campaign3to8-1800x1200.v3.page.db \
+    --rootdir ${ROOT_DIR} \
+    --yolo_dir ${DETECTION_DIR}/campaign8/splits/campaign3to8-1800x1200.v3.page \
+    --splits_dir ${DETECTION_DIR}/campaign8/splits/campaign3to8-1800x1200.v3.page \
+    --k_fold 5 --classes page --as_polygons
+'''
+
+import os, os.path as op
+import time
+import random
+import shutil
+import sqlite3
+import logging
+import argparse
+import concurrent.futures
+
+import db_utils
+import crop_utils
+
+TABLES = ['images', 'objects', 'properties', 'polygons', 'matches']
+
+DATASET_YML = '''
+  path: .  # dataset root dir
+  train: train2017.txt  # train images (relative to "path")
+  val: val2017.txt  # val images (relative to "path")
+  test:
+  nc: %d
+  names:
+%s
+'''
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Make cross-validation splits and export them to YOLO.')
+    parser.add_argument('--db_file', required=True)
+    parser.add_argument('--rootdir', required=True)
+    parser.add_argument('--yolo_dir', required=True)
+    parser.add_argument('--splits_dir',
+                        help='If given, write dbs of splits there.')
+    parser.add_argument('--k_fold', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--classes',
+                        nargs='+',
+                        required=True,
+                        help='Names of objects, in the order of YOLO ids. '
+                        'Other objects are not exported.')
+    parser.add_argument(
+        '--dirtree_level_for_name',
+        type=int,
+        default=2,
+        help='The number of last components of imagefile that are joined '
+        'with "_" into the name of an exported image.')
+    parser.add_argument('--as_polygons',
+                        action='store_true',
+                        help='Export polygons instead of boxes.')
+    parser.add_argument('--num_workers',
+                        type=int,
+                        help='The number of processes. Default: all cpus.')
+    parser.add_argument(
+        "--logging_level",
+        type=int,
+        choices=[10, 20, 30, 40],
+        default=20,
+        help="Set logging level. 10: debug, 20: info, 30: warning, 40: error.")
+    return parser
+
+
+def get_name(imagefile, dirtree_level):
+    return '_'.join(imagefile.split('/')[-dirtree_level:])
+
+
+def get_folds(imagefiles, k_fold, seed=0):
+    ''' Returns a list of "k_fold" lists of imagefiles. '''
+    imagefiles = sorted(imagefiles)
+    random.Random(seed).shuffle(imagefiles)
+    return [sorted(imagefiles[i::k_fold]) for i in range(k_fold)]
+
+
+def get_splits(folds):
+    ''' Returns a list of (name, train imagefiles, validation imagefiles). '''
+    splits = []
+    for i, fold in enumerate(folds):
+        train = sorted(x for j, other in enumerate(folds) if j != i
+                       for x in other)
+        splits.append(('split%d' % i, train, fold))
+    everything = sorted(x for fold in folds for x in fold)
+    splits.append(('full', everything, everything))
+    return splits
+
+
+def read_labels(db_file, classes, as_polygons):
+    '''
+    Returns {imagefile: (width, height, a list of label lines)}. Coordinates
+    are normalized by the size of the image in the db.
+    '''
+    class_ids = {name: i for i, name in enumerate(classes)}
+    conn = db_utils.connect(db_file, read_only=True)
+    try:
+        images = {}
+        for imagefile, width, height in conn.execute(
+                'SELECT imagefile,width,height FROM images'):
+            if not width or not height:
+                raise ValueError('Image "%s" has no size in the db, '
+                                 'see image_metadata_index.py fill_sizes.' %
+                                 imagefile)
+            images[imagefile] = (width, height, [])
+        polygons = {}
+        if as_polygons and 'polygons' in db_utils.get_tables(conn):
+            for objectid, x, y in conn.execute(
+                    'SELECT objectid,x,y FROM polygons ORDER BY objectid,id'):
+                polygons.setdefault(objectid, []).append((x, y))
+        for objectid, imagefile, x1, y1, width, height, name in conn.execute(
+                'SELECT objectid,imagefile,x1,y1,width,height,name '
+                'FROM objects ORDER BY objectid'):
+            if name not in class_ids:
+                continue
+            image_width, image_height, lines = images[imagefile]
+            if as_polygons:
+                points = polygons.get(objectid)
+                if points is None:
+                    points = [(x1, y1), (x1 + width, y1),
+                              (x1 + width, y1 + height), (x1, y1 + height)]
+                coords = []
+                for x, y in points:
+                    coords += [x / image_width, y / image_height]
+            else:
+                coords = [(x1 + width / 2) / image_width,
+                          (y1 + height / 2) / image_height,
+                          width / image_width, height / image_height]
+            lines.append('%d %s' %
+                         (class_ids[name], ' '.join('%.6f' % c
+                                                    for c in coords)))
+    finally:
+        conn.close()
+    return images
+
+
+def _write_labels(task):
+    ''' Symlinks images and writes label files of a chunk of images. '''
+    items, images_dir, labels_dir = task
+    for name, image_path, lines in items:
+        link_path = op.join(images_dir, name)
+        if op.lexists(link_path):
+            os.remove(link_path)
+        os.symlink(image_path, link_path)
+        label_path = op.join(labels_dir, op.splitext(name)[0] + '.txt')
+        with open(label_path, 'w') as f:
+            f.write(''.join(line + '\n' for line in lines))
+    return len(items)
+
+
+def write_tree(labels, yolo_dir, rootdir, dirtree_level, num_workers=None):
+    '''
+    Writes the shared tree of image symlinks and labels.
+    Returns {imagefile: the path of its symlink}.
+    '''
+    images_dir = op.join(yolo_dir, 'images')
+    labels_dir = op.join(yolo_dir, 'labels')
+    for path in [images_dir, labels_dir]:
+        if op.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+
+    items = []
+    links = {}
+    names = set()
+    for imagefile, (_, _, lines) in sorted(labels.items()):
+        name = get_name(imagefile, dirtree_level)
+        if name in names:
+            raise ValueError('Two images have the name "%s", increase '
+                             '--dirtree_level_for_name.' % name)
+        names.add(name)
+        links[imagefile] = op.join(images_dir, name)
+        items.append((name, op.join(rootdir, imagefile), lines))
+
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    chunk_size = max(min(len(items) // num_workers, 1000), 1)
+    tasks = [(items[i:i + chunk_size], images_dir, labels_dir)
+             for i in range(0, len(items), chunk_size)]
+    if num_workers <= 1:
+        list(map(_write_labels, tasks))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(num_workers) as executor:
+            list(executor.map(_write_labels, tasks))
+    return links
+
+
+def write_split(split_dir, train_paths, val_paths, classes):
+    os.makedirs(split_dir, exist_ok=True)
+    for filename, paths in [('train2017.txt', train_paths),
+                            ('val2017.txt', val_paths)]:
+        with open(op.join(split_dir, filename), 'w') as f:
+            f.write(''.join(path + '\n' for path in paths))
+    names = '\n'.join('    %d: %s' % (i, name)
+                      for i, name in enumerate(classes))
+    with open(op.join(split_dir, 'dataset.yml'), 'w') as f:
+        f.write(DATASET_YML % (len(classes), names))
+
+
+def write_split_db(db_file, out_db_file, imagefiles):
+    ''' Copies "imagefiles" with their objects from "db_file". '''
+    tmp_db_file = out_db_file + '.tmp'
+    if op.exists(tmp_db_file):
+        os.remove(tmp_db_file)
+    conn = sqlite3.connect(tmp_db_file)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('ATTACH DATABASE ? AS src', (db_file, ))
+        src_tables = db_utils.get_tables(cursor, schema='src')
+        for table in TABLES:
+            if table in src_tables:
+                sql = cursor.execute(
+                    "SELECT sql FROM src.sqlite_master "
+                    "WHERE type='table' AND name=?", (table, )).fetchone()
+                cursor.execute(sql[0])
+        cursor.execute(
+            'CREATE TEMP TABLE selected (imagefile TEXT PRIMARY KEY)')
+        cursor.executemany('INSERT INTO selected VALUES (?)',
+                           [(x, ) for x in imagefiles])
+        cursor.execute('INSERT INTO images SELECT * FROM src.images '
+                       'WHERE imagefile IN (SELECT imagefile FROM selected)')
+        cursor.execute('INSERT INTO objects SELECT * FROM src.objects '
+                       'WHERE imagefile IN (SELECT imagefile FROM selected)')
+        for table in ['properties', 'polygons', 'matches']:
+            if table in src_tables:
+                cursor.execute(
+                    'INSERT INTO %s SELECT * FROM src.%s WHERE objectid IN '
+                    '(SELECT objectid FROM objects)' % (table, table))
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_db_file, out_db_file)
+
+
+def write_split_dbs(db_file, splits_dir, splits):
+    for name, train, val in splits:
+        split_dir = op.join(splits_dir, name)
+        os.makedirs(split_dir, exist_ok=True)
+        train_db_file = op.join(split_dir, 'train.db')
+        val_db_file = op.join(split_dir, 'validation.db')
+        if name == 'full':
+            # Nothing writes to these dbs, so they can share the input db.
+            crop_utils.link_or_copy(db_file, train_db_file)
+            crop_utils.link_or_copy(db_file, val_db_file)
+            continue
+        write_split_db(db_file, train_db_file, train)
+        write_split_db(db_file, val_db_file, val)
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        level=args.logging_level)
+
+    start = time.time()
+    labels = read_labels(args.db_file, args.classes, args.as_polygons)
+    logging.info('Read %d images and %d objects.', len(labels),
+                 sum(len(x[2]) for x in labels.values()))
+    splits = get_splits(get_folds(labels.keys(), args.k_fold, args.seed))
+
+    if args.splits_dir is not None:
+        write_split_dbs(args.db_file, args.splits_dir, splits)
+        logging.info('Wrote dbs of %d splits.', len(splits))
+
+    links = write_tree(labels, args.yolo_dir, args.rootdir,
+                       args.dirtree_level_for_name, args.num_workers)
+    for name, train, val in splits:
+        write_split(op.join(args.yolo_dir, name), [links[x] for x in train],
+                    [links[x] for x in val], args.classes)
+    logging.info('Exported %d splits to %s in %.1f sec.', len(splits),
+                 args.yolo_dir,
+                 time.time() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+'''
+Finalize a database after inference in one process and one transaction.
+
+Replaces a chain of "python -m shuffler ... filterObjectsSQL | sql | sql",
+"python -m shuffler ... randomNImages | writeMedia" and "sqlite3" calls,
+each of which started an interpreter and rewrote the output db.
+Here the input db is copied once, and then, over one connection:
+  0. (optional) objects detected on another version are added,
+  1. (optional) name and score are synced from a reference db,
+  2. (optional) objects are deleted with their properties, polygons, matches,
+  3. (optional) scores are copied to properties,
+  4. (optional) scores are reset to 0,
+  5. the transaction is committed,
+  6. (optional) Shuffler-only subcommands run in one call,
+  7. a video of random images is written.
+The output is written to a temporary file and moved in place at the end,
+so a failed run never leaves a half-finished output db.
+
+Example (finalize_stamp_detection_inference.sh):
+  python3 finalize_inference.py \
+    --in_db_file detected.db --out_db_file out.db --rootdir ${ROOT_DIR} \
+    --delete_where "name = 'stamp' AND score < 0.2" \
+    --score_to_property "stamp_detection_score" --reset_scores \
+    --num_images_for_video 100
+'''
+
+import os, sys, os.path as op
+import shlex
+import sqlite3
+import logging
+import argparse
+import subprocess
+
+import preview_utils
+import db_utils
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Finalize a database after inference.')
+    parser.add_argument('--in_db_file', required=True)
+    parser.add_argument('--out_db_file', required=True)
+    parser.add_argument('--rootdir',
+                        required=True,
+                        help='The root of imagefiles, needed for the video.')
+    parser.add_argument(
+        '--add_objects_db_file',
+        help='If specified, add objects of this db with their properties and '
+        'polygons, e.g. pages detected on the version before stamps were '
+        'finalized. Only images of the input db get objects.')
+    parser.add_argument(
+        '--add_objects_where',
+        default='1',
+        help='Only add objects that satisfy this SQL condition.')
+    parser.add_argument(
+        '--add_objects_base_db_file',
+        help='The db that "--add_objects_db_file" was derived from. '
+        'Its objects are not added.')
+    parser.add_argument(
+        '--sync_ref_db_file',
+        help='If specified, copy columns "--sync_cols" of objects '
+        'from this db, matching objects by objectid.')
+    parser.add_argument('--sync_cols', nargs='+', default=['name', 'score'])
+    parser.add_argument(
+        '--delete_where',
+        help='Delete objects that satisfy this SQL condition, '
+        'e.g. "name = \'stamp\' AND score < 0.2".')
+    parser.add_argument(
+        '--score_to_property',
+        help='If specified, insert properties with this key and '
+        'the score of an object as value.')
+    parser.add_argument(
+        '--score_to_property_where',
+        default='1',
+        help='Only copy scores of objects that satisfy this SQL condition.')
+    parser.add_argument('--reset_scores',
+                        action='store_true',
+                        help='Set scores of all objects to 0.')
+    parser.add_argument(
+        '--shuffler_ops',
+        help='Shuffler subcommands that have no SQL equivalent, e.g. '
+        '"polygonsToBboxes | classifyPages". Run in one call after the rest.')
+    parser.add_argument('--num_images_for_video',
+                        type=int,
+                        default=100,
+                        help='0 for no video.')
+    parser.add_argument('--video_path',
+                        help='Default: "--out_db_file" + ".avi".')
+    parser.add_argument('--seed', type=int, help='Seed of image sampling.')
+    parser.add_argument(
+        "--logging_level",
+        type=int,
+        choices=[10, 20, 30, 40],
+        default=20,
+        help="Set logging level. 10: debug, 20: info, 30: warning, 40: error.")
+    return parser
+
+
+def log_counts(cursor, when):
+    counts = cursor.execute(
+        'SELECT name,COUNT(1) FROM objects GROUP BY name').fetchall()
+    logging.info('Number of objects %s: %s', when,
+                 ', '.join('%s: %d' % count for count in counts) or 'none')
+
+
+def add_objects(cursor, db_file, where='1', base_db_file=None):
+    '''
+    Add objects of "db_file" with their properties and polygons. Added
+    objects get new objectids, because "db_file" may have been derived from
+    another version, and its objectids may be used by other objects here.
+    Args:
+      where:         Only add objects that satisfy this SQL condition.
+      base_db_file:  The db that "db_file" was derived from. Its objects are
+                     not added, e.g. to add only objects detected on it.
+    '''
+    for path in [db_file, base_db_file]:
+        if path is not None and not op.exists(path):
+            raise FileNotFoundError('Db does not exist at "%s"' % path)
+    cursor.execute('ATTACH DATABASE ? AS added', (db_file, ))
+    condition = '(%s) AND imagefile IN (SELECT imagefile FROM main.images)' % (
+        where)
+    if base_db_file is not None:
+        cursor.execute('ATTACH DATABASE ? AS base', (base_db_file, ))
+        condition += ' AND objectid NOT IN (SELECT objectid FROM base.objects)'
+    # Map old objectids to new ones, after the last objectid of this db.
+    cursor.execute(
+        'CREATE TEMP TABLE id_map AS SELECT objectid AS old_id, '
+        '(SELECT IFNULL(MAX(objectid), 0) FROM main.objects) + '
+        'ROW_NUMBER() OVER (ORDER BY objectid) AS new_id '
+        'FROM added.objects WHERE %s' % condition)
+    added_tables = db_utils.get_tables(cursor, schema='added')
+    for table in ['objects', 'properties', 'polygons']:
+        if table not in added_tables:
+            continue
+        # Ids of properties and polygons are assigned anew.
+        columns = [
+            x for x in db_utils.get_columns(cursor, 'main', table)
+            if x not in ['id', 'objectid']
+        ]
+        cursor.execute(
+            'INSERT INTO main.%s(objectid%s) SELECT m.new_id%s FROM added.%s t '
+            'JOIN temp.id_map m ON t.objectid = m.old_id' %
+            (table, ''.join(',' + x for x in columns), ''.join(
+                ',t.' + x for x in columns), table))
+        if table == 'objects':
+            logging.info('Added %d objects from %s WHERE %s.',
+                         cursor.rowcount, db_file, where)
+    cursor.execute('DROP TABLE temp.id_map')
+    if base_db_file is not None:
+        cursor.execute('DETACH DATABASE base')
+
+
+def sync_with_db(cursor, ref_db_file, cols):
+    ''' Copy "cols" of objects from "ref_db_file", matching by objectid. '''
+    if not op.exists(ref_db_file):
+        raise FileNotFoundError('Ref db does not exist at "%s"' % ref_db_file)
+    cursor.execute('ATTACH DATABASE ? AS ref', (ref_db_file, ))
+    cursor.execute('UPDATE objects SET %s WHERE objectid IN '
+                   '(SELECT objectid FROM ref.objects)' % ', '.join(
+                       '%s = (SELECT r.%s FROM ref.objects r '
+                       'WHERE r.objectid = objects.objectid)' % (col, col)
+                       for col in cols))
+    logging.info('Synced %s of %d objects with %s.', ', '.join(cols),
+                 cursor.rowcount, ref_db_file)
+
+
+def delete_objects(cursor, where):
+    ''' Same as "filterObjectsSQL --delete" in Shuffler. '''
+    cursor.execute('CREATE TEMP TABLE deleted AS '
+                   'SELECT objectid FROM objects WHERE %s' % where)
+    tables = [
+        name for name, in cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type='table'")
+    ]
+    for table in ['properties', 'polygons', 'matches', 'objects']:
+        if table in tables:
+            cursor.execute('DELETE FROM %s WHERE objectid IN '
+                           '(SELECT objectid FROM temp.deleted)' % table)
+    logging.info('Deleted %d objects WHERE %s.', cursor.rowcount, where)
+    cursor.execute('DROP TABLE temp.deleted')
+
+
+def finalize(conn, args):
+    cursor = conn.cursor()
+    log_counts(cursor, 'before')
+    if args.add_objects_db_file is not None:
+        add_objects(cursor, args.add_objects_db_file, args.add_objects_where,
+                    args.add_objects_base_db_file)
+    if args.sync_ref_db_file is not None:
+        sync_with_db(cursor, args.sync_ref_db_file, args.sync_cols)
+    if args.delete_where is not None:
+        delete_objects(cursor, args.delete_where)
+    if args.score_to_property is not None:
+        cursor.execute(
+            'INSERT INTO properties(objectid,key,value) '
+            'SELECT objectid,?,score FROM objects WHERE %s' %
+            args.score_to_property_where, (args.score_to_property, ))
+    if args.reset_scores:
+        cursor.execute('UPDATE objects SET score = 0')
+    log_counts(cursor, 'after')
+    conn.commit()
+    if args.sync_ref_db_file is not None:
+        cursor.execute('DETACH DATABASE ref')
+    if args.add_objects_db_file is not None:
+        cursor.execute('DETACH DATABASE added')
+
+
+def run_shuffler(db_file, rootdir, ops):
+    command = [
+        sys.executable, '-m', 'shuffler', '-i', db_file, '-o', db_file,
+        '--rootdir', rootdir
+    ] + shlex.split(ops)
+    logging.info('Running: %s', ' '.join(command))
+    subprocess.run(command, check=True)
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        level=args.logging_level)
+
+    if not op.exists(args.in_db_file):
+        raise FileNotFoundError('Input db does not exist at "%s"' %
+                                args.in_db_file)
+    tmp_db_file = args.out_db_file + '.tmp'
+    if op.exists(tmp_db_file):
+        os.remove(tmp_db_file)
+
+    # Copy with the backup API, which also works while the input is open.
+    src = sqlite3.connect('file:%s?mode=ro' % args.in_db_file, uri=True)
+    conn = sqlite3.connect(tmp_db_file)
+    src.backup(conn)
+    src.close()
+    try:
+        finalize(conn, args)
+        if args.shuffler_ops:
+            conn.close()
+            run_shuffler(tmp_db_file, args.rootdir, args.shuffler_ops)
+            conn = sqlite3.connect(tmp_db_file)
+        if args.num_images_for_video > 0:
+            # Workers of the preview read the db from the file.
+            conn.commit()
+            video_path = args.video_path or args.out_db_file + '.avi'
+            preview_utils.write_preview(tmp_db_file,
+                                        args.rootdir,
+                                        video_path,
+                                        number=args.num_images_for_video,
+                                        seed=args.seed)
+    finally:
+        conn.close()
+    os.replace(tmp_db_file, args.out_db_file)
+    logging.info('Wrote %s', args.out_db_file)
+
+
+if __name__ == '__main__':
+    main()
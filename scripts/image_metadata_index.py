@@ -0,0 +1,392 @@
+'''
+An index of metadata of all images of the archive.
+
+Shuffler's filterBadImages, resizeAnnotations, clipObjectsToImageBoundaries
+and the exporters open JPEGs under ROOT_DIR to learn their size or whether
+they are readable, every time a step runs. On Lustre that is a metadata
+request and a read per image. Here every image is read once, and the
+index keeps its file size, mtime, width, height, EXIF orientation and
+capture time, a content hash, and whether it is valid.
+
+Validity is checked from the header and the end of the file only: a JPEG
+is valid if its header has a frame with a size, and the file ends with an
+end-of-image marker, so truncated uploads are caught. Images are not
+decoded.
+
+"update" only reads images that are new or whose size or mtime changed,
+and drops images that are gone. Steps then query the index:
+- "filter_bad" deletes images of a db that are invalid or missing.
+- "fill_sizes" sets images.width and images.height of a db, so that
+  Shuffler takes sizes from the db.
+
+Examples:
+  python3 scripts/image_metadata_index.py \
+    --rootdir ${ROOT_DIR} \
+    --index_db_file ${DATABASES_DIR}/all-images.metadata.db \
+    update --image_dirs 1800x1200 original_dataset
+
+  python3 scripts/image_metadata_index.py \
+    --rootdir ${ROOT_DIR} \
+    --index_db_file ${DATABASES_DIR}/all-images.metadata.db \
+    filter_bad --db_file campaign9-1800x1200.v1.db
+'''
+
+import os, os.path as op
+import time
+import struct
+import sqlite3
+import hashlib
+import logging
+import argparse
+import concurrent.futures
+
+import db_utils
+
+JPEG_EXTENSIONS = ['.jpg', '.jpeg']
+CHUNK_SIZE = 1 << 20
+# Tables of a Shuffler db that refer to objects.
+OBJECT_TABLES = ['properties', 'polygons', 'matches']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS images (
+  imagefile TEXT PRIMARY KEY,
+  size INTEGER,
+  mtime REAL,
+  width INTEGER,
+  height INTEGER,
+  orientation INTEGER,
+  timestamp TEXT,
+  valid INTEGER,
+  checksum TEXT
+);
+'''
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Keep and query an index of metadata of images.')
+    parser.add_argument('--rootdir', required=True)
+    parser.add_argument('--index_db_file', required=True)
+    parser.add_argument(
+        "--logging_level",
+        type=int,
+        choices=[10, 20, 30, 40],
+        default=20,
+        help="Set logging level. 10: debug, 20: info, 30: warning, 40: error.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_update = subparsers.add_parser('update',
+                                          help='Index new and changed images.')
+    parser_update.add_argument('--image_dirs',
+                               nargs='+',
+                               default=['1800x1200'],
+                               help='Dirs of images, relative to rootdir.')
+    parser_update.add_argument('--no_checksum',
+                               action='store_true',
+                               help='Do not hash contents of images.')
+    parser_update.add_argument(
+        '--num_workers',
+        type=int,
+        help='The number of processes. Default: all cpus.')
+
+    parser_filter = subparsers.add_parser(
+        'filter_bad', help='Delete invalid and missing images from a db.')
+    parser_filter.add_argument('--db_file', required=True)
+
+    parser_fill = subparsers.add_parser(
+        'fill_sizes', help='Set width and height of images of a db.')
+    parser_fill.add_argument('--db_file', required=True)
+    return parser
+
+
+def _parse_exif(data):
+    ''' Returns (orientation, timestamp) from the payload of APP1 Exif. '''
+    tiff = data[6:]
+    if len(tiff) < 8 or tiff[:2] not in (b'II', b'MM'):
+        return None, None
+    endian = '<' if tiff[:2] == b'II' else '>'
+
+    def read_ifd(offset):
+        entries = {}
+        if offset + 2 > len(tiff):
+            return entries
+        count = struct.unpack(endian + 'H', tiff[offset:offset + 2])[0]
+        for i in range(count):
+            begin = offset + 2 + i * 12
+            if begin + 12 > len(tiff):
+                break
+            tag, kind, num, value = struct.unpack(endian + 'HHI4s',
+                                                  tiff[begin:begin + 12])
+            entries[tag] = (kind, num, value)
+        return entries
+
+    def to_int(entry):
+        kind, _, value = entry
+        if kind == 3:  # SHORT
+            return struct.unpack(endian + 'H', value[:2])[0]
+        return struct.unpack(endian + 'I', value)[0]
+
+    ifd0 = read_ifd(struct.unpack(endian + 'I', tiff[4:8])[0])
+    orientation = to_int(ifd0[0x0112]) if 0x0112 in ifd0 else None
+    timestamp = None
+    if 0x8769 in ifd0:
+        exif_ifd = read_ifd(to_int(ifd0[0x8769]))
+        entry = exif_ifd.get(0x9003) or ifd0.get(0x0132)
+        if entry is not None and entry[0] == 2:  # ASCII
+            offset = struct.unpack(endian + 'I', entry[2])[0]
+            value = tiff[offset:offset + entry[1]].rstrip(b'\0')
+            timestamp = value.decode('ascii', errors='replace') or None
+    return orientation, timestamp
+
+
+def read_jpeg_header(path):
+    '''
+    Reads the header of a JPEG up to its frame, and its last two bytes.
+    Returns a dict with width, height, orientation, timestamp and valid.
+    '''
+    metadata = {
+        'width': None,
+        'height': None,
+        'orientation': None,
+        'timestamp': None,
+        'valid': False
+    }
+    with open(path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            return metadata
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xff:
+                return metadata
+            # Markers without a payload, and fill bytes.
+            if marker[1] in (0x01, 0xff) or 0xd0 <= marker[1] <= 0xd7:
+                if marker[1] == 0xff:
+                    f.seek(-1, os.SEEK_CUR)
+                continue
+            length = f.read(2)
+            if len(length) < 2:
+                return metadata
+            length = struct.unpack('>H', length)[0]
+            if marker[1] == 0xe1 and metadata['orientation'] is None:
+                data = f.read(length - 2)
+                if data.startswith(b'Exif\0\0'):
+                    try:
+                        (metadata['orientation'],
+                         metadata['timestamp']) = _parse_exif(data)
+                    except struct.error:
+                        logging.warning('Bad EXIF in "%s"', path)
+                continue
+            # Start of frame, except DHT (c4), JPG (c8) and DAC (cc).
+            if 0xc0 <= marker[1] <= 0xcf and marker[1] not in (0xc4, 0xc8,
+                                                               0xcc):
+                frame = f.read(5)
+                if len(frame) < 5:
+                    return metadata
+                height, width = struct.unpack('>xHH', frame)
+                metadata['width'] = width
+                metadata['height'] = height
+                break
+            f.seek(length - 2, os.SEEK_CUR)
+        f.seek(-2, os.SEEK_END)
+        metadata['valid'] = (width > 0 and height > 0
+                             and f.read(2) == b'\xff\xd9')
+    return metadata
+
+
+def get_jpeg_size(path):
+    ''' Returns (width, height) from the header of a JPEG, or None. '''
+    metadata = read_jpeg_header(path)
+    if metadata['width'] is None:
+        return None
+    return metadata['width'], metadata['height']
+
+
+def get_checksum(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def open_index(index_db_file):
+    conn = sqlite3.connect(index_db_file)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _index_image(task):
+    ''' Returns a row of the index for one image. '''
+    imagefile, path, stat, with_checksum = task
+    try:
+        metadata = read_jpeg_header(path)
+        checksum = get_checksum(path) if with_checksum else None
+    except OSError as e:
+        logging.error('Failed to read "%s": %s', path, e)
+        metadata = {
+            'width': None,
+            'height': None,
+            'orientation': None,
+            'timestamp': None,
+            'valid': False
+        }
+        checksum = None
+    return (imagefile, stat[0], stat[1], metadata['width'], metadata['height'],
+            metadata['orientation'], metadata['timestamp'],
+            int(metadata['valid']), checksum)
+
+
+def list_images(rootdir, image_dir):
+    ''' Returns {imagefile: (size, mtime)} of JPEGs under rootdir/image_dir. '''
+    images = {}
+    for dirpath, _, filenames in os.walk(op.join(rootdir, image_dir)):
+        for filename in filenames:
+            if op.splitext(filename)[1].lower() not in JPEG_EXTENSIONS:
+                continue
+            path = op.join(dirpath, filename)
+            stat = os.stat(path)
+            images[op.relpath(path, rootdir)] = (stat.st_size, stat.st_mtime)
+    return images
+
+
+def update(rootdir,
+           index_db_file,
+           image_dirs=('1800x1200', ),
+           with_checksum=True,
+           num_workers=None):
+    ''' Index images that are new or changed, and drop images that are gone. '''
+    start = time.time()
+    conn = open_index(index_db_file)
+    try:
+        for image_dir in image_dirs:
+            images = list_images(rootdir, image_dir)
+            known = {}
+            for imagefile, size, mtime, checksum in conn.execute(
+                    'SELECT imagefile,size,mtime,checksum FROM images '
+                    'WHERE substr(imagefile, 1, ?) = ?',
+                (len(image_dir) + 1, op.join(image_dir, ''))):
+                # Images indexed without a hash are read again to hash them.
+                if with_checksum and checksum is None:
+                    size = None
+                known[imagefile] = (size, mtime)
+            gone = [(x, ) for x in known if x not in images]
+            conn.executemany('DELETE FROM images WHERE imagefile=?', gone)
+            tasks = [(imagefile, op.join(rootdir,
+                                         imagefile), stat, with_checksum)
+                     for imagefile, stat in sorted(images.items())
+                     if known.get(imagefile) != stat]
+            logging.info('%s: %d images, %d to index, %d are gone.', image_dir,
+                         len(images), len(tasks), len(gone))
+
+            if num_workers is None:
+                num_workers = os.cpu_count() or 1
+            executor = None
+            mapper = map
+            if num_workers > 1 and len(tasks) > 1:
+                executor = concurrent.futures.ProcessPoolExecutor(num_workers)
+                mapper = lambda fn, tasks: executor.map(
+                    fn, tasks, chunksize=64)
+            try:
+                for i, row in enumerate(mapper(_index_image, tasks)):
+                    conn.execute(
+                        'INSERT OR REPLACE INTO images '
+                        'VALUES (?,?,?,?,?,?,?,?,?)', row)
+                    # Commit now and then, so that an interrupted run resumes.
+                    if (i + 1) % 10000 == 0:
+                        conn.commit()
+                        logging.info('Indexed %d/%d images.', i + 1,
+                                     len(tasks))
+            finally:
+                conn.commit()
+                if executor is not None:
+                    executor.shutdown()
+    finally:
+        conn.close()
+    logging.info('Updated the index in %.1f sec.', time.time() - start)
+
+
+def _attach_index(conn, index_db_file):
+    conn.execute('ATTACH DATABASE ? AS idx', (index_db_file, ))
+
+
+def filter_bad(db_file, index_db_file, rootdir):
+    '''
+    Delete images of a db, with their objects, that are invalid in the
+    index. Images that are not in the index are checked by their headers.
+    Returns the number of deleted images.
+    '''
+    conn = db_utils.connect(db_file)
+    try:
+        cursor = conn.cursor()
+        _attach_index(conn, index_db_file)
+        bad = [
+            imagefile for imagefile, in cursor.execute(
+                'SELECT i.imagefile FROM images i '
+                'JOIN idx.images x ON i.imagefile = x.imagefile '
+                'WHERE x.valid = 0')
+        ]
+        for imagefile, in cursor.execute(
+                'SELECT imagefile FROM images WHERE imagefile NOT IN '
+                '(SELECT imagefile FROM idx.images)').fetchall():
+            path = op.join(rootdir, imagefile)
+            if not op.exists(path) or not read_jpeg_header(path)['valid']:
+                bad.append(imagefile)
+        cursor.execute('CREATE TEMP TABLE bad (imagefile TEXT PRIMARY KEY)')
+        cursor.executemany('INSERT INTO bad VALUES (?)', [(x, ) for x in bad])
+        tables = db_utils.get_tables(cursor)
+        for table in OBJECT_TABLES:
+            if table in tables:
+                cursor.execute(
+                    'DELETE FROM %s WHERE objectid IN (SELECT objectid '
+                    'FROM objects WHERE imagefile IN (SELECT imagefile '
+                    'FROM bad))' % table)
+        cursor.execute('DELETE FROM objects WHERE imagefile IN '
+                       '(SELECT imagefile FROM bad)')
+        cursor.execute('DELETE FROM images WHERE imagefile IN '
+                       '(SELECT imagefile FROM bad)')
+        conn.commit()
+    finally:
+        conn.close()
+    for imagefile in bad[:10]:
+        logging.warning('Deleted bad image: %s', imagefile)
+    logging.info('Deleted %d bad images from %s', len(bad), db_file)
+    return len(bad)
+
+
+def fill_sizes(db_file, index_db_file):
+    ''' Set width and height of images of a db from the index. '''
+    conn = db_utils.connect(db_file)
+    try:
+        _attach_index(conn, index_db_file)
+        cursor = conn.execute(
+            'UPDATE images SET width=x.width, height=x.height '
+            'FROM idx.images x WHERE images.imagefile = x.imagefile '
+            'AND x.valid = 1')
+        num_updated = cursor.rowcount
+        num_images = conn.execute('SELECT COUNT(1) FROM images').fetchone()[0]
+        conn.commit()
+    finally:
+        conn.close()
+    if num_updated < num_images:
+        logging.warning('%d out of %d images of %s are not in the index.',
+                        num_images - num_updated, num_images, db_file)
+    logging.info('Set sizes of %d images of %s', num_updated, db_file)
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        level=args.logging_level)
+
+    if args.command == 'update':
+        update(args.rootdir, args.index_db_file, args.image_dirs,
+               not args.no_checksum, args.num_workers)
+    elif args.command == 'filter_bad':
+        filter_bad(args.db_file, args.index_db_file, args.rootdir)
+    elif args.command == 'fill_sizes':
+        fill_sizes(args.db_file, args.index_db_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+'''
+Create indexes on campaign databases and update their statistics.
+See db_utils.py for the indexes.
+
+Called by log_db_version in constants.sh for every new version.
+Databases that do not exist are skipped, and indexes that exist are kept,
+so it is safe to run it again.
+
+Example:
+  python3 scripts/index_db.py \
+    --db_files ${DATABASES_DIR}/campaign8/campaign3to8-1800x1200.v5.db \
+    --add_is_page
+'''
+
+import os.path as op
+import time
+import logging
+import argparse
+
+import db_utils
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Create indexes on databases and run ANALYZE.')
+    parser.add_argument('--db_files', nargs='+', required=True)
+    parser.add_argument(
+        '--add_is_page',
+        action='store_true',
+        help='Add the generated column objects.is_page with an index.')
+    parser.add_argument('--wal',
+                        action='store_true',
+                        help='Switch dbs to the WAL journal mode.')
+    parser.add_argument(
+        "--logging_level",
+        type=int,
+        choices=[10, 20, 30, 40],
+        default=20,
+        help="Set logging level. 10: debug, 20: info, 30: warning, 40: error.")
+    return parser
+
+
+def index_db(db_file, add_is_page=False, wal=False):
+    start = time.time()
+    conn = db_utils.connect(db_file)
+    try:
+        if wal:
+            db_utils.set_wal(conn)
+        db_utils.create_indexes(conn)
+        if add_is_page:
+            db_utils.add_is_page_column(conn)
+        db_utils.analyze(conn)
+    finally:
+        conn.close()
+    logging.info('Indexed %s in %.1f sec.', db_file, time.time() - start)
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        level=args.logging_level)
+
+    for db_file in args.db_files:
+        if not op.exists(db_file):
+            logging.info('No db at %s, skipping.', db_file)
+            continue
+        index_db(db_file, args.add_is_page, args.wal)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,400 @@
+'''
+Make collages of stamps for cleaning in Labelme.
+
+This replaces "expandObjects | tileObjects --split_by_name |
+expandObjects | exportLabelme" and "writeMedia" of Shuffler:
+1. Stamps are grouped by name once, and assigned to cells of pages.
+2. Cells are cut with crop_utils: every source image is decoded once for
+   all its stamps, by a process pool. Cells are cached, so a repeated
+   cleaning export of the same stamps does not decode images again.
+3. Pages are composed by a process pool. Every worker writes the page and
+   its Labelme annotation, and returns a small frame, which is written to
+   the video as pages come.
+
+A cell shows a stamp with the context around it: a square around the
+stamp, "expand_fraction" larger than its longer side. Objects of the output
+db keep their objectid and properties, have coordinates on pages, and the
+transform from the original image in properties "kx", "ky", "bx", "by",
+so that "revertObjectTransforms" in import.sh maps them back.
+
+Example:
+  python3 scripts/make_collages.py \
+    --rootdir ${ROOT_DIR} \
+    --in_db_file campaign3to5-6Kx4K.v5.db \
+    --out_db_file labelme/cleaning-v5-campaign3to5.db \
+    --images_dir ${LABELME_DIR}/campaign5/cleaning-v5-campaign3to5/Images \
+    --annotations_dir ${LABELME_DIR}/campaign5/cleaning-v5-campaign3to5/Annotations \
+    --labelme_folder cleaning-v5-campaign3to5 \
+    --username ${LABELME_USER} \
+    --cache_dir ${DATABASES_DIR}/crops_cache \
+    --video_path labelme/cleaning-v5-campaign3to5.avi
+'''
+
+import os, os.path as op
+import time
+import shutil
+import sqlite3
+import logging
+import argparse
+import itertools
+import concurrent.futures
+import xml.etree.ElementTree as ET
+import numpy as np
+import cv2
+
+import db_utils
+import crop_utils
+import preview_utils
+
+TABLES = ['images', 'objects', 'properties', 'polygons', 'matches']
+TRANSFORM_KEYS = ['kx', 'ky', 'bx', 'by']
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Make collages of stamps and export them to Labelme.')
+    parser.add_argument('--in_db_file', required=True)
+    parser.add_argument('--out_db_file', required=True)
+    parser.add_argument('--rootdir', required=True)
+    parser.add_argument('--images_dir',
+                        required=True,
+                        help='Collages are written here.')
+    parser.add_argument('--annotations_dir',
+                        required=True,
+                        help='Labelme annotations are written here.')
+    parser.add_argument('--labelme_folder', required=True)
+    parser.add_argument('--username', required=True)
+    parser.add_argument('--cache_dir',
+                        required=True,
+                        help='The cache of crops, see crop_utils.py.')
+    parser.add_argument('--where_object',
+                        default="objects.name NOT LIKE '%page%'",
+                        help='SQL condition on objects to put in collages.')
+    parser.add_argument('--expand_fraction', type=float, default=1.0)
+    parser.add_argument('--num_cells_X', type=int, default=6)
+    parser.add_argument('--num_cells_Y', type=int, default=4)
+    parser.add_argument('--cell_size', type=int, default=400)
+    parser.add_argument('--inter_cell_gap', type=int, default=50)
+    parser.add_argument('--video_path', help='If given, write a video.')
+    parser.add_argument('--video_scale',
+                        type=float,
+                        default=0.5,
+                        help='Frames of the video are pages of this scale.')
+    parser.add_argument('--num_workers',
+                        type=int,
+                        help='The number of processes. Default: all cpus.')
+    parser.add_argument(
+        "--logging_level",
+        type=int,
+        choices=[10, 20, 30, 40],
+        default=20,
+        help="Set logging level. 10: debug, 20: info, 30: warning, 40: error.")
+    return parser
+
+
+class Layout(object):
+    ''' Positions of cells on a page. '''
+
+    def __init__(self, num_cells_X, num_cells_Y, cell_size, gap):
+        self.num_cells_X = num_cells_X
+        self.num_cells_Y = num_cells_Y
+        self.cell_size = cell_size
+        self.gap = gap
+        self.width = num_cells_X * cell_size + (num_cells_X + 1) * gap
+        self.height = num_cells_Y * cell_size + (num_cells_Y + 1) * gap
+
+    def num_cells(self):
+        return self.num_cells_X * self.num_cells_Y
+
+    def cell_origin(self, cell):
+        ''' Returns (x, y) of the top left corner of a cell. '''
+        col = cell % self.num_cells_X
+        row = cell // self.num_cells_X
+        return (self.gap + col * (self.cell_size + self.gap),
+                self.gap + row * (self.cell_size + self.gap))
+
+
+def get_cell_bbox(bbox, expand_fraction):
+    ''' A square around "bbox", "expand_fraction" larger than its longer side. '''
+    x1, y1, width, height = bbox
+    side = max(width, height, 1) * (1. + expand_fraction)
+    return (x1 + width / 2. - side / 2., y1 + height / 2. - side / 2., side,
+            side)
+
+
+def assign_cells(objects, layout):
+    '''
+    Split objects into pages, every page has objects of one name.
+    Args:
+      objects:  Dicts with "name", ordered by name.
+    Returns:
+      A list of pages, each is a list of objects.
+    '''
+    pages = []
+    for _, group in itertools.groupby(objects, key=lambda x: x['name']):
+        group = list(group)
+        for begin in range(0, len(group), layout.num_cells()):
+            pages.append(group[begin:begin + layout.num_cells()])
+    return pages
+
+
+def make_annotation(imagefile, folder, width, height, objects, username):
+    '''
+    Labelme annotation of a page.
+    Args:
+      objects:  A list of (name, a list of points (x, y)).
+    '''
+    annotation = ET.Element('annotation')
+    ET.SubElement(annotation, 'filename').text = imagefile
+    ET.SubElement(annotation, 'folder').text = folder
+    source = ET.SubElement(annotation, 'source')
+    ET.SubElement(source, 'sourceImage').text = ''
+    ET.SubElement(source, 'sourceAnnotation').text = 'Labelme'
+    imagesize = ET.SubElement(annotation, 'imagesize')
+    ET.SubElement(imagesize, 'nrows').text = str(height)
+    ET.SubElement(imagesize, 'ncols').text = str(width)
+    date = time.strftime('%d-%b-%Y %H:%M:%S')
+    for id_, (name, points) in enumerate(objects):
+        object_ = ET.SubElement(annotation, 'object')
+        ET.SubElement(object_, 'name').text = name
+        ET.SubElement(object_, 'deleted').text = '0'
+        ET.SubElement(object_, 'verified').text = '0'
+        ET.SubElement(object_, 'occluded').text = 'no'
+        ET.SubElement(object_, 'date').text = date
+        ET.SubElement(object_, 'id').text = str(id_)
+        polygon = ET.SubElement(object_, 'polygon')
+        ET.SubElement(polygon, 'username').text = username
+        for x, y in points:
+            pt = ET.SubElement(polygon, 'pt')
+            ET.SubElement(pt, 'x').text = str(int(round(x)))
+            ET.SubElement(pt, 'y').text = str(int(round(y)))
+    return ET.ElementTree(annotation)
+
+
+def _render_page(task):
+    '''
+    Compose a page from cells, write it and its annotation.
+    Returns a frame for the video, or None.
+    '''
+    (page_path, annotation_path, folder, username, width, height, cells,
+     objects, video_scale) = task
+    page = np.full((height, width, 3), 255, np.uint8)
+    for cell_path, x, y in cells:
+        cell = cv2.imread(cell_path)
+        if cell is None:
+            logging.error('Failed to read a cell "%s".', cell_path)
+            continue
+        page[y:y + cell.shape[0], x:x + cell.shape[1]] = cell
+    if not cv2.imwrite(page_path, page):
+        raise IOError('Failed to write "%s"' % page_path)
+    make_annotation(op.basename(page_path), folder, width, height,
+                    [(name, points) for _, name, points in objects],
+                    username).write(annotation_path, encoding='utf-8')
+    if video_scale is None:
+        return None
+    polygons = {objectid: points for objectid, _, points in objects}
+    preview_utils.draw_objects(page,
+                               [(objectid, None, None, None, None, name, None)
+                                for objectid, name, _ in objects], polygons)
+    cv2.putText(page, op.basename(page_path), (10, 30),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2)
+    return cv2.resize(page,
+                      (int(width * video_scale), int(height * video_scale)))
+
+
+def get_objects(conn, where_object):
+    objects = []
+    for row in conn.execute(
+            'SELECT objectid,imagefile,x1,y1,width,height,name,score '
+            'FROM objects WHERE %s ORDER BY name,objectid' % where_object):
+        if None in row[2:6]:
+            logging.warning('Object %d has no bbox, skipping it.', row[0])
+            continue
+        objects.append({
+            'objectid': row[0],
+            'imagefile': row[1],
+            'bbox': tuple(row[2:6]),
+            'name': row[6],
+            'score': row[7],
+        })
+    return objects
+
+
+def get_transforms(conn, objectids):
+    ''' Returns {objectid: {key: value}} of transforms recorded in properties. '''
+    transforms = {}
+    for objectid, key, value in conn.execute(
+            'SELECT objectid,key,value FROM properties WHERE key IN '
+            '(%s)' % ','.join('?' * len(TRANSFORM_KEYS)), TRANSFORM_KEYS):
+        if objectid in objectids:
+            transforms.setdefault(objectid, {})[key] = float(value)
+    return transforms
+
+
+def get_polygons(conn, objectids):
+    polygons = {}
+    for objectid, x, y, name in conn.execute(
+            'SELECT objectid,x,y,name FROM polygons ORDER BY id'):
+        if objectid in objectids:
+            polygons.setdefault(objectid, []).append((x, y, name))
+    return polygons
+
+
+def write_db(in_db_file, out_db_file, images, objects, polygons, properties):
+    '''
+    Args:
+      images:       A list of (imagefile, width, height).
+      objects:      A list of (objectid,imagefile,x1,y1,width,height,name,score).
+      polygons:     A list of (objectid, x, y, name).
+      properties:   A list of (objectid, key, value) to add.
+    '''
+    tmp_db_file = out_db_file + '.tmp'
+    if op.exists(tmp_db_file):
+        os.remove(tmp_db_file)
+    conn = sqlite3.connect(tmp_db_file)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('ATTACH DATABASE ? AS src', (in_db_file, ))
+        for table in TABLES:
+            sql = cursor.execute(
+                "SELECT sql FROM src.sqlite_master "
+                "WHERE type='table' AND name=?", (table, )).fetchone()
+            if sql is not None:
+                cursor.execute(sql[0])
+        cursor.executemany(
+            'INSERT INTO images(imagefile,width,height) VALUES (?,?,?)',
+            images)
+        cursor.executemany(
+            'INSERT INTO objects(objectid,imagefile,x1,y1,width,height,name,'
+            'score) VALUES (?,?,?,?,?,?,?,?)', objects)
+        cursor.executemany(
+            'INSERT INTO polygons(objectid,x,y,name) VALUES (?,?,?,?)',
+            polygons)
+        # Keep properties except old transforms, which are composed anew.
+        cursor.execute(
+            'INSERT INTO properties(objectid,key,value) '
+            'SELECT objectid,key,value FROM src.properties '
+            'WHERE objectid IN (SELECT objectid FROM objects) '
+            'AND key NOT IN (%s)' % ','.join('?' * len(TRANSFORM_KEYS)),
+            TRANSFORM_KEYS)
+        cursor.executemany(
+            'INSERT INTO properties(objectid,key,value) VALUES (?,?,?)',
+            properties)
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_db_file, out_db_file)
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        level=args.logging_level)
+
+    start = time.time()
+    layout = Layout(args.num_cells_X, args.num_cells_Y, args.cell_size,
+                    args.inter_cell_gap)
+
+    conn = db_utils.connect(args.in_db_file, read_only=True)
+    try:
+        objects = get_objects(conn, args.where_object)
+        objectids = set(object_['objectid'] for object_ in objects)
+        transforms = get_transforms(conn, objectids)
+        src_polygons = get_polygons(conn, objectids)
+    finally:
+        conn.close()
+    pages = assign_cells(objects, layout)
+    logging.info('%d objects in %d pages.', len(objects), len(pages))
+
+    # Cut all cells, decoding every source image once.
+    for object_ in objects:
+        object_['cell_bbox'] = get_cell_bbox(object_['bbox'],
+                                             args.expand_fraction)
+    keys = crop_utils.fill_cache([(object_['imagefile'], object_['cell_bbox'])
+                                  for object_ in objects], args.rootdir,
+                                 args.cache_dir, args.cell_size,
+                                 args.num_workers)
+    for object_, key in zip(objects, keys):
+        object_['cell_path'] = crop_utils.get_cache_path(args.cache_dir, key)
+    logging.info('Cut cells in %.1f sec.', time.time() - start)
+
+    for dir_ in [args.images_dir, args.annotations_dir]:
+        if op.exists(dir_):
+            shutil.rmtree(dir_)
+        os.makedirs(dir_)
+
+    # Place objects on pages.
+    images = []
+    out_objects = []
+    out_polygons = []
+    properties = []
+    tasks = []
+    for page_id, page_objects in enumerate(pages):
+        name = '%s-%06d' % (args.labelme_folder, page_id)
+        page_path = op.join(args.images_dir, name + '.jpg')
+        imagefile = op.relpath(page_path, args.rootdir)
+        images.append((imagefile, layout.width, layout.height))
+        cells = []
+        task_objects = []
+        for cell, object_ in enumerate(page_objects):
+            x0, y0 = layout.cell_origin(cell)
+            cell_x1, cell_y1, cell_side, _ = object_['cell_bbox']
+            k = args.cell_size / cell_side
+            bx, by = x0 - k * cell_x1, y0 - k * cell_y1
+            x1, y1, width, height = object_['bbox']
+            objectid = object_['objectid']
+            out_objects.append(
+                (objectid, imagefile, k * x1 + bx, k * y1 + by, k * width,
+                 k * height, object_['name'], object_['score']))
+            if objectid in src_polygons:
+                points = [(k * x + bx, k * y + by)
+                          for x, y, _ in src_polygons[objectid]]
+                out_polygons += [(objectid, x, y, point_name) for (
+                    x, y), (_, _,
+                            point_name) in zip(points, src_polygons[objectid])]
+            else:
+                points = [(k * x1 + bx, k * y1 + by),
+                          (k * (x1 + width) + bx, k * y1 + by),
+                          (k * (x1 + width) + bx, k * (y1 + height) + by),
+                          (k * x1 + bx, k * (y1 + height) + by)]
+            # Compose with a transform that the object already has.
+            old = transforms.get(objectid, {})
+            kx0, ky0 = old.get('kx', 1.), old.get('ky', 1.)
+            bx0, by0 = old.get('bx', 0.), old.get('by', 0.)
+            properties += [(objectid, 'kx', k * kx0),
+                           (objectid, 'ky', k * ky0),
+                           (objectid, 'bx', k * bx0 + bx),
+                           (objectid, 'by', k * by0 + by)]
+            cells.append((object_['cell_path'], x0, y0))
+            task_objects.append((objectid, object_['name'], points))
+        tasks.append(
+            (page_path, op.join(args.annotations_dir,
+                                name + '.xml'), args.labelme_folder,
+             args.username, layout.width, layout.height, cells, task_objects,
+             None if args.video_path is None else args.video_scale))
+
+    os.makedirs(op.dirname(op.abspath(args.out_db_file)), exist_ok=True)
+    if args.video_path is not None:
+        os.makedirs(op.dirname(op.abspath(args.video_path)), exist_ok=True)
+
+    # Render pages in parallel, and write the video as frames come.
+    num_workers = args.num_workers or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(num_workers) as executor:
+        frames = executor.map(_render_page, tasks, chunksize=4)
+        if args.video_path is None:
+            for _ in frames:
+                pass
+        else:
+            preview_utils.write_frames(frames, args.video_path)
+    logging.info('Rendered pages in %.1f sec.', time.time() - start)
+
+    write_db(args.in_db_file, args.out_db_file, images, out_objects,
+             out_polygons, properties)
+    logging.info('Wrote %d pages to %s in %.1f sec.', len(images),
+                 args.out_db_file,
+                 time.time() - start)
+
+
+if __name__ == '__main__':
+    main()
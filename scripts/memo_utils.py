@@ -0,0 +1,220 @@
+'''
+Memoization of pipeline stages.
+
+A stage (e.g. the export of YOLO splits in "start_*_detection_training.sh")
+is identified by a key, which is the hash of
+- the contents of its input files and dirs,
+- its parameters, e.g. "k_fold=5 seed=0",
+- the contents of the scripts that implement it.
+When a stage completes, its key and outputs are recorded in a manifest.
+When it is about to run again, and the manifest has the same key and all
+outputs are still in place, the stage is skipped.
+
+Inputs are addressed by their content, not by their modification time. If an
+upstream stage is rerun and produces the same database, downstream stages
+are still skipped. Hashing a big database is slow, so the manifest also keeps
+the size and mtime of every input, and the hash of an input is only
+recomputed when they change.
+
+The manifest is a JSON file:
+  {"key": "...", "date": "...", "params": {...},
+   "inputs": {path: {"size": ..., "mtime": ..., "digest": ...}},
+   "scripts": {...the same as inputs...},
+   "outputs": {path: {"size": ..., "mtime": ...}}}
+'''
+
+import os, os.path as op
+import json
+import time
+import hashlib
+import logging
+
+CHUNK_SIZE = 1 << 20
+
+
+def _hash_file(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _hash_dir(path):
+    ''' Hash relative paths and contents of all files in a dir, in order. '''
+    sha = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            file_path = op.join(dirpath, filename)
+            sha.update(op.relpath(file_path, path).encode())
+            sha.update(_hash_file(file_path).encode())
+    return sha.hexdigest()
+
+
+def _stat(path):
+    '''
+    Returns {"size": ..., "mtime": ...} of a file. For a dir, the size is the
+    number of files, and mtime is the latest of all files.
+    '''
+    if not op.isdir(path):
+        stat = os.stat(path)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    size = 0
+    mtime = os.stat(path).st_mtime_ns
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            size += 1
+            mtime = max(mtime, os.stat(op.join(dirpath, filename)).st_mtime_ns)
+    return {'size': size, 'mtime': mtime}
+
+
+def describe_files(paths, known=None):
+    '''
+    Returns {path: {"size": ..., "mtime": ..., "digest": ...}}.
+    Args:
+      paths:    Files or dirs. All must exist.
+      known:    Descriptions from a previous manifest. If size and mtime of a
+                path did not change, its digest is reused.
+    '''
+    known = known or {}
+    descriptions = {}
+    for path in paths:
+        if not op.exists(path):
+            raise FileNotFoundError('Input does not exist at "%s"' % path)
+        description = _stat(path)
+        previous = known.get(path)
+        if previous is not None and all(
+                previous.get(key) == description[key]
+                for key in ['size', 'mtime']):
+            description['digest'] = previous['digest']
+        else:
+            logging.debug('Hashing %s', path)
+            description['digest'] = (_hash_dir(path)
+                                     if op.isdir(path) else _hash_file(path))
+        descriptions[path] = description
+    return descriptions
+
+
+def parse_params(params):
+    ''' Turn a list of "key=value" strings into a dict. '''
+    result = {}
+    for param in params:
+        if '=' not in param:
+            raise ValueError('Parameter "%s" is not in the form key=value.' %
+                             param)
+        key, value = param.split('=', 1)
+        result[key] = value
+    return result
+
+
+def stage_key(inputs, params, scripts):
+    '''
+    Returns the key of a stage.
+    Args:
+      inputs:     Descriptions of inputs, from describe_files().
+      params:     A dict {name: value}.
+      scripts:    Descriptions of scripts, from describe_files().
+    Inputs and scripts are addressed by their digests only, in their order,
+    so that the key does not change when a database is moved.
+    '''
+    blob = json.dumps(
+        {
+            'inputs': [inputs[path]['digest'] for path in inputs],
+            'params': params,
+            'scripts': [scripts[path]['digest'] for path in scripts],
+        },
+        sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+def read_manifest(manifest_path):
+    if not op.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except ValueError:
+        logging.warning('Manifest at "%s" is corrupted, ignoring it.',
+                        manifest_path)
+        return None
+
+
+class Stage(object):
+    '''
+    Args:
+      manifest_path:  Where the manifest of the stage is kept.
+      inputs:         Paths of input files and dirs.
+      params:         A dict {name: value}.
+      scripts:        Paths of scripts that implement the stage.
+      outputs:        Paths of files and dirs that the stage writes.
+    '''
+
+    def __init__(self, manifest_path, inputs, params, scripts, outputs):
+        self.manifest_path = manifest_path
+        self.inputs = list(inputs)
+        self.params = {key: str(value) for key, value in params.items()}
+        self.scripts = list(scripts)
+        self.outputs = list(outputs)
+
+    def _describe(self, manifest):
+        manifest = manifest or {}
+        inputs = describe_files(self.inputs, manifest.get('inputs'))
+        scripts = describe_files(self.scripts, manifest.get('scripts'))
+        return inputs, scripts, stage_key(inputs, self.params, scripts)
+
+    def is_up_to_date(self):
+        ''' Returns True if the stage can be skipped, and logs why not. '''
+        manifest = read_manifest(self.manifest_path)
+        if manifest is None:
+            logging.info('No manifest at "%s".', self.manifest_path)
+            return False
+        try:
+            _, _, key = self._describe(manifest)
+        except FileNotFoundError as e:
+            # The stage itself will report it.
+            logging.info(str(e))
+            return False
+        if key != manifest['key']:
+            logging.info('Inputs, parameters or scripts changed since %s.',
+                         manifest['date'])
+            return False
+        for path in self.outputs:
+            if not op.exists(path):
+                logging.info('Output is missing: %s', path)
+                return False
+            recorded = manifest['outputs'].get(path)
+            if recorded is not None and not op.isdir(path) and _stat(
+                    path) != recorded:
+                logging.info('Output was modified: %s', path)
+                return False
+        logging.info('Up to date since %s.', manifest['date'])
+        return True
+
+    def record(self):
+        ''' Write the manifest after the stage completed. '''
+        inputs, scripts, key = self._describe(
+            read_manifest(self.manifest_path))
+        outputs = {}
+        for path in self.outputs:
+            if not op.exists(path):
+                raise FileNotFoundError(
+                    'Stage completed but its output is missing: %s' % path)
+            outputs[path] = _stat(path)
+        manifest = {
+            'key': key,
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'params': self.params,
+            'inputs': inputs,
+            'scripts': scripts,
+            'outputs': outputs,
+        }
+        manifest_dir = op.dirname(op.abspath(self.manifest_path))
+        if not op.exists(manifest_dir):
+            os.makedirs(manifest_dir)
+        # Write atomically, so that an interrupted write is not a valid manifest.
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+        logging.info('Recorded the manifest at "%s".', self.manifest_path)
@@ -0,0 +1,74 @@
+'''
+Skip pipeline stages whose inputs, parameters and scripts did not change.
+See memo_utils.py for how stages are identified.
+
+Usage in a pipeline script:
+  memo_args="--manifest ${out_db_path}.manifest.json \
+    --inputs ${in_db_path} --params threshold=${threshold} \
+    --scripts $0 --outputs ${out_db_path}"
+  if python3 ${dir_of_this_file}/../scripts/memoize.py check ${memo_args}; then
+    echo "Up to date, skipping."
+    exit 0
+  fi
+  <run the stage>
+  python3 ${dir_of_this_file}/../scripts/memoize.py record ${memo_args}
+
+"check" exits with 0 if the stage is up to date, and with 1 if it must run.
+Delete the manifest to force a stage to run.
+'''
+
+import sys
+import logging
+import argparse
+
+import memo_utils
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Check or record the manifest of a pipeline stage.')
+    parser.add_argument('subcommand', choices=['check', 'record'])
+    parser.add_argument('--manifest',
+                        required=True,
+                        help='Path of the JSON manifest of the stage.')
+    parser.add_argument('--inputs',
+                        nargs='*',
+                        default=[],
+                        help='Input files and dirs.')
+    parser.add_argument('--params',
+                        nargs='*',
+                        default=[],
+                        help='Parameters as key=value.')
+    parser.add_argument('--scripts',
+                        nargs='*',
+                        default=[],
+                        help='Scripts that implement the stage.')
+    parser.add_argument('--outputs',
+                        nargs='*',
+                        default=[],
+                        help='Output files and dirs.')
+    parser.add_argument(
+        "--logging_level",
+        type=int,
+        choices=[10, 20, 30, 40],
+        default=20,
+        help="Set logging level. 10: debug, 20: info, 30: warning, 40: error.")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        level=args.logging_level)
+
+    stage = memo_utils.Stage(args.manifest, args.inputs,
+                             memo_utils.parse_params(args.params),
+                             args.scripts, args.outputs)
+    if args.subcommand == 'check':
+        sys.exit(0 if stage.is_up_to_date() else 1)
+    stage.record()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+'''
+Merge the db of a new campaign into the up-to-now db of previous campaigns.
+
+Shuffler's "addDb" writes a new up-to-now db with all rows of all previous
+campaigns, so the time and the disk space of every merge grow with the
+history. Here only the rows of the new campaign are inserted:
+
+- "full":     The base up-to-now db is cloned (a reflink where the file
+              system supports it, otherwise a copy), and rows of the new
+              campaign are appended in one transaction. The result is a
+              regular db that Shuffler can read.
+- "layered":  The output db has only the rows of the new campaign, and
+              the table "layers" with paths of the up-to-now dbs it is
+              stacked on, which are never modified. open_layered() attaches
+              the layers and creates TEMP VIEWs with the names of the tables,
+              so that queries read the union. Use "flatten" to make a
+              regular db for Shuffler.
+
+objectids (and ids of properties, polygons, matches) of the new campaign
+are kept, unless they collide with the base. Then they are shifted past
+the largest id of the base. Images that are already in the base are not
+added again.
+
+Examples:
+  python3 merge_uptonow.py merge --mode full \
+    --base_db_file campaign3to7-1800x1200.latest.db \
+    --new_db_file campaign8-1800x1200.v2.db \
+    --out_db_file campaign3to8-1800x1200.v2.db
+  python3 merge_uptonow.py flatten \
+    --in_db_file layered.db --out_db_file regular.db
+'''
+
+import os, os.path as op
+import time
+import sqlite3
+import logging
+import argparse
+
+import db_utils
+import file_utils
+
+TABLES = ['images', 'objects', 'properties', 'polygons', 'matches']
+
+# Columns of tables with ids that must be unique across campaigns.
+ID_COLUMNS = {
+    'objects': ['objectid'],
+    'properties': ['id', 'objectid'],
+    'polygons': ['id', 'objectid'],
+    'matches': ['id', 'objectid', 'match'],
+}
+
+# The default limit of attached databases in SQLite.
+MAX_ATTACHED = 10
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Merge a new campaign into the up-to-now db.')
+    parser.add_argument(
+        "--logging_level",
+        type=int,
+        choices=[10, 20, 30, 40],
+        default=20,
+        help="Set logging level. 10: debug, 20: info, 30: warning, 40: error.")
+    subparsers = parser.add_subparsers(dest='subcommand')
+    subparsers.required = True
+
+    merge_parser = subparsers.add_parser('merge', help='Merge a campaign.')
+    merge_parser.add_argument('--base_db_file',
+                              required=True,
+                              help='The up-to-now db of previous campaigns.')
+    merge_parser.add_argument('--new_db_file',
+                              required=True,
+                              help='The db of the new campaign.')
+    merge_parser.add_argument('--out_db_file', required=True)
+    merge_parser.add_argument('--mode',
+                              choices=['full', 'layered'],
+                              default='full')
+
+    flatten_parser = subparsers.add_parser(
+        'flatten', help='Make a regular db from a layered one.')
+    flatten_parser.add_argument('--in_db_file', required=True)
+    flatten_parser.add_argument('--out_db_file', required=True)
+    return parser
+
+
+def get_layers(cursor, schema='main'):
+    ''' Returns paths of dbs a layered db is stacked on, oldest first. '''
+    if 'layers' not in db_utils.get_tables(cursor, schema):
+        return []
+    return [
+        db_path for db_path, in cursor.execute(
+            'SELECT db_path FROM %s.layers ORDER BY position' % schema)
+    ]
+
+
+def _attach(cursor, db_path, schema):
+    if not op.exists(db_path):
+        raise FileNotFoundError('Database does not exist at "%s"' % db_path)
+    cursor.execute('ATTACH DATABASE ? AS %s' % schema, (db_path, ))
+
+
+def _attach_layers(cursor, layers):
+    ''' Attach layers as layer0, layer1, ... Returns their schema names. '''
+    if len(layers) + 1 > MAX_ATTACHED:
+        raise ValueError('A layered db can have at most %d layers, got %d. '
+                         'Flatten its base first.' %
+                         (MAX_ATTACHED - 1, len(layers)))
+    schemas = []
+    for i, db_path in enumerate(layers):
+        schema = 'layer%d' % i
+        _attach(cursor, db_path, schema)
+        schemas.append(schema)
+    return schemas
+
+
+def _offset_key(table, column):
+    # objectid of all tables is offset as objects.objectid.
+    return 'objectid' if column == 'objectid' else '%s.%s' % (table, column)
+
+
+def get_id_offsets(cursor, base_schemas, new_schema):
+    '''
+    Returns {column: offset} for columns of ID_COLUMNS. An offset is 0 if
+    ids of the new db do not collide with ids in "base_schemas".
+    '''
+    columns = {}
+    for table, table_columns in ID_COLUMNS.items():
+        for column in table_columns:
+            key = _offset_key(table, column)
+            if key in columns or table not in db_utils.get_tables(
+                    cursor, new_schema):
+                continue
+            base_max = None
+            for schema in base_schemas:
+                if table not in db_utils.get_tables(cursor, schema):
+                    continue
+                value = cursor.execute('SELECT MAX(%s) FROM %s.%s' %
+                                       (column, schema, table)).fetchone()[0]
+                if value is not None:
+                    base_max = value if base_max is None else max(
+                        base_max, value)
+            new_min = cursor.execute('SELECT MIN(%s) FROM %s.%s' %
+                                     (column, new_schema, table)).fetchone()[0]
+            if base_max is None or new_min is None or new_min > base_max:
+                columns[key] = 0
+            else:
+                columns[key] = base_max + 1 - new_min
+    return columns
+
+
+def _create_tables_like(cursor, src_schema, tables):
+    ''' Create tables in main with the same schema as in "src_schema". '''
+    for table in tables:
+        sql = cursor.execute(
+            "SELECT sql FROM %s.sqlite_master WHERE type='table' AND name=?" %
+            src_schema, (table, )).fetchone()[0]
+        cursor.execute(sql)
+
+
+def append_db(cursor, new_schema, base_schemas, offsets):
+    '''
+    Insert all rows of "new_schema" into main, shifting ids by "offsets".
+    Images that are in main or in "base_schemas" are skipped.
+    Returns {table: number of inserted rows}.
+    '''
+    counts = {}
+    new_tables = db_utils.get_tables(cursor, new_schema)
+    for table in TABLES:
+        if table not in new_tables:
+            continue
+        columns = db_utils.get_columns(cursor, 'main', table)
+        expressions = []
+        for column in columns:
+            offset = 0
+            if column in ID_COLUMNS.get(table, []):
+                offset = offsets.get(_offset_key(table, column), 0)
+            expressions.append('%s + %d' %
+                               (column, offset) if offset else column)
+        sql = 'INSERT INTO main.%s(%s) SELECT %s FROM %s.%s' % (
+            table, ','.join(columns), ','.join(expressions), new_schema, table)
+        if table == 'images':
+            sql += ' WHERE ' + ' AND '.join(
+                'imagefile NOT IN (SELECT imagefile FROM %s.images)' % schema
+                for schema in ['main'] + base_schemas)
+        cursor.execute(sql)
+        counts[table] = cursor.rowcount
+    return counts
+
+
+def merge(base_db_file, new_db_file, out_db_file, mode='full'):
+    '''
+    Make "out_db_file" with rows of "base_db_file" and "new_db_file".
+    Returns {table: number of rows inserted from the new db}.
+    '''
+    for path in [base_db_file, new_db_file]:
+        if not op.exists(path):
+            raise FileNotFoundError('Database does not exist at "%s"' % path)
+    start = time.time()
+    tmp_db_file = out_db_file + '.tmp'
+    if op.exists(tmp_db_file):
+        os.remove(tmp_db_file)
+
+    if mode == 'full':
+        file_utils.clone_file(base_db_file, tmp_db_file)
+        conn = db_utils.connect(tmp_db_file)
+        cursor = conn.cursor()
+        if len(get_layers(cursor)) > 0:
+            raise ValueError('Base db "%s" is layered. Flatten it first.' %
+                             base_db_file)
+        base_schemas = []
+        id_schemas = ['main']
+    else:
+        conn = sqlite3.connect(tmp_db_file)
+        cursor = conn.cursor()
+        _attach(cursor, base_db_file, 'base')
+        layers = get_layers(cursor, 'base') + [op.realpath(base_db_file)]
+        cursor.execute('DETACH DATABASE base')
+        base_schemas = _attach_layers(cursor, layers)
+        id_schemas = base_schemas
+    try:
+        _attach(cursor, new_db_file, 'new')
+        offsets = get_id_offsets(cursor, id_schemas, 'new')
+        logging.info('Offsets of ids: %s', offsets)
+        if mode == 'layered':
+            _create_tables_like(cursor, 'new', [
+                table for table in TABLES
+                if table in db_utils.get_tables(cursor, 'new')
+            ])
+            cursor.execute(
+                'CREATE TABLE layers (position INTEGER, db_path TEXT)')
+            cursor.executemany('INSERT INTO layers VALUES (?,?)',
+                               list(enumerate(layers)))
+        counts = append_db(cursor, 'new', base_schemas, offsets)
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_db_file, out_db_file)
+    logging.info('Merged %s into %s in %.1f sec, added rows: %s', new_db_file,
+                 out_db_file,
+                 time.time() - start, counts)
+    return counts
+
+
+def open_layered(db_file):
+    '''
+    Open a db. If it is layered, attach its layers and create TEMP VIEWs
+    named as tables, so that "SELECT ... FROM objects" reads all layers.
+    Views are read-only.
+    '''
+    conn = sqlite3.connect('file:%s?mode=ro' % db_file, uri=True)
+    cursor = conn.cursor()
+    layers = get_layers(cursor)
+    if len(layers) == 0:
+        return conn
+    schemas = _attach_layers(cursor, layers)
+    for table in TABLES:
+        if table not in db_utils.get_tables(cursor, 'main'):
+            continue
+        columns = ','.join(db_utils.get_columns(cursor, 'main', table))
+        selects = ['SELECT %s FROM main.%s' % (columns, table)]
+        selects += [
+            'SELECT %s FROM %s.%s' % (columns, schema, table)
+            for schema in schemas
+            if table in db_utils.get_tables(cursor, schema)
+        ]
+        cursor.execute('CREATE TEMP VIEW %s AS %s' %
+                       (table, ' UNION ALL '.join(selects)))
+    return conn
+
+
+def flatten(in_db_file, out_db_file):
+    ''' Write all rows of a layered db into a regular db. '''
+    start = time.time()
+    tmp_db_file = out_db_file + '.tmp'
+    if op.exists(tmp_db_file):
+        os.remove(tmp_db_file)
+    conn = open_layered(in_db_file)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('ATTACH DATABASE ? AS out', (tmp_db_file, ))
+        for table in TABLES:
+            if table not in db_utils.get_tables(cursor, 'main'):
+                continue
+            sql = cursor.execute(
+                "SELECT sql FROM main.sqlite_master "
+                "WHERE type='table' AND name=?", (table, )).fetchone()[0]
+            cursor.execute(
+                sql.replace('CREATE TABLE %s' % table,
+                            'CREATE TABLE out.%s' % table, 1))
+            columns = ','.join(db_utils.get_columns(cursor, 'main', table))
+            # Unqualified names resolve to the TEMP VIEWs.
+            cursor.execute('INSERT INTO out.%s(%s) SELECT %s FROM %s' %
+                           (table, columns, columns, table))
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_db_file, out_db_file)
+    logging.info('Flattened %s into %s in %.1f sec.', in_db_file, out_db_file,
+                 time.time() - start)
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        level=args.logging_level)
+
+    if args.subcommand == 'merge':
+        merge(args.base_db_file, args.new_db_file, args.out_db_file, args.mode)
+    else:
+        flatten(args.in_db_file, args.out_db_file)
+
+
+if __name__ == '__main__':
+    main()
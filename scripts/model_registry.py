@@ -0,0 +1,260 @@
+'''
+Promote the best model of a training run, and delete unused snapshots.
+
+postprocess.py scripts used to copy the best snapshot, and remove and
+recreate symlinks to it, so that for a while there was no best model.
+Here:
+- A snapshot is promoted with a hardlink, or a reflink if the file system
+  supports it (see file_utils.clone_file), and only copied as the last
+  resort. It is written under a temporary name and renamed into place.
+- Symlinks are swapped atomically: a new symlink is made under a temporary
+  name and renamed over the old one, so readers see either the old or the
+  new model.
+- Every promotion is appended to "promotions.json" in the run dir.
+- collect_garbage() deletes all but the last "keep" snapshots of every
+  hyper, except "protected" ones, e.g. the snapshot that postprocess.py
+  reads. Since the promoted model is a separate link, it survives.
+
+Example, deleting all snapshots but the last one of every hyper:
+  python3 scripts/model_registry.py gc \
+    --run_dir ${DETECTION_DIR}/campaign8/set-stamp-1800x1200/run0 \
+    --patterns "exp/weights/*.pt" --protected exp/weights/last.pt \
+    --keep 1 --dry_run
+'''
+
+import os, os.path as op
+import glob
+import json
+import time
+import shutil
+import logging
+import argparse
+
+import file_utils
+
+MANIFEST_FILENAME = 'promotions.json'
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Delete unused snapshots of a training run.')
+    parser.add_argument(
+        "--logging_level",
+        type=int,
+        choices=[10, 20, 30, 40],
+        default=20,
+        help="Set logging level. 10: debug, 20: info, 30: warning, 40: error.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_gc = subparsers.add_parser(
+        'gc', help='Delete all but the last snapshots of every hyper.')
+    parser_gc.add_argument('--run_dir', required=True)
+    parser_gc.add_argument(
+        '--patterns',
+        nargs='+',
+        required=True,
+        help='Glob patterns of snapshots relative to a hyper dir, '
+        'e.g. "exp/weights/*.pt".')
+    parser_gc.add_argument('--keep',
+                           type=int,
+                           default=1,
+                           help='Keep this many latest snapshots of a hyper.')
+    parser_gc.add_argument(
+        '--protected',
+        nargs='*',
+        default=[],
+        help='Snapshots relative to a hyper dir that are never deleted, '
+        'e.g. "exp/weights/last.pt".')
+    parser_gc.add_argument('--dry_run',
+                           action='store_true',
+                           help='Only log what would be deleted.')
+
+    parser_history = subparsers.add_parser('history',
+                                           help='Print promotions of a run.')
+    parser_history.add_argument('--run_dir', required=True)
+    return parser
+
+
+def link_file(src_path, dst_path):
+    '''
+    Make "dst_path" a hardlink, a reflink, or a copy of "src_path", in this
+    order of preference. "dst_path" is replaced atomically.
+    Returns:
+      "hardlink" or "clone" (a reflink or a copy).
+    '''
+    tmp_path = dst_path + '.tmp'
+    if op.lexists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(src_path, tmp_path)
+        method = 'hardlink'
+    except OSError:
+        file_utils.clone_file(src_path, tmp_path)
+        method = 'clone'
+    os.replace(tmp_path, dst_path)
+    return method
+
+
+def swap_symlink(target, link_path):
+    ''' Point "link_path" to "target", without a moment when it is missing. '''
+    tmp_path = link_path + '.tmp'
+    if op.lexists(tmp_path):
+        os.remove(tmp_path)
+    os.symlink(target, tmp_path)
+    os.replace(tmp_path, link_path)
+
+
+def read_manifest(run_dir):
+    ''' Returns the list of promotions of a run, oldest first. '''
+    path = op.join(run_dir, MANIFEST_FILENAME)
+    if not op.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def record_promotion(run_dir, record):
+    promotions = read_manifest(run_dir)
+    promotions.append(record)
+    path = op.join(run_dir, MANIFEST_FILENAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(promotions, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def promote_file(src_path, dst_path, symlinks=(), run_dir=None, info=None):
+    '''
+    Link the best snapshot into the run dir and point symlinks to it.
+    Args:
+      src_path:  The snapshot.
+      dst_path:  Where the promoted model is linked.
+      symlinks:  A list of (target, link_path) to swap after linking.
+      run_dir:   The dir of the manifest. Default: the dir of "dst_path".
+      info:      A dict with extra fields of the record, e.g. the epoch.
+    Returns:
+      The record of the promotion.
+    '''
+    method = link_file(src_path, dst_path)
+    for target, link_path in symlinks:
+        swap_symlink(target, link_path)
+    record = {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'source': op.abspath(src_path),
+        'destination': op.abspath(dst_path),
+        'method': method,
+        'symlinks': [op.abspath(link_path) for _, link_path in symlinks],
+    }
+    record.update(info or {})
+    record_promotion(run_dir or op.dirname(op.abspath(dst_path)), record)
+    logging.info('Promoted (%s) %s\n\tto %s', method, src_path, dst_path)
+    return record
+
+
+def promote_dir(files, link_path, run_dir=None, info=None):
+    '''
+    Link files into a new versioned dir, and point "link_path" to it.
+    The previous versioned dir is removed after the swap. A regular dir at
+    "link_path", made before promotions were versioned, is removed first.
+    The new dir is named by time and a counter, and is created exclusively,
+    so that promotions within one second never reuse the current target.
+    Args:
+      files:      A list of (src_path, path relative to the new dir).
+      link_path:  E.g. "${run_dir}/hyperbest".
+    Returns:
+      The record of the promotion.
+    '''
+    parent_dir = op.dirname(op.abspath(link_path))
+    version_prefix = '%s.%s' % (op.basename(link_path),
+                                time.strftime('%Y-%m-%d_%H-%M-%S'))
+    counter = 0
+    while True:
+        version_name = '%s.%d' % (version_prefix, counter)
+        version_dir = op.join(parent_dir, version_name)
+        try:
+            os.mkdir(version_dir)
+            break
+        except FileExistsError:
+            counter += 1
+
+    methods = set()
+    for src_path, relpath in files:
+        dst_path = op.join(version_dir, relpath)
+        os.makedirs(op.dirname(dst_path), exist_ok=True)
+        methods.add(link_file(src_path, dst_path))
+
+    previous_dir = None
+    if op.islink(link_path):
+        previous_dir = op.join(parent_dir, os.readlink(link_path))
+    elif op.isdir(link_path):
+        logging.warning('Replacing the regular dir %s.', link_path)
+        shutil.rmtree(link_path)
+    swap_symlink(version_name, link_path)
+    if previous_dir is not None and op.abspath(previous_dir) != version_dir:
+        shutil.rmtree(previous_dir, ignore_errors=True)
+
+    record = {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'sources': [op.abspath(src_path) for src_path, _ in files],
+        'destination': version_dir,
+        'method': ','.join(sorted(methods)),
+        'symlinks': [op.abspath(link_path)],
+    }
+    record.update(info or {})
+    record_promotion(run_dir or parent_dir, record)
+    logging.info('Promoted %d files to %s', len(files), link_path)
+    return record
+
+
+def collect_garbage(run_dir, patterns, keep=1, dry_run=False, protected=()):
+    '''
+    Delete all but the "keep" latest snapshots of every hyper of a run.
+    Args:
+      patterns:   Glob patterns of snapshots, relative to a hyper dir.
+      protected:  Snapshots that are never deleted and do not count towards
+                  "keep". Paths are relative to a hyper dir, or absolute.
+                  Snapshots are ordered by mtime, and e.g. YOLOv5 strips
+                  best.pt after last.pt, so files that postprocess.py
+                  reads must be protected explicitly.
+    Returns:
+      The number of deleted files and the number of bytes freed. A file
+      with other hardlinks (e.g. a promoted model) frees nothing.
+    '''
+    num_files, num_bytes = 0, 0
+    for hyper_dir in sorted(glob.glob(op.join(run_dir, 'hyper[0-9]*'))):
+        paths = set()
+        for pattern in patterns:
+            paths.update(glob.glob(op.join(hyper_dir, pattern)))
+        paths -= set(op.join(hyper_dir, path) for path in protected)
+        paths = sorted(paths, key=lambda x: (op.getmtime(x), x))
+        for path in paths[:max(len(paths) - keep, 0)]:
+            stat = os.stat(path)
+            if stat.st_nlink == 1:
+                num_bytes += stat.st_size
+            num_files += 1
+            if dry_run:
+                logging.info('Would delete %s', path)
+            else:
+                logging.debug('Deleting %s', path)
+                os.remove(path)
+    logging.info('%s %d snapshots, %.1f GB.',
+                 'Would delete' if dry_run else 'Deleted', num_files,
+                 num_bytes / 1e9)
+    return num_files, num_bytes
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        level=args.logging_level)
+
+    if args.command == 'gc':
+        collect_garbage(args.run_dir, args.patterns, args.keep, args.dry_run,
+                        args.protected)
+    elif args.command == 'history':
+        for record in read_manifest(args.run_dir):
+            print(json.dumps(record, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+'''
+Monitor a running training sweep.
+
+Reads job ids of every hyper from "hyper*/batch_jobs/job_ids.txt" in a run dir,
+queries their states from the scheduler in one batch, and tails the results
+file of every hyper. Only the bytes appended since the previous poll are
+parsed, using the same schema as the postprocess.py of this kind of training.
+
+Prints a table with the state, the last epoch, the last and best metric,
+and the ETA of every hyper. Optionally cancels hypers whose metric is too low.
+
+Example:
+  source constants.sh
+  python3 scripts/monitor_jobs.py \
+    --run_dir $(get_detection_run_dir 5 set-stamp-1800x1200 0) \
+    --kind detection_yolov5 \
+    --experiments_path .../experiments.txt
+'''
+
+import os, sys, os.path as op
+import time
+import glob
+import logging
+import argparse
+import importlib.util
+
+sys.path.insert(0, op.dirname(op.abspath(__file__)))
+import postprocess_utils
+import slurm_utils
+
+# Dir with postprocess.py, results file of a hyper, the default metric,
+# and the column in experiments file with the number of epochs.
+KINDS = {
+    'detection_yolov5': ('detection_training_yolov5_jobs', 'exp/results.csv',
+                         'metrics/mAP_0.5', 4),
+    'detection_polygon_yolov5': ('detection_training_polygon_yolov5_jobs',
+                                 'exp/results.txt', 'mAP@0.5:0.95', 4),
+    'classification': ('classification_training',
+                       'batch_jobs/train_classification*.out', 'value', None),
+    'classification_pel':
+    ('classification_training_pel', 'batch_jobs/train_classification*.out',
+     'value', None),
+}
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Monitor jobs and results of a training sweep.')
+    parser.add_argument('--run_dir',
+                        required=True,
+                        help='Dir with "hyper*" dirs of a run.')
+    parser.add_argument('--kind', required=True, choices=list(KINDS.keys()))
+    parser.add_argument('--metric',
+                        help='Metric to show. Default depends on "kind".')
+    parser.add_argument(
+        '--experiments_path',
+        help='If provided, the number of epochs of detection hypers is read '
+        'from it to compute ETA.')
+    parser.add_argument('--num_epochs',
+                        type=int,
+                        help='The number of epochs of every hyper, for ETA.')
+    parser.add_argument('--interval',
+                        type=float,
+                        default=60,
+                        help='Seconds between polls.')
+    parser.add_argument('--once',
+                        action='store_true',
+                        help='Poll once and exit.')
+    parser.add_argument(
+        '--cancel_below',
+        type=float,
+        help='Cancel running hypers whose best metric is below this value '
+        'after "cancel_after_epoch" epochs.')
+    parser.add_argument('--cancel_after_epoch', type=int, default=5)
+    parser.add_argument(
+        '--fake_states_path',
+        help='Use a JSON file {job_id: state} instead of SLURM. For testing.')
+    parser.add_argument(
+        "--logging_level",
+        type=int,
+        choices=[10, 20, 30, 40],
+        default=20,
+        help="Set logging level. 10: debug, 20: info, 30: warning, 40: error.")
+    return parser
+
+
+def load_schema(kind):
+    ''' Import SCHEMA from postprocess.py of this kind. '''
+    path = op.join(op.dirname(op.abspath(__file__)), KINDS[kind][0],
+                   'postprocess.py')
+    spec = importlib.util.spec_from_file_location('postprocess_%s' % kind,
+                                                  path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.SCHEMA
+
+
+class HyperMonitor(object):
+    ''' Tails the results file of one hyper. '''
+
+    def __init__(self, hyper_dir, pattern, schema, metric):
+        self.hyper_dir = hyper_dir
+        self.pattern = pattern
+        self.schema = schema
+        self.metric = metric
+        self.path = None
+        self.offset = 0
+        self.state = None
+        self.stat = None
+        self.epoch = None
+        self.last = None
+        self.best = None
+        # A dict {epoch: metric} of all parsed epochs.
+        self.values = {}
+        # The first observed (mtime, epoch), to estimate time per epoch.
+        self.first_progress = None
+        self.last_progress = None
+
+    def _find_path(self):
+        paths = sorted(glob.glob(op.join(self.hyper_dir, self.pattern)))
+        # If a hyper was resubmitted, the latest file is the relevant one.
+        return paths[-1] if len(paths) > 0 else None
+
+    def poll(self):
+        path = self._find_path()
+        if path is None:
+            return
+        if path != self.path:
+            self.path = path
+            self.offset, self.state, self.stat = 0, None, None
+            self.values = {}
+            self.first_progress = None
+        stat = os.stat(path)
+        stat = (stat.st_size, stat.st_mtime)
+        if stat == self.stat:
+            return
+        if self.stat is not None and stat[0] < self.stat[0]:
+            logging.warning('File was truncated, will reread it: %s', path)
+            self.offset, self.state = 0, None
+        self.stat = stat
+
+        columns, self.offset, self.state = self.schema.parse(
+            path, self.offset, self.state)
+        if len(columns['epoch']) == 0:
+            return
+        self.values.update(zip(columns['epoch'], columns[self.metric]))
+        self.epoch = columns['epoch'][-1]
+        self.last = columns[self.metric][-1]
+        best = max(columns[self.metric])
+        self.best = best if self.best is None else max(self.best, best)
+        self.last_progress = (stat[1], self.epoch)
+        if self.first_progress is None:
+            self.first_progress = self.last_progress
+
+    def get_best(self, max_epoch):
+        ''' Returns the best metric up to and including "max_epoch". '''
+        values = [v for epoch, v in self.values.items() if epoch <= max_epoch]
+        return max(values) if len(values) > 0 else None
+
+    def get_eta(self, num_epochs):
+        ''' Returns seconds until the last epoch, or None if unknown. '''
+        if num_epochs is None or self.first_progress is None:
+            return None
+        (time0, epoch0), (time1, epoch1) = self.first_progress, \
+            self.last_progress
+        if epoch1 <= epoch0 or time1 <= time0:
+            return None
+        seconds_per_epoch = (time1 - time0) / (epoch1 - epoch0)
+        return max(num_epochs - 1 - epoch1, 0) * seconds_per_epoch
+
+
+def read_num_epochs(experiments_path, column):
+    ''' Returns a dict {hyper name: number of epochs}. '''
+    num_epochs = {}
+    for words in postprocess_utils.read_experiments(experiments_path):
+        num_epochs['hyper%s' % words[0]] = int(words[column])
+    return num_epochs
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    return '%d:%02d:%02d' % (seconds // 3600, seconds % 3600 // 60,
+                             seconds % 60)
+
+
+def format_value(value, fmt='%.4f'):
+    return '-' if value is None else fmt % value
+
+
+def print_table(rows):
+    print('%-10s %-12s %-12s %6s %10s %10s %10s' %
+          ('hyper', 'job_id', 'state', 'epoch', 'last', 'best', 'eta'))
+    for row in rows:
+        print('%-10s %-12s %-12s %6s %10s %10s %10s' % row)
+    sys.stdout.flush()
+
+
+def poll(args, scheduler, monitors, num_epochs):
+    job_ids = slurm_utils.find_job_ids(args.run_dir)
+    states = scheduler.get_states(job_ids.values())
+
+    rows = []
+    to_cancel = []
+    for hyper_name, monitor in sorted(monitors.items()):
+        monitor.poll()
+        job_id = job_ids.get(hyper_name)
+        state = states.get(job_id, '-')
+        eta = (monitor.get_eta(num_epochs.get(hyper_name, args.num_epochs))
+               if slurm_utils.is_active(state) else None)
+        rows.append(
+            (hyper_name, job_id
+             or '-', state, format_value(monitor.epoch,
+                                         '%d'), format_value(monitor.last),
+             format_value(monitor.best), format_seconds(eta)))
+
+        if (args.cancel_below is not None and slurm_utils.is_active(state)
+                and monitor.epoch is not None
+                and monitor.epoch >= args.cancel_after_epoch
+                and monitor.best < args.cancel_below):
+            logging.warning('Hyper %s has best %s %.4f < %.4f. Cancelling.',
+                            hyper_name, args.metric, monitor.best,
+                            args.cancel_below)
+            to_cancel.append(job_id)
+
+    print_table(rows)
+    if len(to_cancel) > 0:
+        scheduler.cancel(to_cancel)
+    return list(states.values())
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        level=args.logging_level)
+
+    if not op.isdir(args.run_dir):
+        raise FileNotFoundError('Run dir not found at: %s' % args.run_dir)
+
+    _, pattern, default_metric, epochs_column = KINDS[args.kind]
+    schema = load_schema(args.kind)
+    if args.metric is None:
+        args.metric = default_metric
+    if args.metric not in schema.columns():
+        raise ValueError('Unknown metric "%s". Available: %s' %
+                         (args.metric, schema.columns()))
+
+    num_epochs = {}
+    if args.experiments_path is not None and epochs_column is not None:
+        num_epochs = read_num_epochs(args.experiments_path, epochs_column)
+
+    scheduler = slurm_utils.get_scheduler(args.fake_states_path)
+    monitors = {}
+    while True:
+        for hyper_dir in sorted(glob.glob(op.join(args.run_dir, 'hyper*'))):
+            hyper_name = op.basename(hyper_dir)
+            if op.isdir(hyper_dir) and hyper_name not in monitors:
+                monitors[hyper_name] = HyperMonitor(hyper_dir, pattern, schema,
+                                                    args.metric)
+
+        states = poll(args, scheduler, monitors, num_epochs)
+        if args.once:
+            break
+        if not any(slurm_utils.is_active(state) for state in states):
+            logging.info('No active jobs. Exiting.')
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
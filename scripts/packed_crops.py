@@ -0,0 +1,315 @@
+'''
+Crops of the same size packed into memory-mapped shards.
+
+Classification reads tens of thousands of small crops, one file each, and
+on Lustre opening a file costs more than reading it. Here crops are packed
+into a directory with:
+- "shard%05d.npy":  uint8 arrays of shape (N, size, size, 3), RGB.
+- "index.npy":      objectid, shard and row of every crop, by objectid.
+- "meta.json":      size, number of crops and shards.
+- "sources.json":   the file every crop was read from, with its size and
+                    mtime, in the index order.
+
+PackedCrops reads crops by objectid. Shards are memory-mapped, and
+iterate() reads crops in the order they are stored, so a pass over all
+crops is a sequential read of every shard once.
+
+When a dir is packed again, crops with the same objectid, source path,
+size and mtime are copied from the previous shards, and only new crops are
+decoded. A re-cropped object keeps its path in a cropped db, but its file
+is a new file, so its mtime changes.
+
+The cropping job writes the packed dir next to the cropped db. The loaders
+of OLTR and PEL live in their own repos and do not read it yet. A loader
+can do:
+  crops = packed_crops.PackedCrops(packed_dir)
+  image = crops.get(objectid)
+
+Example of packing a cropped db:
+  python3 scripts/packed_crops.py \
+    --db_file crops/campaign3to8-6Kx4K.v5.expand0.5.size260.cropped.db \
+    --rootdir ${ROOT_DIR} \
+    --out_dir crops/campaign3to8-6Kx4K.v5.expand0.5.size260.cropped.packed
+'''
+
+import os, os.path as op
+import json
+import time
+import shutil
+import sqlite3
+import logging
+import argparse
+import concurrent.futures
+import numpy as np
+import cv2
+
+INDEX_DTYPE = np.dtype([('objectid', np.int64), ('shard', np.int32),
+                        ('row', np.int32)])
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Pack crops of a cropped db into shards.')
+    parser.add_argument('--db_file', required=True)
+    parser.add_argument('--rootdir', required=True)
+    parser.add_argument('--out_dir', required=True)
+    parser.add_argument('--size',
+                        type=int,
+                        help='Crops are resized to it if needed. '
+                        'Default: the size of the first crop.')
+    parser.add_argument('--shard_size', type=int, default=10000)
+    parser.add_argument('--num_workers',
+                        type=int,
+                        help='The number of processes. Default: all cpus.')
+    parser.add_argument(
+        "--logging_level",
+        type=int,
+        choices=[10, 20, 30, 40],
+        default=20,
+        help="Set logging level. 10: debug, 20: info, 30: warning, 40: error.")
+    return parser
+
+
+def get_shard_path(packed_dir, shard):
+    return op.join(packed_dir, 'shard%05d.npy' % shard)
+
+
+def _read_crops(task):
+    ''' Returns an array of crops of one chunk of a shard. '''
+    paths, size = task
+    crops = np.zeros((len(paths), size, size, 3), np.uint8)
+    for i, path in enumerate(paths):
+        image = cv2.imread(path)
+        if image is None:
+            raise IOError('Failed to read "%s"' % path)
+        if image.shape[:2] != (size, size):
+            image = cv2.resize(image, (size, size),
+                               interpolation=cv2.INTER_AREA)
+        crops[i] = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return crops
+
+
+def _describe_source(path):
+    ''' What tells if a crop changed: its path, size and mtime. '''
+    stat = os.stat(path)
+    return [path, stat.st_size, stat.st_mtime_ns]
+
+
+def _open_previous(out_dir, size):
+    '''
+    Returns the existing packed dir as PackedCrops and
+    {objectid: description of the source, see _describe_source},
+    or (None, {}) if there is none of this size.
+    '''
+    sources_path = op.join(out_dir, 'sources.json')
+    if not op.exists(sources_path):
+        return None, {}
+    previous = PackedCrops(out_dir)
+    if previous.size != size:
+        return None, {}
+    with open(sources_path) as f:
+        sources = json.load(f)
+    return previous, dict(zip(previous.objectids().tolist(), sources))
+
+
+def pack(items, out_dir, size, shard_size=10000, num_workers=None):
+    '''
+    Write crops into shards. The output dir is replaced atomically.
+    Crops of the previous "out_dir" with the same source are reused.
+    Args:
+      items:        A list of (objectid, path of the crop).
+      out_dir:      The packed dir.
+      size:         The size of square crops.
+      shard_size:   The number of crops per shard.
+      num_workers:  The number of processes to decode crops.
+    '''
+    start = time.time()
+    items = sorted(items)
+    tmp_dir = out_dir.rstrip('/') + '.tmp'
+    if op.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    previous, previous_sources = _open_previous(out_dir, size)
+    sources = [_describe_source(path) for _, path in items]
+    num_reused = 0
+
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    # Chunks of shards are decoded in parallel, and written in order.
+    chunk_size = max(min(shard_size // num_workers, 1000), 1)
+    index = np.zeros(len(items), INDEX_DTYPE)
+    num_shards = (len(items) + shard_size - 1) // shard_size
+    executor = None
+    mapper = map
+    if num_workers > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(num_workers)
+        mapper = executor.map
+    try:
+        for shard in range(num_shards):
+            shard_items = items[shard * shard_size:(shard + 1) * shard_size]
+            array = np.lib.format.open_memmap(get_shard_path(tmp_dir, shard),
+                                              mode='w+',
+                                              dtype=np.uint8,
+                                              shape=(len(shard_items), size,
+                                                     size, 3))
+            shard_sources = sources[shard * shard_size:(shard + 1) *
+                                    shard_size]
+            reused_rows = [
+                row for row, ((objectid, _), source) in enumerate(
+                    zip(shard_items, shard_sources))
+                if previous_sources.get(objectid) == source
+            ]
+            for i in range(0, len(reused_rows), chunk_size):
+                rows = reused_rows[i:i + chunk_size]
+                array[rows] = previous.get_many(
+                    [shard_items[row][0] for row in rows])
+            num_reused += len(reused_rows)
+            new_rows = sorted(
+                set(range(len(shard_items))) - set(reused_rows))
+            tasks = []
+            for i in range(0, len(new_rows), chunk_size):
+                rows = new_rows[i:i + chunk_size]
+                tasks.append(([shard_items[row][1] for row in rows], size))
+            for i, crops in enumerate(mapper(_read_crops, tasks)):
+                array[new_rows[i * chunk_size:(i + 1) * chunk_size]] = crops
+            array.flush()
+            del array
+            begin = shard * shard_size
+            index['objectid'][begin:begin + len(shard_items)] = [
+                objectid for objectid, _ in shard_items
+            ]
+            index['shard'][begin:begin + len(shard_items)] = shard
+            index['row'][begin:begin + len(shard_items)] = np.arange(
+                len(shard_items))
+            logging.info('Wrote shard %d/%d.', shard + 1, num_shards)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    np.save(op.join(tmp_dir, 'index.npy'), index)
+    with open(op.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(
+            {
+                'size': size,
+                'num_crops': len(items),
+                'num_shards': num_shards,
+                'shard_size': shard_size,
+                'channels': 'RGB',
+            },
+            f,
+            indent=2)
+    with open(op.join(tmp_dir, 'sources.json'), 'w') as f:
+        json.dump(sources, f)
+    # Shards of the previous dir are memory-mapped until here.
+    del previous
+    if op.exists(out_dir):
+        shutil.rmtree(out_dir)
+    os.replace(tmp_dir, out_dir)
+    logging.info('Packed %d crops (%d reused) into %s in %.1f sec.',
+                 len(items), num_reused, out_dir, time.time() - start)
+
+
+class PackedCrops(object):
+    ''' Reads crops from a packed dir by objectid. '''
+
+    def __init__(self, packed_dir):
+        self.packed_dir = packed_dir
+        with open(op.join(packed_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.size = self.meta['size']
+        self.index = np.load(op.join(packed_dir, 'index.npy'))
+        self._shards = [None] * self.meta['num_shards']
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, objectid):
+        i = np.searchsorted(self.index['objectid'], objectid)
+        return i < len(self.index) and self.index['objectid'][i] == objectid
+
+    def objectids(self):
+        return self.index['objectid']
+
+    def _shard(self, shard):
+        if self._shards[shard] is None:
+            path = get_shard_path(self.packed_dir, shard)
+            self._shards[shard] = np.load(path, mmap_mode='r')
+        return self._shards[shard]
+
+    def _locate(self, objectids):
+        ''' Returns rows of the index for "objectids". '''
+        objectids = np.asarray(objectids, np.int64)
+        if len(self.index) == 0:
+            if len(objectids) > 0:
+                raise KeyError('Objectids are not packed: %s' %
+                               objectids[:10].tolist())
+            return np.zeros(0, np.int64)
+        positions = np.searchsorted(self.index['objectid'], objectids)
+        positions = np.minimum(positions, len(self.index) - 1)
+        found = self.index['objectid'][positions] == objectids
+        if not found.all():
+            raise KeyError('Objectids are not packed: %s' %
+                           objectids[~found][:10].tolist())
+        return positions
+
+    def get(self, objectid):
+        ''' Returns a crop as an array (size, size, 3), RGB. '''
+        entry = self.index[self._locate([objectid])[0]]
+        return np.array(self._shard(entry['shard'])[entry['row']])
+
+    def get_many(self, objectids):
+        '''
+        Returns crops of "objectids" as an array (N, size, size, 3).
+        Crops are read in the order they are stored.
+        '''
+        positions = self._locate(objectids)
+        crops = np.zeros((len(positions), self.size, self.size, 3), np.uint8)
+        for i in np.argsort(positions, kind='stable'):
+            entry = self.index[positions[i]]
+            crops[i] = self._shard(entry['shard'])[entry['row']]
+        return crops
+
+    def iterate(self, objectids=None, batch_size=256):
+        '''
+        Yields (objectids, crops) in batches, in the order crops are stored.
+        If "objectids" is None, yields all crops.
+        '''
+        if objectids is None:
+            positions = np.arange(len(self.index))
+        else:
+            positions = np.sort(self._locate(objectids))
+        for begin in range(0, len(positions), batch_size):
+            batch = self.index[positions[begin:begin + batch_size]]
+            crops = np.zeros((len(batch), self.size, self.size, 3), np.uint8)
+            for shard in np.unique(batch['shard']):
+                mask = batch['shard'] == shard
+                crops[mask] = self._shard(shard)[batch['row'][mask]]
+            yield batch['objectid'].copy(), crops
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        level=args.logging_level)
+
+    conn = sqlite3.connect('file:%s?mode=ro' % args.db_file, uri=True)
+    items = [(objectid, op.join(args.rootdir, imagefile))
+             for objectid, imagefile in conn.execute(
+                 'SELECT objectid,imagefile FROM objects')]
+    conn.close()
+    if len(items) == 0:
+        raise ValueError('No objects in %s' % args.db_file)
+
+    size = args.size
+    if size is None:
+        image = cv2.imread(items[0][1])
+        if image is None:
+            raise IOError('Failed to read "%s"' % items[0][1])
+        size = image.shape[0]
+    pack(items, args.out_dir, size, args.shard_size, args.num_workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,51 +1,135 @@
-import argparse
-import sqlite3
-import shutil
-import os
-
-parser = argparse.ArgumentParser(description='''
+'''
 Objects in all databases seem to have the correct value of "campaign" key
 in table "properties". Table images has field "name", which also is supposed
 to contain the campaign id. However, images.name seems to be not populated
 correctly in many databases. This script fixes that for one database.
 
+Every reference db is attached to the connection, and images.name is set
+with one UPDATE per campaign, all in one transaction (one per 10 campaigns,
+the limit of attached dbs). If -o is not given,
+only the number of images that would change is printed.
+
 Usage:
-  Run this once for the input_db_file and for every previous campaign.
-''')
-parser.add_argument('-i', '--input_db_file', required=True)
-parser.add_argument('--campaign_db_file',
-                    required=True,
-                    help='Reference db of a campaign.')
-parser.add_argument('--campaign_id',
-                    required=True,
-                    type=int,
-                    help='Campaign id to set.')
-parser.add_argument('-o', '--output_db_file')
-args = parser.parse_args()
-
-assert os.path.exists(args.input_db_file)
-
-conn = sqlite3.connect('file:%s?mode=ro' % args.campaign_db_file, uri=True)
-c = conn.cursor()
-c.execute('SELECT imagefile FROM images')
-ref_imagefiles = c.fetchall()
-conn.close()
-
-if args.output_db_file is not None:
-    if args.output_db_file != args.input_db_file:
-        shutil.copyfile(args.input_db_file, args.output_db_file)
-    conn = sqlite3.connect(args.output_db_file)
-else:
-    conn = sqlite3.connect('file:%s?mode=ro' % args.input_db_file, uri=True)
-c = conn.cursor()
-
-for imagefile, in ref_imagefiles:
-    if args.output_db_file is not None:
-        c.execute('UPDATE images SET name=? WHERE imagefile=?',
-                  (args.campaign_id, imagefile))
-
-if args.output_db_file is not None:
-    conn.commit()
-conn.close()
-
-print('Done.')
+  Pass the reference dbs of all campaigns at once, in the same order as
+  their ids. If an image is in several of them, the last one wins.
+  python3 populate_image_campaign.py -i campaign3to8.db \
+    --campaign_db_file campaign3.db campaign4.db ... \
+    --campaign_id 3 4 ... \
+    -o campaign3to8.fixed.db
+'''
+
+import os.path as op
+import time
+import sqlite3
+import logging
+import argparse
+
+import db_utils
+
+# The default limit of attached databases in SQLite.
+MAX_ATTACHED = 10
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Set images.name to the campaign id.')
+    parser.add_argument('-i', '--input_db_file', required=True)
+    parser.add_argument('--campaign_db_file',
+                        required=True,
+                        nargs='+',
+                        help='Reference dbs of campaigns.')
+    parser.add_argument('--campaign_id',
+                        required=True,
+                        type=int,
+                        nargs='+',
+                        help='Campaign ids to set, one per reference db.')
+    parser.add_argument('-o', '--output_db_file')
+    parser.add_argument(
+        "--logging_level",
+        type=int,
+        choices=[10, 20, 30, 40],
+        default=20,
+        help="Set logging level. 10: debug, 20: info, 30: warning, 40: error.")
+    return parser
+
+
+def populate(conn, campaign_db_files, campaign_ids, dry_run=False):
+    '''
+    Set images.name to the campaign id of every reference db.
+    Returns a list with the number of changed images per campaign.
+    '''
+    cursor = conn.cursor()
+    if not dry_run:
+        db_utils.create_indexes(
+            conn, [('images_imagefile', 'images', ['imagefile'])])
+    campaigns = list(zip(campaign_db_files, campaign_ids))
+    counts = []
+    # A db can not be detached inside a transaction, so all reference dbs
+    # of a transaction are attached before it. SQLite allows to attach
+    # MAX_ATTACHED dbs at a time.
+    for start in range(0, len(campaigns), MAX_ATTACHED):
+        chunk = campaigns[start:start + MAX_ATTACHED]
+        for i, (campaign_db_file, _) in enumerate(chunk):
+            if not op.exists(campaign_db_file):
+                raise FileNotFoundError('Campaign db does not exist at "%s"' %
+                                        campaign_db_file)
+            cursor.execute('ATTACH DATABASE ? AS ref%d' % i,
+                           ('file:%s?mode=ro' % campaign_db_file, ))
+        for i, (_, campaign_id) in enumerate(chunk):
+            # "IS NOT" skips images that already have the right name.
+            where = ('imagefile IN (SELECT imagefile FROM ref%d.images) '
+                     'AND name IS NOT ?' % i)
+            if dry_run:
+                count = cursor.execute(
+                    'SELECT COUNT(1) FROM images WHERE %s' % where,
+                    (str(campaign_id), )).fetchone()[0]
+            else:
+                cursor.execute('UPDATE images SET name=? WHERE %s' % where,
+                               (str(campaign_id), str(campaign_id)))
+                count = cursor.rowcount
+            logging.info('Campaign %d: %d images %s.', campaign_id, count,
+                         'would change' if dry_run else 'changed')
+            counts.append(count)
+        conn.commit()
+        for i in range(len(chunk)):
+            cursor.execute('DETACH DATABASE ref%d' % i)
+    return counts
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        level=args.logging_level)
+
+    if not op.exists(args.input_db_file):
+        raise FileNotFoundError('Input db does not exist at "%s"' %
+                                args.input_db_file)
+    if len(args.campaign_db_file) != len(args.campaign_id):
+        raise ValueError('Got %d campaign dbs but %d campaign ids.' %
+                         (len(args.campaign_db_file), len(args.campaign_id)))
+
+    start_time = time.time()
+    dry_run = args.output_db_file is None
+    if dry_run:
+        conn = db_utils.connect(args.input_db_file, read_only=True)
+    else:
+        if op.abspath(args.output_db_file) != op.abspath(args.input_db_file):
+            src = db_utils.connect(args.input_db_file, read_only=True)
+            dst = sqlite3.connect(args.output_db_file)
+            src.backup(dst)
+            src.close()
+            dst.close()
+        conn = db_utils.connect(args.output_db_file)
+    try:
+        counts = populate(conn, args.campaign_db_file, args.campaign_id,
+                          dry_run)
+    finally:
+        conn.close()
+    logging.info('%s %d images in %.1f sec.',
+                 'Would change' if dry_run else 'Changed', sum(counts),
+                 time.time() - start_time)
+
+
+if __name__ == '__main__':
+    main()
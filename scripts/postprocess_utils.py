@@ -0,0 +1,445 @@
+'''
+Code common for all postprocess scripts.
+
+Every postprocess script only declares how its per-epoch results look like,
+either as a regex over a text log (LogSchema), or as a table (CsvSchema).
+Parsing of all hyperparameter dirs is done here: files are streamed line by
+line, and several files are parsed in parallel by a process pool.
+
+Parsed epochs can be kept in a cache (ResultsCache) next to the results.
+A rerun then only parses lines appended since the previous run.
+
+Epochs of all hypers are collected into a ResultTable, which keeps typed
+NumPy columns and stores text columns such as "hyper_n" and "split" as
+categorical codes.
+'''
+
+import os, os.path as op
+import re
+import glob
+import json
+import logging
+import sqlite3
+import concurrent.futures
+import numpy as np
+import pandas as pd
+
+
+def find_output_file(run_dir,
+                     hyper_n,
+                     pattern='batch_jobs/train_classification*.out'):
+    cout_pattern = op.join(run_dir, 'hyper%s' % hyper_n, pattern)
+    cout_paths = glob.glob(cout_pattern)
+    if len(cout_paths) == 0:
+        raise FileNotFoundError(
+            'Output file is not found with pattern:\n\t%s' % cout_pattern)
+    elif len(cout_paths) > 1:
+        raise Exception(
+            'Several files match pattern.\n\t- %s'
+            '\nEach run_id is supposed to be run only once. '
+            'If you ran this run_id several times, delete all but needed file.'
+            % '\n\t- '.join(cout_paths))
+    cout_path = cout_paths[0]
+    logging.info('Found cout file "%s"', cout_path)
+    return cout_path
+
+
+def read_experiments(experiments_path):
+    '''
+    Read an experiments file, e.g. "experiment.example.v2.txt".
+    Returns a list of lines, each split by ";". Skips empty lines and comments.
+    '''
+    if not op.exists(experiments_path):
+        raise FileNotFoundError('Experiment file not found at: %s' %
+                                experiments_path)
+
+    experiments = []
+    with open(experiments_path) as f:
+        for line in f:
+            line = line.strip()
+            logging.debug(line)
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            experiments.append(line.split(';'))
+    return experiments
+
+
+class LogSchema(object):
+    '''
+    A text log where every line matching "pattern_str" marks one epoch.
+    The first group of the pattern is written to column "column".
+    If "start_line" is provided, lines before the line that starts with it
+    are ignored.
+    '''
+
+    def __init__(self, pattern_str, column='value', start_line=None):
+        self.pattern = re.compile(pattern_str)
+        self.column = column
+        self.start_line = start_line
+
+    def columns(self):
+        return ['epoch', self.column]
+
+    def key(self):
+        ''' Identifies the schema in ResultsCache. '''
+        return json.dumps(['log', self.pattern.pattern, self.start_line])
+
+    def parse(self, path, offset=0, state=None):
+        '''
+        Stream the file from byte "offset".
+        Returns:
+          columns:  A dict {column: list of values}.
+          offset:   The byte after the last complete line.
+          state:    Pass it together with "offset" to continue parsing.
+        '''
+        logging.debug('Will look for pattern: "%s" in %s from byte %d',
+                      self.pattern.pattern, path, offset)
+        columns = {'epoch': [], self.column: []}
+
+        if state is None:
+            state = {'has_started': self.start_line is None, 'epoch': 0}
+        has_started = state['has_started']
+        epoch = state['epoch']
+
+        for line, offset in _iterate_complete_lines(path, offset):
+            if not has_started:
+                has_started = line.startswith(self.start_line)
+                continue
+
+            match = self.pattern.match(line)
+            if match is None:
+                continue
+            columns['epoch'].append(epoch)
+            columns[self.column].append(float(match.group(1)))
+            # Every match is one epoch.
+            epoch += 1
+
+        logging.debug('Found %d epochs in %s', len(columns['epoch']), path)
+        return columns, offset, {'has_started': has_started, 'epoch': epoch}
+
+
+class CsvSchema(object):
+    '''
+    A table with a header and one row per epoch, e.g. YOLOv5's "results.csv".
+    Only "columns" are kept. Column "epoch" is always kept.
+    Incomplete lines (a file that is still being written) are skipped.
+    '''
+
+    def __init__(self, columns, sep=r',\s*'):
+        self.names = ['epoch'] + [x for x in columns if x != 'epoch']
+        self.sep = re.compile(sep)
+
+    def columns(self):
+        return list(self.names)
+
+    def key(self):
+        ''' Identifies the schema in ResultsCache. '''
+        return json.dumps(['csv', self.names, self.sep.pattern])
+
+    def parse(self, path, offset=0, state=None):
+        '''
+        Stream the file from byte "offset".
+        Returns:
+          columns:  A dict {column: list of values}.
+          offset:   The byte after the last complete line.
+          state:    Pass it together with "offset" to continue parsing.
+        '''
+        columns = {name: [] for name in self.names}
+
+        for line, offset in _iterate_complete_lines(path, offset):
+            words = [x.strip() for x in self.sep.split(line.strip())]
+
+            # The first line is the header.
+            if state is None:
+                for name in self.names:
+                    if name not in words:
+                        raise ValueError(
+                            'Column "%s" not in the header of %s: %s' %
+                            (name, path, words))
+                state = {
+                    'num_columns': len(words),
+                    'indices': [words.index(name) for name in self.names]
+                }
+                continue
+
+            if len(words) < state['num_columns']:
+                continue
+            indices = state['indices']
+            columns['epoch'].append(int(float(words[indices[0]])))
+            for name, index in zip(self.names[1:], indices[1:]):
+                columns[name].append(float(words[index]))
+
+        logging.debug('Found %d epochs in %s', len(columns['epoch']), path)
+        return columns, offset, state
+
+
+def _iterate_complete_lines(path, offset):
+    '''
+    Yield (line, offset after the line) starting from byte "offset".
+    The last line without a newline may be still being written and is skipped.
+    '''
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            offset += len(line)
+            yield line.decode('utf-8', errors='replace'), offset
+
+
+class ResultsCache(object):
+    '''
+    Parsed epochs of every hyper, stored in a SQLite file.
+
+    For every hyper, the cache remembers the source file, its size and mtime,
+    the offset after the last parsed line, and the last bytes before it.
+    If the file has only grown since, only the new lines are parsed.
+    If the file was replaced or truncated, it is parsed from scratch.
+    '''
+
+    TAIL_SIZE = 64
+
+    def __init__(self, cache_path):
+        self.conn = sqlite3.connect(cache_path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS sources ('
+                          'hyper_n TEXT PRIMARY KEY, path TEXT, schema TEXT, '
+                          'size INTEGER, mtime REAL, offset INTEGER, '
+                          'tail BLOB, state TEXT)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS epochs ('
+                          'hyper_n TEXT, row INTEGER, data TEXT, '
+                          'PRIMARY KEY (hyper_n, row))')
+
+    def close(self):
+        self.conn.close()
+
+    def get_task(self, hyper_n, path, schema):
+        '''
+        Returns (offset, state) to continue parsing from,
+        or None if cached epochs are up to date.
+        '''
+        row = self.conn.execute(
+            'SELECT path,schema,size,mtime,offset,tail,state FROM sources '
+            'WHERE hyper_n=?', (hyper_n, )).fetchone()
+        if row is None:
+            return 0, None
+        cached_path, schema_key, size, mtime, offset, tail, state = row
+
+        stat = os.stat(path)
+        if cached_path != path or schema_key != schema.key():
+            logging.info('Source of hyper %s has changed.', hyper_n)
+            return 0, None
+        if stat.st_size == size and stat.st_mtime == mtime:
+            logging.debug('Hyper %s is up to date in the cache.', hyper_n)
+            return None
+        if stat.st_size < offset or _read_tail(path, offset) != tail:
+            logging.info('File %s was rewritten. Will parse it again.', path)
+            return 0, None
+        logging.debug('Will parse %s from byte %d.', path, offset)
+        return offset, json.loads(state)
+
+    def update(self, hyper_n, path, schema, offset, state, columns, is_new,
+               stat):
+        '''
+        Append new epochs of a hyper, or replace them if "is_new".
+        "stat" of the file must be taken before parsing, so that lines
+        appended while parsing make the file look changed next time.
+        '''
+        if is_new:
+            self.conn.execute('DELETE FROM epochs WHERE hyper_n=?',
+                              (hyper_n, ))
+        num_rows = self.conn.execute(
+            'SELECT COUNT(1) FROM epochs WHERE hyper_n=?',
+            (hyper_n, )).fetchone()[0]
+        names = schema.columns()
+        self.conn.executemany(
+            'INSERT INTO epochs(hyper_n,row,data) VALUES (?,?,?)',
+            ((hyper_n, num_rows + i, json.dumps(values))
+             for i, values in enumerate(zip(*[columns[x] for x in names]))))
+        self.conn.execute(
+            'INSERT OR REPLACE INTO sources'
+            '(hyper_n,path,schema,size,mtime,offset,tail,state) '
+            'VALUES (?,?,?,?,?,?,?,?)',
+            (hyper_n, path, schema.key(), stat.st_size, stat.st_mtime, offset,
+             _read_tail(path, offset), json.dumps(state)))
+
+    def load(self, hyper_n, schema):
+        ''' Returns cached epochs as a dict {column: list of values}. '''
+        names = schema.columns()
+        columns = {name: [] for name in names}
+        for data, in self.conn.execute(
+                'SELECT data FROM epochs WHERE hyper_n=? ORDER BY row',
+            (hyper_n, )):
+            for name, value in zip(names, json.loads(data)):
+                columns[name].append(value)
+        return columns
+
+    def commit(self):
+        self.conn.commit()
+
+
+def _read_tail(path, offset):
+    ''' The bytes right before "offset". Used to detect rewritten files. '''
+    with open(path, 'rb') as f:
+        start = max(offset - ResultsCache.TAIL_SIZE, 0)
+        f.seek(start)
+        return f.read(offset - start)
+
+
+def _missing_value(dtype):
+    return np.nan if dtype == np.float64 else -1
+
+
+class ResultTable(object):
+    '''
+    A typed columnar table of epochs of many hypers.
+
+    Value columns come from a schema. Column "epoch" is int32, the rest are
+    float64. Constant columns are the same for all epochs of a run, e.g.
+    "hyper_n", "split", "lr". Text constants are stored as categorical codes,
+    numbers as int64 or float64 arrays. A run without a constant that other
+    runs have gets NaN, or -1 for codes and integers.
+    All columns are preallocated and grow by doubling, so appending a run
+    costs time proportional to the number of its epochs.
+    '''
+
+    def __init__(self, value_columns, capacity=1024):
+        self.size = 0
+        self.capacity = capacity
+        self.arrays = {}
+        self.categories = {}  # Column name -> {category: code}.
+        self.constant_columns = []
+        for name in value_columns:
+            dtype = np.int32 if name == 'epoch' else np.float64
+            self.arrays[name] = np.empty(capacity, dtype=dtype)
+
+    def __len__(self):
+        return self.size
+
+    def _reserve(self, size):
+        if size <= self.capacity:
+            return
+        while self.capacity < size:
+            self.capacity *= 2
+        for name, array in self.arrays.items():
+            new_array = np.empty(self.capacity, dtype=array.dtype)
+            new_array[:self.size] = array[:self.size]
+            self.arrays[name] = new_array
+
+    def _add_constant_column(self, name, value):
+        if isinstance(value, str):
+            dtype = np.int32
+            self.categories[name] = {}
+        elif isinstance(value, (int, np.integer)):
+            dtype = np.int64
+        else:
+            dtype = np.float64
+        # Runs appended before this column appeared get -1 or NaN.
+        array = np.empty(self.capacity, dtype=dtype)
+        array[:self.size] = _missing_value(dtype)
+        self.arrays[name] = array
+        self.constant_columns.append(name)
+
+    def append_run(self, columns, constants):
+        '''
+        Args:
+          columns:    A dict {value column: list of values} of one run.
+          constants:  A dict {constant column: value} of the same run.
+        '''
+        num_epochs = len(columns['epoch'])
+        begin, end = self.size, self.size + num_epochs
+        self._reserve(end)
+
+        for name, values in columns.items():
+            self.arrays[name][begin:end] = values
+        for name, value in constants.items():
+            if name not in self.arrays:
+                self._add_constant_column(name, value)
+            if name in self.categories:
+                value = self.categories[name].setdefault(
+                    value, len(self.categories[name]))
+            self.arrays[name][begin:end] = value
+        for name in self.constant_columns:
+            if name not in constants:
+                self.arrays[name][begin:end] = _missing_value(
+                    self.arrays[name].dtype)
+        self.size = end
+
+    def to_dataframe(self):
+        ''' Returns a pd.DataFrame. Text columns become pd.Categorical. '''
+        data = {}
+        for name, array in self.arrays.items():
+            array = array[:self.size]
+            if name in self.categories:
+                categories = sorted(self.categories[name],
+                                    key=self.categories[name].get)
+                data[name] = pd.Categorical.from_codes(array,
+                                                       categories=categories)
+            else:
+                data[name] = array
+        return pd.DataFrame(data)
+
+
+def _parse(task):
+    ''' Returns (columns, offset, state, stat of the file before parsing). '''
+    schema, path, offset, state = task
+    stat = os.stat(path)
+    return schema.parse(path, offset, state) + (stat, )
+
+
+def parse_runs(runs, schema, num_workers=None, cache_path=None):
+    '''
+    Parse results of many hypers in parallel and return one pd.DataFrame.
+
+    Args:
+      runs:         A list of dicts. Key "path" is the file to parse with
+                    "schema". Key "hyper_n" identifies the run in the cache.
+                    All other keys are constant columns of this run,
+                    e.g. "split", "lr".
+      schema:       LogSchema or CsvSchema.
+      num_workers:  The number of processes. Default: the number of CPUs.
+      cache_path:   If provided, parsed epochs are cached in this file, and
+                    only the lines appended since the last call are parsed.
+    Returns:
+      A pd.DataFrame with columns of the schema and all constant columns.
+    '''
+    cache = ResultsCache(cache_path) if cache_path is not None else None
+
+    # Find what needs to be parsed.
+    tasks = []
+    runs_to_parse = []
+    for run in runs:
+        task = (0, None)
+        if cache is not None:
+            task = cache.get_task(run['hyper_n'], run['path'], schema)
+        if task is not None:
+            logging.info('Will parse "%s"', run['path'])
+            tasks.append((schema, run['path']) + task)
+            runs_to_parse.append(run)
+
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = min(num_workers, len(tasks))
+
+    if num_workers <= 1:
+        parsed = [_parse(task) for task in tasks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(num_workers) as executor:
+            parsed = list(executor.map(_parse, tasks))
+
+    if cache is None:
+        parsed_columns = [columns for columns, _, _, _ in parsed]
+    else:
+        for run, task, (columns, offset, state,
+                        stat) in zip(runs_to_parse, tasks, parsed):
+            is_new = task[2] == 0
+            cache.update(run['hyper_n'], run['path'], schema, offset, state,
+                         columns, is_new, stat)
+        cache.commit()
+        parsed_columns = [cache.load(run['hyper_n'], schema) for run in runs]
+        cache.close()
+
+    table = ResultTable(schema.columns())
+    for run, columns in zip(runs, parsed_columns):
+        constants = {key: value for key, value in run.items() if key != 'path'}
+        table.append_run(columns, constants)
+    return table.to_dataframe()
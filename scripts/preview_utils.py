@@ -0,0 +1,296 @@
+'''
+Previews of Shuffler databases: videos and contact sheets.
+
+Shuffler's "randomNImages | writeMedia" needs its own interpreter, copies
+the db without the images that were not sampled, and decodes images one by
+one. Here:
+- Images are sampled by rowid with a few indexed lookups, so the time
+  depends on the number of sampled images, not on the size of the db.
+  "number" caps the number of frames, and "stride" takes every N-th image.
+- Frames are decoded and drawn by a process pool, and come to the single
+  encoder in order through a bounded queue.
+- A preview is a video (.avi), or a contact sheet of thumbnails (.png or
+  .jpg), which is faster to look through.
+'''
+
+import os, os.path as op
+import zlib
+import random
+import logging
+import sqlite3
+import collections
+import concurrent.futures
+
+import numpy as np
+import cv2
+
+
+def _lookup_rowids(conn, rowids):
+    imagefiles = []
+    rowids = list(rowids)
+    for begin in range(0, len(rowids), 500):
+        chunk = rowids[begin:begin + 500]
+        imagefiles += [
+            imagefile for imagefile, in conn.execute(
+                'SELECT imagefile FROM images WHERE rowid IN (%s)' %
+                ','.join('?' * len(chunk)), chunk)
+        ]
+    return imagefiles
+
+
+def sample_imagefiles(conn, number=None, seed=None, stride=None):
+    '''
+    Returns a sorted list of imagefiles: every "stride"-th image if "stride"
+    is given, and out of them "number" random ones, or all if None.
+    '''
+    max_rowid = conn.execute('SELECT MAX(rowid) FROM images').fetchone()[0]
+    if max_rowid is None:
+        return []
+    candidates = range(1, max_rowid + 1, stride or 1)
+    if number is None or number >= len(candidates):
+        if len(candidates) == max_rowid:
+            return sorted(
+                imagefile
+                for imagefile, in conn.execute('SELECT imagefile FROM images'))
+        return sorted(_lookup_rowids(conn, candidates))
+
+    # Rowids of deleted images are missing, so sample until there is enough.
+    rng = random.Random(seed)
+    tried = set()
+    imagefiles = []
+    while len(imagefiles) < number and len(tried) < len(candidates):
+        if len(tried) > len(candidates) // 2:
+            rowids = [x for x in candidates if x not in tried]
+            rng.shuffle(rowids)
+        else:
+            rowids = [
+                x for x in rng.sample(
+                    candidates,
+                    min(2 * (number - len(imagefiles)), len(candidates)))
+                if x not in tried
+            ]
+        rowids = rowids[:number - len(imagefiles)]
+        tried.update(rowids)
+        imagefiles += _lookup_rowids(conn, rowids)
+    return sorted(imagefiles)
+
+
+def get_color(name):
+    ''' A color that is the same for the same name in every video. '''
+    hash_ = zlib.crc32(str(name).encode())
+    return (64 + hash_ % 192, 64 + (hash_ >> 8) % 192,
+            64 + (hash_ >> 16) % 192)
+
+
+def draw_objects(image, objects, polygons):
+    '''
+    Draw objects on an image in place.
+    Args:
+      image:      A numpy array HxWx3.
+      objects:    Tuples (objectid, x1, y1, width, height, name, score).
+      polygons:   A dict {objectid: a list of (x, y)}.
+    '''
+    for objectid, x1, y1, width, height, name, score in objects:
+        color = get_color(name)
+        if objectid in polygons:
+            points = np.array(polygons[objectid], dtype=np.int32)
+            cv2.polylines(image, [points], True, color, 2)
+            x1, y1 = points.min(axis=0)
+        elif x1 is not None:
+            cv2.rectangle(image, (int(x1), int(y1)),
+                          (int(x1 + width), int(y1 + height)), color, 2)
+        else:
+            continue
+        label = name if score is None else '%s %.2f' % (name, score)
+        cv2.putText(image, str(label), (int(x1), max(int(y1) - 5, 10)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+    return image
+
+
+def read_frame(conn, imagefile, rootdir, with_objects=True, with_imageid=True):
+    ''' Returns the image with its objects drawn, or None if it is missing. '''
+    image = cv2.imread(op.join(rootdir, imagefile))
+    if image is None:
+        logging.warning('Failed to read image: %s', imagefile)
+        return None
+    if with_objects:
+        objects = conn.execute(
+            'SELECT objectid,x1,y1,width,height,name,score FROM objects '
+            'WHERE imagefile=?', (imagefile, )).fetchall()
+        polygons = {}
+        # Cropped dbs may have no polygons.
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' "
+                        "AND name='polygons'").fetchone() is not None:
+            for objectid, x, y in conn.execute(
+                    'SELECT p.objectid,p.x,p.y FROM polygons p '
+                    'JOIN objects o ON p.objectid = o.objectid '
+                    'WHERE o.imagefile=? ORDER BY p.id', (imagefile, )):
+                polygons.setdefault(objectid, []).append((x, y))
+        draw_objects(image, objects, polygons)
+    if with_imageid:
+        cv2.putText(image, imagefile, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8,
+                    (255, 255, 255), 2)
+    return image
+
+
+def write_frames(frames, video_path, fps=2):
+    '''
+    Write frames (numpy arrays HxWx3) as they come. All frames are resized
+    to the size of the first one. Returns the number of written frames.
+    Raises IOError if the video can not be opened for writing.
+    '''
+    writer = None
+    num_frames = 0
+    for frame in frames:
+        if writer is None:
+            height, width = frame.shape[:2]
+            writer = cv2.VideoWriter(video_path,
+                                     cv2.VideoWriter_fourcc(*'MJPG'), fps,
+                                     (width, height))
+            if not writer.isOpened():
+                raise IOError('Failed to open "%s" for writing' % video_path)
+        elif frame.shape[:2] != (height, width):
+            frame = cv2.resize(frame, (width, height))
+        writer.write(frame)
+        num_frames += 1
+    if writer is not None:
+        writer.release()
+    logging.info('Wrote %d frames to %s', num_frames, video_path)
+    return num_frames
+
+
+# A connection to the db in every worker of the pool.
+_worker_conn = None
+
+
+def _init_worker(db_file):
+    global _worker_conn
+    _worker_conn = sqlite3.connect('file:%s?mode=ro' % db_file, uri=True)
+
+
+def _render_frame(task):
+    imagefile, rootdir, with_objects, with_imageid, max_width = task
+    frame = read_frame(_worker_conn, imagefile, rootdir, with_objects,
+                       with_imageid)
+    if frame is not None and max_width and frame.shape[1] > max_width:
+        height = int(frame.shape[0] * max_width / frame.shape[1])
+        frame = cv2.resize(frame, (max_width, height),
+                           interpolation=cv2.INTER_AREA)
+    return frame
+
+
+def _map_bounded(executor, fn, tasks, max_pending):
+    ''' Like executor.map, but with at most "max_pending" results waiting. '''
+    pending = collections.deque()
+    for task in tasks:
+        pending.append(executor.submit(fn, task))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while len(pending) > 0:
+        yield pending.popleft().result()
+
+
+def render_frames(db_file,
+                  imagefiles,
+                  rootdir,
+                  with_objects=True,
+                  with_imageid=True,
+                  max_width=None,
+                  num_workers=None,
+                  queue_size=16):
+    '''
+    Yields frames of "imagefiles" in order. Missing images are skipped.
+    Frames wider than "max_width" are downscaled by workers.
+    '''
+    tasks = [(imagefile, rootdir, with_objects, with_imageid, max_width)
+             for imagefile in imagefiles]
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    if num_workers <= 1:
+        _init_worker(db_file)
+        try:
+            for frame in map(_render_frame, tasks):
+                if frame is not None:
+                    yield frame
+        finally:
+            _worker_conn.close()
+        return
+    with concurrent.futures.ProcessPoolExecutor(
+            num_workers, initializer=_init_worker,
+            initargs=(db_file, )) as executor:
+        for frame in _map_bounded(executor, _render_frame, tasks, queue_size):
+            if frame is not None:
+                yield frame
+
+
+def make_contact_sheet(frames, columns=None, cell_width=480):
+    '''
+    Tile frames into one image. Frames are resized to "cell_width", and to
+    the aspect ratio of the first frame.
+    '''
+    if len(frames) == 0:
+        return None
+    if columns is None:
+        columns = int(np.ceil(np.sqrt(len(frames))))
+    rows = (len(frames) + columns - 1) // columns
+    height, width = frames[0].shape[:2]
+    cell_height = int(cell_width * height / width)
+    sheet = np.zeros((rows * cell_height, columns * cell_width, 3), np.uint8)
+    for i, frame in enumerate(frames):
+        y = (i // columns) * cell_height
+        x = (i % columns) * cell_width
+        sheet[y:y + cell_height,
+              x:x + cell_width] = cv2.resize(frame, (cell_width, cell_height),
+                                             interpolation=cv2.INTER_AREA)
+    return sheet
+
+
+def is_contact_sheet(out_path):
+    return op.splitext(out_path)[1].lower() in ['.png', '.jpg', '.jpeg']
+
+
+def write_preview(db_file,
+                  rootdir,
+                  out_path,
+                  number=None,
+                  stride=None,
+                  seed=None,
+                  with_objects=True,
+                  with_imageid=True,
+                  max_width=None,
+                  num_workers=None,
+                  fps=2,
+                  columns=None,
+                  cell_width=480):
+    '''
+    Write a video, or a contact sheet if "out_path" is an image.
+    Args:
+      number:       The max number of random images.
+      stride:       Take every "stride"-th image.
+      max_width:    Downscale wider frames of the video.
+      columns, cell_width:  The layout of a contact sheet.
+    Returns the number of frames.
+    '''
+    conn = sqlite3.connect('file:%s?mode=ro' % db_file, uri=True)
+    try:
+        imagefiles = sample_imagefiles(conn, number, seed, stride)
+    finally:
+        conn.close()
+    logging.info('Sampled %d images from %s', len(imagefiles), db_file)
+
+    if not is_contact_sheet(out_path):
+        return write_frames(
+            render_frames(db_file, imagefiles, rootdir, with_objects,
+                          with_imageid, max_width, num_workers), out_path, fps)
+
+    frames = list(
+        render_frames(db_file, imagefiles, rootdir, with_objects, with_imageid,
+                      cell_width, num_workers))
+    sheet = make_contact_sheet(frames, columns, cell_width)
+    if sheet is None:
+        logging.warning('No frames, not writing %s', out_path)
+        return 0
+    if not cv2.imwrite(out_path, sheet):
+        raise IOError('Failed to write "%s"' % out_path)
+    logging.info('Wrote %d frames to %s', len(frames), out_path)
+    return len(frames)
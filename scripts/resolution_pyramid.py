@@ -0,0 +1,457 @@
+'''
+Derive smaller resolutions of the archive, and move databases between them.
+
+The archive keeps original JPEGs (about 6000x4000) in "original_dataset",
+and their 1800x1200 copies in "1800x1200", with the same "folder/file.JPG"
+under each of them. Previously the copies were made once by
+resize_dataset.sbatch with mogrify, and databases were moved between
+resolutions with Shuffler's "moveMedia --level 2 | resizeAnnotations",
+which decodes every image to get its size.
+
+Here:
+- "derive" reads every original once and writes all derivatives from it.
+  JPEGs are decoded already downscaled by 2, 4 or 8 in the DCT domain,
+  which is several times faster than a full decode. Originals that did not
+  change since the last run (by size and mtime, or by checksum with
+  --checksum) are skipped, so a new archive batch is onboarded
+  incrementally.
+- A derivative that exists and is not older than its original (e.g. made
+  by mogrify before the manifest existed) is taken as up to date. It is
+  recorded in the manifest with the size from its JPEG header, and is not
+  rewritten.
+- The manifest db keeps the size of every file of every resolution.
+- "rescale" moves a db to another resolution using only the manifest, and
+  reads JPEG headers of files that are not in it. Images are not decoded.
+
+Examples:
+  python3 scripts/resolution_pyramid.py derive \
+    --rootdir ${ROOT_DIR} \
+    --manifest_db_file ${DATABASES_DIR}/resolutions.db \
+    --resolutions 1800x1200
+
+  python3 scripts/resolution_pyramid.py rescale \
+    --rootdir ${ROOT_DIR} \
+    --manifest_db_file ${DATABASES_DIR}/resolutions.db \
+    --in_db_file campaign8-1800x1200.v3.db \
+    --out_db_file campaign8-6Kx4K.v3.db \
+    --image_path original_dataset
+'''
+
+import os, os.path as op
+import time
+import shutil
+import sqlite3
+import hashlib
+import logging
+import argparse
+import concurrent.futures
+import cv2
+
+import db_utils
+import image_metadata_index
+
+ORIGINAL_DIR = 'original_dataset'
+JPEG_EXTENSIONS = ['.jpg', '.jpeg']
+JPEG_QUALITY = 95
+# Flags of cv2.imread that decode a JPEG downscaled in the DCT domain.
+# Orientation is ignored, as mogrify did for the existing derivatives.
+REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Derive resolutions of the archive, and move dbs '
+        'between them.')
+    parser.add_argument('--rootdir', required=True)
+    parser.add_argument('--manifest_db_file', required=True)
+    parser.add_argument(
+        "--logging_level",
+        type=int,
+        choices=[10, 20, 30, 40],
+        default=20,
+        help="Set logging level. 10: debug, 20: info, 30: warning, 40: error.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_derive = subparsers.add_parser(
+        'derive', help='Write derivatives of new and changed originals.')
+    parser_derive.add_argument('--original_dir',
+                               default=ORIGINAL_DIR,
+                               help='Relative to rootdir.')
+    parser_derive.add_argument(
+        '--resolutions',
+        nargs='+',
+        default=['1800x1200'],
+        help='Derivatives "WIDTHxHEIGHT" go to rootdir/WIDTHxHEIGHT. '
+        'As with mogrify, an image is resized to fit in the box.')
+    parser_derive.add_argument(
+        '--subdirs',
+        nargs='+',
+        help='Only derive these dirs of original_dir, e.g. a new batch.')
+    parser_derive.add_argument(
+        '--checksum',
+        action='store_true',
+        help='Hash an original whose mtime changed, and skip it if the '
+        'hash did not change.')
+    parser_derive.add_argument(
+        '--num_workers',
+        type=int,
+        help='The number of processes. Default: all cpus.')
+
+    parser_rescale = subparsers.add_parser(
+        'rescale',
+        help='Move a db to another resolution, '
+        'like "moveMedia --level 2 | resizeAnnotations".')
+    parser_rescale.add_argument('--in_db_file', required=True)
+    parser_rescale.add_argument('--out_db_file', required=True)
+    parser_rescale.add_argument(
+        '--image_path',
+        required=True,
+        help='The dir of the resolution, e.g. "1800x1200".')
+    parser_rescale.add_argument(
+        '--level',
+        type=int,
+        default=2,
+        help='The number of last components of imagefile to keep.')
+    return parser
+
+
+def parse_resolution(resolution):
+    width, height = resolution.lower().split('x')
+    return int(width), int(height)
+
+
+def get_checksum(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def fit_in_box(width, height, box):
+    ''' The size of an image resized to fit in "box", keeping aspect. '''
+    scale = min(box[0] / width, box[1] / height)
+    return max(int(round(width * scale)), 1), max(int(round(height * scale)),
+                                                  1)
+
+
+def get_reduction(width, height, sizes):
+    ''' The largest DCT reduction that is not smaller than all "sizes". '''
+    for reduction in [8, 4, 2]:
+        if all(width // reduction >= w and height // reduction >= h
+               for w, h in sizes):
+            return reduction
+    return 1
+
+
+def open_manifest(manifest_db_file):
+    conn = sqlite3.connect(manifest_db_file)
+    conn.execute('CREATE TABLE IF NOT EXISTS files ('
+                 'relpath TEXT, resolution TEXT, width INTEGER, '
+                 'height INTEGER, size INTEGER, mtime REAL, checksum TEXT, '
+                 'PRIMARY KEY (relpath, resolution))')
+    return conn
+
+
+def _write_atomically(path, image):
+    os.makedirs(op.dirname(path), exist_ok=True)
+    tmp_path = '%s.%d.tmp%s' % (path, os.getpid(), op.splitext(path)[1])
+    if not cv2.imwrite(tmp_path, image,
+                       [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]):
+        raise IOError('Failed to write "%s"' % tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _derive_image(task):
+    '''
+    Decode one original once and write its derivatives. Derivatives of
+    resolutions in "existing" are up to date, and only their headers are
+    read. If all are up to date, the original is not decoded.
+    Returns (relpath, rows of the manifest), or (relpath, None) on failure.
+    '''
+    relpath, rootdir, original_dir, resolutions, stat, checksum, existing = (
+        task)
+    original_path = op.join(rootdir, original_dir, relpath)
+    original_size = image_metadata_index.get_jpeg_size(original_path)
+    if original_size is None:
+        logging.error('Failed to read the header of "%s"', original_path)
+        return relpath, None
+    width, height = original_size
+    original_row = (relpath, original_dir, width, height, stat[0], stat[1],
+                    checksum)
+    rows = [original_row]
+    missing = []
+    for resolution in resolutions:
+        path = op.join(rootdir, resolution, relpath)
+        size = None
+        if resolution in existing:
+            size = image_metadata_index.get_jpeg_size(path)
+            if size is None:
+                logging.warning('Failed to read the header of "%s".', path)
+        if size is None:
+            missing.append(resolution)
+            continue
+        rows.append((relpath, resolution, size[0], size[1], op.getsize(path),
+                     op.getmtime(path), None))
+    if len(missing) == 0:
+        return relpath, rows
+    resolutions = missing
+    sizes = [
+        fit_in_box(width, height, parse_resolution(resolution))
+        for resolution in resolutions
+    ]
+    reduction = get_reduction(width, height, sizes)
+    image = cv2.imread(
+        original_path,
+        REDUCED_FLAGS[reduction] | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        logging.error('Failed to read "%s"', original_path)
+        return relpath, None
+
+    for resolution, size in zip(resolutions, sizes):
+        path = op.join(rootdir, resolution, relpath)
+        _write_atomically(
+            path, cv2.resize(image, size, interpolation=cv2.INTER_AREA))
+        rows.append((relpath, resolution, size[0], size[1], op.getsize(path),
+                     op.getmtime(path), None))
+    return relpath, rows
+
+
+def list_originals(original_root, subdirs=None):
+    ''' Returns relpaths of JPEGs under "original_root", sorted. '''
+    relpaths = []
+    tops = subdirs if subdirs is not None else sorted(
+        os.listdir(original_root))
+    for top in tops:
+        top_dir = op.join(original_root, top)
+        if not op.isdir(top_dir):
+            continue
+        for dirpath, _, filenames in os.walk(top_dir):
+            for filename in filenames:
+                if op.splitext(filename)[1].lower() in JPEG_EXTENSIONS:
+                    relpaths.append(
+                        op.relpath(op.join(dirpath, filename), original_root))
+    return sorted(relpaths)
+
+
+def get_existing(rootdir, resolutions, relpath, mtime):
+    ''' Resolutions whose derivative exists and is not older than "mtime". '''
+    existing = []
+    for resolution in resolutions:
+        path = op.join(rootdir, resolution, relpath)
+        if op.exists(path) and op.getmtime(path) >= mtime:
+            existing.append(resolution)
+    return existing
+
+
+def get_tasks(conn, rootdir, original_dir, resolutions, relpaths, checksum):
+    '''
+    Returns tasks for originals whose derivatives are not in the manifest or
+    not up to date. The last item of a task is the list of resolutions whose
+    derivatives are up to date and only need to be recorded.
+    '''
+    known = {}
+    for relpath, resolution, size, mtime, digest in conn.execute(
+            'SELECT relpath,resolution,size,mtime,checksum FROM files'):
+        known[(relpath, resolution)] = (size, mtime, digest)
+
+    tasks = []
+    for relpath in relpaths:
+        original_path = op.join(rootdir, original_dir, relpath)
+        stat = os.stat(original_path)
+        stat = (stat.st_size, stat.st_mtime)
+        derived = all((relpath, resolution) in known
+                      and op.exists(op.join(rootdir, resolution, relpath))
+                      for resolution in resolutions)
+        record = known.get((relpath, original_dir))
+        digest = None
+        if derived and record is not None:
+            if record[:2] == stat:
+                continue
+            if checksum:
+                digest = get_checksum(original_path)
+                if digest == record[2]:
+                    # Touched, but not changed.
+                    conn.execute(
+                        'UPDATE files SET mtime=? '
+                        'WHERE relpath=? AND resolution=?',
+                        (stat[1], relpath, original_dir))
+                    continue
+        elif checksum:
+            digest = get_checksum(original_path)
+        existing = get_existing(rootdir, resolutions, relpath, stat[1])
+        tasks.append((relpath, rootdir, original_dir, resolutions, stat,
+                      digest, existing))
+    return tasks
+
+
+def derive(rootdir,
+           manifest_db_file,
+           original_dir=ORIGINAL_DIR,
+           resolutions=('1800x1200', ),
+           subdirs=None,
+           checksum=False,
+           num_workers=None):
+    ''' Write derivatives of new and changed originals. '''
+    start = time.time()
+    resolutions = list(resolutions)
+    relpaths = list_originals(op.join(rootdir, original_dir), subdirs)
+    conn = open_manifest(manifest_db_file)
+    try:
+        tasks = get_tasks(conn, rootdir, original_dir, resolutions, relpaths,
+                          checksum)
+        conn.commit()
+        logging.info(
+            '%d out of %d originals need derivatives, '
+            '%d of them only need to be recorded.', len(tasks),
+            len(relpaths),
+            sum(len(task[-1]) == len(resolutions) for task in tasks))
+
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        executor = None
+        mapper = map
+        if num_workers > 1 and len(tasks) > 1:
+            executor = concurrent.futures.ProcessPoolExecutor(num_workers)
+            mapper = lambda fn, tasks: executor.map(fn, tasks, chunksize=8)
+        num_failed = 0
+        try:
+            for i, (relpath, rows) in enumerate(mapper(_derive_image, tasks)):
+                if rows is None:
+                    num_failed += 1
+                    continue
+                conn.executemany(
+                    'INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?)',
+                    rows)
+                # Commit now and then, so that an interrupted run resumes.
+                if (i + 1) % 1000 == 0:
+                    conn.commit()
+                    logging.info('Derived %d/%d originals.', i + 1, len(tasks))
+        finally:
+            conn.commit()
+            if executor is not None:
+                executor.shutdown()
+    finally:
+        conn.close()
+    logging.info('Derived %d originals in %.1f sec, %d failed.',
+                 len(tasks) - num_failed,
+                 time.time() - start, num_failed)
+
+
+def get_sizes(conn, rootdir, resolution, relpaths):
+    '''
+    Returns {relpath: (width, height)} of files of "resolution", from the
+    manifest or from JPEG headers.
+    '''
+    sizes = {}
+    relpaths = list(relpaths)
+    for begin in range(0, len(relpaths), 500):
+        chunk = relpaths[begin:begin + 500]
+        for relpath, width, height in conn.execute(
+                'SELECT relpath,width,height FROM files WHERE resolution=? '
+                'AND relpath IN (%s)' % ','.join('?' * len(chunk)),
+            [resolution] + chunk):
+            sizes[relpath] = (width, height)
+    for relpath in relpaths:
+        if relpath not in sizes:
+            path = op.join(rootdir, resolution, relpath)
+            size = None
+            if op.exists(path):
+                size = image_metadata_index.get_jpeg_size(path)
+            if size is None:
+                raise IOError('Unknown size of "%s"' % path)
+            sizes[relpath] = size
+    return sizes
+
+
+def rescale(in_db_file,
+            out_db_file,
+            rootdir,
+            manifest_db_file,
+            image_path,
+            level=2):
+    '''
+    Move images of a db to "image_path" keeping the last "level"
+    components of imagefile, and scale objects and polygons to the sizes of
+    the new images. Maskfiles are kept.
+    '''
+    conn = db_utils.connect(in_db_file, read_only=True)
+    try:
+        images = conn.execute(
+            'SELECT imagefile,width,height FROM images').fetchall()
+    finally:
+        conn.close()
+
+    def get_relpath(imagefile):
+        return op.join(*imagefile.split('/')[-level:])
+
+    manifest = open_manifest(manifest_db_file)
+    try:
+        sizes = get_sizes(
+            manifest, rootdir, image_path,
+            [get_relpath(imagefile) for imagefile, _, _ in images])
+    finally:
+        manifest.close()
+
+    moves = []
+    for imagefile, width, height in images:
+        new_width, new_height = sizes[get_relpath(imagefile)]
+        if not width or not height:
+            raise ValueError('Image "%s" has no size in %s' %
+                             (imagefile, in_db_file))
+        moves.append(
+            (imagefile, op.join(image_path, get_relpath(imagefile)),
+             new_width / width, new_height / height, new_width, new_height))
+
+    tmp_db_file = out_db_file + '.tmp'
+    shutil.copyfile(in_db_file, tmp_db_file)
+    conn = sqlite3.connect(tmp_db_file)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('CREATE TEMP TABLE moves (imagefile TEXT PRIMARY KEY, '
+                       'new_imagefile TEXT, kx REAL, ky REAL, '
+                       'width INTEGER, height INTEGER)')
+        cursor.executemany('INSERT INTO moves VALUES (?,?,?,?,?,?)', moves)
+        tables = db_utils.get_tables(cursor)
+        if 'polygons' in tables:
+            cursor.execute(
+                'UPDATE polygons SET x=x*m.kx, y=y*m.ky '
+                'FROM objects o JOIN moves m ON o.imagefile = m.imagefile '
+                'WHERE polygons.objectid = o.objectid')
+        cursor.execute('UPDATE objects SET x1=x1*m.kx, y1=y1*m.ky, '
+                       'width=objects.width*m.kx, height=objects.height*m.ky, '
+                       'imagefile=m.new_imagefile '
+                       'FROM moves m WHERE objects.imagefile = m.imagefile')
+        cursor.execute(
+            'UPDATE images SET imagefile=m.new_imagefile, width=m.width, '
+            'height=m.height FROM moves m WHERE images.imagefile = m.imagefile'
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_db_file, out_db_file)
+    logging.info('Moved %d images to %s in %s', len(moves), image_path,
+                 out_db_file)
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        level=args.logging_level)
+
+    if args.command == 'derive':
+        derive(args.rootdir, args.manifest_db_file, args.original_dir,
+               args.resolutions, args.subdirs, args.checksum, args.num_workers)
+    elif args.command == 'rescale':
+        rescale(args.in_db_file, args.out_db_file, args.rootdir,
+                args.manifest_db_file, args.image_path, args.level)
+
+
+if __name__ == '__main__':
+    main()
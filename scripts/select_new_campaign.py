@@ -0,0 +1,281 @@
+'''
+Select images of a new campaign from the archive.
+
+Shuffler's "filterImagesViaAnotherDb --delete | randomNImages |
+filterBadImages" copied all of all-1800x1200.db, compared its paths with
+the paths of all labeled images, and then opened the sampled images. Here:
+- Keys of labeled images (the last --key_level components of imagefile)
+  are kept in the table "labeled" of the image metadata index (see
+  image_metadata_index.py). "record" adds images of a db to it after an
+  import.
+- "select" excludes labeled images with an indexed anti-join, and images
+  that the metadata index knows to be bad. Then it samples, optionally
+  stratified by folder or decade, and writes the selected images directly
+  into the new campaign db.
+
+Stratified sampling takes the same number of images from every stratum,
+and gives what a small stratum can not take to the others.
+
+Examples:
+  python3 scripts/select_new_campaign.py \
+    --index_db_file ${DATABASES_DIR}/all-1800x1200.metadata.db \
+    record --db_file campaign8-1800x1200.v3.db --campaign_id 8
+
+  python3 scripts/select_new_campaign.py \
+    --index_db_file ${DATABASES_DIR}/all-1800x1200.metadata.db \
+    select --all_db_file ${DATABASES_DIR}/all-1800x1200.db \
+    --out_db_file campaign9/campaign9-1800x1200.v1.db \
+    --number 500 --stratify_by folder
+'''
+
+import os, os.path as op
+import random
+import sqlite3
+import logging
+import argparse
+
+import db_utils
+import image_metadata_index
+
+TABLES = ['images', 'objects', 'properties', 'polygons', 'matches']
+
+LABELED_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS labeled (
+  key TEXT PRIMARY KEY,
+  campaign INTEGER
+) WITHOUT ROWID;
+'''
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Select images of a new campaign.')
+    parser.add_argument('--index_db_file', required=True)
+    parser.add_argument(
+        '--key_level',
+        type=int,
+        default=1,
+        help='The number of last components of imagefile that identify an '
+        'image, as "--dirtree_level" of filterImagesViaAnotherDb.')
+    parser.add_argument(
+        "--logging_level",
+        type=int,
+        choices=[10, 20, 30, 40],
+        default=20,
+        help="Set logging level. 10: debug, 20: info, 30: warning, 40: error.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_record = subparsers.add_parser(
+        'record', help='Add images of a db to labeled images.')
+    parser_record.add_argument('--db_file', required=True)
+    parser_record.add_argument('--campaign_id', type=int)
+    parser_record.add_argument(
+        '--replace',
+        action='store_true',
+        help='Forget all labeled images first, e.g. to rebuild the table '
+        'from an up-to-now db.')
+
+    parser_select = subparsers.add_parser(
+        'select', help='Sample unlabeled images into a new db.')
+    parser_select.add_argument('--all_db_file', required=True)
+    parser_select.add_argument('--out_db_file', required=True)
+    parser_select.add_argument('--number', type=int, required=True)
+    parser_select.add_argument(
+        '--stratify_by',
+        choices=['none', 'folder', 'decade'],
+        default='none',
+        help='"folder" is the dir of an image, and "decade" is taken from '
+        'images.timestamp of the all db.')
+    parser_select.add_argument('--seed', type=int)
+    return parser
+
+
+def get_key(imagefile, key_level):
+    return '/'.join(imagefile.split('/')[-key_level:])
+
+
+def open_labeled(index_db_file):
+    conn = image_metadata_index.open_index(index_db_file)
+    conn.executescript(LABELED_SCHEMA)
+    return conn
+
+
+def record(index_db_file,
+           db_file,
+           campaign_id=None,
+           key_level=1,
+           replace=False):
+    ''' Add images of "db_file" to labeled images. '''
+    src = db_utils.connect(db_file, read_only=True)
+    try:
+        keys = [(get_key(imagefile, key_level), campaign_id)
+                for imagefile, in src.execute('SELECT imagefile FROM images')]
+    finally:
+        src.close()
+    conn = open_labeled(index_db_file)
+    try:
+        if replace:
+            conn.execute('DELETE FROM labeled')
+        conn.executemany('INSERT OR IGNORE INTO labeled VALUES (?,?)', keys)
+        conn.commit()
+        num_labeled = conn.execute(
+            'SELECT COUNT(1) FROM labeled').fetchone()[0]
+    finally:
+        conn.close()
+    logging.info('Recorded %d images of %s, %d images are labeled.', len(keys),
+                 db_file, num_labeled)
+
+
+def get_stratum(imagefile, timestamp, stratify_by):
+    if stratify_by == 'folder':
+        return op.dirname(imagefile)
+    if stratify_by == 'decade':
+        if timestamp is None or len(str(timestamp)) < 4:
+            return None
+        return '%s0s' % str(timestamp)[:3]
+    return None
+
+
+def get_candidates(conn, key_level, stratify_by):
+    '''
+    Returns {stratum: a list of imagefiles} of images of the all db that are
+    not labeled and not known to be bad.
+    '''
+    conn.execute('CREATE TEMP TABLE candidates (imagefile TEXT, '
+                 'key TEXT, timestamp TEXT)')
+    images = conn.execute(
+        'SELECT imagefile,timestamp FROM src.images').fetchall()
+    conn.executemany('INSERT INTO candidates VALUES (?,?,?)',
+                     [(imagefile, get_key(imagefile, key_level), timestamp)
+                      for imagefile, timestamp in images])
+    rows = conn.execute('SELECT c.imagefile,c.timestamp FROM candidates c '
+                        'WHERE NOT EXISTS (SELECT 1 FROM main.labeled l '
+                        'WHERE l.key = c.key) '
+                        'AND NOT EXISTS (SELECT 1 FROM main.images i '
+                        'WHERE i.imagefile = c.imagefile AND i.valid = 0) '
+                        'ORDER BY c.imagefile').fetchall()
+    num_unknown = conn.execute(
+        'SELECT COUNT(1) FROM candidates c WHERE NOT EXISTS '
+        '(SELECT 1 FROM main.images i WHERE i.imagefile = c.imagefile)'
+    ).fetchone()[0]
+    if num_unknown > 0:
+        logging.warning(
+            '%d images are not in the metadata index, '
+            'run "image_metadata_index.py update".', num_unknown)
+    strata = {}
+    for imagefile, timestamp in rows:
+        strata.setdefault(get_stratum(imagefile, timestamp, stratify_by),
+                          []).append(imagefile)
+    return strata
+
+
+def allocate(sizes, number):
+    '''
+    Split "number" between strata as equally as their sizes allow.
+    Args:
+      sizes:  A dict {stratum: the number of candidates}.
+    Returns:
+      A dict {stratum: the number to sample}.
+    '''
+    counts = {stratum: 0 for stratum in sizes}
+    left = min(number, sum(sizes.values()))
+    open_strata = sorted((s for s in sizes if sizes[s] > 0),
+                         key=lambda s: (sizes[s], str(s)))
+    while left > 0:
+        share = max(left // len(open_strata), 1)
+        still_open = []
+        for stratum in open_strata:
+            take = min(share, sizes[stratum] - counts[stratum], left)
+            counts[stratum] += take
+            left -= take
+            if counts[stratum] < sizes[stratum]:
+                still_open.append(stratum)
+        open_strata = still_open
+    return counts
+
+
+def write_db(all_db_file, out_db_file, imagefiles):
+    ''' Copy "imagefiles" with their objects from the all db to a new db. '''
+    tmp_db_file = out_db_file + '.tmp'
+    if op.exists(tmp_db_file):
+        os.remove(tmp_db_file)
+    conn = sqlite3.connect(tmp_db_file)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('ATTACH DATABASE ? AS src', (all_db_file, ))
+        src_tables = db_utils.get_tables(cursor, schema='src')
+        for table in TABLES:
+            if table in src_tables:
+                sql = cursor.execute(
+                    "SELECT sql FROM src.sqlite_master "
+                    "WHERE type='table' AND name=?", (table, )).fetchone()
+                cursor.execute(sql[0])
+        cursor.execute(
+            'CREATE TEMP TABLE selected (imagefile TEXT PRIMARY KEY)')
+        cursor.executemany('INSERT INTO selected VALUES (?)',
+                           [(x, ) for x in imagefiles])
+        cursor.execute('INSERT INTO images SELECT * FROM src.images '
+                       'WHERE imagefile IN (SELECT imagefile FROM selected)')
+        if 'objects' in src_tables:
+            cursor.execute(
+                'INSERT INTO objects SELECT * FROM src.objects '
+                'WHERE imagefile IN (SELECT imagefile FROM selected)')
+        for table in ['properties', 'polygons', 'matches']:
+            if table in src_tables:
+                cursor.execute(
+                    'INSERT INTO %s SELECT * FROM src.%s WHERE objectid IN '
+                    '(SELECT objectid FROM objects)' % (table, table))
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_db_file, out_db_file)
+
+
+def select(index_db_file,
+           all_db_file,
+           out_db_file,
+           number,
+           key_level=1,
+           stratify_by='none',
+           seed=None):
+    ''' Sample unlabeled good images of the all db into a new db. '''
+    conn = open_labeled(index_db_file)
+    try:
+        conn.execute('ATTACH DATABASE ? AS src', (all_db_file, ))
+        strata = get_candidates(conn, key_level, stratify_by)
+        sizes = {stratum: len(x) for stratum, x in strata.items()}
+        num_candidates = sum(sizes.values())
+        logging.info('%d unlabeled images in %d strata.', num_candidates,
+                     len(strata))
+        if num_candidates < number:
+            logging.warning('Only %d images are left, selecting all.',
+                            num_candidates)
+        rng = random.Random(seed)
+        selected = []
+        for stratum, count in sorted(allocate(sizes, number).items(),
+                                     key=lambda x: str(x[0])):
+            selected += rng.sample(strata[stratum], count)
+            logging.debug('Stratum %s: %d out of %d.', stratum, count,
+                          sizes[stratum])
+    finally:
+        conn.close()
+    write_db(all_db_file, out_db_file, selected)
+    logging.info('Selected %d images into %s', len(selected), out_db_file)
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        level=args.logging_level)
+
+    if args.command == 'record':
+        record(args.index_db_file, args.db_file, args.campaign_id,
+               args.key_level, args.replace)
+    elif args.command == 'select':
+        select(args.index_db_file, args.all_db_file, args.out_db_file,
+               args.number, args.key_level, args.stratify_by, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+'''
+Selection of the best hyperparameters and epoch after a sweep.
+
+Epochs of all hypers are put into a NumPy array indexed by
+(config, split, epoch, metric), where a config is a unique combination of
+hyperparameters, e.g. (batch_size, lr). Hypers that stopped early or have a
+different number of epochs are padded with NaN. Rows of the same
+(config, split, epoch), e.g. from a rerun under another hyper_n, are
+averaged, as the groupby of the previous selection did.
+
+The score of every (config, split, epoch) is a weighted sum of metrics,
+optionally smoothed over a window of epochs. Scores are averaged across
+splits, and the std across splits can be subtracted as a penalty.
+Everything is done in one vectorized pass.
+'''
+
+import logging
+import warnings
+import numpy as np
+import pandas as pd
+
+
+def parse_metrics(metrics):
+    '''
+    Parse strings like "metrics/mAP_0.5=0.9" into names and weights.
+    The weight is 1 if omitted.
+    '''
+    names = []
+    weights = []
+    for metric in metrics:
+        name, _, weight = metric.rpartition('=')
+        if name == '':
+            name, weight = weight, 1.
+        names.append(name)
+        weights.append(float(weight))
+    return names, weights
+
+
+def _encode(df, columns):
+    '''
+    Returns the code of every row according to the unique combinations of
+    "columns", and these unique combinations as a list of tuples.
+    '''
+    codes = []
+    uniques = []
+    for name in columns:
+        column = df[name]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            codes.append(column.cat.codes.values.astype(np.int64))
+            uniques.append(list(column.cat.categories))
+        else:
+            code, unique = pd.factorize(column.values, sort=True)
+            codes.append(code)
+            uniques.append(unique.tolist())
+    # Combine codes of all columns into one integer, and factorize it.
+    # Hashing is much faster than np.unique(..., axis=0) on large sweeps.
+    combined = np.ravel_multi_index(codes, [len(unique) for unique in uniques])
+    inverse, rows = pd.factorize(combined, sort=True)
+    rows = np.unravel_index(rows, [len(unique) for unique in uniques])
+    keys = [
+        tuple(uniques[i][code] for i, code in enumerate(row))
+        for row in zip(*rows)
+    ]
+    return inverse, keys
+
+
+class Cube(object):
+    '''
+    Metrics of a sweep as an array of shape
+    (num_configs, num_splits, num_epochs, num_metrics), padded with NaN.
+    '''
+
+    def __init__(self, df, config_columns, metric_columns, split_column):
+        self.config_columns = list(config_columns)
+        self.metric_columns = list(metric_columns)
+
+        config_codes, self.configs = _encode(df, config_columns)
+        split_codes, splits = _encode(df, [split_column])
+        self.splits = [split for split, in splits]
+
+        epochs = df['epoch'].values.astype(np.int64)
+        self.first_epoch = int(epochs.min())
+        num_epochs = int(epochs.max()) - self.first_epoch + 1
+
+        shape = (len(self.configs), len(self.splits), num_epochs,
+                 len(self.metric_columns))
+        cells = np.ravel_multi_index(
+            (config_codes, split_codes, epochs - self.first_epoch), shape[:3])
+        metrics = df[self.metric_columns].values.astype(np.float64)
+        unique_cells, counts = np.unique(cells, return_counts=True)
+        if (counts > 1).any():
+            self._warn_duplicates(unique_cells[counts > 1], shape)
+            self.values = _average_cells(cells, metrics, shape)
+        else:
+            self.values = np.full(shape, np.nan, dtype=np.float64)
+            self.values.reshape(-1, shape[3])[cells] = metrics
+        logging.debug('Made a cube of shape %s.', str(self.values.shape))
+
+    def _warn_duplicates(self, cells, shape):
+        config_ids, split_ids, epoch_ids = np.unravel_index(cells, shape[:3])
+        examples = [
+            '%s, split %s, epoch %d' %
+            (self.configs[config_id], self.splits[split_id],
+             epoch_id + self.first_epoch) for config_id, split_id, epoch_id in
+            list(zip(config_ids, split_ids, epoch_ids))[:5]
+        ]
+        logging.warning(
+            '%d epochs have several rows of the same config and split, '
+            'averaging them. E.g.:\n\t%s', len(cells), '\n\t'.join(examples))
+
+
+def _average_cells(cells, metrics, shape):
+    ''' Average rows of "metrics" by their flat cell, ignoring NaN. '''
+    is_valid = ~np.isnan(metrics)
+    sums = np.zeros((np.prod(shape[:3]), shape[3]))
+    counts = np.zeros_like(sums)
+    np.add.at(sums, cells, np.where(is_valid, metrics, 0.))
+    np.add.at(counts, cells, is_valid)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sums / counts).reshape(shape)
+
+
+def build_cube(df, config_columns, metric_columns, split_column='split'):
+    ''' Make a Cube from a table made by postprocess_utils.parse_runs. '''
+    if len(df) == 0:
+        raise ValueError('Dataframe is empty.')
+    return Cube(df, config_columns, metric_columns, split_column)
+
+
+def _smooth(score, window):
+    '''
+    Average over a centered window of epochs, ignoring NaN.
+    Epochs that are NaN stay NaN, so that only existing epochs are selected.
+    '''
+    half = window // 2
+    is_valid = ~np.isnan(score)
+    num_epochs = score.shape[-1]
+
+    def window_sum(x):
+        cumsum = np.cumsum(x, axis=-1)
+        cumsum = np.concatenate([np.zeros(x.shape[:-1] + (1, )), cumsum],
+                                axis=-1)
+        end = np.minimum(np.arange(num_epochs) + half + 1, num_epochs)
+        begin = np.maximum(np.arange(num_epochs) - half, 0)
+        return cumsum[..., end] - cumsum[..., begin]
+
+    sums = window_sum(np.where(is_valid, score, 0.))
+    counts = window_sum(is_valid.astype(np.float64))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        smoothed = sums / counts
+    smoothed[~is_valid] = np.nan
+    return smoothed
+
+
+def select(cube,
+           weights=None,
+           smooth_window=1,
+           std_penalty=0.,
+           min_splits=1):
+    '''
+    Find the best epoch for every config, and the best config.
+
+    Args:
+      cube:           Cube.
+      weights:        Weights of metrics in the score. Default: all 1.
+      smooth_window:  Average the score over this many epochs (centered).
+      std_penalty:    Subtract std_penalty * (std across splits) from the mean.
+      min_splits:     An epoch of a config counts only if at least this many
+                      splits reached it. The default 1 averages every epoch
+                      over the splits that reached it, as the previous
+                      selection did. The number of splits makes configs
+                      with early-stopped or failed splits comparable.
+    Returns:
+      df_by_config:   pd.DataFrame with the best epoch of every config.
+      best:           pd.Series, the best row of df_by_config.
+    '''
+    values = cube.values
+    if weights is None:
+        weights = np.ones(len(cube.metric_columns))
+    weights = np.asarray(weights, dtype=np.float64)
+
+    # (config, split, epoch)
+    score = np.tensordot(values, weights, axes=([3], [0]))
+    if smooth_window > 1:
+        score = _smooth(score, smooth_window)
+
+    is_valid = ~np.isnan(score)
+    num_splits = is_valid.sum(axis=1)  # (config, epoch)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(is_valid, score, 0.).sum(axis=1) / num_splits
+        deviation = np.where(is_valid, score - mean[:, np.newaxis, :], 0.)
+        std = np.sqrt((deviation**2).sum(axis=1) / num_splits)
+    objective = mean - std_penalty * std
+    objective[(num_splits < min_splits) | (num_splits == 0)] = -np.inf
+
+    config_ids = np.arange(len(cube.configs))
+    best_epoch_ids = np.argmax(objective, axis=1)
+    best_objectives = objective[config_ids, best_epoch_ids]
+    has_score = np.isfinite(best_objectives)
+    if not has_score.any():
+        raise ValueError('No config has an epoch reached by enough splits.')
+    for config_id in config_ids[~has_score]:
+        logging.warning(
+            'Dropping config %s: no epoch was reached by %d splits.',
+            cube.configs[config_id], min_splits)
+
+    # Mean of every metric across splits at the best epochs.
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        metrics = np.nanmean(values[config_ids, :, best_epoch_ids], axis=1)
+
+    rows = []
+    for config_id in config_ids[has_score]:
+        row = dict(zip(cube.config_columns, cube.configs[config_id]))
+        row['epoch'] = int(best_epoch_ids[config_id]) + cube.first_epoch
+        row['score'] = float(best_objectives[config_id])
+        row['std'] = float(std[config_id, best_epoch_ids[config_id]])
+        row['num_splits'] = int(num_splits[config_id,
+                                           best_epoch_ids[config_id]])
+        for i, name in enumerate(cube.metric_columns):
+            row[name] = float(metrics[config_id, i])
+        rows.append(row)
+    df_by_config = pd.DataFrame(rows)
+
+    # Keep python types of config values, e.g. int batch_size.
+    best_id = int(df_by_config['score'].idxmax())
+    best = pd.Series(rows[best_id], name=best_id, dtype=object)
+    return df_by_config, best
@@ -0,0 +1,310 @@
+'''
+Access to the job scheduler.
+
+Scripts never call "sbatch", "squeue", "sacct" or "scancel" directly,
+they go through a Scheduler. SlurmScheduler queries the states of all jobs in one "squeue"
+call, and asks "sacct" only about jobs that already left the queue.
+FakeScheduler keeps states in a dict and is used for dry runs and tests.
+
+Job ids are read from "batch_jobs/job_ids.txt" files, where every submit.sh
+appends a line "<date> <job_id>".
+
+The id of an array job (e.g. "123" of "Submitted batch job 123") is never
+listed by squeue or sacct, which only know its tasks "123_N". The state of
+such an id is aggregated from the states of its tasks, see
+aggregate_states().
+'''
+
+import os, os.path as op
+import re
+import glob
+import json
+import getpass
+import logging
+import time
+import subprocess
+
+# States of jobs that have not finished yet.
+ACTIVE_STATES = [
+    'PENDING', 'CONFIGURING', 'RUNNING', 'COMPLETING', 'SUSPENDED', 'REQUEUED',
+    'RESIZING'
+]
+
+
+def is_active(state):
+    return state in ACTIVE_STATES
+
+
+def aggregate_states(states):
+    '''
+    The state of an array job from the states of its tasks: active if some
+    task is active, COMPLETED if all tasks completed, otherwise the state of
+    a task that did not complete, e.g. FAILED.
+    '''
+    states = list(states)
+    if len(states) == 0:
+        return 'UNKNOWN'
+    for state in states:
+        if is_active(state):
+            return 'RUNNING' if 'RUNNING' in states else state
+    for state in states:
+        if state != 'COMPLETED':
+            return state
+    return 'COMPLETED'
+
+
+def _get_array_states(states, job_id):
+    ''' States of tasks "<job_id>_N" in "states". '''
+    prefix = job_id + '_'
+    return [
+        state for task_id, state in states.items()
+        if task_id.startswith(prefix)
+    ]
+
+
+def read_job_ids(job_ids_path):
+    ''' Returns the list of job ids in a "job_ids.txt" file, oldest first. '''
+    job_ids = []
+    with open(job_ids_path) as f:
+        for line in f:
+            words = line.split()
+            if len(words) == 0:
+                continue
+            # The date has spaces in it, the job id is the last word.
+            job_ids.append(words[-1])
+    return job_ids
+
+
+def find_job_ids(run_dir):
+    '''
+    Find job ids of all hypers in a run dir.
+    Returns:
+      A dict {hyper name, e.g. "hyper001": the last submitted job id}.
+    '''
+    job_ids = {}
+    pattern = op.join(run_dir, 'hyper*', 'batch_jobs', 'job_ids.txt')
+    for job_ids_path in sorted(glob.glob(pattern)):
+        hyper_name = op.basename(op.dirname(op.dirname(job_ids_path)))
+        hyper_job_ids = read_job_ids(job_ids_path)
+        if len(hyper_job_ids) == 0:
+            logging.warning('No job ids in %s', job_ids_path)
+            continue
+        job_ids[hyper_name] = hyper_job_ids[-1]
+    logging.debug('Found job ids of %d hypers in %s', len(job_ids), run_dir)
+    return job_ids
+
+
+def _expand_job_id(job_id):
+    '''
+    squeue prints pending tasks of an array job as one line, e.g.
+    "123_[4-6,9%2]". Expand it to ["123_4", "123_5", "123_6", "123_9"].
+    '''
+    match = re.match(r'^(\d+)_\[([^\]]+)\]$', job_id)
+    if match is None:
+        return [job_id]
+    base_id, ranges = match.groups()
+    # Drop the limit of simultaneously running tasks.
+    ranges = ranges.split('%')[0]
+    task_ids = []
+    for word in ranges.split(','):
+        if '-' in word:
+            begin, end = word.split('-')
+            task_ids += list(range(int(begin), int(end) + 1))
+        else:
+            task_ids.append(int(word))
+    return ['%s_%d' % (base_id, task_id) for task_id in task_ids]
+
+
+class Scheduler(object):
+    ''' The interface to a job scheduler. '''
+
+    def get_states(self, job_ids):
+        '''
+        Query the states of several jobs at once.
+        Returns:
+          A dict {job_id: state}, e.g. "RUNNING". Unknown jobs are "UNKNOWN".
+        '''
+        raise NotImplementedError()
+
+    def submit(self, script_path, options=None):
+        '''
+        Submit a batch script.
+        Args:
+          script_path:  Path to the script.
+          options:      A list of extra options, e.g. ["--array=0-9%2"].
+        Returns:
+          The job id as a string.
+        '''
+        raise NotImplementedError()
+
+    def cancel(self, job_ids):
+        raise NotImplementedError()
+
+
+class SlurmScheduler(Scheduler):
+    '''
+    Calls SLURM command line tools. Their paths can be replaced, e.g. with
+    scripts that print a saved output of squeue and sacct.
+    '''
+
+    def __init__(self,
+                 account=None,
+                 sbatch='sbatch',
+                 squeue='squeue',
+                 sacct='sacct',
+                 scancel='scancel'):
+        self.account = account
+        self.sbatch = sbatch
+        self.squeue = squeue
+        self.sacct = sacct
+        self.scancel = scancel
+
+    def _run(self, command):
+        logging.debug('Running: %s', ' '.join(command))
+        return subprocess.run(command,
+                              check=True,
+                              stdout=subprocess.PIPE,
+                              universal_newlines=True).stdout
+
+    def _query_squeue(self):
+        ''' Returns states of all our jobs in the queue. '''
+        command = [self.squeue, '--noheader', '--format=%i|%T']
+        if self.account is not None:
+            command += ['--account', self.account]
+        else:
+            command += ['--user', getpass.getuser()]
+        states = {}
+        for line in self._run(command).splitlines():
+            if '|' not in line:
+                continue
+            job_id, state = line.strip().split('|')
+            for task_id in _expand_job_id(job_id):
+                states[task_id] = state
+        return states
+
+    def _query_sacct(self, job_ids):
+        ''' Returns states of finished jobs. '''
+        command = [
+            self.sacct, '--noheader', '--parsable2', '--format=JobID,State',
+            '--jobs', ','.join(job_ids)
+        ]
+        states = {}
+        for line in self._run(command).splitlines():
+            if '|' not in line:
+                continue
+            job_id, state = line.strip().split('|')
+            # Skip job steps, e.g. "123.batch".
+            if '.' in job_id:
+                continue
+            # E.g. "CANCELLED by 12345".
+            for task_id in _expand_job_id(job_id):
+                states[task_id] = state.split()[0] if state else 'UNKNOWN'
+        return states
+
+    def get_states(self, job_ids):
+        job_ids = list(job_ids)
+        if len(job_ids) == 0:
+            return {}
+        queued = self._query_squeue()
+        states = {}
+        for job_id in job_ids:
+            if job_id in queued:
+                states[job_id] = queued[job_id]
+            elif len(_get_array_states(queued, job_id)) > 0:
+                # Tasks of an array that are not in the queue are finished,
+                # so the array is active.
+                states[job_id] = aggregate_states(
+                    _get_array_states(queued, job_id))
+        finished_ids = [job_id for job_id in job_ids if job_id not in states]
+        if len(finished_ids) > 0:
+            finished = self._query_sacct(finished_ids)
+            for job_id in finished_ids:
+                if job_id in finished:
+                    states[job_id] = finished[job_id]
+                else:
+                    states[job_id] = aggregate_states(
+                        _get_array_states(finished, job_id))
+        return {job_id: states.get(job_id, 'UNKNOWN') for job_id in job_ids}
+
+    def submit(self, script_path, options=None):
+        command = [self.sbatch, '--parsable']
+        if self.account is not None:
+            command += ['-A', self.account]
+        command += list(options or []) + [script_path]
+        # The output is "<job_id>" or "<job_id>;<cluster>".
+        job_id = self._run(command).strip().split(';')[0]
+        logging.info('Submitted job %s: %s', job_id, script_path)
+        return job_id
+
+    def cancel(self, job_ids):
+        job_ids = list(job_ids)
+        if len(job_ids) > 0:
+            self._run([self.scancel] + job_ids)
+
+
+class FakeScheduler(Scheduler):
+    '''
+    Keeps job states in a dict instead of a real scheduler.
+    Args:
+      states:       A dict {job_id: state}.
+      states_path:  A JSON file with a dict {job_id: state}. If provided, it is
+                    read on every query, so that it can be edited meanwhile.
+    '''
+
+    def __init__(self, states=None, states_path=None):
+        self.states = dict(states or {})
+        self.states_path = states_path
+        self.cancelled = []
+        self.submitted = []
+
+    def get_states(self, job_ids):
+        if self.states_path is not None and op.exists(self.states_path):
+            with open(self.states_path) as f:
+                self.states.update(json.load(f))
+            for job_id in self.cancelled:
+                self.states[job_id] = 'CANCELLED'
+        return {
+            job_id: self.states.get(job_id, 'UNKNOWN')
+            for job_id in job_ids
+        }
+
+    def submit(self, script_path, options=None):
+        job_id = str(1000 + len(self.submitted))
+        logging.info('Fake submitting job %s: %s %s', job_id,
+                     ' '.join(options or []), script_path)
+        self.submitted.append((job_id, script_path, list(options or [])))
+        self.states[job_id] = 'PENDING'
+        return job_id
+
+    def cancel(self, job_ids):
+        for job_id in job_ids:
+            logging.info('Fake cancelling job %s', job_id)
+            self.states[job_id] = 'CANCELLED'
+            self.cancelled.append(job_id)
+
+
+def wait_for_jobs(scheduler, job_ids, interval=60):
+    '''
+    Poll the scheduler until none of "job_ids" is active.
+    Returns:
+      A dict {job_id: final state}.
+    '''
+    job_ids = list(job_ids)
+    while True:
+        states = scheduler.get_states(job_ids)
+        num_active = sum(is_active(state) for state in states.values())
+        if num_active == 0:
+            return states
+        logging.debug('%d of %d jobs are still active.', num_active,
+                      len(job_ids))
+        time.sleep(interval)
+
+
+def get_scheduler(fake_states_path=None):
+    '''
+    Returns FakeScheduler if "fake_states_path" is provided, otherwise
+    SlurmScheduler for ${ACCOUNT} from "constants.sh".
+    '''
+    if fake_states_path is not None:
+        return FakeScheduler(states_path=fake_states_path)
+    return SlurmScheduler(account=os.environ.get('ACCOUNT'))
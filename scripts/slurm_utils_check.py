@@ -0,0 +1,112 @@
+'''
+Check SlurmScheduler.get_states on saved output of squeue and sacct.
+
+squeue and sacct are replaced with scripts that print the output below, so
+the check runs without SLURM. Array jobs are submitted as e.g. "123", and
+their tasks are listed as "123_N" or "123_[N-M]". Exits with an error if a
+state differs from the expected one.
+
+Example:
+  python3 scripts/slurm_utils_check.py
+'''
+
+import os, sys, os.path as op
+import shutil
+import logging
+import argparse
+import tempfile
+
+import slurm_utils
+
+# "squeue --noheader --format=%i|%T": array 123 has running and pending
+# tasks, 456 is a plain job.
+SQUEUE_OUTPUT = '''123_1|RUNNING
+123_2|RUNNING
+123_[3-5%2]|PENDING
+456|RUNNING
+'''
+
+# "sacct --noheader --parsable2 --format=JobID,State": array 789 has a failed
+# task, array 790 completed, 791 is a plain job.
+SACCT_OUTPUT = '''789_0|COMPLETED
+789_0.batch|COMPLETED
+789_0.extern|COMPLETED
+789_1|FAILED
+789_1.batch|FAILED
+790_0|COMPLETED
+790_0.batch|COMPLETED
+790_[1-2]|COMPLETED
+791|CANCELLED by 12345
+'''
+
+EXPECTED_STATES = {
+    '123': 'RUNNING',
+    '123_4': 'PENDING',
+    '456': 'RUNNING',
+    '789': 'FAILED',
+    '789_0': 'COMPLETED',
+    '790': 'COMPLETED',
+    '791': 'CANCELLED',
+    '999': 'UNKNOWN',
+}
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Check states of array jobs on saved SLURM output.')
+    parser.add_argument(
+        "--logging_level",
+        type=int,
+        choices=[10, 20, 30, 40],
+        default=20,
+        help="Set logging level. 10: debug, 20: info, 30: warning, 40: error.")
+    return parser
+
+
+def write_command(path, output):
+    ''' Write a script that prints "output" whatever its arguments are. '''
+    with open(path + '.txt', 'w') as f:
+        f.write(output)
+    with open(path, 'w') as f:
+        f.write('#!/bin/sh\ncat "%s.txt"\n' % path)
+    os.chmod(path, 0o755)
+
+
+def check(work_dir):
+    ''' Returns the list of (job_id, expected state, state) that differ. '''
+    squeue = op.join(work_dir, 'squeue')
+    sacct = op.join(work_dir, 'sacct')
+    write_command(squeue, SQUEUE_OUTPUT)
+    write_command(sacct, SACCT_OUTPUT)
+    scheduler = slurm_utils.SlurmScheduler(account='fake',
+                                           squeue=squeue,
+                                           sacct=sacct)
+    states = scheduler.get_states(EXPECTED_STATES.keys())
+    errors = []
+    for job_id, expected in sorted(EXPECTED_STATES.items()):
+        logging.info('Job %s: %s', job_id, states[job_id])
+        if states[job_id] != expected:
+            errors.append((job_id, expected, states[job_id]))
+    return errors
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        level=args.logging_level)
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        errors = check(work_dir)
+    finally:
+        shutil.rmtree(work_dir)
+    for job_id, expected, state in errors:
+        logging.error('Job %s: expected %s, got %s.', job_id, expected, state)
+    if len(errors) > 0:
+        sys.exit(1)
+    logging.info('All %d states are as expected.', len(EXPECTED_STATES))
+
+
+if __name__ == '__main__':
+    main()
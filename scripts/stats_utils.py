@@ -0,0 +1,313 @@
+'''
+Materialized statistics of campaign databases.
+
+Statistics of a db are computed in one pass over objects and their
+"campaign" and "decade" properties, and stored in a small sqlite db (the
+store) as counts of objects per (campaign, decade, name), plus the number
+of images per campaign. Counts per name, per campaign, per decade, and of
+pages vs stamps are all sums over these rows, so reports read the store
+instead of the big db.
+
+A summary is keyed by the path of the db and its checksum (see
+memo_utils.describe_files), so it is recomputed only when the db changes.
+
+Up-to-now dbs of consecutive versions differ in the rows of the current
+campaign only. If the summary of a base db (e.g. the previous version) is
+given, objects are counted per campaign and name, without decades.
+Campaigns whose counts per name did not change are copied from the base
+summary, and only the rest are recounted. Use "recount_campaigns" after
+changing decades only.
+'''
+
+import os.path as op
+import time
+import sqlite3
+import logging
+
+import db_utils
+import memo_utils
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS summaries (
+  id INTEGER PRIMARY KEY,
+  db_path TEXT,
+  version TEXT,
+  size INTEGER,
+  mtime INTEGER,
+  digest TEXT,
+  num_images INTEGER,
+  date TEXT);
+CREATE INDEX IF NOT EXISTS summaries_db_path ON summaries(db_path);
+CREATE TABLE IF NOT EXISTS object_counts (
+  summary_id INTEGER,
+  campaign TEXT,
+  decade TEXT,
+  name TEXT,
+  count INTEGER);
+CREATE INDEX IF NOT EXISTS object_counts_summary_id
+  ON object_counts(summary_id);
+CREATE TABLE IF NOT EXISTS image_counts (
+  summary_id INTEGER,
+  campaign TEXT,
+  count INTEGER);
+CREATE INDEX IF NOT EXISTS image_counts_summary_id
+  ON image_counts(summary_id);
+'''
+
+# Joins objects with their campaign and decade, if any. With an inner join
+# on the campaign, the planner starts from the index on properties.
+_OBJECTS_SQL = '''
+  FROM objects o
+  %s JOIN properties c ON c.objectid = o.objectid AND c.key = 'campaign'
+  LEFT JOIN properties d ON d.objectid = o.objectid AND d.key = 'decade'
+'''
+
+
+def open_store(store_path):
+    conn = sqlite3.connect(store_path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _campaign_condition(campaigns):
+    '''
+    SQL condition and its parameters to select objects of "campaigns".
+    None in "campaigns" stands for objects without a campaign.
+    '''
+    values = [campaign for campaign in campaigns if campaign is not None]
+    conditions = []
+    if len(values) > 0:
+        conditions.append('c.value IN (%s)' % ','.join('?' * len(values)))
+    if None in campaigns:
+        conditions.append('c.value IS NULL')
+    return ' OR '.join(conditions), values
+
+
+def count_objects(conn, campaigns=None):
+    '''
+    Returns a list of (campaign, decade, name, count).
+    Only objects of "campaigns" are counted, if it is not None.
+    '''
+    join = 'LEFT'
+    where = ''
+    params = []
+    if campaigns is not None:
+        condition, params = _campaign_condition(campaigns)
+        where = 'WHERE %s ' % condition
+        if None not in campaigns:
+            join = ''
+    sql = ('SELECT c.value, d.value, o.name, COUNT(1) ' + _OBJECTS_SQL % join +
+           where + 'GROUP BY c.value, d.value, o.name')
+    return conn.execute(sql, params).fetchall()
+
+
+def count_images(conn, campaigns=None):
+    ''' Returns a list of (campaign, number of images with its objects). '''
+    sql = ('SELECT c.value, COUNT(DISTINCT(o.imagefile)) FROM objects o '
+           "JOIN properties c ON c.objectid = o.objectid AND c.key = 'campaign' ")
+    params = []
+    if campaigns is not None:
+        values = [campaign for campaign in campaigns if campaign is not None]
+        sql += 'WHERE c.value IN (%s) ' % ','.join('?' * len(values))
+        params = values
+    sql += 'GROUP BY c.value'
+    return conn.execute(sql, params).fetchall()
+
+
+def _group_by_campaign(rows):
+    ''' Turns rows (campaign, name, count) to {campaign: {name: count}}. '''
+    counts = {}
+    for campaign, name, count in rows:
+        counts.setdefault(campaign, {})[name] = count
+    return counts
+
+
+def count_names_per_campaign(conn):
+    '''
+    Returns {campaign: {name: number of objects}}, None for objects without
+    a campaign. Serves as a digest of every campaign: a rename or a clean-up
+    changes it even if the number of objects stays the same.
+    '''
+    return _group_by_campaign(
+        conn.execute('SELECT c.value, o.name, COUNT(1) FROM objects o '
+                     "LEFT JOIN properties c ON c.objectid = o.objectid "
+                     "AND c.key = 'campaign' GROUP BY c.value, o.name"))
+
+
+def count_db_images(db_path):
+    ''' The number of images of a db, without summarizing it. '''
+    conn = db_utils.connect(db_path, read_only=True)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM images').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def find_summary(store, db_path, description):
+    ''' Returns the id of a summary of a db with the same digest, or None. '''
+    row = store.execute(
+        'SELECT id FROM summaries WHERE db_path = ? AND digest = ? '
+        'ORDER BY id DESC LIMIT 1',
+        (op.realpath(db_path), description['digest'])).fetchone()
+    return None if row is None else row[0]
+
+
+def _describe(store, db_path):
+    ''' Checksum of a db, reusing the one of its last summary if unchanged. '''
+    db_path = op.realpath(db_path)
+    row = store.execute(
+        'SELECT size, mtime, digest FROM summaries WHERE db_path = ? '
+        'ORDER BY id DESC LIMIT 1', (db_path, )).fetchone()
+    known = {}
+    if row is not None:
+        known[db_path] = {'size': row[0], 'mtime': row[1], 'digest': row[2]}
+    return memo_utils.describe_files([db_path], known)[db_path]
+
+
+def get_base_summary(store, base_db_path):
+    ''' The latest summary of the base db, if it still matches the file. '''
+    if base_db_path is None or not op.exists(base_db_path):
+        return None
+    return find_summary(store, base_db_path, _describe(store, base_db_path))
+
+
+def _name_counts_of_summary(store, summary_id):
+    return _group_by_campaign(
+        store.execute(
+            'SELECT campaign, name, SUM(count) FROM object_counts '
+            'WHERE summary_id = ? GROUP BY campaign, name', (summary_id, )))
+
+
+def summarize(store,
+              db_path,
+              version=None,
+              base_db_path=None,
+              recount_campaigns=(),
+              full=False):
+    '''
+    Returns the id of the summary of a db, computing it if needed.
+    Args:
+      store:          A connection to the store, from open_store().
+      db_path:        The db to summarize.
+      version:        Stored for reference.
+      base_db_path:   A db that differs from "db_path" in a few campaigns,
+                      e.g. the previous version. Its summary is reused.
+      recount_campaigns:  Campaigns to recount even if the number of their
+                      objects per name did not change, e.g. after decades
+                      were fixed.
+      full:           If True, recompute everything.
+    '''
+    recount_campaigns = [str(campaign) for campaign in recount_campaigns]
+    description = _describe(store, db_path)
+    if not full:
+        summary_id = find_summary(store, db_path, description)
+        if summary_id is not None:
+            logging.debug('Summary of %s is up to date.', db_path)
+            return summary_id
+
+    start = time.time()
+    conn = db_utils.connect(db_path, read_only=True)
+    try:
+        num_images = conn.execute('SELECT COUNT(1) FROM images').fetchone()[0]
+        base_id = None if full else get_base_summary(store, base_db_path)
+        if base_id is None:
+            object_counts = count_objects(conn)
+            image_counts = count_images(conn)
+            logging.info('Counted all objects of %s.', db_path)
+        else:
+            base_counts = _name_counts_of_summary(store, base_id)
+            counts = count_names_per_campaign(conn)
+            # Campaigns that were added or whose counts per name changed.
+            changed = [
+                campaign for campaign, name_counts in counts.items()
+                if name_counts != base_counts.get(campaign)
+                or campaign in recount_campaigns
+            ]
+            kept = [
+                campaign for campaign in base_counts
+                if campaign in counts and campaign not in changed
+            ]
+            logging.info('Recounting campaigns %s of %s, copying %s.',
+                         changed, db_path, kept)
+            object_counts = []
+            image_counts = []
+            if len(changed) > 0:
+                object_counts = count_objects(conn, changed)
+                if any(campaign is not None for campaign in changed):
+                    image_counts = count_images(conn, changed)
+            if len(kept) > 0:
+                condition, params = _campaign_condition(kept)
+                condition = condition.replace('c.value', 'campaign')
+                object_counts += store.execute(
+                    'SELECT campaign, decade, name, count FROM object_counts '
+                    'WHERE summary_id = ? AND (%s)' % condition,
+                    [base_id] + params).fetchall()
+                image_counts += store.execute(
+                    'SELECT campaign, count FROM image_counts '
+                    'WHERE summary_id = ? AND (%s)' % condition,
+                    [base_id] + params).fetchall()
+    finally:
+        conn.close()
+
+    cursor = store.cursor()
+    cursor.execute(
+        'INSERT INTO summaries(db_path,version,size,mtime,digest,num_images,'
+        'date) VALUES (?,?,?,?,?,?,?)',
+        (op.realpath(db_path), version, description['size'],
+         description['mtime'], description['digest'], num_images,
+         time.strftime('%Y-%m-%d %H:%M:%S')))
+    summary_id = cursor.lastrowid
+    cursor.executemany(
+        'INSERT INTO object_counts(summary_id,campaign,decade,name,count) '
+        'VALUES (?,?,?,?,?)', [(summary_id, ) + tuple(row)
+                               for row in object_counts])
+    cursor.executemany(
+        'INSERT INTO image_counts(summary_id,campaign,count) VALUES (?,?,?)',
+        [(summary_id, ) + tuple(row) for row in image_counts])
+    store.commit()
+    logging.info('Summarized %s in %.1f sec.', db_path, time.time() - start)
+    return summary_id
+
+
+def _page_condition(is_page):
+    if is_page is None:
+        return '1'
+    return db_utils.IS_PAGE_SQL if is_page else 'NOT ' + db_utils.IS_PAGE_SQL
+
+
+def get_num_images(store, summary_id):
+    return store.execute('SELECT num_images FROM summaries WHERE id = ?',
+                         (summary_id, )).fetchone()[0]
+
+
+def get_num_objects(store, summary_id, is_page=None):
+    ''' The number of objects, only pages or only stamps if is_page is set. '''
+    return store.execute(
+        'SELECT TOTAL(count) FROM object_counts WHERE summary_id = ? AND %s' %
+        _page_condition(is_page), (summary_id, )).fetchone()[0]
+
+
+def get_counts(store, summary_id, by, is_page=None):
+    '''
+    Returns a list of (value, number of objects) ordered by value.
+    Objects of images without a campaign are not counted by campaign.
+    Args:
+      by:       "name", "campaign", or "decade".
+      is_page:  If True, count only pages, if False, only stamps.
+    '''
+    if by not in ['name', 'campaign', 'decade']:
+        raise ValueError('Can not count by "%s".' % by)
+    condition = _page_condition(is_page)
+    if by == 'campaign':
+        condition += ' AND campaign IS NOT NULL'
+    return store.execute(
+        'SELECT %s, SUM(count) FROM object_counts WHERE summary_id = ? AND %s '
+        'GROUP BY %s ORDER BY %s' % (by, condition, by, by),
+        (summary_id, )).fetchall()
+
+
+def get_image_counts(store, summary_id):
+    ''' Returns a list of (campaign, number of images) ordered by campaign. '''
+    return store.execute(
+        'SELECT campaign, count FROM image_counts WHERE summary_id = ? '
+        'ORDER BY campaign', (summary_id, )).fetchall()
@@ -0,0 +1,356 @@
+'''
+Code common for all submit.py scripts, which submit a sweep of trainings.
+
+A submit.py parses the experiments file once and renders "template.sbatch"
+for every hyper in memory. All hypers of a sweep are submitted as one SLURM
+job array. Each task of the array runs the script of one hyper, selected by
+${SLURM_ARRAY_TASK_ID}, and writes its stdout and stderr to the
+"batch_jobs" dir of its hyper, same as a standalone job did.
+
+Files written for every submission:
+  ${hyper_dir}/batch_jobs/<stem>.sbatch   The rendered script of a hyper.
+  ${hyper_dir}/batch_jobs/<stem>.out      Its stdout (written by the job).
+  ${hyper_dir}/batch_jobs/<stem>.err      Its stderr (written by the job).
+  ${hyper_dir}/batch_jobs/job_ids.txt     "<date> <job_id>_<task_id>" lines.
+  ${run_dir}/batch_jobs/<stem>.array.sbatch   The script of the job array.
+
+With "--hold_full 1", hypers of the "full" split are written but not
+submitted, and the name of their script is kept in
+"${hyper_dir}/batch_jobs/held.txt". The job array of the other splits is
+followed by a selection job, which runs postprocess.py with
+"--submit_held_full". It selects the best config over the other splits, and
+submits only the "full" hyper of this config. Retraining on the full data then
+takes one GPU job instead of one per config. The selection job is logged as
+"Submitted job <id> with output <path>", and logs the id of the "full" job
+to this output, so that dag_utils.run_and_wait waits for both.
+'''
+
+import os, os.path as op
+import re
+import time
+import logging
+
+import slurm_utils
+
+
+def add_arguments(parser):
+    ''' Arguments common for all submit.py scripts. '''
+    parser.add_argument('--experiments_path', required=True)
+    parser.add_argument('--splits_dir',
+                        required=True,
+                        help='Directory with data splits.')
+    parser.add_argument('--run_dir',
+                        required=True,
+                        help='Will contain hyperparameter folders.')
+    parser.add_argument(
+        '--max_parallel',
+        type=int,
+        default=0,
+        help='Run at most this many hypers at a time. 0 means no limit.')
+    parser.add_argument(
+        '--dry_run',
+        type=int,
+        default=0,
+        help='Enter 1 to write all scripts but NOT submit jobs.')
+    parser.add_argument(
+        '--hold_full',
+        type=int,
+        default=0,
+        help='Enter 1 to submit hypers of the "full" split only for the best '
+        'config, after the selection over other splits.')
+    parser.add_argument(
+        "--logging_level",
+        type=int,
+        choices=[10, 20, 30, 40],
+        default=20,
+        help="Set logging level. 10: debug, 20: info, 30: warning, 40: error.")
+
+
+def get_constant(name):
+    ''' Returns a constant exported by "constants.sh". '''
+    if name not in os.environ:
+        raise KeyError('%s is not set. Source "constants.sh" first.' % name)
+    return os.environ[name]
+
+
+def read_template(template_path):
+    if not op.exists(template_path):
+        raise FileNotFoundError('Job template does not exist at "%s"' %
+                                template_path)
+    with open(template_path) as f:
+        return f.read()
+
+
+def render(template, substitutions):
+    '''
+    Replace every occurrence of keys of "substitutions" by their values.
+    Unlike a chain of "sed -e", all keys are replaced in one pass, and values
+    are never substituted again. Longer keys take precedence, e.g.
+    "CONDA_YOLOV5_ENV" over "YOLOV5_DIR".
+    '''
+    keys = sorted(substitutions.keys(), key=len, reverse=True)
+    pattern = re.compile('|'.join(re.escape(key) for key in keys))
+    return pattern.sub(lambda match: str(substitutions[match.group(0)]),
+                       template)
+
+
+class Task(object):
+    ''' The rendered script of one hyper. '''
+
+    def __init__(self, hyper_dir, script, split=None):
+        self.hyper_dir = hyper_dir
+        self.script = script
+        self.split = split
+
+    def batch_jobs_dir(self):
+        return op.join(self.hyper_dir, 'batch_jobs')
+
+
+def _get_sbatch_options(script):
+    return [line for line in script.splitlines() if line.startswith('#SBATCH')]
+
+
+def make_array_script(tasks, stems):
+    '''
+    Make one script that runs task number ${SLURM_ARRAY_TASK_ID}.
+    #SBATCH options are taken from the tasks, and must be the same for all.
+    '''
+    options = _get_sbatch_options(tasks[0].script)
+    for task in tasks[1:]:
+        if _get_sbatch_options(task.script) != options:
+            raise ValueError(
+                'All hypers of a job array must have the same #SBATCH options.'
+                ' Hyper %s has:\n%s\ninstead of\n%s' %
+                (task.hyper_dir, '\n'.join(_get_sbatch_options(
+                    task.script)), '\n'.join(options)))
+
+    lines = ['#!/bin/bash', ''] + options + ['', 'set -e', '']
+    lines.append('case ${SLURM_ARRAY_TASK_ID} in')
+    for task_id, stem in enumerate(stems):
+        lines.append('  %d) stem="%s" ;;' % (task_id, stem))
+    lines += [
+        '  *) echo "Unknown task ${SLURM_ARRAY_TASK_ID}."; exit 1 ;;',
+        'esac',
+        '',
+        'echo "Task ${SLURM_ARRAY_TASK_ID} of job ${SLURM_ARRAY_JOB_ID}:'
+        ' ${stem}.sbatch"',
+        'bash "${stem}.sbatch" > "${stem}.out" 2> "${stem}.err"',
+        '',
+    ]
+    return '\n'.join(lines)
+
+
+def _write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+    logging.debug('Wrote %s', path)
+
+
+def _get_stem_name(job_name):
+    return '%s_%s' % (job_name, time.strftime('%Y-%m-%d_%H-%M'))
+
+
+def _record_job_id(batch_jobs_dir, job_id):
+    date = time.strftime('%a %b %d %H:%M:%S %Z %Y')
+    with open(op.join(batch_jobs_dir, 'job_ids.txt'), 'a') as f:
+        f.write('%s %s\n' % (date, job_id))
+
+
+def submit_array(tasks,
+                 run_dir,
+                 job_name,
+                 max_parallel=0,
+                 dry_run=False,
+                 scheduler=None):
+    '''
+    Write scripts of all tasks and submit them as one job array.
+    Args:
+      tasks:          A list of Task.
+      run_dir:        Dir of the run. The array script is written there.
+      job_name:       A prefix of file names, e.g. "train_detector".
+      max_parallel:   The "%" limit of the array. 0 means no limit.
+      dry_run:        If True, only write the scripts.
+      scheduler:      slurm_utils.Scheduler. Default: SLURM for ${ACCOUNT}.
+    Returns:
+      The job id, or None in the dry run mode.
+    '''
+    if len(tasks) == 0:
+        raise ValueError('No hypers to submit.')
+    stem_name = _get_stem_name(job_name)
+
+    stems = []
+    for task in tasks:
+        if not op.exists(task.batch_jobs_dir()):
+            os.makedirs(task.batch_jobs_dir())
+        stem = op.join(task.batch_jobs_dir(), stem_name)
+        _write(stem + '.sbatch', task.script)
+        stems.append(stem)
+
+    array_dir = op.join(run_dir, 'batch_jobs')
+    if not op.exists(array_dir):
+        os.makedirs(array_dir)
+    array_stem = op.join(array_dir, stem_name)
+    array_path = array_stem + '.array.sbatch'
+    _write(array_path, make_array_script(tasks, stems))
+    logging.info('Wrote scripts of %d hypers and the array script "%s".',
+                 len(tasks), array_path)
+
+    array = '0-%d' % (len(tasks) - 1)
+    if max_parallel > 0:
+        array += '%%%d' % max_parallel
+    options = [
+        '--array=%s' % array,
+        '--job-name=%s' % job_name,
+        # Only the dispatching is logged here, tasks write to their hyper dirs.
+        '--output=%s_%%A_%%a.array.out' % array_stem,
+        '--error=%s_%%A_%%a.array.err' % array_stem,
+    ]
+    if dry_run:
+        logging.info('Dry run. Would submit: sbatch %s %s', ' '.join(options),
+                     array_path)
+        return None
+
+    if scheduler is None:
+        scheduler = slurm_utils.get_scheduler()
+    job_id = scheduler.submit(array_path, options)
+
+    for task_id, task in enumerate(tasks):
+        _record_job_id(task.batch_jobs_dir(), '%s_%d' % (job_id, task_id))
+    logging.info('Submitted job array %s with %d tasks.', job_id, len(tasks))
+    return job_id
+
+
+def hold(tasks, job_name):
+    ''' Write scripts of tasks to be submitted later by submit_held(). '''
+    stem_name = _get_stem_name(job_name)
+    for task in tasks:
+        if not op.exists(task.batch_jobs_dir()):
+            os.makedirs(task.batch_jobs_dir())
+        _write(op.join(task.batch_jobs_dir(), stem_name + '.sbatch'),
+               task.script)
+        _write(op.join(task.batch_jobs_dir(), 'held.txt'), stem_name + '\n')
+    logging.info('Holding %d hypers: %s', len(tasks),
+                 ' '.join(op.basename(task.hyper_dir) for task in tasks))
+
+
+def submit_held(hyper_dir, after_job_ids=None, dry_run=False, scheduler=None):
+    '''
+    Submit the script of a hyper written by hold().
+    Args:
+      hyper_dir:      Dir of the hyper.
+      after_job_ids:  The job starts after these jobs end, in any state.
+      dry_run:        If True, only log the command.
+      scheduler:      slurm_utils.Scheduler. Default: SLURM for ${ACCOUNT}.
+    Returns:
+      The job id, or None in the dry run mode.
+    '''
+    batch_jobs_dir = op.join(hyper_dir, 'batch_jobs')
+    held_path = op.join(batch_jobs_dir, 'held.txt')
+    if not op.exists(held_path):
+        raise FileNotFoundError('Hyper %s is not held, no %s' %
+                                (hyper_dir, held_path))
+    with open(held_path) as f:
+        stem = op.join(batch_jobs_dir, f.read().strip())
+
+    options = ['--output=%s.out' % stem, '--error=%s.err' % stem]
+    if after_job_ids:
+        options.append('--dependency=afterany:%s' % ':'.join(after_job_ids))
+    if dry_run:
+        logging.info('Dry run. Would submit: sbatch %s %s.sbatch',
+                     ' '.join(options), stem)
+        return None
+
+    if scheduler is None:
+        scheduler = slurm_utils.get_scheduler()
+    job_id = scheduler.submit(stem + '.sbatch', options)
+    _record_job_id(batch_jobs_dir, job_id)
+    os.remove(held_path)
+    return job_id
+
+
+def submit_held_full(run_dir, hyper_n, fold_hyper_ns, scheduler=None):
+    '''
+    Submit the held hyper "hyper_n" to start after the active jobs of
+    "fold_hyper_ns" end. Called by postprocess.py with "--submit_held_full".
+    Returns:
+      The job id.
+    '''
+    if scheduler is None:
+        scheduler = slurm_utils.get_scheduler()
+    job_ids = slurm_utils.find_job_ids(run_dir)
+    fold_job_ids = [
+        job_ids['hyper%s' % x] for x in fold_hyper_ns
+        if 'hyper%s' % x in job_ids
+    ]
+    states = scheduler.get_states(fold_job_ids)
+    after_job_ids = [
+        job_id for job_id in fold_job_ids
+        if slurm_utils.is_active(states[job_id])
+    ]
+    job_id = submit_held(op.join(run_dir, 'hyper%03d' % hyper_n),
+                         after_job_ids,
+                         scheduler=scheduler)
+    logging.info('Submitted hyper%03d as job %s after %d active jobs.',
+                 hyper_n, job_id, len(after_job_ids))
+    return job_id
+
+
+def submit_holding_full(tasks,
+                        run_dir,
+                        job_name,
+                        select_command,
+                        max_parallel=0,
+                        dry_run=False,
+                        scheduler=None):
+    '''
+    Hold tasks of the "full" split, submit the others as a job array, and
+    submit "select_command" to run after the array ends.
+    Args:
+      tasks:           A list of Task with "split".
+      select_command:  A shell command that selects the best config and
+                       calls submit_held(), e.g. "postprocess.py
+                       --submit_held_full".
+    Returns:
+      The job id of the array, or None in the dry run mode.
+    '''
+    hold([task for task in tasks if task.split == 'full'], job_name)
+    if scheduler is None and not dry_run:
+        scheduler = slurm_utils.get_scheduler()
+    job_id = submit_array([task for task in tasks if task.split != 'full'],
+                          run_dir, job_name, max_parallel, dry_run, scheduler)
+
+    script = '\n'.join([
+        '#!/bin/bash',
+        '',
+        '#SBATCH -p RM-shared',
+        '#SBATCH -t 1:00:00',
+        '',
+        'set -e',
+        '',
+        'source %s' % get_constant('CONDA_INIT_SCRIPT'),
+        'conda activate %s' % get_constant('CONDA_SHUFFLER_ENV'),
+        '',
+        select_command,
+        '',
+    ])
+    stem = op.join(run_dir, 'batch_jobs', _get_stem_name(job_name))
+    select_path = stem + '.select.sbatch'
+    _write(select_path, script)
+    # Without --error, logs of the selection go to its output too.
+    options = [
+        '--job-name=select_%s' % job_name,
+        '--output=%s.select.out' % stem,
+    ]
+    if dry_run:
+        logging.info(
+            'Dry run. Would submit: sbatch %s '
+            '--dependency=afterany:<job array> %s', ' '.join(options),
+            select_path)
+        return None
+    options.append('--dependency=afterany:%s' % job_id)
+    select_job_id = scheduler.submit(select_path, options)
+    logging.info('Submitted job %s with output %s.select.out',
+                 select_job_id, stem)
+    logging.info('The selection job %s runs after job array %s.',
+                 select_job_id, job_id)
+    return job_id
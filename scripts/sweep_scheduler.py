@@ -0,0 +1,342 @@
+'''
+Stop losing configs of a training sweep early, by successive halving.
+
+A config is a set of hyperparameters that is trained on every split, e.g.
+"batch_size;lr;epochs" of a detection sweep. Its hypers on "splitN" are its
+folds, and its hypers on "full" are the retraining on all data.
+
+Rungs are epochs "min_epoch * reduction_factor^k" below the number of epochs.
+When all folds of a config have passed a rung (or finished), the score of
+the config at this rung is the mean over folds of the best metric up to the
+rung. It is compared with the scores of all configs that reached this rung
+before it (asynchronous successive halving, ASHA). A config continues if it
+is in the top 1/reduction_factor of them, otherwise all its jobs are
+cancelled, including the "full" hypers of this config. The first config to
+reach a rung always continues.
+
+Scores and decisions are kept in "sweep_scheduler.json" in the run dir, so
+that the scheduler can be restarted without changing its past decisions.
+Metrics are read with monitor_jobs.HyperMonitor, and are higher-is-better.
+
+Example:
+  source constants.sh
+  python3 scripts/sweep_scheduler.py \
+    --run_dir $(get_detection_run_dir 5 set-stamp-1800x1200 0) \
+    --kind detection_yolov5 \
+    --experiments_path .../experiments.txt \
+    --min_epoch 5 --reduction_factor 3
+
+To test a policy on recorded results files, put the results into "hyper*"
+dirs of a copy of the run dir, and pass "--fake_states_path" with the states
+of its jobs.
+'''
+
+import os, sys, os.path as op
+import json
+import time
+import logging
+import argparse
+
+sys.path.insert(0, op.dirname(op.abspath(__file__)))
+import postprocess_utils
+import slurm_utils
+import monitor_jobs
+
+# Columns of an experiments file that define a config, by kind. The other
+# columns are the hyper number, the split, and e.g. "save_snapshots".
+CONFIG_COLUMNS = {
+    'detection_yolov5': [2, 3, 4],
+    'detection_polygon_yolov5': [2, 3, 4],
+    'classification': [2],
+    'classification_pel': [2],
+}
+
+STATE_FILENAME = 'sweep_scheduler.json'
+
+# States of jobs that will not write more epochs. Unknown (not submitted)
+# and active jobs are waited for.
+FINISHED_STATES = [
+    'COMPLETED', 'FAILED', 'CANCELLED', 'TIMEOUT', 'NODE_FAIL',
+    'OUT_OF_MEMORY', 'PREEMPTED', 'BOOT_FAIL', 'DEADLINE'
+]
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Cancel losing configs of a training sweep early.')
+    parser.add_argument('--run_dir',
+                        required=True,
+                        help='Dir with "hyper*" dirs of a run.')
+    parser.add_argument('--kind',
+                        required=True,
+                        choices=list(monitor_jobs.KINDS.keys()))
+    parser.add_argument('--experiments_path', required=True)
+    parser.add_argument('--metric',
+                        help='Metric to compare. Default depends on "kind".')
+    parser.add_argument(
+        '--config_columns',
+        type=int,
+        nargs='+',
+        help='Columns of the experiments file that define a config. '
+        'Default depends on "kind".')
+    parser.add_argument(
+        '--num_epochs',
+        type=int,
+        help='The number of epochs of every hyper. Default: the max number '
+        'of epochs in the experiments file.')
+    parser.add_argument('--min_epoch',
+                        type=int,
+                        default=5,
+                        help='The epoch of the first rung.')
+    parser.add_argument('--reduction_factor',
+                        type=int,
+                        default=3,
+                        help='Keep the top 1/N of configs at every rung.')
+    parser.add_argument('--interval',
+                        type=float,
+                        default=300,
+                        help='Seconds between polls.')
+    parser.add_argument('--once',
+                        action='store_true',
+                        help='Poll once and exit.')
+    parser.add_argument('--dry_run',
+                        action='store_true',
+                        help='Only log which jobs would be cancelled.')
+    parser.add_argument(
+        '--fake_states_path',
+        help='Use a JSON file {job_id: state} instead of SLURM. For testing.')
+    parser.add_argument(
+        "--logging_level",
+        type=int,
+        choices=[10, 20, 30, 40],
+        default=20,
+        help="Set logging level. 10: debug, 20: info, 30: warning, 40: error.")
+    return parser
+
+
+def read_configs(experiments_path, config_columns, epochs_column=None):
+    '''
+    Group hypers of an experiments file by config.
+    Returns:
+      configs:     A dict {config: {"folds": hyper names, "full": hyper names}}.
+                   A config is its columns joined with ";".
+      max_epochs:  The max number of epochs, or None if "epochs_column" is None.
+    '''
+    configs = {}
+    max_epochs = None
+    for words in postprocess_utils.read_experiments(experiments_path):
+        hyper_name = 'hyper%s' % words[0]
+        split = words[1]
+        config = ';'.join(words[i] for i in config_columns)
+        group = configs.setdefault(config, {'folds': [], 'full': []})
+        group['full' if split == 'full' else 'folds'].append(hyper_name)
+        if epochs_column is not None:
+            max_epochs = max(max_epochs or 0, int(words[epochs_column]))
+    return configs, max_epochs
+
+
+def get_rungs(min_epoch, reduction_factor, num_epochs):
+    ''' Returns epochs of rungs, e.g. [5, 15, 45] for 5, 3, 100. '''
+    if min_epoch < 1 or reduction_factor < 2:
+        raise ValueError('Need min_epoch >= 1 and reduction_factor >= 2.')
+    rungs = []
+    epoch = min_epoch
+    while epoch < num_epochs - 1:
+        rungs.append(epoch)
+        epoch *= reduction_factor
+    return rungs
+
+
+def read_state(run_dir):
+    path = op.join(run_dir, STATE_FILENAME)
+    if not op.exists(path):
+        return {'rungs': {}, 'stopped': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_state(run_dir, state):
+    path = op.join(run_dir, STATE_FILENAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def get_score(monitors, hyper_names, job_states, rung):
+    '''
+    Returns the mean over folds of the best metric up to "rung", or None if
+    some fold has neither passed the rung nor finished.
+    '''
+    bests = []
+    for hyper_name in hyper_names:
+        monitor = monitors[hyper_name]
+        passed = monitor.epoch is not None and monitor.epoch >= rung
+        if not passed and job_states.get(hyper_name) not in FINISHED_STATES:
+            return None
+        best = monitor.get_best(rung)
+        if best is not None:
+            bests.append(best)
+    if len(bests) == 0:
+        return None
+    return sum(bests) / len(bests)
+
+
+def update_rungs(state, configs, monitors, job_states, rungs,
+                 reduction_factor):
+    '''
+    Record scores of configs that reached a rung, and stop the losers.
+    Returns:
+      The list of configs stopped now.
+    '''
+    newly_stopped = []
+    for rung in rungs:
+        recorded = state['rungs'].setdefault(str(rung), {})
+        arrived = {}
+        for config, group in sorted(configs.items()):
+            if (config in recorded or config in state['stopped']
+                    or len(group['folds']) == 0):
+                continue
+            score = get_score(monitors, group['folds'], job_states, rung)
+            if score is not None:
+                arrived[config] = score
+        if len(arrived) == 0:
+            continue
+        # Configs that arrive at the same poll are compared with each other,
+        # as in synchronous successive halving.
+        recorded.update(arrived)
+        ranked = sorted(recorded, key=lambda x: recorded[x], reverse=True)
+        num_kept = max(len(ranked) // reduction_factor, 1)
+        for config in sorted(arrived):
+            rank = ranked.index(config)
+            if rank < num_kept:
+                logging.info(
+                    'Config %s continues from epoch %d: %.4f, '
+                    'rank %d of %d.', config, rung, arrived[config], rank + 1,
+                    len(ranked))
+            else:
+                logging.info(
+                    'Config %s stops at epoch %d: %.4f, '
+                    'rank %d of %d.', config, rung, arrived[config], rank + 1,
+                    len(ranked))
+                state['stopped'][config] = rung
+                newly_stopped.append(config)
+    return newly_stopped
+
+
+def print_table(state, configs, monitors, job_states):
+    print('%-24s %6s %6s %10s %-12s' %
+          ('config', 'folds', 'epoch', 'score', 'status'))
+    for config, group in sorted(configs.items()):
+        epochs = [
+            monitors[x].epoch for x in group['folds']
+            if monitors[x].epoch is not None
+        ]
+        scores = [(int(rung), scores[config])
+                  for rung, scores in state['rungs'].items()
+                  if config in scores]
+        score = max(scores)[1] if len(scores) > 0 else None
+        if config in state['stopped']:
+            status = 'stopped@%d' % state['stopped'][config]
+        elif any(
+                slurm_utils.is_active(job_states.get(x))
+                for x in group['folds'] + group['full']):
+            status = 'active'
+        else:
+            status = 'done'
+        print(
+            '%-24s %6d %6s %10s %-12s' %
+            (config, len(group['folds']),
+             monitor_jobs.format_value(min(epochs) if epochs else None, '%d'),
+             monitor_jobs.format_value(score), status))
+    sys.stdout.flush()
+
+
+def poll(args, scheduler, state, configs, monitors, rungs):
+    '''
+    Read new epochs, update rungs, and cancel active jobs of stopped configs.
+    Returns:
+      True if some job of the sweep is still active.
+    '''
+    job_ids = slurm_utils.find_job_ids(args.run_dir)
+    states_by_job_id = scheduler.get_states(job_ids.values())
+    job_states = {
+        hyper_name: states_by_job_id.get(job_id)
+        for hyper_name, job_id in job_ids.items()
+    }
+    for monitor in monitors.values():
+        monitor.poll()
+
+    update_rungs(state, configs, monitors, job_states, rungs,
+                 args.reduction_factor)
+
+    # Jobs of configs stopped at previous polls are cancelled again, in case
+    # they were resubmitted.
+    to_cancel = []
+    for config in sorted(state['stopped']):
+        group = configs.get(config, {'folds': [], 'full': []})
+        for hyper_name in group['folds'] + group['full']:
+            if slurm_utils.is_active(job_states.get(hyper_name)):
+                to_cancel.append(job_ids[hyper_name])
+    if len(to_cancel) > 0:
+        if args.dry_run:
+            logging.info('Would cancel jobs: %s', ' '.join(to_cancel))
+        else:
+            logging.warning('Cancelling jobs: %s', ' '.join(to_cancel))
+            scheduler.cancel(to_cancel)
+            for job_id in to_cancel:
+                states_by_job_id[job_id] = 'CANCELLED'
+
+    if not args.dry_run:
+        write_state(args.run_dir, state)
+    print_table(state, configs, monitors, job_states)
+    return any(slurm_utils.is_active(x) for x in states_by_job_id.values())
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        level=args.logging_level)
+
+    if not op.isdir(args.run_dir):
+        raise FileNotFoundError('Run dir not found at: %s' % args.run_dir)
+
+    _, pattern, default_metric, epochs_column = monitor_jobs.KINDS[args.kind]
+    schema = monitor_jobs.load_schema(args.kind)
+    if args.metric is None:
+        args.metric = default_metric
+    if args.metric not in schema.columns():
+        raise ValueError('Unknown metric "%s". Available: %s' %
+                         (args.metric, schema.columns()))
+    if args.config_columns is None:
+        args.config_columns = CONFIG_COLUMNS[args.kind]
+
+    configs, max_epochs = read_configs(args.experiments_path,
+                                       args.config_columns, epochs_column)
+    num_epochs = args.num_epochs or max_epochs
+    if num_epochs is None:
+        raise ValueError('Provide --num_epochs for kind "%s".' % args.kind)
+    rungs = get_rungs(args.min_epoch, args.reduction_factor, num_epochs)
+    logging.info('%d configs, rungs at epochs: %s', len(configs), rungs)
+
+    monitors = {}
+    for group in configs.values():
+        for hyper_name in group['folds']:
+            monitors[hyper_name] = monitor_jobs.HyperMonitor(
+                op.join(args.run_dir, hyper_name), pattern, schema,
+                args.metric)
+
+    state = read_state(args.run_dir)
+    scheduler = slurm_utils.get_scheduler(args.fake_states_path)
+    while True:
+        is_active = poll(args, scheduler, state, configs, monitors, rungs)
+        if args.once:
+            break
+        if not is_active:
+            logging.info('No active jobs. Exiting.')
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
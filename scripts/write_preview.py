@@ -0,0 +1,89 @@
+'''
+Write a video or a contact sheet of random images of a db with objects.
+Replaces "python -m shuffler randomNImages | writeMedia --media video".
+See preview_utils.py.
+
+Examples:
+  python3 scripts/write_preview.py \
+    --db_file campaign8-1800x1200.v3.db --rootdir ${ROOT_DIR} \
+    --out_path campaign8-1800x1200.v3.db.avi --number 100
+  python3 scripts/write_preview.py \
+    --db_file crops/campaign3to8-6Kx4K.v5.size260.cropped.db \
+    --rootdir ${ROOT_DIR} \
+    --out_path crops/campaign3to8-6Kx4K.v5.size260.cropped.db.png \
+    --number 400 --no_imageid
+'''
+
+import logging
+import argparse
+
+import preview_utils
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Write a video or a contact sheet of a db.')
+    parser.add_argument('--db_file', required=True)
+    parser.add_argument('--rootdir', required=True)
+    parser.add_argument(
+        '--out_path',
+        required=True,
+        help='A video if it ends with ".avi", a contact sheet if ".png" or '
+        '".jpg".')
+    parser.add_argument('--number',
+                        type=int,
+                        help='The max number of random images. '
+                        'Default: all images.')
+    parser.add_argument('--stride',
+                        type=int,
+                        help='If given, take every N-th image.')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--no_objects', action='store_true')
+    parser.add_argument('--no_imageid', action='store_true')
+    parser.add_argument('--max_width',
+                        type=int,
+                        default=1800,
+                        help='Downscale wider frames of a video.')
+    parser.add_argument('--fps', type=int, default=2)
+    parser.add_argument('--columns',
+                        type=int,
+                        help='Columns of a contact sheet. Default: a square.')
+    parser.add_argument('--cell_width',
+                        type=int,
+                        default=480,
+                        help='The width of a frame in a contact sheet.')
+    parser.add_argument('--num_workers',
+                        type=int,
+                        help='The number of processes. Default: all cpus.')
+    parser.add_argument(
+        "--logging_level",
+        type=int,
+        choices=[10, 20, 30, 40],
+        default=20,
+        help="Set logging level. 10: debug, 20: info, 30: warning, 40: error.")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        format='%(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        level=args.logging_level)
+
+    preview_utils.write_preview(args.db_file,
+                                args.rootdir,
+                                args.out_path,
+                                number=args.number,
+                                stride=args.stride,
+                                seed=args.seed,
+                                with_objects=not args.no_objects,
+                                with_imageid=not args.no_imageid,
+                                max_width=args.max_width,
+                                num_workers=args.num_workers,
+                                fps=args.fps,
+                                columns=args.columns,
+                                cell_width=args.cell_width)
+
+
+if __name__ == '__main__':
+    main()